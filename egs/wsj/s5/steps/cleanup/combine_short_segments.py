@@ -9,10 +9,15 @@ import sys
 import os
 import subprocess
 import errno
-import copy
 import shutil
 import warnings
 
+import numpy as np
+
+sys.path.insert(0, 'steps')
+import libs.data_dir as data_dir_lib
+import libs.utt_combination as utt_combination_lib
+
 def GetArgs():
     # we add compulsary arguments as named arguments for readability
     parser = argparse.ArgumentParser(description="""
@@ -26,6 +31,8 @@ def GetArgs():
                         help="Minimum duration of the segments in the output directory")
     parser.add_argument("--input-data-dir", type=str, required = True)
     parser.add_argument("--output-data-dir", type=str, required = True)
+    parser.add_argument("--num-jobs", type=int, default = 1,
+                        help="Number of processes used to plan the combination of the utterances of the speakers")
 
     print(' '.join(sys.argv))
     args = parser.parse_args()
@@ -61,239 +68,115 @@ def CheckFiles(input_data_dir):
         if not os.path.exists(file_name):
             raise Exception("There is no such file {0}".format(file_name))
 
-def ParseFileToDict(file, assert2fields = False, value_processor = None):
-    if value_processor is None:
-        value_processor = lambda x: x[0]
-
-    dict = {}
-    for line in open(file, 'r'):
-        parts = line.split()
-        if assert2fields:
-            assert(len(parts) == 2)
-
-        dict[parts[0]] = value_processor(parts[1:])
-    return dict
-
-def WriteDictToFile(dict, file_name):
-    file = open(file_name, 'w')
-    keys = dict.keys()
-    keys.sort()
-    for key in keys:
-        value = dict[key]
-        if type(value) in [list, tuple] :
-            if type(value) is tuple:
-                value = list(value)
-            value.sort()
-            value = ' '.join(value)
-        file.write('{0}\t{1}\n'.format(key, value))
-    file.close()
+def LookupValues(table, utts):
+    # Returns the array of the values of the DataTable 'table' for the list
+    # of utterances 'utts', all of which must be in it.
+    index = table.lookup(utts)
+    if (index < 0).any():
+        raise KeyError(utts[np.argmax(index < 0)])
+    return table.values[index]
 
 
 def ParseDataDirInfo(data_dir):
-    data_dir_file = lambda file_name: '{0}/{1}'.format(data_dir, file_name)
+    data_dir = data_dir_lib.DataDir(data_dir, normalize_whitespace = True)
 
-    utt2spk = ParseFileToDict(data_dir_file('utt2spk'))
-    spk2utt = ParseFileToDict(data_dir_file('spk2utt'), value_processor = lambda x: x)
-    text = ParseFileToDict(data_dir_file('text'), value_processor = lambda x: " ".join(x))
+    # each utterance (or speaker) is kept once, with its last value.
+    utt2spk = data_dir['utt2spk'].unique()
+    spk2utt = data_dir['spk2utt'].unique()
+    text = data_dir['text'].unique()
     # we want to assert feats.scp has just 2 fields, as we don't know how
     # to process it otherwise
-    feat = ParseFileToDict(data_dir_file('feats.scp'), assert2fields = True)
-    utt2dur = ParseFileToDict(data_dir_file('utt2dur'), value_processor = lambda x: float(x[0]))
+    feat = data_dir.get('feats.scp', assert2fields = True).unique()
+    utt2dur = data_dir.get_durations('utt2dur').unique()
     utt2uniq = None
-    if os.path.exists(data_dir_file('utt2uniq')):
-        utt2uniq = ParseFileToDict(data_dir_file('utt2uniq'))
+    if data_dir.has('utt2uniq'):
+        utt2uniq = data_dir['utt2uniq'].unique()
     return utt2spk, spk2utt, text, feat, utt2dur, utt2uniq
 
 
-def GetCombinedUttIndexRange(utt_index, utts, utt_durs, minimum_duration):
-    # We want the minimum number of concatenations
-    # to reach the minimum_duration. If two concatenations satisfy
-    # the minimum duration constraint we choose the shorter one.
-    left_index = utt_index - 1
-    right_index = utt_index + 1
-    num_remaining_segments = len(utts) - 1
-    cur_utt_dur = utt_durs[utts[utt_index]]
-
-    while num_remaining_segments > 0:
-
-        left_utt_dur = 0
-        if left_index >= 0:
-            left_utt_dur = utt_durs[utts[left_index]]
-        right_utt_dur = 0
-        if right_index <= len(utts) - 1:
-            right_utt_dur = utt_durs[utts[right_index]]
-
-        right_combined_utt_dur = cur_utt_dur + right_utt_dur
-        left_combined_utt_dur = cur_utt_dur + left_utt_dur
-        left_right_combined_utt_dur = cur_utt_dur + left_utt_dur + right_utt_dur
-
-        combine_left_exit = False
-        combine_right_exit = False
-        if right_combined_utt_dur >= minimum_duration:
-            if left_combined_utt_dur >= minimum_duration:
-                if left_combined_utt_dur <= right_combined_utt_dur:
-                    combine_left_exit = True
-                else:
-                    combine_right_exit = True
-            else:
-                combine_right_exit = True
-        elif left_combined_utt_dur >= minimum_duration:
-            combine_left_exit = True
-        elif left_right_combined_utt_dur >= minimum_duration :
-            combine_left_exit = True
-            combine_right_exit = True
-
-        if combine_left_exit and combine_right_exit:
-            cur_utt_dur = left_right_combined_utt_dur
-            break
-        elif combine_left_exit:
-            cur_utt_dur = left_combined_utt_dur
-            # move back the right_index as we don't need to combine it
-            right_index = right_index - 1
-            break
-        elif combine_right_exit:
-            cur_utt_dur = right_combined_utt_dur
-            # move back the left_index as we don't need to combine it
-            left_index = left_index + 1
-            break
-
-        # couldn't satisfy minimum duration requirement so continue search
-        if left_index >= 0:
-            num_remaining_segments = num_remaining_segments - 1
-        if right_index <= len(utts) - 1:
-            num_remaining_segments = num_remaining_segments - 1
-
-        left_index = left_index - 1
-        right_index = right_index + 1
-
-        cur_utt_dur = left_right_combined_utt_dur
-    left_index = max(0, left_index)
-    right_index = min(len(utts)-1, right_index)
-    return left_index, right_index, cur_utt_dur
-
-
-def WriteCombinedDirFiles(output_dir, utt2spk, spk2utt, text, feat, utt2dur, utt2uniq):
+def WriteCombinedDirFiles(output_dir, utt2spk, spk2utt, text, feat, utt2dur,
+                          utt2uniq, combined_utts):
+    # 'combined_utts' is a list of the sorted lists of utterances that are
+    # combined; each one is replaced by a new utterance in the DataTables,
+    # which are written sorted on the utterance-ids.
     out_dir_file = lambda file_name: '{0}/{1}'.format(output_dir, file_name)
-    total_combined_utt_list = []
-    for speaker in spk2utt.keys():
-        utts = spk2utt[speaker]
-        for utt in utts:
-            if type(utt) is tuple:
-                #this is a combined utt
-                total_combined_utt_list.append((speaker, utt))
-
-    for speaker, combined_utt_tuple in total_combined_utt_list:
-        combined_utt_list = list(combined_utt_tuple)
-        combined_utt_list.sort()
-        new_utt_name = "-".join(combined_utt_list)+'-appended'
-
-        # updating the utt2spk dict
-        for utt in combined_utt_list:
-            spk_name = utt2spk.pop(utt)
-        utt2spk[new_utt_name] = spk_name
-
-        # updating the spk2utt dict
-        spk2utt[speaker].remove(combined_utt_tuple)
-        spk2utt[speaker].append(new_utt_name)
-
-        # updating the text dict
-        combined_text = []
-        for utt in combined_utt_list:
-            combined_text.append(text.pop(utt))
-        text[new_utt_name] = ' '.join(combined_text)
-
-        # updating the feat dict
-        combined_feat = []
-        for utt in combined_utt_list:
-            combined_feat.append(feat.pop(utt))
-        feat_command = "concat-feats --print-args=false {feats} - |".format(feats = " ".join(combined_feat))
-        feat[new_utt_name] = feat_command
-
-        # updating utt2dur
-        combined_dur = 0
-        for utt in combined_utt_list:
-            combined_dur += utt2dur.pop(utt)
-        utt2dur[new_utt_name] = combined_dur
-
-        # updating utt2uniq
-        if utt2uniq is not None:
-            combined_uniqs = []
-            for utt in combined_utt_list:
-                combined_uniqs.append(utt2uniq.pop(utt))
-            # utt2uniq file is used to map perturbed data to original unperturbed
-            # versions so that the training cross validation sets can avoid overlap
-            # of data however if perturbation changes the length of the utterance
-            # (e.g. speed perturbation) the utterance combinations in each
-            # perturbation of the original recording can be very different. So there
-            # is no good way to find the utt2uniq mapping so that we can avoid
-            # overlap.
-            utt2uniq[new_utt_name] = combined_uniqs[0]
-
-
-    WriteDictToFile(utt2spk, out_dir_file('utt2spk'))
-    WriteDictToFile(spk2utt, out_dir_file('spk2utt'))
-    WriteDictToFile(feat, out_dir_file('feats.scp'))
-    WriteDictToFile(text, out_dir_file('text'))
+    new_utts = ["-".join(utts) + '-appended' for utts in combined_utts]
+    all_combined_utts = [utt for utts in combined_utts for utt in utts]
+    is_combined = data_dir_lib.DataTable(all_combined_utts, all_combined_utts)
+
+    def CombineUtts(table, combine_values):
+        # Returns 'table' with the combined utterances replaced by the new
+        # ones, whose values are combine_values(list of the values of the
+        # utterances).
+        new_values = [combine_values(LookupValues(table, utts).tolist())
+                      for utts in combined_utts]
+        return data_dir_lib.concatenate_tables(
+            [table.select(is_combined.lookup(table.keys) < 0),
+             data_dir_lib.DataTable(new_utts, new_values)]).sorted()
+
+    def WriteTable(table, file_name):
+        table.write(out_dir_file(file_name), separator = '\t')
+
+    WriteTable(CombineUtts(utt2spk, lambda spks: spks[-1]), 'utt2spk')
+    WriteTable(spk2utt.sorted(), 'spk2utt')
+    WriteTable(CombineUtts(feat, lambda feats:
+                           "concat-feats --print-args=false {feats} - |".format(
+                               feats = " ".join(feats))),
+               'feats.scp')
+    WriteTable(CombineUtts(text, lambda texts: ' '.join(texts)), 'text')
     if utt2uniq is not None:
-        WriteDictToFile(utt2uniq, out_dir_file('utt2uniq'))
-    WriteDictToFile(utt2dur, out_dir_file('utt2dur'))
-
-
-def CombineSegments(input_dir, output_dir, minimum_duration):
+        # utt2uniq file is used to map perturbed data to original unperturbed
+        # versions so that the training cross validation sets can avoid overlap
+        # of data however if perturbation changes the length of the utterance
+        # (e.g. speed perturbation) the utterance combinations in each
+        # perturbation of the original recording can be very different. So there
+        # is no good way to find the utt2uniq mapping so that we can avoid
+        # overlap.
+        WriteTable(CombineUtts(utt2uniq, lambda uniqs: uniqs[0]), 'utt2uniq')
+    WriteTable(CombineUtts(utt2dur, sum), 'utt2dur')
+
+
+def CombineSegments(input_dir, output_dir, minimum_duration, num_jobs = 1):
     utt2spk, spk2utt, text, feat, utt2dur, utt2uniq = ParseDataDirInfo(input_dir)
-    total_combined_utt_list = []
-
-    # copy the duration dictionary so that we can modify it
-    utt_durs = copy.deepcopy(utt2dur)
-    speakers = spk2utt.keys()
-    speakers.sort()
-    for speaker in speakers:
-
-        utts = spk2utt[speaker] # this is an assignment of the reference
-        # In WriteCombinedDirFiles the values of spk2utt will have the list
-        # of combined utts which will be used as reference
-
-        # we make an assumption that the sorted uttlist corresponds
-        # to contiguous segments. This is true only if utt naming
-        # is done according to accepted conventions
-        # this is an easily violatable assumption. Have to think of a better
-        # way to do this.
-        utts.sort()
-        utt_index = 0
-        while utt_index < len(utts):
-            if utt_durs[utts[utt_index]] < minimum_duration:
-                left_index, right_index, cur_utt_dur = GetCombinedUttIndexRange(utt_index, utts, utt_durs, minimum_duration)
-                if not cur_utt_dur >= minimum_duration:
-                    # this is a rare occurrence, better make the user aware of this
-                    # situation and let them deal with it
-                    warnings.warn('Speaker {0} does not have enough utterances to satisfy the minimum duration '
-                                  'constraint. Not modifying these utterances'.format(speaker))
-                    utt_index = utt_index + 1
-                    continue
-                combined_duration = 0
-                combined_utts = []
-                # update the utts_dur dictionary
-                for utt in utts[left_index:right_index + 1]:
-                    combined_duration += utt_durs.pop(utt)
-                    if type(utt) is tuple:
-                        for item in utt:
-                            combined_utts.append(item)
-                    else:
-                        combined_utts.append(utt)
-                combined_utts = tuple(combined_utts) # converting to immutable type to use as dictionary key
-                assert(cur_utt_dur == combined_duration)
-
-                # now modify the utts list
-                combined_indices = list(range(left_index, right_index + 1))
-                # start popping from the largest index so that the lower
-                # indexes are valid
-                for i in combined_indices[::-1]:
-                    utts.pop(i)
-                utts.insert(left_index, combined_utts)
-                utt_durs[combined_utts] = combined_duration
-                utt_index = left_index
-            utt_index = utt_index + 1
-    WriteCombinedDirFiles(output_dir, utt2spk, spk2utt, text, feat, utt2dur, utt2uniq)
+
+    spk2utt = spk2utt.sorted()
+    speakers = spk2utt.keys.tolist()
+    # we make an assumption that the sorted uttlist corresponds
+    # to contiguous segments. This is true only if utt naming
+    # is done according to accepted conventions
+    # this is an easily violatable assumption. Have to think of a better
+    # way to do this.
+    spk_utts = [sorted(utts.split()) for utts in spk2utt.values.tolist()]
+    durations = LookupValues(utt2dur, [utt for utts in spk_utts for utt in utts])
+    speaker_offsets = np.cumsum([0] + [len(utts) for utts in spk_utts])
+
+    plans = utt_combination_lib.plan_per_speaker(
+        utt_combination_lib.plan_short_segment_combination, minimum_duration,
+        durations, speaker_offsets, num_jobs)
+    combined_utts = []
+    for s, plan in enumerate(plans):
+        if plan is None:
+            # all the utterances of the speaker are long enough.
+            continue
+        boundaries, num_unsatisfied = plan
+        if num_unsatisfied > 0:
+            # this is a rare occurrence, better make the user aware of this
+            # situation and let them deal with it
+            warnings.warn('Speaker {0} does not have enough utterances to satisfy the minimum duration '
+                          'constraint. Not modifying these utterances'.format(speakers[s]))
+        utts = spk_utts[s]
+        new_spk_utts = []
+        for start, end in utt_combination_lib.boundaries_to_ranges(boundaries):
+            if end - start == 1:
+                new_spk_utts.append(utts[start])
+            else:
+                combined_utts.append(utts[start:end])
+                new_spk_utts.append("-".join(utts[start:end]) + '-appended')
+        spk_utts[s] = new_spk_utts
+    spk2utt = data_dir_lib.DataTable(
+        speakers, [' '.join(sorted(utts)) for utts in spk_utts])
+    WriteCombinedDirFiles(output_dir, utt2spk, spk2utt, text, feat, utt2dur,
+                          utt2uniq, combined_utts)
 
 def Main():
     print("""steps/cleanup/combine_short_segments.py: warning: this script is deprecated and will be removed.
@@ -307,7 +190,8 @@ def Main():
 
     RunKaldiCommand("utils/data/get_utt2dur.sh {0}".format(args.input_data_dir))
 
-    CombineSegments(args.input_data_dir, args.output_data_dir, args.minimum_duration)
+    CombineSegments(args.input_data_dir, args.output_data_dir, args.minimum_duration,
+                    args.num_jobs)
 
     RunKaldiCommand("utils/utt2spk_to_spk2utt.pl {od}/utt2spk > {od}/spk2utt".format(od = args.output_data_dir))
     if os.path.exists('{0}/cmvn.scp'.format(args.input_data_dir)):
@@ -17,6 +17,8 @@ import argparse
 import logging
 import sys
 
+import numpy as np
+
 sys.path.insert(0, 'steps')
 import libs.common as common_lib
 
@@ -76,6 +78,14 @@ def get_args():
                         the end to get the alignment. This is different
                         from the normal Smith-Waterman alignment, where the
                         traceback will be from the maximum score.""")
+    parser.add_argument("--band", type=int, default=0,
+                        help="""If positive, only compute the alignment
+                        scores within this many reference words of the
+                        diagonal of the score matrix. This reduces the time
+                        and memory needed to align long recordings whose
+                        reference and hypothesis roughly correspond, but
+                        the alignment may differ from the unbanded one if
+                        the best path leaves the band.""")
 
     parser.add_argument("--debug-only", type=str, default="false",
                         choices=["true", "false"],
@@ -180,13 +190,72 @@ def read_ctm(ctm_file, file_and_channel2reco=None):
     ctm_file.close()
 
 
-def smith_waterman_alignment(ref, hyp, similarity_score_function,
+# Backpointer codes used by smith_waterman_alignment()
+_BP_NONE = 0    # no predecessor; the traceback stops here
+_BP_DIAG = 1    # from (ref_index - 1, hyp_index - 1), i.e. correct or sub
+_BP_DEL = 2     # from (ref_index - 1, hyp_index)
+_BP_INS = 3     # from (ref_index, hyp_index - 1)
+
+
+def _get_diagonal_range(diag, ref_len, hyp_len, band):
+    """Returns the range [lo, hi] of reference indexes of the cells
+    (ref_index, diag - ref_index) of the score matrix that are computed.
+    If band is not None, only the cells within band reference words of the
+    straight line from (0, 0) to (ref_len, hyp_len) are computed, i.e. the
+    cells with |ref_index * hyp_len - hyp_index * ref_len| <= band * hyp_len.
+    """
+    lo = max(0, diag - hyp_len)
+    hi = min(ref_len, diag)
+    if band is not None:
+        total_len = ref_len + hyp_len
+        lo = max(lo, -((band * hyp_len - diag * ref_len) // total_len))
+        hi = min(hi, (diag * ref_len + band * hyp_len) // total_len)
+    return lo, hi
+
+
+def _get_diagonal_slice(values, values_lo, start, length, fill_value):
+    """Returns values[start - values_lo : start - values_lo + length],
+    where the elements outside of values are fill_value."""
+    begin = start - values_lo
+    if begin >= 0 and begin + length <= len(values):
+        return values[begin:begin + length]
+    out = np.full(length, fill_value, dtype=values.dtype)
+    src_begin = max(begin, 0)
+    src_end = min(begin + length, len(values))
+    if src_begin < src_end:
+        out[src_begin - begin:src_end - begin] = values[src_begin:src_end]
+    return out
+
+
+def _is_full_hyp_alignment(output, hyp_len):
+    """Returns True if the edits in output, as returned by
+    smith_waterman_alignment(), are contiguous, each cover at most one
+    reference word and one hypothesis word, and together cover the whole
+    hypothesis."""
+    ref_index, hyp_index = (output[0][2], 0) if len(output) > 0 else (0, 0)
+    for edit in output:
+        (prev_ref_index, prev_hyp_index, next_ref_index,
+         next_hyp_index) = edit[2:]
+        if ((prev_ref_index, prev_hyp_index) != (ref_index, hyp_index)
+                or not 0 <= next_ref_index - prev_ref_index <= 1
+                or not 0 <= next_hyp_index - prev_hyp_index <= 1
+                or (next_ref_index, next_hyp_index) == (ref_index,
+                                                        hyp_index)):
+            return False
+        ref_index, hyp_index = next_ref_index, next_hyp_index
+    return hyp_index == hyp_len
+
+
+def smith_waterman_alignment(ref, hyp, correct_score, substitution_score,
                              del_score, ins_score,
-                             eps_symbol="<eps>", align_full_hyp=True):
+                             eps_symbol="<eps>", align_full_hyp=True,
+                             band=None):
     """Does Smith-Waterman alignment of reference sequence and hypothesis
     sequence.
     This is a special case of the Smith-Waterman alignment that assumes that
     the deletion and insertion costs are linear with number of incorrect words.
+    A correct match adds correct_score to the alignment score and a
+    substitution adds substitution_score (usually negative).
 
     If align_full_hyp is True, then the traceback of the alignment
     is started at the end of the hypothesis. This is when we want the
@@ -197,6 +266,17 @@ def smith_waterman_alignment(ref, hyp, similarity_score_function,
     sub-sequence of the hypothesis that best matches with a
     sub-sequence of the reference.
 
+    The words are mapped to integers and the score matrix is computed one
+    anti-diagonal at a time, since the cells on an anti-diagonal depend only
+    on the two previous anti-diagonals. Only the backpointers are stored
+    (as int8), not the scores. If band is not None, only the cells
+    within band reference words of the diagonal from (0, 0) to
+    (len(ref), len(hyp)) are computed, which is useful for long recordings;
+    the band is widened if needed so that the computed cells are connected.
+    If align_full_hyp is True and the traceback through the band does not
+    align every hypothesis word, e.g. because it restarts at a cell whose
+    predecessors are outside the band, the unbanded alignment is returned.
+
     Returns a list of tuples where each tuple has the format:
         (ref_word, hyp_word, ref_word_from_index, hyp_word_from_index,
          ref_word_to_index, hyp_word_to_index)
@@ -206,74 +286,135 @@ def smith_waterman_alignment(ref, hyp, similarity_score_function,
     ref_len = len(ref)
     hyp_len = len(hyp)
 
-    bp = [[] for x in range(ref_len+1)]
-
-    # Score matrix of size (ref_len + 1) x (hyp_len + 1)
-    # The index m, n in this matrix corresponds to the score
-    # of the best matching sub-sequence pair between reference and hypothesis
+    if band is not None:
+        if ref_len == 0 or hyp_len == 0:
+            band = None
+        else:
+            band = max(band, -(-ref_len // hyp_len))
+
+    word2id = {}
+    ref_ids = np.array([word2id.setdefault(x, len(word2id)) for x in ref],
+                       dtype=np.int64)
+    # The hypothesis is reversed so that the hypothesis words of the cells
+    # on an anti-diagonal are contiguous.
+    hyp_ids_reversed = np.array(
+        [word2id.setdefault(x, len(word2id)) for x in reversed(hyp)],
+        dtype=np.int64)
+
+    # The element H[m][n] of the score matrix of size
+    # (ref_len + 1) x (hyp_len + 1) is the score of the best matching
+    # sub-sequence pair between reference and hypothesis
     # ending with the reference word ref[m-1] and hypothesis word hyp[n-1].
     # If align_full_hyp is True, then the hypothesis sub-sequence is from
     # the 0th word i.e. hyp[0].
-    H = [[] for x in range(ref_len+1)]
+    # The cells that have not been reached from any other cell have the
+    # score init_score. Cells outside the band are given the score
+    # fill_score.
+    if align_full_hyp:
+        init_score = -(hyp_len + 2)
+        fill_score = -(1 << 40)
+    else:
+        init_score = 0
+        fill_score = 0
 
-    for ref_index in range(ref_len+1):
-        if align_full_hyp:
-            H[ref_index] = [-(hyp_len+2) for x in range(hyp_len+1)]
-            H[ref_index][0] = 0
-        else:
-            H[ref_index] = [0 for x in range(hyp_len+1)]
-        bp[ref_index] = [(0, 0) for x in range(hyp_len+1)]
-
-        if align_full_hyp and ref_index == 0:
-            for hyp_index in range(1, hyp_len+1):
-                H[0][hyp_index] = H[0][hyp_index-1] + ins_score
-                bp[ref_index][hyp_index] = (ref_index, hyp_index-1)
-                logger.debug(
-                    "({0},{1}) -> ({2},{3}): {4}"
-                    "".format(ref_index, hyp_index-1, ref_index, hyp_index,
-                              H[ref_index][hyp_index]))
+    # bp[d] and diag_lo[d] store the backpointers of the cells on the
+    # anti-diagonal d i.e. the cells (m, n) with m + n = d and
+    # m >= diag_lo[d].
+    bp = []
+    diag_lo = []
+    all_scores = [] if verbose_level > 2 else None
+
+    prev_scores, prev_lo = np.zeros(0, dtype=np.int64), 0
+    prev2_scores, prev2_lo = np.zeros(0, dtype=np.int64), 0
 
     max_score = -float("inf")
     max_score_element = (0, 0)
 
-    for ref_index in range(1, ref_len+1):     # Reference
-        for hyp_index in range(1, hyp_len+1):     # Hypothesis
-            sub_or_ok = (H[ref_index-1][hyp_index-1]
-                         + similarity_score_function(ref[ref_index-1],
-                                                     hyp[hyp_index-1]))
-
-            if ((not align_full_hyp and sub_or_ok > 0)
-                    or (align_full_hyp
-                        and sub_or_ok >= H[ref_index][hyp_index])):
-                H[ref_index][hyp_index] = sub_or_ok
-                bp[ref_index][hyp_index] = (ref_index-1, hyp_index-1)
-                logger.debug(
-                    "({0},{1}) -> ({2},{3}): {4} ({5},{6})"
-                    "".format(ref_index-1, hyp_index-1, ref_index, hyp_index,
-                              H[ref_index][hyp_index],
-                              ref[ref_index-1], hyp[hyp_index-1]))
-
-            if H[ref_index-1][hyp_index] + del_score > H[ref_index][hyp_index]:
-                H[ref_index][hyp_index] = H[ref_index-1][hyp_index] + del_score
-                bp[ref_index][hyp_index] = (ref_index-1, hyp_index)
-                logger.debug(
-                    "({0},{1}) -> ({2},{3}): {4}"
-                    "".format(ref_index-1, hyp_index, ref_index, hyp_index,
-                              H[ref_index][hyp_index]))
-
-            if H[ref_index][hyp_index-1] + ins_score > H[ref_index][hyp_index]:
-                H[ref_index][hyp_index] = H[ref_index][hyp_index-1] + ins_score
-                bp[ref_index][hyp_index] = (ref_index, hyp_index-1)
-                logger.debug(
-                    "({0},{1}) -> ({2},{3}): {4}"
-                    "".format(ref_index, hyp_index-1, ref_index, hyp_index,
-                              H[ref_index][hyp_index]))
-
-            #if hyp_index == hyp_len and H[ref_index][hyp_index] >= max_score:
-            if ((not align_full_hyp or hyp_index == hyp_len)
-                    and H[ref_index][hyp_index] >= max_score):
-                max_score = H[ref_index][hyp_index]
-                max_score_element = (ref_index, hyp_index)
+    for diag in range(ref_len + hyp_len + 1):
+        lo, hi = _get_diagonal_range(diag, ref_len, hyp_len, band)
+        scores = np.empty(max(hi - lo + 1, 0), dtype=np.int64)
+        codes = np.zeros(len(scores), dtype=np.int8)
+
+        # cells with ref_index >= 1 and hyp_index >= 1
+        begin = max(lo, 1)
+        end = min(hi, diag - 1)
+        if begin <= end:
+            length = end - begin + 1
+            is_correct = (ref_ids[begin-1:end]
+                          == hyp_ids_reversed[hyp_len - diag + begin:
+                                              hyp_len - diag + end + 1])
+            sub_or_ok = (_get_diagonal_slice(prev2_scores, prev2_lo,
+                                             begin - 1, length, fill_score)
+                         + np.where(is_correct, correct_score,
+                                    substitution_score))
+            if align_full_hyp:
+                is_diag = sub_or_ok >= init_score
+            else:
+                is_diag = sub_or_ok > 0
+            cur_scores = np.where(is_diag, sub_or_ok, init_score)
+            cur_codes = np.where(is_diag, _BP_DIAG, _BP_NONE).astype(np.int8)
+
+            deletion = _get_diagonal_slice(prev_scores, prev_lo, begin - 1,
+                                           length, fill_score) + del_score
+            is_better = deletion > cur_scores
+            cur_scores[is_better] = deletion[is_better]
+            cur_codes[is_better] = _BP_DEL
+
+            insertion = _get_diagonal_slice(prev_scores, prev_lo, begin,
+                                            length, fill_score) + ins_score
+            is_better = insertion > cur_scores
+            cur_scores[is_better] = insertion[is_better]
+            cur_codes[is_better] = _BP_INS
+
+            scores[begin-lo:end-lo+1] = cur_scores
+            codes[begin-lo:end-lo+1] = cur_codes
+
+            if not align_full_hyp:
+                # Keep the last maximum in the order (ref_index, hyp_index)
+                best = cur_scores.max()
+                ref_index = begin + length - 1 - int(
+                    np.argmax(cur_scores[::-1] == best))
+                element = (ref_index, diag - ref_index)
+                if (best > max_score
+                        or (best == max_score
+                            and element > max_score_element)):
+                    max_score = int(best)
+                    max_score_element = element
+            elif hyp_len >= 1 and begin <= diag - hyp_len <= end:
+                score = int(cur_scores[diag - hyp_len - begin])
+                if score >= max_score:
+                    max_score = score
+                    max_score_element = (diag - hyp_len, hyp_len)
+
+        if lo == 0 and hi >= 0:
+            # cell (0, diag)
+            if align_full_hyp and diag > 0:
+                scores[0] = diag * ins_score
+                codes[0] = _BP_INS
+            else:
+                scores[0] = 0
+        if hi == diag and diag > 0 and hi >= lo:
+            # cell (diag, 0)
+            scores[-1] = 0
+
+        bp.append(codes)
+        diag_lo.append(lo)
+        if all_scores is not None:
+            all_scores.append(scores)
+        prev2_scores, prev2_lo = prev_scores, prev_lo
+        prev_scores, prev_lo = scores, lo
+
+    def get_backpointer(ref_index, hyp_index):
+        codes = bp[ref_index + hyp_index]
+        offset = ref_index - diag_lo[ref_index + hyp_index]
+        code = codes[offset] if 0 <= offset < len(codes) else _BP_NONE
+        if code == _BP_DIAG:
+            return (code, ref_index - 1, hyp_index - 1)
+        if code == _BP_DEL:
+            return (code, ref_index - 1, hyp_index)
+        if code == _BP_INS:
+            return (code, ref_index, hyp_index - 1)
+        return (code, 0, 0)
 
     ref_index, hyp_index = max_score_element
     score = max_score
@@ -282,72 +423,82 @@ def smith_waterman_alignment(ref, hyp, similarity_score_function,
 
     while ((not align_full_hyp and score >= 0)
            or (align_full_hyp and hyp_index > 0)):
-        try:
-            prev_ref_index, prev_hyp_index = bp[ref_index][hyp_index]
-            if ((prev_ref_index, prev_hyp_index) == (ref_index, hyp_index)
-                    or (prev_ref_index, prev_hyp_index) == (0, 0)):
-                score = H[ref_index][hyp_index]
-                if score != 0:
-                    ref_word = ref[ref_index-1] if ref_index > 0 else eps_symbol
-                    hyp_word = hyp[hyp_index-1] if hyp_index > 0 else eps_symbol
-                    output.append((ref_word, hyp_word, prev_ref_index,
-                        prev_hyp_index, ref_index, hyp_index))
-
-                    ref_index, hyp_index = (prev_ref_index, prev_hyp_index)
-                    score = H[ref_index][hyp_index]
-                break
-
-            if (ref_index == prev_ref_index + 1
-                    and hyp_index == prev_hyp_index + 1):
-                # Substitution or correct
-                output.append(
-                    (ref[ref_index-1] if ref_index > 0 else eps_symbol,
-                     hyp[hyp_index-1] if hyp_index > 0 else eps_symbol,
-                     prev_ref_index, prev_hyp_index, ref_index, hyp_index))
-            elif (prev_hyp_index == hyp_index):
-                # Deletion
-                assert prev_ref_index == ref_index - 1
-                output.append(
-                    (ref[ref_index-1] if ref_index > 0 else eps_symbol,
-                     eps_symbol,
-                     prev_ref_index, prev_hyp_index, ref_index, hyp_index))
-            elif (prev_ref_index == ref_index):
-                # Insertion
-                assert prev_hyp_index == hyp_index - 1
-                output.append(
-                    (eps_symbol,
-                     hyp[hyp_index-1] if hyp_index > 0 else eps_symbol,
-                     prev_ref_index, prev_hyp_index, ref_index, hyp_index))
+        code, prev_ref_index, prev_hyp_index = get_backpointer(ref_index,
+                                                               hyp_index)
+        if ((prev_ref_index, prev_hyp_index) == (ref_index, hyp_index)
+                or (prev_ref_index, prev_hyp_index) == (0, 0)):
+            # The scores are not stored, but the score of a cell whose
+            # predecessor is (0, 0) is known.
+            if code == _BP_DIAG:
+                score = (correct_score if ref[0] == hyp[0]
+                         else substitution_score)
+            elif code == _BP_INS:
+                score = ins_score
+            elif align_full_hyp and hyp_index > 0:
+                score = init_score
             else:
-                raise RuntimeError
-
+                score = 0
+            if score != 0:
+                ref_word = ref[ref_index-1] if ref_index > 0 else eps_symbol
+                hyp_word = hyp[hyp_index-1] if hyp_index > 0 else eps_symbol
+                output.append((ref_word, hyp_word, prev_ref_index,
+                    prev_hyp_index, ref_index, hyp_index))
+
+                ref_index, hyp_index = (prev_ref_index, prev_hyp_index)
+                score = 0
+            break
+
+        if code == _BP_DIAG:
+            # Substitution or correct
+            output.append(
+                (ref[ref_index-1], hyp[hyp_index-1],
+                 prev_ref_index, prev_hyp_index, ref_index, hyp_index))
+        elif code == _BP_DEL:
+            # Deletion
+            output.append(
+                (ref[ref_index-1], eps_symbol,
+                 prev_ref_index, prev_hyp_index, ref_index, hyp_index))
+        else:
+            # Insertion
+            output.append(
+                (eps_symbol, hyp[hyp_index-1],
+                 prev_ref_index, prev_hyp_index, ref_index, hyp_index))
 
-            ref_index, hyp_index = (prev_ref_index, prev_hyp_index)
-            score = H[ref_index][hyp_index]
-        except Exception:
-            logger.error("Unexpected entry (%d,%d) -> (%d,%d), %s, %s",
-                         prev_ref_index, prev_hyp_index, ref_index, hyp_index,
-                         ref[prev_ref_index], hyp[prev_hyp_index])
-            raise RuntimeError("Unexpected result: Bug in code!!")
+        ref_index, hyp_index = (prev_ref_index, prev_hyp_index)
 
     assert (align_full_hyp or score == 0)
 
     output.reverse()
 
-    if verbose_level > 2:
+    if (align_full_hyp and band is not None
+            and not _is_full_hyp_alignment(output, hyp_len)):
+        logger.debug("The alignment within a band of %d words does not "
+                     "cover the full hypothesis; aligning without a band",
+                     band)
+        return smith_waterman_alignment(
+            ref, hyp, correct_score, substitution_score, del_score, ins_score,
+            eps_symbol=eps_symbol, align_full_hyp=align_full_hyp, band=None)
+
+    if all_scores is not None:
         for ref_index in range(ref_len+1):
             for hyp_index in range(hyp_len+1):
-                print ("{0} ".format(H[ref_index][hyp_index]), end='',
-                       file=sys.stderr)
+                diag = ref_index + hyp_index
+                offset = ref_index - diag_lo[diag]
+                if 0 <= offset < len(all_scores[diag]):
+                    score = all_scores[diag][offset]
+                else:
+                    score = fill_score
+                print ("{0} ".format(score), end='', file=sys.stderr)
             print ("", file=sys.stderr)
 
-    logger.debug("Aligned output:")
-    logger.debug("  -  ".join(["({0},{1})".format(x[4], x[5])
-                               for x in output]))
-    logger.debug("REF: ")
-    logger.debug("    ".join(str(x[0]) for x in output))
-    logger.debug("HYP:")
-    logger.debug("    ".join(str(x[1]) for x in output))
+    if verbose_level > 2:
+        logger.debug("Aligned output:")
+        logger.debug("  -  ".join(["({0},{1})".format(x[4], x[5])
+                                   for x in output]))
+        logger.debug("REF: ")
+        logger.debug("    ".join(str(x[0]) for x in output))
+        logger.debug("HYP:")
+        logger.debug("    ".join(str(x[1]) for x in output))
 
     return (output, max_score)
 
@@ -505,22 +656,24 @@ def test_alignment(align_full_hyp):
     logger.info("HYP: %s", hyp)
 
     output, score = smith_waterman_alignment(
-        ref, hyp, similarity_score_function=lambda x, y: 2 if (x == y) else -1,
+        ref, hyp, correct_score=2, substitution_score=-1,
         del_score=-1, ins_score=-1, eps_symbol="-", align_full_hyp=align_full_hyp)
 
     print_alignment("Alignment", output, out_file_handle=sys.stderr)
 
+    # A band that covers the whole score matrix must not change the result.
+    banded_output, banded_score = smith_waterman_alignment(
+        ref, hyp, correct_score=2, substitution_score=-1,
+        del_score=-1, ins_score=-1, eps_symbol="-", align_full_hyp=align_full_hyp,
+        band=len(ref) + len(hyp))
+    assert (banded_output, banded_score) == (output, score)
+
 
 def run(args):
     if args.debug_only:
         test_alignment(args.align_full_hyp)
         raise SystemExit("Exiting since --debug-only was true")
 
-    def similarity_score_function(x, y):
-        if x == y:
-            return args.correct_score
-        return -args.substitution_penalty
-
     del_score = -args.deletion_penalty
     ins_score = -args.insertion_penalty
 
@@ -575,9 +728,11 @@ def run(args):
 
             output, score = smith_waterman_alignment(
                 ref_text, hyp_array, eps_symbol=args.eps_symbol,
-                similarity_score_function=similarity_score_function,
+                correct_score=args.correct_score,
+                substitution_score=-args.substitution_penalty,
                 del_score=del_score, ins_score=ins_score,
-                align_full_hyp=args.align_full_hyp)
+                align_full_hyp=args.align_full_hyp,
+                band=args.band if args.band > 0 else None)
 
             if args.hyp_format == "CTM":
                 ctm_edits = get_ctm_edits(output, hyp_lines[reco],
@@ -2,11 +2,13 @@
 
 from __future__ import print_function
 import argparse
+import itertools
 import logging
 import sys
 
 import tf_idf
 sys.path.insert(0, 'steps')
+import libs.common as common_lib
 
 logger = logging.getLogger('tf_idf')
 logger.setLevel(logging.INFO)
@@ -61,6 +63,20 @@ def _get_args():
                         choices=["true", "false"],
                         help="If true, the stats are accumulated over all the "
                         "documents and a single tf-idf-file is written out.")
+    parser.add_argument("--num-jobs", type=int, default=1,
+                        help="Number of worker processes that accumulate the "
+                        "stats for shards of the documents, if "
+                        "--accumulate-over-docs=true; if 1, everything is "
+                        "done in this process.")
+    parser.add_argument("--shard-size", type=int, default=100,
+                        help="Number of consecutive documents in a shard, "
+                        "if --accumulate-over-docs=true.")
+    parser.add_argument("--write-binary-cache", type=str, default="false",
+                        choices=["true", "false"],
+                        help="If true, the TF-IDF is also written in binary "
+                        "form to <tf-idf-file>.bin, from which "
+                        "retrieve_similar_docs.py loads it. Requires "
+                        "--accumulate-over-docs=true.")
     parser.add_argument("docs", type=argparse.FileType('r'),
                         help="Input documents in kaldi text format i.e. "
                         "<document-id> <text>")
@@ -74,16 +90,82 @@ def _get_args():
     if args.tf_normalization_factor >= 1.0 or args.tf_normalization_factor < 0:
         raise ValueError("--tf-normalization-factor must be in [0,1)")
 
+    if args.num_jobs < 1 or args.shard_size < 1:
+        raise ValueError("--num-jobs and --shard-size must be positive")
+
     args.accumulate_over_docs = bool(args.accumulate_over_docs == "true")
+    args.write_binary_cache = bool(args.write_binary_cache == "true")
 
     if not args.accumulate_over_docs and args.input_idf_stats is None:
         raise TypeError(
             "If --accumulate-over-docs=false is provided, "
             "then --input-idf-stats must be provided.")
 
+    if args.write_binary_cache and (not args.accumulate_over_docs
+                                    or args.tf_idf_file.name == "<stdout>"):
+        raise TypeError(
+            "--write-binary-cache=true requires --accumulate-over-docs=true "
+            "and a tf-idf-file that is not the standard output.")
+
     return args
 
 
+def _accumulate_shard(shard):
+    lines, ngram_order = shard
+    return tf_idf.NgramCounts.accumulate(lines, ngram_order)
+
+
+def _read_shards(docs, shard_size, ngram_order):
+    """Yields the shards (lines, ngram_order) for _accumulate_shard()."""
+    while True:
+        lines = list(itertools.islice(docs, shard_size))
+        if len(lines) == 0:
+            break
+        yield lines, ngram_order
+
+
+def _run_accumulate_over_docs(args, idf_stats):
+    """Accumulates the stats over all the documents, in shards whose counts
+    are merged, and writes the TF-IDF values."""
+    counts = tf_idf.NgramCounts.merge_all(common_lib.map_in_order(
+        _accumulate_shard,
+        _read_shards(args.docs, args.shard_size, args.ngram_order),
+        num_jobs=args.num_jobs))
+    if counts is None:
+        raise RuntimeError("Could not compute TF-IDF for any query documents")
+
+    if len(counts.counts) == 0:
+        raise RuntimeError("No (term, doc) found in tf-stats.")
+    logger.info("Accumulated stats for %d terms in %d documents",
+                len(counts.terms), len(counts.docs))
+
+    if args.input_idf_stats is None:
+        num_docs_for_terms = counts.get_num_docs_for_terms()
+        num_docs = counts.get_num_docs()
+        if args.output_idf_stats is not None:
+            counts.write_idf_stats(args.output_idf_stats)
+            args.output_idf_stats.close()
+    else:
+        num_docs_for_terms = idf_stats.get_num_docs_for_terms(counts.term_ids)
+        num_docs = idf_stats.num_docs
+        if args.output_idf_stats is not None:
+            idf_stats.write(args.output_idf_stats)
+            args.output_idf_stats.close()
+
+    values = counts.get_tfidf_values(
+        num_docs_for_terms, num_docs,
+        tf_weighting_scheme=args.tf_weighting_scheme,
+        idf_weighting_scheme=args.idf_weighting_scheme,
+        tf_normalization_factor=args.tf_normalization_factor)
+    counts.write_tfidf(args.tf_idf_file, values)
+
+    if args.write_binary_cache:
+        # The text file must not be newer than the cache.
+        args.tf_idf_file.flush()
+        counts.get_sparse_tfidf(values).write_binary(
+            tf_idf.get_binary_cache_filename(args.tf_idf_file.name))
+
+
 def _run(args):
     tf_stats = tf_idf.TFStats()
     idf_stats = tf_idf.IDFStats()
@@ -91,38 +173,26 @@ def _run(args):
     if args.input_idf_stats is not None:
         idf_stats.read(args.input_idf_stats)
 
+    if args.accumulate_over_docs:
+        _run_accumulate_over_docs(args, idf_stats)
+        return
+
     num_done = 0
     for line in args.docs:
         parts = line.strip().split()
         doc = parts[0]
         tf_stats.accumulate(doc, parts[1:], args.ngram_order)
 
-        if not args.accumulate_over_docs:
-            # Write the document-id and the corresponding tf-idf values.
-            print (doc, file=args.tf_idf_file, end=' ')
-            tf_idf.write_tfidf_from_stats(
-                tf_stats, idf_stats, args.tf_idf_file,
-                tf_weighting_scheme=args.tf_weighting_scheme,
-                idf_weighting_scheme=args.idf_weighting_scheme,
-                tf_normalization_factor=args.tf_normalization_factor,
-                expected_document_id=doc)
-            tf_stats = tf_idf.TFStats()
-        num_done += 1
-
-    if args.accumulate_over_docs:
-        tf_stats.compute_term_stats(idf_stats=idf_stats
-                                              if args.input_idf_stats is None
-                                              else None)
-
-        if args.output_idf_stats is not None:
-            idf_stats.write(args.output_idf_stats)
-            args.output_idf_stats.close()
-
+        # Write the document-id and the corresponding tf-idf values.
+        print (doc, file=args.tf_idf_file, end=' ')
         tf_idf.write_tfidf_from_stats(
             tf_stats, idf_stats, args.tf_idf_file,
             tf_weighting_scheme=args.tf_weighting_scheme,
             idf_weighting_scheme=args.idf_weighting_scheme,
-            tf_normalization_factor=args.tf_normalization_factor)
+            tf_normalization_factor=args.tf_normalization_factor,
+            expected_document_id=doc)
+        tf_stats = tf_idf.TFStats()
+        num_done += 1
 
     if num_done == 0:
         raise RuntimeError("Could not compute TF-IDF for any query documents")
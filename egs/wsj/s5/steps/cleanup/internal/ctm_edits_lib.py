@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# Apache 2.0
+""" This module contains the reading and writing code for the 'ctm-edits'
+    format that is shared by get_ctm_edits.py, modify_ctm_edits.py,
+    taint_ctm_edits.py, segment_ctm_edits.py, segment_ctm_edits_mild.py and
+    process_ctm_edits.py.  The format is:
+    <file-id> <channel> <start-time> <duration> <hyp-word> <conf> <ref-word> <edit> ['tainted']
+    e.g.:
+    AJJacobs_2007P-0001605-0003029 1 0 0.09 <eps> 1.0 <eps> sil
+    AJJacobs_2007P-0001605-0003029 1 0.09 0.15 i 1.0 i cor
+    [note: file-id is really utterance-id at this point].
+
+    The per-stage code works on the lines of one utterance at a time, as a
+    list of split lines (lists of fields); read_ctm_edits_utterances() does
+    the grouping of the input lines into utterances.  CtmEditsUtterance holds
+    the same information stored by column, which is the form in which
+    process_ctm_edits.py passes utterances between processes.
+"""
+
+from __future__ import print_function
+import sys
+
+import numpy as np
+
+
+def read_ctm_edits_utterances(f, program_name='ctm_edits_lib.py'):
+    """Reads ctm-edits lines from the file object 'f' and groups them per
+    utterance, yielding pairs (utterance_id, split_lines), where split_lines
+    is a list of lists of fields, one per line, for a run of consecutive
+    lines with the same utterance-id.  Empty input and empty or whitespace
+    lines are errors; 'program_name' is used in the error messages.
+    """
+    cur_utterance = None
+    split_lines_of_cur_utterance = []
+    for line in f:
+        split_line = line.split()
+        if len(split_line) == 0:
+            if cur_utterance is None:
+                sys.exit(program_name + ": bad input line " + line)
+            sys.exit(program_name + ": got an empty or whitespace input line")
+        if split_line[0] != cur_utterance:
+            if cur_utterance is not None:
+                yield cur_utterance, split_lines_of_cur_utterance
+            cur_utterance = split_line[0]
+            split_lines_of_cur_utterance = []
+        split_lines_of_cur_utterance.append(split_line)
+    if cur_utterance is None:
+        sys.exit(program_name + ": empty input")
+    yield cur_utterance, split_lines_of_cur_utterance
+
+
+def format_ctm_edits_lines(split_lines):
+    """Returns the text of the ctm-edits lines in 'split_lines' (a list of
+    lists of fields), each followed by a newline."""
+    return ''.join([' '.join(split_line) + '\n' for split_line in split_lines])
+
+
+def write_ctm_edits_lines(f, split_lines):
+    """Writes the ctm-edits lines in 'split_lines' (a list of lists of fields)
+    to the file object 'f'; this is the same as printing ' '.join() of each
+    of them."""
+    f.write(format_ctm_edits_lines(split_lines))
+
+
+def _to_object_array(strings):
+    """Returns a 1-d NumPy object array with the strings of the list
+    'strings'."""
+    array = np.empty(len(strings), dtype=object)
+    array[:] = strings
+    return array
+
+
+class CtmEditsUtterance(object):
+    """This class holds the ctm-edits lines of one utterance, stored by
+    column in NumPy arrays: object arrays of the strings of the channels,
+    hyp-words, confidences, ref-words and edit-types, float arrays of the
+    start-times and durations, and a bool array which is true for the lines
+    with the 'tainted' field.  The times are also kept as the strings they
+    were read as (start_texts and duration_texts), so that converting back
+    to lines with to_split_lines() gives exactly the input.  Any fields
+    after the 'tainted' field are not supported.
+    """
+    __slots__ = ['utterance_id', 'channels', 'start_texts', 'duration_texts',
+                 'start_times', 'durations', 'hyp_words', 'confidences',
+                 'ref_words', 'edit_types', 'tainted']
+
+    def __init__(self, utterance_id, channels, start_texts, duration_texts,
+                 hyp_words, confidences, ref_words, edit_types, tainted):
+        self.utterance_id = utterance_id
+        self.channels = channels
+        self.start_texts = start_texts
+        self.duration_texts = duration_texts
+        self.start_times = start_texts.astype(np.float64)
+        self.durations = duration_texts.astype(np.float64)
+        self.hyp_words = hyp_words
+        self.confidences = confidences
+        self.ref_words = ref_words
+        self.edit_types = edit_types
+        self.tainted = tainted
+
+    def __len__(self):
+        return len(self.edit_types)
+
+    @classmethod
+    def from_split_lines(cls, utterance_id, split_lines):
+        """Returns the CtmEditsUtterance for the lines 'split_lines' (a list
+        of lists of fields) of the utterance 'utterance_id'; raises
+        ValueError if one of them is not a ctm-edits line of it."""
+        for split_line in split_lines:
+            if (split_line[0] != utterance_id
+                    or not (len(split_line) == 8
+                            or (len(split_line) == 9
+                                and split_line[8] == 'tainted'))):
+                raise ValueError(
+                    "bad ctm-edits line for utterance {0}: {1}".format(
+                        utterance_id, ' '.join(split_line)))
+        columns = [_to_object_array([split_line[i]
+                                     for split_line in split_lines])
+                   for i in range(1, 8)]
+        try:
+            return cls(utterance_id, *columns,
+                       tainted=np.array([len(split_line) == 9
+                                         for split_line in split_lines],
+                                        dtype=bool))
+        except ValueError:
+            raise ValueError(
+                "bad start-time or duration in the ctm-edits lines for "
+                "utterance {0}".format(utterance_id))
+
+    def to_split_lines(self):
+        """Returns the lines of the utterance as a list of lists of fields
+        (newly created, so the caller may modify them)."""
+        split_lines = [
+            [self.utterance_id, channel, start, duration, hyp_word,
+             confidence, ref_word, edit_type]
+            for channel, start, duration, hyp_word, confidence, ref_word,
+            edit_type in zip(
+                self.channels.tolist(), self.start_texts.tolist(),
+                self.duration_texts.tolist(), self.hyp_words.tolist(),
+                self.confidences.tolist(), self.ref_words.tolist(),
+                self.edit_types.tolist())]
+        for split_line, tainted in zip(split_lines, self.tainted.tolist()):
+            if tainted:
+                split_line.append('tainted')
+        return split_lines
+
+
+def read_ctm_edits(f, program_name='ctm_edits_lib.py'):
+    """Like read_ctm_edits_utterances(), but yields one CtmEditsUtterance
+    per utterance."""
+    for utterance_id, split_lines in read_ctm_edits_utterances(f,
+                                                               program_name):
+        try:
+            yield CtmEditsUtterance.from_split_lines(utterance_id, split_lines)
+        except ValueError as e:
+            sys.exit(program_name + ": " + str(e))
@@ -7,6 +7,8 @@
 from __future__ import print_function
 import sys, operator, argparse
 
+import ctm_edits_lib
+
 # Modify the CTM to include for each token the information from Levenshtein
 # alignment of 'hypothesis' and 'reference'
 # (i.e. the output of 'align-text'.
@@ -89,27 +91,28 @@ import sys, operator, argparse
 
 
 
-parser = argparse.ArgumentParser(
-    description = "Append to the CTM the Levenshtein alignment of 'hypothesis' and 'reference'; "
-    "creates augmented CTM with extra fields (see script for details)")
+def GetArgs():
+    parser = argparse.ArgumentParser(
+        description = "Append to the CTM the Levenshtein alignment of 'hypothesis' and 'reference'; "
+        "creates augmented CTM with extra fields (see script for details)")
 
-parser.add_argument("--oov", type = int, default = -1,
-                    help = "The integer representation of the OOV symbol; substitutions "
-                    "by the OOV symbol for out-of-vocabulary reference words are treated "
-                    "as correct, if you also supply the --symbol-table option.")
-parser.add_argument("--symbol-table", type = str,
-                    help = "The words.txt your system used; if supplied, it is used to "
-                    "determine OOV words (and such words will count as correct if "
-                    "substituted by the OOV symbol).  See also the --oov option")
-# Required arguments
-parser.add_argument("edits_in", metavar = "<edits-in>",
-                    help = "Filename of output of 'align-text', which this program reads. "
-                    "Use /dev/stdin for standard input.")
-parser.add_argument("ctm_in", metavar = "<ctm-in>",
-                    help = "Filename of input hypothesis in ctm format")
-parser.add_argument("ctm_edits_out", metavar = "<ctm-edits-out>",
-                    help = "Filename of output (CTM appended with word-edit information)")
-args = parser.parse_args()
+    parser.add_argument("--oov", type = int, default = -1,
+                        help = "The integer representation of the OOV symbol; substitutions "
+                        "by the OOV symbol for out-of-vocabulary reference words are treated "
+                        "as correct, if you also supply the --symbol-table option.")
+    parser.add_argument("--symbol-table", type = str,
+                        help = "The words.txt your system used; if supplied, it is used to "
+                        "determine OOV words (and such words will count as correct if "
+                        "substituted by the OOV symbol).  See also the --oov option")
+    # Required arguments
+    parser.add_argument("edits_in", metavar = "<edits-in>",
+                        help = "Filename of output of 'align-text', which this program reads. "
+                        "Use /dev/stdin for standard input.")
+    parser.add_argument("ctm_in", metavar = "<ctm-in>",
+                        help = "Filename of input hypothesis in ctm format")
+    parser.add_argument("ctm_edits_out", metavar = "<ctm-edits-out>",
+                        help = "Filename of output (CTM appended with word-edit information)")
+    return parser.parse_args()
 
 
 
@@ -252,12 +255,14 @@ def FloatToString(f):
     return format_str % f
 
 
-def OutputCtm(utterance_id, edits_array, ctm_array):
-    global ctm_edits_out
+# This function returns the ctm-edits lines for an utterance as a list of lists
+# of fields.
+def GetCtmEditsLines(utterance_id, edits_array, ctm_array):
     # note: this function expects the padded entries created by PadARrays.
     assert len(edits_array) == len(ctm_array)
     channel = '1'  # this is hardcoded at both input and output, since this CTM
                    # doesn't really represent recordings, only utterances.
+    split_lines = []
     for i in range(len(edits_array)):
         ( hyp_word, ref_word ) = edits_array[i]
         ( start_time, duration, hyp_word2, confidence ) = ctm_array[i]
@@ -267,9 +272,16 @@ def OutputCtm(utterance_id, edits_array, ctm_array):
             sys.exit(1)
         assert hyp_word == hyp_word2
         edit_type = GetEditType(hyp_word, ref_word, duration)
-        print(utterance_id, channel, FloatToString(start_time),
-              FloatToString(duration), hyp_word, confidence, ref_word,
-              edit_type, file = ctm_edits_out)
+        split_lines.append([ utterance_id, channel, FloatToString(start_time),
+                             FloatToString(duration), hyp_word, str(confidence),
+                             ref_word, edit_type ])
+    return split_lines
+
+
+def OutputCtm(utterance_id, edits_array, ctm_array):
+    global ctm_edits_out
+    ctm_edits_lib.write_ctm_edits_lines(
+        ctm_edits_out, GetCtmEditsLines(utterance_id, edits_array, ctm_array))
 
 
 def ProcessOneUtterance(utterance_id, edits_line, ctm_lines):
@@ -346,6 +358,13 @@ def ProcessData():
             num_utterances_processed), file=sys.stderr)
 
 
-OpenFiles()
-ProcessData()
+def main():
+    global args
+    args = GetArgs()
+    OpenFiles()
+    ProcessData()
+
+
+if __name__ == '__main__':
+    main()
 
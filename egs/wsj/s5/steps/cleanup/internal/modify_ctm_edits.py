@@ -10,6 +10,8 @@ import logging
 import sys
 from collections import defaultdict
 
+import ctm_edits_lib
+
 """
 This script reads and writes the 'ctm-edits' file that is
 produced by get_ctm_edits.py.
@@ -63,47 +65,74 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
-parser = argparse.ArgumentParser(
-    description = "This program modifies the reference in the ctm-edits which "
-    "is output by steps/cleanup/internal/get_ctm_edits.py, to allow insertions, deletions and "
-    "substitutions of non-scored words, and [if --allow-repetitions=true], "
-    "duplications of single words or pairs of scored words (to account for dysfluencies "
-    "that were not transcribed).  Note: deletions and substitutions of non-scored words "
-    "after the reference is corrected, will be marked as operation 'fix' rather than "
-    "'cor' (correct) so that the downstream processing knows that this was not in "
-    "the original reference.  Also by defaults tags non-scored words as such when "
-    "they are correct; see the --tag-non-scored option.")
-
-parser.add_argument("--verbose", type = int, default = 1,
-                    choices=[0,1,2,3],
-                    help = "Verbose level, higher = more verbose output")
-parser.add_argument("--allow-repetitions", type = str, default = 'true',
-                    choices=['true','false'],
-                    help = "If true, allow repetitions in the transcript of one or "
-                    "two-word sequences: for instance if the ref says 'i' but "
-                    "the hyp says 'i i', or the ref says 'but then' and the hyp says "
-                    "'but then but then', fix the reference accordingly.  Intervening "
-                    "non-scored words are allowed between the repetitions.  These "
-                    "fixes will be marked as 'cor', not as 'fix', since there is "
-                    "generally no way to tell which repetition was the 'real' one "
-                    "(and since we're generally confident that such things were "
-                    "actually uttered).")
-parser.add_argument("non_scored_words_in", metavar = "<non-scored-words-file>",
-                    help="Filename of file containing a list of non-scored words, "
-                    "one per line. See steps/cleanup/get_nonscored_words.py.")
-parser.add_argument("ctm_edits_in", metavar = "<ctm-edits-in>",
-                    help = "Filename of input ctm-edits file. "
-                    "Use /dev/stdin for standard input.")
-parser.add_argument("ctm_edits_out", metavar = "<ctm-edits-out>",
-                    help = "Filename of output ctm-edits file. "
-                    "Use /dev/stdout for standard output.")
-
-args = parser.parse_args()
-
-
-
+def GetArgs():
+    parser = argparse.ArgumentParser(
+        description = "This program modifies the reference in the ctm-edits which "
+        "is output by steps/cleanup/internal/get_ctm_edits.py, to allow insertions, deletions and "
+        "substitutions of non-scored words, and [if --allow-repetitions=true], "
+        "duplications of single words or pairs of scored words (to account for dysfluencies "
+        "that were not transcribed).  Note: deletions and substitutions of non-scored words "
+        "after the reference is corrected, will be marked as operation 'fix' rather than "
+        "'cor' (correct) so that the downstream processing knows that this was not in "
+        "the original reference.  Also by defaults tags non-scored words as such when "
+        "they are correct; see the --tag-non-scored option.")
+
+    parser.add_argument("--verbose", type = int, default = 1,
+                        choices=[0,1,2,3],
+                        help = "Verbose level, higher = more verbose output")
+    parser.add_argument("--allow-repetitions", type = str, default = 'true',
+                        choices=['true','false'],
+                        help = "If true, allow repetitions in the transcript of one or "
+                        "two-word sequences: for instance if the ref says 'i' but "
+                        "the hyp says 'i i', or the ref says 'but then' and the hyp says "
+                        "'but then but then', fix the reference accordingly.  Intervening "
+                        "non-scored words are allowed between the repetitions.  These "
+                        "fixes will be marked as 'cor', not as 'fix', since there is "
+                        "generally no way to tell which repetition was the 'real' one "
+                        "(and since we're generally confident that such things were "
+                        "actually uttered).")
+    parser.add_argument("non_scored_words_in", metavar = "<non-scored-words-file>",
+                        help="Filename of file containing a list of non-scored words, "
+                        "one per line. See steps/cleanup/get_nonscored_words.py.")
+    parser.add_argument("ctm_edits_in", metavar = "<ctm-edits-in>",
+                        help = "Filename of input ctm-edits file. "
+                        "Use /dev/stdin for standard input.")
+    parser.add_argument("ctm_edits_out", metavar = "<ctm-edits-out>",
+                        help = "Filename of output ctm-edits file. "
+                        "Use /dev/stdout for standard output.")
+
+    return parser.parse_args()
+
+
+# This class holds the statistics that are printed at the end about what was
+# changed; ModificationStats objects from different parts of the data may be
+# combined with Add().
+class ModificationStats(object):
+    def __init__(self):
+        self.num_lines = 0
+        self.num_correct_lines = 0
+        # ref_change_stats will be a map from a string like
+        # 'foo -> bar' to an integer count; it keeps track of how much we changed
+        # the reference.
+        self.ref_change_stats = defaultdict(int)
+        # repetition_stats will be a map from strings like
+        # 'a', or 'a b' (the repeated strings), to an integer count; like
+        # ref_change_stats, it keeps track of how many changes we made
+        # in allowing repetitions.
+        self.repetition_stats = defaultdict(int)
+
+    def Add(self, other):
+        self.num_lines += other.num_lines
+        self.num_correct_lines += other.num_correct_lines
+        for k, v in other.ref_change_stats.items():
+            self.ref_change_stats[k] += v
+        for k, v in other.repetition_stats.items():
+            self.repetition_stats[k] += v
+
+
+# Returns the set of non-scored words read from the file.
 def ReadNonScoredWords(non_scored_words_file):
-    global non_scored_words
+    non_scored_words = set()
     try:
         f = open(non_scored_words_file, encoding='utf-8')
     except:
@@ -116,6 +145,7 @@ def ReadNonScoredWords(non_scored_words_file):
                      "file {0}: {1}".format(non_scored_words_file, line))
         non_scored_words.add(a[0])
     f.close()
+    return non_scored_words
 
 
 
@@ -131,11 +161,11 @@ def ReadNonScoredWords(non_scored_words_file):
 # It modifies the object 'a'.   This function returns the modified array,
 # and please note that it is destructive of its input 'a'.
 # If it returnso the empty array then the line is to be deleted.
-def ProcessLineForNonScoredWords(a):
-    global num_lines, num_correct_lines, ref_change_stats
+# The counts in 'stats' (a ModificationStats object) are updated.
+def ProcessLineForNonScoredWords(a, non_scored_words, stats):
     try:
         assert len(a) == 8
-        num_lines += 1
+        stats.num_lines += 1
         # we could do:
         # [ file, channel, start, duration, hyp_word, confidence, ref_word, edit_type ] = a
         duration = a[3]
@@ -146,24 +176,24 @@ def ProcessLineForNonScoredWords(a):
             assert ref_word == '<eps>'
             if hyp_word in non_scored_words:
                 # insert this non-scored word into the reference.
-                ref_change_stats[ref_word + ' -> ' + hyp_word] += 1
+                stats.ref_change_stats[ref_word + ' -> ' + hyp_word] += 1
                 ref_word = hyp_word
                 edit_type = 'fix'
         elif edit_type == 'del':
             assert hyp_word == '<eps>' and float(duration) == 0.0
             if ref_word in non_scored_words:
-                ref_change_stats[ref_word + ' -> ' + hyp_word] += 1
+                stats.ref_change_stats[ref_word + ' -> ' + hyp_word] += 1
                 return []
         elif edit_type == 'sub':
             assert hyp_word != '<eps>'
             if hyp_word in non_scored_words and ref_word in non_scored_words:
                 # we also allow replacing one non-scored word with another.
-                ref_change_stats[ref_word + ' -> ' + hyp_word] += 1
+                stats.ref_change_stats[ref_word + ' -> ' + hyp_word] += 1
                 ref_word = hyp_word
                 edit_type = 'fix'
         else:
             assert edit_type == 'cor' or edit_type == 'sil'
-            num_correct_lines += 1
+            stats.num_correct_lines += 1
 
         a[4] = hyp_word
         a[6] = ref_word
@@ -182,8 +212,7 @@ def ProcessLineForNonScoredWords(a):
 # ref to match.
 # It returns the modified list-of-lists [but note that the input
 # is actually modified].
-def ProcessUtteranceForRepetitions(split_lines_of_utt):
-    global non_scored_words, repetition_stats
+def ProcessUtteranceForRepetitions(split_lines_of_utt, non_scored_words, stats):
     # The array 'selected_lines' will contain the indexes of of selected
     # elements of 'split_lines_of_utt'.  Consider split_line =
     # split_lines_of_utt[i].  If the hyp and ref words in split_line are both
@@ -263,7 +292,7 @@ def ProcessUtteranceForRepetitions(split_lines_of_utt):
                 word_pair = this_hyp_words[0] + ' '  + this_hyp_words[1]
                 # e.g. word_pair = 'hi there'
                 # add 2 because these stats are of words.
-                repetition_stats[word_pair] += 2
+                stats.repetition_stats[word_pair] += 2
                 # the next line prevents this region of the text being used
                 # in any further edits.
                 selected_edits[i:i+4] = [ None, None, None, None ]
@@ -282,7 +311,7 @@ def ProcessUtteranceForRepetitions(split_lines_of_utt):
                     indexes_to_fix.append(i+1)
                 else:
                     indexes_to_fix.append(i)
-                repetition_stats[this_hyp_words[0]] += 1
+                stats.repetition_stats[this_hyp_words[0]] += 1
                 # the next line prevents this region of the text being used
                 # in any further edits.
                 selected_edits[i:i+2] = [ None, None ]
@@ -303,19 +332,24 @@ def ProcessUtteranceForRepetitions(split_lines_of_utt):
 
 # note: split_lines_of_utt is a list of lists, one per line, each containing the
 # sequence of fields.
-# Returns the same format of data after processing.
-def ProcessUtterance(split_lines_of_utt):
+# Returns the same format of data after processing.  'non_scored_words' is a
+# set of words, 'allow_repetitions' is a bool (see the --allow-repetitions
+# option) and the counts in 'stats' (a ModificationStats object) are updated.
+def ProcessUtterance(split_lines_of_utt, non_scored_words, allow_repetitions,
+                     stats):
     new_split_lines_of_utt = []
     for split_line in split_lines_of_utt:
-        new_split_line = ProcessLineForNonScoredWords(split_line)
+        new_split_line = ProcessLineForNonScoredWords(split_line,
+                                                      non_scored_words, stats)
         if new_split_line != []:
             new_split_lines_of_utt.append(new_split_line)
-    if args.allow_repetitions == 'true':
-        new_split_lines_of_utt = ProcessUtteranceForRepetitions(new_split_lines_of_utt)
+    if allow_repetitions:
+        new_split_lines_of_utt = ProcessUtteranceForRepetitions(
+            new_split_lines_of_utt, non_scored_words, stats)
     return new_split_lines_of_utt
 
 
-def ProcessData():
+def ProcessData(args, non_scored_words, stats):
     try:
         f_in = open(args.ctm_edits_in, encoding='utf-8')
     except:
@@ -326,53 +360,31 @@ def ProcessData():
     except:
         sys.exit("modify_ctm_edits.py: error opening ctm-edits output "
                  "file {0}".format(args.ctm_edits_out))
-    num_lines_processed = 0
-
-
-    # Most of what we're doing in the lines below is splitting the input lines
-    # and grouping them per utterance, before giving them to ProcessUtterance()
-    # and then printing the modified lines.
-    first_line = f_in.readline()
-    if first_line == '':
-        sys.exit("modify_ctm_edits.py: empty input")
-    split_pending_line = first_line.split()
-    if len(split_pending_line) == 0:
-        sys.exit("modify_ctm_edits.py: bad input line " + first_line)
-    cur_utterance = split_pending_line[0]
-    split_lines_of_cur_utterance = []
-
-    while True:
-        if len(split_pending_line) == 0 or split_pending_line[0] != cur_utterance:
-            split_lines_of_cur_utterance = ProcessUtterance(split_lines_of_cur_utterance)
-            for split_line in split_lines_of_cur_utterance:
-                print(' '.join(split_line), file = f_out)
-            split_lines_of_cur_utterance = []
-            if len(split_pending_line) == 0:
-                break
-            else:
-                cur_utterance = split_pending_line[0]
-
-        split_lines_of_cur_utterance.append(split_pending_line)
-        next_line = f_in.readline()
-        split_pending_line = next_line.split()
-        if len(split_pending_line) == 0:
-            if next_line != '':
-                sys.exit("modify_ctm_edits.py: got an empty or whitespace input line")
+
+    # read_ctm_edits_utterances() splits the input lines and groups them per
+    # utterance; we give them to ProcessUtterance() and then print the
+    # modified lines.
+    for utterance_id, split_lines_of_utt in \
+            ctm_edits_lib.read_ctm_edits_utterances(f_in, "modify_ctm_edits.py"):
+        split_lines_of_utt = ProcessUtterance(
+            split_lines_of_utt, non_scored_words,
+            args.allow_repetitions == 'true', stats)
+        ctm_edits_lib.write_ctm_edits_lines(f_out, split_lines_of_utt)
     try:
         f_out.close()
     except:
         sys.exit("modify_ctm_edits.py: error closing ctm-edits output "
                  "(broken pipe or full disk?)")
 
-def PrintNonScoredStats():
-    if args.verbose < 1:
+def PrintNonScoredStats(stats, verbose):
+    if verbose < 1:
         return
-    if num_lines == 0:
+    if stats.num_lines == 0:
         print("modify_ctm_edits.py: processed no input.", file = sys.stderr)
-    num_lines_modified = sum(ref_change_stats.values())
-    num_incorrect_lines = num_lines - num_correct_lines
-    percent_lines_incorrect= '%.2f' % (num_incorrect_lines * 100.0 / num_lines)
-    percent_modified = '%.2f' % (num_lines_modified * 100.0 / num_lines);
+    num_lines_modified = sum(stats.ref_change_stats.values())
+    num_incorrect_lines = stats.num_lines - stats.num_correct_lines
+    percent_lines_incorrect= '%.2f' % (num_incorrect_lines * 100.0 / stats.num_lines)
+    percent_modified = '%.2f' % (num_lines_modified * 100.0 / stats.num_lines);
     if num_incorrect_lines > 0:
         percent_of_incorrect_modified = '%.2f' % (num_lines_modified * 100.0 /
                                                   num_incorrect_lines)
@@ -381,29 +393,29 @@ def PrintNonScoredStats():
     print("modify_ctm_edits.py: processed {0} lines of ctm ({1}% of which incorrect), "
           "of which {2} were changed fixing the reference for non-scored words "
           "({3}% of lines, or {4}% of incorrect lines)".format(
-            num_lines, percent_lines_incorrect, num_lines_modified,
+            stats.num_lines, percent_lines_incorrect, num_lines_modified,
             percent_modified, percent_of_incorrect_modified),
           file = sys.stderr)
 
-    keys = sorted(ref_change_stats.keys(), reverse=True,
-                  key = lambda x: ref_change_stats[x])
-    num_keys_to_print = 40 if args.verbose >= 2 else 10
+    keys = sorted(stats.ref_change_stats.keys(), reverse=True,
+                  key = lambda x: stats.ref_change_stats[x])
+    num_keys_to_print = 40 if verbose >= 2 else 10
 
     print("modify_ctm_edits.py: most common edits (as percentages "
           "of all such edits) are:\n" +
-          ('\n'.join([ '%s [%.2f%%]' % (k, ref_change_stats[k]*100.0/num_lines_modified)
+          ('\n'.join([ '%s [%.2f%%]' % (k, stats.ref_change_stats[k]*100.0/num_lines_modified)
                      for k in keys[0:num_keys_to_print]]))
           + '\n...'if num_keys_to_print < len(keys) else '',
           file = sys.stderr)
 
 
-def PrintRepetitionStats():
-    if args.verbose < 1 or sum(repetition_stats.values()) == 0:
+def PrintRepetitionStats(stats, verbose):
+    if verbose < 1 or sum(stats.repetition_stats.values()) == 0:
         return
-    num_lines_modified = sum(repetition_stats.values())
-    num_incorrect_lines = num_lines - num_correct_lines
-    percent_lines_incorrect= '%.2f' % (num_incorrect_lines * 100.0 / num_lines)
-    percent_modified = '%.2f' % (num_lines_modified * 100.0 / num_lines);
+    num_lines_modified = sum(stats.repetition_stats.values())
+    num_incorrect_lines = stats.num_lines - stats.num_correct_lines
+    percent_lines_incorrect= '%.2f' % (num_incorrect_lines * 100.0 / stats.num_lines)
+    percent_modified = '%.2f' % (num_lines_modified * 100.0 / stats.num_lines);
     if num_incorrect_lines > 0:
         percent_of_incorrect_modified = '%.2f' % (num_lines_modified * 100.0 /
                                                   num_incorrect_lines)
@@ -412,37 +424,30 @@ def PrintRepetitionStats():
     print("modify_ctm_edits.py: processed {0} lines of ctm ({1}% of which incorrect), "
           "of which {2} were changed fixing the reference for repetitions ({3}% of "
           "lines, or {4}% of incorrect lines)".format(
-            num_lines, percent_lines_incorrect, num_lines_modified,
+            stats.num_lines, percent_lines_incorrect, num_lines_modified,
             percent_modified, percent_of_incorrect_modified),
           file = sys.stderr)
 
-    keys = sorted(repetition_stats.keys(), reverse=True,
-                  key = lambda x: repetition_stats[x])
-    num_keys_to_print = 40 if args.verbose >= 2 else 10
+    keys = sorted(stats.repetition_stats.keys(), reverse=True,
+                  key = lambda x: stats.repetition_stats[x])
+    num_keys_to_print = 40 if verbose >= 2 else 10
 
     print("modify_ctm_edits.py: most common repetitions inserted into reference (as percentages "
           "of all words fixed in this way) are:\n" +
-          ('\n'.join([ '%s [%.2f%%]' % (k, repetition_stats[k]*100.0/num_lines_modified)
+          ('\n'.join([ '%s [%.2f%%]' % (k, stats.repetition_stats[k]*100.0/num_lines_modified)
                      for k in keys[0:num_keys_to_print]]))
           + '\n...' if num_keys_to_print < len(keys) else '',
           file = sys.stderr)
 
 
-non_scored_words = set()
-ReadNonScoredWords(args.non_scored_words_in)
-
-num_lines = 0
-num_correct_lines = 0
-# ref_change_stats will be a map from a string like
-# 'foo -> bar' to an integer count; it keeps track of how much we changed
-# the reference.
-ref_change_stats = defaultdict(int)
-# repetition_stats will be a map from strings like
-# 'a', or 'a b' (the repeated strings), to an integer count; like
-# ref_change_stats, it keeps track of how many changes we made
-# in allowing repetitions.
-repetition_stats = defaultdict(int)
-
-ProcessData()
-PrintNonScoredStats()
-PrintRepetitionStats()
+def main():
+    args = GetArgs()
+    non_scored_words = ReadNonScoredWords(args.non_scored_words_in)
+    stats = ModificationStats()
+    ProcessData(args, non_scored_words, stats)
+    PrintNonScoredStats(stats, args.verbose)
+    PrintRepetitionStats(stats, args.verbose)
+
+
+if __name__ == '__main__':
+    main()
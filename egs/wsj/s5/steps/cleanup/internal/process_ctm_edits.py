@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# Apache 2.0
+
+"""
+This script does, in one pass over the ctm-edits file, what is otherwise done
+by running modify_ctm_edits.py, taint_ctm_edits.py and
+segment_ctm_edits_mild.py one after the other, e.g. in
+steps/cleanup/segment_long_utterances.sh.  The input is only parsed once, and
+the utterances are processed in batches by --num-jobs worker processes.  The
+outputs are written in the order of the input, and are the same as those of
+the separate scripts; the outputs of the first two stages can be written with
+--modified-ctm-edits-out and --tainted-ctm-edits-out.  The stats that the
+separate scripts print are printed at the end.
+"""
+
+from __future__ import print_function
+import argparse
+import io
+import logging
+import sys
+
+import ctm_edits_lib
+import modify_ctm_edits
+import segment_ctm_edits_mild
+import taint_ctm_edits
+sys.path.insert(0, 'steps')
+import libs.common as common_lib
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s [%(pathname)s:%(lineno)s - '
+                              '%(funcName)s - %(levelname)s ] %(message)s')
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+# These are set in the worker processes (and in the main process) by
+# init_worker(); they are the same for every utterance.
+_global_options = None
+_global_oov_symbol = None
+
+
+def get_args():
+    parser = segment_ctm_edits_mild.get_parser()
+    parser.description = (
+        "This program runs the stages of modify_ctm_edits.py, "
+        "taint_ctm_edits.py and segment_ctm_edits_mild.py on each utterance "
+        "of the ctm-edits input, producing the same segmentation and text as "
+        "running those scripts one after the other.  The segmentation "
+        "options are those of segment_ctm_edits_mild.py.")
+
+    parser.add_argument("--allow-repetitions", type=str, default='true',
+                        choices=['true', 'false'],
+                        help="""The --allow-repetitions option of
+                        modify_ctm_edits.py""")
+    parser.add_argument("--remove-deletions", type=str, default="true",
+                        choices=["true", "false"],
+                        help="""The --remove-deletions option of
+                        taint_ctm_edits.py""")
+    parser.add_argument("--stats-verbose", type=int, default=1,
+                        choices=[0, 1, 2, 3],
+                        help="""The --verbose option of modify_ctm_edits.py and
+                        taint_ctm_edits.py, which controls how much of their
+                        stats is printed""")
+    parser.add_argument("--modified-ctm-edits-out",
+                        type=argparse.FileType('w'),
+                        help="""If supplied, the ctm-edits after
+                        modification is written to this file, as it would be
+                        by modify_ctm_edits.py""")
+    parser.add_argument("--tainted-ctm-edits-out",
+                        type=argparse.FileType('w'),
+                        help="""If supplied, the ctm-edits after tainting is
+                        written to this file, as it would be by
+                        taint_ctm_edits.py""")
+    parser.add_argument("--num-jobs", type=int, default=1,
+                        help="""Number of worker processes; if 1, everything
+                        is done in this process""")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="""Number of utterances given to a worker process
+                        at a time""")
+
+    args = segment_ctm_edits_mild.get_args(parser)
+
+    if args.num_jobs < 1 or args.batch_size < 1:
+        raise ValueError("--num-jobs and --batch-size must be positive")
+
+    return args
+
+
+def get_options(args):
+    """Returns the options that are needed to process an utterance, which is
+    'args' without the file objects (which can't be passed to the worker
+    processes), plus some bools."""
+    options = argparse.Namespace(**vars(args))
+    for name in ['non_scored_words_in', 'ctm_edits_in', 'text_out',
+                 'segments_out', 'oov_symbol_file', 'ctm_edits_out',
+                 'word_stats_out', 'modified_ctm_edits_out',
+                 'tainted_ctm_edits_out']:
+        setattr(options, 'write_' + name, getattr(args, name) is not None)
+        setattr(options, name, None)
+    options.allow_repetitions = (args.allow_repetitions == 'true')
+    options.remove_deletions = (args.remove_deletions == 'true')
+    return options
+
+
+def init_worker(options, oov_symbol, non_scored_words):
+    global _global_options, _global_oov_symbol
+    _global_options = options
+    _global_oov_symbol = oov_symbol
+    segment_ctm_edits_mild.set_non_scored_words(non_scored_words)
+
+
+def process_batch(utterances):
+    """Processes a list of ctm_edits_lib.CtmEditsUtterance.  Returns a pair
+    (outputs, stats) where 'outputs' is a list of the text to write to each of
+    the modified and tainted ctm-edits, text, segments and ctm-edits
+    (debug) outputs, and 'stats' is a tuple of the stats objects of the three
+    stages for this batch.
+    """
+    options = _global_options
+    non_scored_words = segment_ctm_edits_mild.non_scored_words()
+    modification_stats = modify_ctm_edits.ModificationStats()
+    taint_stats = taint_ctm_edits.TaintStats()
+    utterance_stats = segment_ctm_edits_mild.UtteranceStats()
+    word_stats = segment_ctm_edits_mild.WordStats()
+    modified_out = io.StringIO()
+    tainted_out = io.StringIO()
+    text_out = io.StringIO()
+    segments_out = io.StringIO()
+    ctm_edits_out = io.StringIO() if options.write_ctm_edits_out else None
+
+    for utterance in utterances:
+        split_lines = modify_ctm_edits.ProcessUtterance(
+            utterance.to_split_lines(), non_scored_words,
+            options.allow_repetitions, modification_stats)
+        # An utterance whose lines have all been removed would not be seen
+        # by the later stages when run as separate scripts.
+        if len(split_lines) == 0:
+            continue
+        if options.write_modified_ctm_edits_out:
+            modified_out.write(
+                ctm_edits_lib.format_ctm_edits_lines(split_lines))
+
+        split_lines = taint_ctm_edits.ProcessUtterance(
+            split_lines, taint_stats, options.remove_deletions)
+        if len(split_lines) == 0:
+            continue
+        if options.write_tainted_ctm_edits_out:
+            tainted_out.write(
+                ctm_edits_lib.format_ctm_edits_lines(split_lines))
+
+        try:
+            segment_ctm_edits_mild.process_utterance(
+                utterance.utterance_id, split_lines, options,
+                _global_oov_symbol, utterance_stats, word_stats,
+                text_out, segments_out, ctm_edits_out)
+        except Exception:
+            logger.error("Error with utterance %s", utterance.utterance_id)
+            raise
+
+    outputs = [modified_out.getvalue(), tainted_out.getvalue(),
+               text_out.getvalue(), segments_out.getvalue(),
+               ctm_edits_out.getvalue() if ctm_edits_out is not None else '']
+    return (outputs, (modification_stats, taint_stats, utterance_stats,
+                      word_stats))
+
+
+def read_batches(ctm_edits_in, batch_size):
+    batch = []
+    for utterance in ctm_edits_lib.read_ctm_edits(ctm_edits_in,
+                                                  "process_ctm_edits.py"):
+        batch.append(utterance)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def process_data(args, options, oov_symbol):
+    """Processes all the input and writes the outputs; returns the combined
+    stats of the three stages as a tuple (modification_stats, taint_stats,
+    utterance_stats, word_stats)."""
+    output_handles = [args.modified_ctm_edits_out, args.tainted_ctm_edits_out,
+                      args.text_out, args.segments_out, args.ctm_edits_out]
+    modification_stats = modify_ctm_edits.ModificationStats()
+    taint_stats = taint_ctm_edits.TaintStats()
+    utterance_stats = segment_ctm_edits_mild.UtteranceStats()
+    word_stats = segment_ctm_edits_mild.WordStats()
+    all_stats = (modification_stats, taint_stats, utterance_stats, word_stats)
+    non_scored_words = segment_ctm_edits_mild.non_scored_words()
+
+    def write_results(results):
+        outputs, batch_stats = results
+        for handle, output in zip(output_handles, outputs):
+            if handle is not None:
+                handle.write(output)
+        modification_stats.Add(batch_stats[0])
+        taint_stats.Add(batch_stats[1])
+        utterance_stats.add(batch_stats[2])
+        word_stats.add(batch_stats[3])
+
+    # The results are written in the order of the input.
+    for results in common_lib.map_in_order(
+            process_batch, read_batches(args.ctm_edits_in, args.batch_size),
+            num_jobs=args.num_jobs, initializer=init_worker,
+            initargs=(options, oov_symbol, non_scored_words)):
+        write_results(results)
+    return all_stats
+
+
+def main():
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf8")
+    args = get_args()
+
+    try:
+        segment_ctm_edits_mild.set_non_scored_words(set())
+        segment_ctm_edits_mild.read_non_scored_words(args.non_scored_words_in)
+        oov_symbol = segment_ctm_edits_mild.read_oov_symbol(
+            args.oov_symbol_file, args.unk_padding)
+
+        (modification_stats, taint_stats,
+         utterance_stats, word_stats) = process_data(
+             args, get_options(args), oov_symbol)
+
+        try:
+            for f in [args.modified_ctm_edits_out, args.tainted_ctm_edits_out,
+                      args.text_out, args.segments_out, args.ctm_edits_out]:
+                if f is not None:
+                    f.close()
+        except:
+            logger.error("error closing one or more outputs "
+                         "(broken pipe or full disk?)")
+            raise
+
+        modify_ctm_edits.PrintNonScoredStats(modification_stats,
+                                             args.stats_verbose)
+        modify_ctm_edits.PrintRepetitionStats(modification_stats,
+                                              args.stats_verbose)
+        taint_ctm_edits.PrintStats(taint_stats, args.stats_verbose)
+        utterance_stats.print_segment_stats()
+        if args.word_stats_out is not None:
+            word_stats.print(args.word_stats_out)
+        if args.ctm_edits_out is not None:
+            logger.info("detailed utterance-level debug information "
+                        "is in %s", args.ctm_edits_out.name)
+    except:
+        logger.error("Failed processing CTM edits")
+        raise
+
+
+if __name__ == '__main__':
+    main()
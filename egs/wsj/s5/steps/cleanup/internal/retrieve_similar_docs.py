@@ -81,6 +81,8 @@ from __future__ import print_function
 import argparse
 import logging
 
+import numpy as np
+
 import tf_idf
 
 
@@ -124,6 +126,17 @@ def get_args():
                         from the neighboring documents is added to the
                         retrieved document.""")
 
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="""Maximum number of consecutive queries
+                        with the same source text whose similarity scores
+                        are computed together.""")
+    parser.add_argument("--use-binary-cache", type=str, default="false",
+                        choices=["true", "false"],
+                        help="""If true, the source TF-IDFs are cached in
+                        binary form in <tf-idf-file>.bin, which is memory-mapped
+                        rather than parsed; compute_tf_idf.py can write it
+                        with --write-binary-cache=true.""")
+
     parser.add_argument("--source-text-id2doc-ids",
                         type=argparse.FileType('r'), required=True,
                         help="""A mapping from the source text to a list of
@@ -158,6 +171,12 @@ def get_args():
         logger.error("--partial-doc-fraction must be in [0,1]")
         raise ValueError
 
+    if args.batch_size <= 0:
+        logger.error("--batch-size must be positive")
+        raise ValueError
+
+    args.use_binary_cache = bool(args.use_binary_cache == "true")
+
     return args
 
 
@@ -235,6 +254,86 @@ def get_document_ids(source_docs, indexes):
     return doc_ids
 
 
+def read_query_batches(query_tfidf, query_id2source_text_id, batch_size):
+    """Reads the archive of query TF-IDF objects and yields tuples
+    (source_text_id, [query_ids], [query_tfidfs]) for batches of
+    consecutive queries with the same source text.
+    """
+    batch_source_text_id = None
+    batch_ids = []
+    batch_tfidfs = []
+    for query_id, query_tfidf in tf_idf.read_tfidf_ark(query_tfidf):
+        source_text_id = query_id2source_text_id[query_id]
+        if (len(batch_ids) > 0
+                and (source_text_id != batch_source_text_id
+                     or len(batch_ids) == batch_size)):
+            yield batch_source_text_id, batch_ids, batch_tfidfs
+            batch_ids = []
+            batch_tfidfs = []
+        batch_source_text_id = source_text_id
+        batch_ids.append(query_id)
+        batch_tfidfs.append(query_tfidf)
+    if len(batch_ids) > 0:
+        yield batch_source_text_id, batch_ids, batch_tfidfs
+
+
+def get_best_docs(args, source_doc_ids, scores, query_id):
+    """Returns the list of documents retrieved for a query, as tuples
+    (<doc-id>, <start-fraction>, <end-fraction>), given the similarity scores
+    of the query with the source documents source_doc_ids.
+    """
+    best_index = int(np.argmax(scores))
+    best_doc_id = source_doc_ids[best_index]
+    best_score = scores[best_index]
+
+    best_indexes = {}
+
+    if args.num_neighbors_to_search == 0:
+        best_indexes[best_index] = (1, 1)
+        if best_index > 0:
+            best_indexes[best_index - 1] = (0, args.partial_doc_fraction)
+        if best_index < len(source_doc_ids) - 1:
+            best_indexes[best_index + 1] = (args.partial_doc_fraction, 0)
+    else:
+        excluded_indexes = set()
+        for index in range(
+                max(best_index - args.num_neighbors_to_search, 0),
+                min(best_index + args.num_neighbors_to_search + 1,
+                    len(source_doc_ids))):
+            if (scores[index]
+                    >= args.neighbor_tfidf_threshold * best_score):
+                best_indexes[index] = (1, 1)    # Type 2
+                if index > 0 and index - 1 in excluded_indexes:
+                    try:
+                        # Type 1 and 3
+                        start_frac, end_frac = best_indexes[index - 1]
+                        assert end_frac == 0
+                        best_indexes[index - 1] = (
+                            start_frac, args.partial_doc_fraction)
+                    except KeyError:
+                        # Type 1
+                        best_indexes[index - 1] = (
+                            0, args.partial_doc_fraction)
+            else:
+                excluded_indexes.add(index)
+                if index > 0 and index - 1 not in excluded_indexes:
+                    # Type 3
+                    best_indexes[index] = (args.partial_doc_fraction, 0)
+
+    best_docs = get_document_ids(source_doc_ids, best_indexes)
+
+    assert len(best_docs) > 0, (
+        "Did not get best docs for query {0}\n"
+        "Scores: {1}\n"
+        "Source docs: {2}\n"
+        "Best index: {best_index}, score: {best_score}\n".format(
+            query_id, scores.tolist(), source_doc_ids,
+            best_index=best_index, best_score=best_score))
+    assert (best_doc_id, 1.0, 1.0) in best_docs
+
+    return best_docs
+
+
 def run(args):
     """The main function that does all the processing.
     Takes as argument the Namespace object obtained from _get_args().
@@ -247,92 +346,43 @@ def run(args):
     source_text_id2tfidf = read_map(args.source_text_id2tfidf,
                                     num_values_per_key=1)
 
-    num_queries = 0
-    prev_source_text_id = ""
-    for query_id, query_tfidf in tf_idf.read_tfidf_ark(args.query_tfidf):
-        num_queries += 1
-
-        # The source text from which a document is to be retrieved for the
-        # input query
-        source_text_id = query_id2source_text_id[query_id]
+    # Consecutive batches of queries usually share the same TF-IDF file, so
+    # the most recently loaded file is kept; only one is held at a time.
+    source_tfidf_file = None
+    source_tfidf = None
 
-        if prev_source_text_id != source_text_id:
-            source_tfidf = tf_idf.TFIDF()
-            source_tfidf.read(
-                open(source_text_id2tfidf[source_text_id]))
-            prev_source_text_id = source_text_id
+    num_queries = 0
+    for source_text_id, query_ids, query_tfidfs in read_query_batches(
+            args.query_tfidf, query_id2source_text_id, args.batch_size):
+        tfidf_file = source_text_id2tfidf[source_text_id]
+        if tfidf_file != source_tfidf_file:
+            # Release the previous file before loading the next one.
+            source_tfidf = None
+            source_tfidf = tf_idf.read_sparse_tfidf(
+                tfidf_file, use_binary_cache=args.use_binary_cache)
+            source_tfidf_file = tfidf_file
 
         # The source documents corresponding to the source text.
         # This is set of documents which will be searched over for the query.
         source_doc_ids = source_text_id2doc_ids[source_text_id]
 
-        scores = query_tfidf.compute_similarity_scores(
-            source_tfidf, source_docs=source_doc_ids, query_id=query_id)
-
-        assert len(scores) > 0, (
-            "Did not get scores for query {0}".format(query_id))
-
-        if args.verbose > 2:
-            for tup, score in scores.items():
-                logger.debug("Score, {num}: {0} {1} {2}".format(
-                    tup[0], tup[1], score, num=num_queries))
-
-        best_index, best_doc_id = max(
-            enumerate(source_doc_ids), key=lambda x: scores[(query_id, x[1])])
-        best_score = scores[(query_id, best_doc_id)]
-
-        assert source_doc_ids[best_index] == best_doc_id
-        assert best_score == max([scores[(query_id, x)]
-                                  for x in source_doc_ids])
-
-        best_indexes = {}
-
-        if args.num_neighbors_to_search == 0:
-            best_indexes[best_index] = (1, 1)
-            if best_index > 0:
-                best_indexes[best_index - 1] = (0, args.partial_doc_fraction)
-            if best_index < len(source_doc_ids) - 1:
-                best_indexes[best_index + 1] = (args.partial_doc_fraction, 0)
-        else:
-            excluded_indexes = set()
-            for index in range(
-                    max(best_index - args.num_neighbors_to_search, 0),
-                    min(best_index + args.num_neighbors_to_search + 1,
-                        len(source_doc_ids))):
-                if (scores[(query_id, source_doc_ids[index])]
-                        >= args.neighbor_tfidf_threshold * best_score):
-                    best_indexes[index] = (1, 1)    # Type 2
-                    if index > 0 and index - 1 in excluded_indexes:
-                        try:
-                            # Type 1 and 3
-                            start_frac, end_frac = best_indexes[index - 1]
-                            assert end_frac == 0
-                            best_indexes[index - 1] = (
-                                start_frac, args.partial_doc_fraction)
-                        except KeyError:
-                            # Type 1
-                            best_indexes[index - 1] = (
-                                0, args.partial_doc_fraction)
-                else:
-                    excluded_indexes.add(index)
-                    if index > 0 and index - 1 not in excluded_indexes:
-                        # Type 3
-                        best_indexes[index] = (args.partial_doc_fraction, 0)
-
-        best_docs = get_document_ids(source_doc_ids, best_indexes)
-
-        assert len(best_docs) > 0, (
-            "Did not get best docs for query {0}\n"
-            "Scores: {1}\n"
-            "Source docs: {2}\n"
-            "Best index: {best_index}, score: {best_score}\n".format(
-                query_id, scores, source_doc_ids,
-                best_index=best_index, best_score=best_score))
-        assert (best_doc_id, 1.0, 1.0) in best_docs
-
-        print ("{0} {1}".format(query_id, " ".join(
-            ["%s,%.2f,%.2f" % x for x in best_docs])),
-               file=args.relevant_docs)
+        scores = source_tfidf.compute_similarity_scores(
+            query_tfidfs, source_doc_ids, query_ids=query_ids)
+
+        for query_id, query_scores in zip(query_ids, scores):
+            num_queries += 1
+
+            if args.verbose > 2:
+                for doc_id, score in zip(source_doc_ids, query_scores):
+                    logger.debug("Score, {num}: {0} {1} {2}".format(
+                        query_id, doc_id, float(score), num=num_queries))
+
+            best_docs = get_best_docs(args, source_doc_ids, query_scores,
+                                      query_id)
+
+            print ("{0} {1}".format(query_id, " ".join(
+                ["%s,%.2f,%.2f" % x for x in best_docs])),
+                   file=args.relevant_docs)
 
     if num_queries == 0:
         raise RuntimeError("Failed to retrieve any document.")
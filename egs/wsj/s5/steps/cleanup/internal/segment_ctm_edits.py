@@ -10,6 +10,8 @@ from __future__ import division
 import sys, operator, argparse, os
 from collections import defaultdict
 
+import ctm_edits_lib
+
 # This script reads 'ctm-edits' file format that is produced by get_ctm_edits.py
 # and modified by modify_ctm_edits.py and taint_ctm_edits.py Its function is to
 # produce a segmentation and text from the ctm-edits input.
@@ -946,42 +948,21 @@ def ProcessData():
             sys.exit("segment_ctm_edits.py: error opening ctm-edits output "
                      "file {0}".format(args.ctm_edits_out))
 
-    # Most of what we're doing in the lines below is splitting the input lines
-    # and grouping them per utterance, before giving them to ProcessUtterance()
-    # and then printing the modified lines.
-    first_line = f_in.readline()
-    if first_line == '':
-        sys.exit("segment_ctm_edits.py: empty input")
-    split_pending_line = first_line.split()
-    if len(split_pending_line) == 0:
-        sys.exit("segment_ctm_edits.py: bad input line " + first_line)
-    cur_utterance = split_pending_line[0]
-    split_lines_of_cur_utterance = []
-
-    while True:
-        if len(split_pending_line) == 0 or split_pending_line[0] != cur_utterance:
-            (segments_for_utterance,
-             deleted_segments_for_utterance) = GetSegmentsForUtterance(split_lines_of_cur_utterance)
-            AccWordStatsForUtterance(split_lines_of_cur_utterance, segments_for_utterance)
-            WriteSegmentsForUtterance(text_output_handle, segments_output_handle,
-                                      cur_utterance, segments_for_utterance)
-            if args.ctm_edits_out != None:
-                PrintDebugInfoForUtterance(ctm_edits_output_handle,
-                                           split_lines_of_cur_utterance,
-                                           segments_for_utterance,
-                                           deleted_segments_for_utterance)
-            split_lines_of_cur_utterance = []
-            if len(split_pending_line) == 0:
-                break
-            else:
-                cur_utterance = split_pending_line[0]
-
-        split_lines_of_cur_utterance.append(split_pending_line)
-        next_line = f_in.readline()
-        split_pending_line = next_line.split()
-        if len(split_pending_line) == 0:
-            if next_line != '':
-                sys.exit("segment_ctm_edits.py: got an empty or whitespace input line")
+    # read_ctm_edits_utterances() splits the input lines and groups them per
+    # utterance; we give them to GetSegmentsForUtterance() and then print the
+    # segments and the debug information.
+    for cur_utterance, split_lines_of_cur_utterance in \
+            ctm_edits_lib.read_ctm_edits_utterances(f_in, "segment_ctm_edits.py"):
+        (segments_for_utterance,
+         deleted_segments_for_utterance) = GetSegmentsForUtterance(split_lines_of_cur_utterance)
+        AccWordStatsForUtterance(split_lines_of_cur_utterance, segments_for_utterance)
+        WriteSegmentsForUtterance(text_output_handle, segments_output_handle,
+                                  cur_utterance, segments_for_utterance)
+        if args.ctm_edits_out != None:
+            PrintDebugInfoForUtterance(ctm_edits_output_handle,
+                                       split_lines_of_cur_utterance,
+                                       segments_for_utterance,
+                                       deleted_segments_for_utterance)
     try:
         text_output_handle.close()
         segments_output_handle.close()
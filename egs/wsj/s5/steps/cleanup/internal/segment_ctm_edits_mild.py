@@ -10,9 +10,12 @@ import argparse
 import copy
 import logging
 import heapq
+import itertools
 import sys
 from collections import defaultdict
 
+import ctm_edits_lib
+
 """
 This script reads 'ctm-edits' file format that is produced by align_ctm_ref.py
 and modified by modify_ctm_edits.py and taint_ctm_edits.py. Its function is to
@@ -45,7 +48,12 @@ def non_scored_words():
     return _global_non_scored_words
 
 
-def get_args():
+def set_non_scored_words(words):
+    global _global_non_scored_words
+    _global_non_scored_words = words
+
+
+def get_parser():
     parser = argparse.ArgumentParser(
         description="""This program produces segmentation and text information
         based on reading ctm-edits input format which is produced by
@@ -232,7 +240,14 @@ def get_args():
 
     parser.add_argument("--verbose", type=int, default=0,
                         help="Use higher verbosity for more debugging output")
+    return parser
 
+
+def get_args(parser=None):
+    """Parses the command line with 'parser', which defaults to the one
+    returned by get_parser(), and sets the verbosity of the logging."""
+    if parser is None:
+        parser = get_parser()
     args = parser.parse_args()
 
     if args.verbose > 2:
@@ -457,9 +472,12 @@ class Segment(object):
 
     def copy(self, copy_stats=True):
         segment = Segment(self.split_lines_of_utt, self.start_index,
-                          self.end_index, debug_str=self.debug_str,
-                          segment_stats=(None if not copy_stats
-                                         else copy.deepcopy(self.stats)))
+                          self.end_index, debug_str=self.debug_str)
+        if copy_stats and self.stats is not None:
+            # Copy the stats by adding them to empty stats rather than
+            # recomputing them from the lines of the segment.
+            segment.stats = SegmentStats()
+            segment.stats.combine(self.stats)
         segment.start_keep_proportion = self.start_keep_proportion
         segment.end_keep_proportion = self.end_keep_proportion
         segment.start_unk_padding = self.start_unk_padding
@@ -1306,95 +1324,131 @@ class SegmentsMerger(object):
                        max_wer=10, max_bad_proportion=0.3,
                        max_segment_length=10,
                        max_intersegment_incorrect_words_length=1):
+        """Does agglomerative clustering of the segments. The initial
+        clusters are the individual segments, plus the regions before the
+        first segment (index -1) and after the last segment
+        (index len(self.segments)). At each step, the pair of adjacent
+        clusters whose merged segment has the highest score, and is within
+        the limits on WER, bad-proportion and length, is merged (ties are
+        broken in favor of the earlier pair).
+
+        The clusters are kept in a doubly-linked list and the candidate
+        merges in a heap. When two clusters are merged, only the merges of
+        the new cluster with its two neighbours are scored; the heap entries
+        that involve the old clusters are discarded when they are popped.
+
+        Returns the list of clusters, each a list of segment indexes.
+        """
         for i, x in enumerate(self.segments):
             _global_logger.debug("before agglomerative clustering, segment %d"
                                  " = %s", i, x)
 
-        # Initial clusters are the individual segments themselves.
-        clusters = [[x] for x in range(-1, len(self.segments) + 1)]
+        # The clusters are ranges of consecutive segment indexes and are
+        # identified by their first index.
+        cluster_end = {}
+        next_cluster = {}
+        prev_cluster = {}
+        for i in range(-1, len(self.segments) + 1):
+            cluster_end[i] = i
+            prev_cluster[i] = i - 1 if i > -1 else None
+            next_cluster[i] = i + 1 if i < len(self.segments) else None
 
         rejected_clusters = set()
 
-        while len(clusters) > 1:
-            try:
-                _global_logger.debug("Current clusters: %s", clusters)
+        # The heap contains tuples (-score, first-index-of-cluster1,
+        # serial-number, (first-index, last-index-of-cluster1,
+        # last-index-of-cluster2, merged-segment, new-cluster)).
+        # The serial number makes the tuples unique.
+        heap = []
+        serial_numbers = itertools.count()
+
+        def add_candidate(cluster1_start, cluster2_start):
+            cluster1 = list(range(cluster1_start,
+                                  cluster_end[cluster1_start] + 1))
+            cluster2 = list(range(cluster2_start,
+                                  cluster_end[cluster2_start] + 1))
+            merged_segment, new_cluster, reject = self._get_merged_cluster(
+                cluster1, cluster2, rejected_clusters,
+                max_intersegment_incorrect_words_length=(
+                    max_intersegment_incorrect_words_length))
+            if reject:
+                rejected_clusters.add(tuple(new_cluster))
+                return
+            heapq.heappush(heap, (-scoring_function(merged_segment),
+                                  cluster1_start, next(serial_numbers),
+                                  (cluster1_start, cluster1[-1], cluster2[-1],
+                                   merged_segment, new_cluster)))
+
+        def is_current(candidate):
+            cluster1_start, cluster1_end, cluster2_end = candidate[:3]
+            return (cluster_end.get(cluster1_start) == cluster1_end
+                    and cluster_end.get(cluster1_end + 1) == cluster2_end)
 
-                heap = []
+        try:
+            for i in range(-1, len(self.segments)):
+                add_candidate(i, i + 1)
 
-                for i in range(len(clusters) - 1):
-                    merged_segment, new_cluster, reject = (
-                        self._get_merged_cluster(
-                            clusters[i], clusters[i + 1], rejected_clusters,
-                            max_intersegment_incorrect_words_length=(
-                                max_intersegment_incorrect_words_length)))
-                    if reject:
-                        rejected_clusters.add(tuple(new_cluster))
-                        continue
-                    heapq.heappush(heap, ((-scoring_function(merged_segment), i),
-                                          (merged_segment, i, new_cluster)))
+            while len(heap) > 0:
+                candidate = heapq.heappop(heap)[3]
+                if not is_current(candidate):
+                    continue
+                cluster1_start, cluster1_end, cluster2_end, segment, cluster = (
+                    candidate)
 
-                candidate_index = -1
-                candidate_cluster = None
+                _global_logger.debug(
+                    "Considering new cluster: %s", cluster)
 
-                while True:
-                    try:
-                        score, tup = heapq.heappop(heap)
-                    except IndexError:
-                        break
+                if segment.stats.wer() > max_wer:
+                    _global_logger.debug(
+                        "Rejecting cluster with "
+                        "WER%% %.2f > %.2f", segment.stats.wer(), max_wer)
+                    rejected_clusters.add(tuple(cluster))
+                    continue
 
-                    segment, index, cluster = tup
+                if segment.stats.bad_proportion() > max_bad_proportion:
+                    _global_logger.debug(
+                        "Rejecting cluster with bad-proportion "
+                        "%.2f > %.2f", segment.stats.bad_proportion(),
+                        max_bad_proportion)
+                    rejected_clusters.add(tuple(cluster))
+                    continue
 
+                if segment.stats.total_length > max_segment_length:
                     _global_logger.debug(
-                        "Considering new cluster: (%d, %s)", index, cluster)
-
-                    if segment.stats.wer() > max_wer:
-                        _global_logger.debug(
-                            "Rejecting cluster with "
-                            "WER%% %.2f > %.2f", segment.stats.wer(), max_wer)
-                        rejected_clusters.add(tuple(cluster))
-                        continue
-
-                    if segment.stats.bad_proportion() > max_bad_proportion:
-                        _global_logger.debug(
-                            "Rejecting cluster with bad-proportion "
-                            "%.2f > %.2f", segment.stats.bad_proportion(),
-                            max_bad_proportion)
-                        rejected_clusters.add(tuple(cluster))
-                        continue
-
-                    if segment.stats.total_length > max_segment_length:
-                        _global_logger.debug(
-                            "Rejecting cluster with length "
-                            "%.2f > %.2f", segment.stats.total_length,
-                            max_segment_length)
-                        rejected_clusters.add(tuple(cluster))
-                        continue
-
-                    candidate_index, candidate_cluster = tup[1:]
-                    _global_logger.debug("Accepted cluster (%d, %s)",
-                                         candidate_index, candidate_cluster)
-                    break
-
-                if candidate_index == -1:
-                    return clusters
-
-                new_clusters = []
-
-                for i in range(candidate_index):
-                    new_clusters.append(clusters[i])
-                new_clusters.append(candidate_cluster)
-                for i in range(candidate_index + 2, len(clusters)):
-                    new_clusters.append(clusters[i])
-
-                if len(new_clusters) >= len(clusters):
-                    raise RuntimeError("Old: {0}; New: {1}".format(
-                        clusters, new_clusters))
-                clusters = new_clusters
-            except Exception:
-                _global_logger.error(
-                    "Failed merging clusters %s", clusters)
-                raise
+                        "Rejecting cluster with length "
+                        "%.2f > %.2f", segment.stats.total_length,
+                        max_segment_length)
+                    rejected_clusters.add(tuple(cluster))
+                    continue
 
+                _global_logger.debug("Accepted cluster %s", cluster)
+
+                # Replace cluster1 and cluster2 by the merged cluster.
+                cluster2_start = cluster1_end + 1
+                cluster_end[cluster1_start] = cluster2_end
+                next_cluster[cluster1_start] = next_cluster[cluster2_start]
+                if next_cluster[cluster1_start] is not None:
+                    prev_cluster[next_cluster[cluster1_start]] = cluster1_start
+                del cluster_end[cluster2_start]
+                del next_cluster[cluster2_start]
+                del prev_cluster[cluster2_start]
+
+                if prev_cluster[cluster1_start] is not None:
+                    add_candidate(prev_cluster[cluster1_start], cluster1_start)
+                if next_cluster[cluster1_start] is not None:
+                    add_candidate(cluster1_start, next_cluster[cluster1_start])
+        except Exception:
+            _global_logger.error(
+                "Failed merging clusters %s",
+                [(x, cluster_end[x]) for x in sorted(cluster_end)])
+            raise
+
+        clusters = []
+        cluster_start = -1
+        while cluster_start is not None:
+            clusters.append(list(range(cluster_start,
+                                       cluster_end[cluster_start] + 1)))
+            cluster_start = next_cluster[cluster_start]
         return clusters
 
 
@@ -1836,6 +1890,10 @@ def print_debug_info_for_utterance(ctm_edits_out_handle,
         print(' '.join(split_line_copy), file=ctm_edits_out_handle)
 
 
+def _new_count_pair():
+    return [0, 0]
+
+
 class WordStats(object):
     """
     This accumulates word-level stats about, for each reference word, with
@@ -1845,7 +1903,10 @@ class WordStats(object):
     wrong lexicon entry).
     """
     def __init__(self):
-        self.word_count_pair = defaultdict(lambda: [0, 0])
+        # word_count_pair is a map from a string (the word) to a list
+        # [total-count, count-not-within-segments]; _new_count_pair is used
+        # rather than a lambda so that objects of this class can be pickled.
+        self.word_count_pair = defaultdict(_new_count_pair)
 
     def accumulate_for_utterance(self, split_lines_of_utt,
                                  segments_for_utterance,
@@ -1863,6 +1924,12 @@ class WordStats(object):
                 if not line_is_in_segment[i]:
                     self.word_count_pair[this_ref_word][1] += 1
 
+    def add(self, other):
+        for word, pair in other.word_count_pair.items():
+            this_pair = self.word_count_pair[word]
+            this_pair[0] += pair[0]
+            this_pair[1] += pair[1]
+
     def print(self, word_stats_out):
         # Sort from most to least problematic.  We want to give more prominence
         # to words that are most frequently not in segments, but also to
@@ -1892,55 +1959,45 @@ class WordStats(object):
             of the file.""", word_stats_out.name)
 
 
+def process_utterance(utterance_id, split_lines_of_utt, args, oov_symbol,
+                      utterance_stats, word_stats, text_out, segments_out,
+                      ctm_edits_out=None):
+    """
+    This function does all the processing of one utterance, given its lines
+    as a list of lists of fields (which it modifies): it gets the segments,
+    accumulates the stats and writes the text, segments and (if
+    ctm_edits_out is not None) the debug information to the file objects
+    given.
+    """
+    (segments_for_utterance,
+     deleted_segments_for_utterance) = get_segments_for_utterance(
+         split_lines_of_utt, args=args, utterance_stats=utterance_stats)
+    word_stats.accumulate_for_utterance(
+        split_lines_of_utt, segments_for_utterance)
+    write_segments_for_utterance(
+        text_out, segments_out, utterance_id, segments_for_utterance,
+        oov_symbol=oov_symbol, frame_length=args.frame_length)
+    if ctm_edits_out is not None:
+        print_debug_info_for_utterance(
+            ctm_edits_out, split_lines_of_utt, segments_for_utterance,
+            deleted_segments_for_utterance, frame_length=args.frame_length)
+
+
 def process_data(args, oov_symbol, utterance_stats, word_stats):
     """
     Most of what we're doing in the lines below is splitting the input lines
-    and grouping them per utterance, before giving them to
-    get_segments_for_utterance() and then printing the modified lines.
+    and grouping them per utterance (see
+    ctm_edits_lib.read_ctm_edits_utterances()), before giving them to
+    process_utterance().
     """
-    first_line = args.ctm_edits_in.readline()
-    if first_line == '':
-        sys.exit("segment_ctm_edits.py: empty input")
-    split_pending_line = first_line.split()
-    if len(split_pending_line) == 0:
-        sys.exit("segment_ctm_edits.py: bad input line " + first_line)
-    cur_utterance = split_pending_line[0]
-    split_lines_of_cur_utterance = []
-
-    while True:
+    for cur_utterance, split_lines_of_cur_utterance in \
+            ctm_edits_lib.read_ctm_edits_utterances(args.ctm_edits_in,
+                                                    "segment_ctm_edits.py"):
         try:
-            if (len(split_pending_line) == 0
-                    or split_pending_line[0] != cur_utterance):
-                # Read one whole utterance. Now process it.
-                (segments_for_utterance,
-                 deleted_segments_for_utterance) = get_segments_for_utterance(
-                     split_lines_of_cur_utterance, args=args,
-                     utterance_stats=utterance_stats)
-                word_stats.accumulate_for_utterance(
-                    split_lines_of_cur_utterance, segments_for_utterance)
-                write_segments_for_utterance(
-                    args.text_out, args.segments_out, cur_utterance,
-                    segments_for_utterance, oov_symbol=oov_symbol,
-                    frame_length=args.frame_length)
-                if args.ctm_edits_out is not None:
-                    print_debug_info_for_utterance(
-                        args.ctm_edits_out, split_lines_of_cur_utterance,
-                        segments_for_utterance, deleted_segments_for_utterance,
-                        frame_length=args.frame_length)
-
-                split_lines_of_cur_utterance = []
-                if len(split_pending_line) == 0:
-                    break
-                else:
-                    cur_utterance = split_pending_line[0]
-
-            split_lines_of_cur_utterance.append(split_pending_line)
-            next_line = args.ctm_edits_in.readline()
-            split_pending_line = next_line.split()
-            if len(split_pending_line) == 0:
-                if next_line != '':
-                    sys.exit("segment_ctm_edits.py: got an "
-                             "empty or whitespace input line")
+            process_utterance(cur_utterance, split_lines_of_cur_utterance,
+                              args, oov_symbol, utterance_stats, word_stats,
+                              args.text_out, args.segments_out,
+                              args.ctm_edits_out)
         except Exception:
             _global_logger.error(
                 "Error with utterance %s", cur_utterance)
@@ -1958,6 +2015,30 @@ def read_non_scored_words(non_scored_words_file):
     non_scored_words_file.close()
 
 
+def read_oov_symbol(oov_symbol_file, unk_padding):
+    """Returns the OOV symbol read from the file object 'oov_symbol_file', or
+    None if it is None (which is only allowed if 'unk_padding' is zero)."""
+    oov_symbol = None
+    if oov_symbol_file is not None:
+        try:
+            line = oov_symbol_file.readline()
+            assert len(line.split()) == 1
+            oov_symbol = line.split()[0]
+            assert oov_symbol_file.readline() == ''
+            oov_symbol_file.close()
+        except Exception:
+            _global_logger.error("error reading file "
+                                 "--oov-symbol-file=%s",
+                                 oov_symbol_file.name)
+            raise
+    elif unk_padding != 0.0:
+        raise ValueError(
+            "if the --unk-padding option is nonzero (which "
+            "it is by default, "
+            "the --oov-symbol-file option must be supplied.")
+    return oov_symbol
+
+
 class UtteranceStats(object):
 
     def __init__(self):
@@ -1980,6 +2061,16 @@ class UtteranceStats(object):
             self.num_segments[text] += 1
             self.segment_total_length[text] += segment.length()
 
+    def add(self, other):
+        for key, length in other.segment_total_length.items():
+            self.segment_total_length[key] += length
+        for key, count in other.num_segments.items():
+            self.num_segments[key] += count
+        self.num_utterances += other.num_utterances
+        self.num_utterances_without_segments += (
+            other.num_utterances_without_segments)
+        self.total_length_of_utterances += other.total_length_of_utterances
+
     def print_segment_stats(self):
         _global_logger.info(
             """Number of utterances is %d, of which %.2f%% had no segments
@@ -2014,24 +2105,7 @@ def main():
         _global_non_scored_words = set()
         read_non_scored_words(args.non_scored_words_in)
 
-        oov_symbol = None
-        if args.oov_symbol_file is not None:
-            try:
-                line = args.oov_symbol_file.readline()
-                assert len(line.split()) == 1
-                oov_symbol = line.split()[0]
-                assert args.oov_symbol_file.readline() == ''
-                args.oov_symbol_file.close()
-            except Exception:
-                _global_logger.error("error reading file "
-                                     "--oov-symbol-file=%s",
-                                     args.oov_symbol_file.name)
-                raise
-        elif args.unk_padding != 0.0:
-            raise ValueError(
-                "if the --unk-padding option is nonzero (which "
-                "it is by default, "
-                "the --oov-symbol-file option must be supplied.")
+        oov_symbol = read_oov_symbol(args.oov_symbol_file, args.unk_padding)
 
         utterance_stats = UtteranceStats()
         word_stats = WordStats()
@@ -5,11 +5,12 @@
 # Apache 2.0
 
 from __future__ import print_function
-import sys, operator, argparse, os
+import sys, argparse
 from collections import defaultdict
 
 import io
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf8")
+
+import ctm_edits_lib
 
 
 # This script reads and writes the 'ctm-edits' file that is
@@ -43,33 +44,54 @@ sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf8")
 
 
 
-parser = argparse.ArgumentParser(
-    description = "This program modifies the ctm-edits format to identify "
-    "silence and 'fixed' non-scored-word lines, and lines where the hyp is "
-    "<unk> and the reference is a real but OOV word, where there is a relatively "
-    "high probability that something is going wrong so we shouldn't trust "
-    "this line.  It adds the field 'tainted' to such "
-    "lines.  Lines in the ctm representing deletions from the reference will "
-    "be removed if they have 'tainted' adjacent lines (since it won't be clear "
-    "where such reference words were really realized, if at all). "
-    "See comments at the top of the script for more information.")
-
-parser.add_argument("--verbose", type = int, default = 1,
-                    choices=[0,1,2,3],
-                    help = "Verbose level, higher = more verbose output")
-parser.add_argument("--remove-deletions", type=str, default="true",
-                    choices=["true", "false"],
-                    help = "Remove deletions next to taintable lines")
-parser.add_argument("ctm_edits_in", metavar = "<ctm-edits-in>",
-                    help = "Filename of input ctm-edits file. "
-                    "Use /dev/stdin for standard input.")
-parser.add_argument("ctm_edits_out", metavar = "<ctm-edits-out>",
-                    help = "Filename of output ctm-edits file. "
-                    "Use /dev/stdout for standard output.")
-
-args = parser.parse_args()
-args.remove_deletions = bool(args.remove_deletions == "true")
-
+def GetArgs():
+    parser = argparse.ArgumentParser(
+        description = "This program modifies the ctm-edits format to identify "
+        "silence and 'fixed' non-scored-word lines, and lines where the hyp is "
+        "<unk> and the reference is a real but OOV word, where there is a relatively "
+        "high probability that something is going wrong so we shouldn't trust "
+        "this line.  It adds the field 'tainted' to such "
+        "lines.  Lines in the ctm representing deletions from the reference will "
+        "be removed if they have 'tainted' adjacent lines (since it won't be clear "
+        "where such reference words were really realized, if at all). "
+        "See comments at the top of the script for more information.")
+
+    parser.add_argument("--verbose", type = int, default = 1,
+                        choices=[0,1,2,3],
+                        help = "Verbose level, higher = more verbose output")
+    parser.add_argument("--remove-deletions", type=str, default="true",
+                        choices=["true", "false"],
+                        help = "Remove deletions next to taintable lines")
+    parser.add_argument("ctm_edits_in", metavar = "<ctm-edits-in>",
+                        help = "Filename of input ctm-edits file. "
+                        "Use /dev/stdin for standard input.")
+    parser.add_argument("ctm_edits_out", metavar = "<ctm-edits-out>",
+                        help = "Filename of output ctm-edits file. "
+                        "Use /dev/stdout for standard output.")
+
+    args = parser.parse_args()
+    args.remove_deletions = bool(args.remove_deletions == "true")
+    return args
+
+
+# This class holds the statistics that are printed at the end; TaintStats
+# objects from different parts of the data may be combined with Add().
+class TaintStats(object):
+    def __init__(self):
+        # num_lines_of_type will map from line-type ('cor', 'sub', etc.) to count.
+        self.num_lines_of_type = defaultdict(int)
+        self.num_tainted_lines = 0
+        self.num_del_lines_giving_taint = 0
+        self.num_sub_lines_giving_taint = 0
+        self.num_ins_lines_giving_taint = 0
+
+    def Add(self, other):
+        for k, v in other.num_lines_of_type.items():
+            self.num_lines_of_type[k] += v
+        self.num_tainted_lines += other.num_tainted_lines
+        self.num_del_lines_giving_taint += other.num_del_lines_giving_taint
+        self.num_sub_lines_giving_taint += other.num_sub_lines_giving_taint
+        self.num_ins_lines_giving_taint += other.num_ins_lines_giving_taint
 
 
 # This function is the core of the program, that does the tainting and
@@ -77,11 +99,9 @@ args.remove_deletions = bool(args.remove_deletions == "true")
 # split_lines_of_utt is a list of lists, one per line, each containing the
 # sequence of fields.  Returns the same format of data after processing to add
 # the 'tainted' field.  Note: this function is destructive of its input; the
-# input will not have the same value afterwards.
-def ProcessUtterance(split_lines_of_utt, remove_deletions=True):
-    global num_lines_of_type, num_tainted_lines, \
-           num_del_lines_giving_taint, num_sub_lines_giving_taint, \
-           num_ins_lines_giving_taint
+# input will not have the same value afterwards.  The counts in 'stats' (a
+# TaintStats object) are updated.
+def ProcessUtterance(split_lines_of_utt, stats, remove_deletions=True):
 
     # work out whether each line is taintable [i.e. silence or fix or unk replacing
     # real-word].
@@ -101,7 +121,7 @@ def ProcessUtterance(split_lines_of_utt, remove_deletions=True):
 
     for i in range(len(split_lines_of_utt)):
         edit_type = split_lines_of_utt[i][7]
-        num_lines_of_type[edit_type] += 1
+        stats.num_lines_of_type[edit_type] += 1
         if edit_type == 'del' or edit_type == 'sub' or edit_type == 'ins':
             tainted_an_adjacent_line = False
             # First go backwards tainting lines
@@ -109,7 +129,7 @@ def ProcessUtterance(split_lines_of_utt, remove_deletions=True):
             while j >= 0 and taintable[j]:
                 tainted_an_adjacent_line = True
                 if len(split_lines_of_utt[j]) == 8:
-                    num_tainted_lines += 1
+                    stats.num_tainted_lines += 1
                     split_lines_of_utt[j].append('tainted')
                 j -= 1
             # Next go forwards tainting lines
@@ -117,18 +137,18 @@ def ProcessUtterance(split_lines_of_utt, remove_deletions=True):
             while j < len(split_lines_of_utt) and taintable[j]:
                 tainted_an_adjacent_line = True
                 if len(split_lines_of_utt[j]) == 8:
-                    num_tainted_lines += 1
+                    stats.num_tainted_lines += 1
                     split_lines_of_utt[j].append('tainted')
                 j += 1
             if tainted_an_adjacent_line:
                 if edit_type == 'del':
                     if remove_deletions:
                         split_lines_of_utt[i][7] = 'remove-this-line'
-                    num_del_lines_giving_taint += 1
+                    stats.num_del_lines_giving_taint += 1
                 elif edit_type == 'sub':
-                    num_sub_lines_giving_taint += 1
+                    stats.num_sub_lines_giving_taint += 1
                 else:
-                    num_ins_lines_giving_taint += 1
+                    stats.num_ins_lines_giving_taint += 1
 
     new_split_lines_of_utt = []
     for i in range(len(split_lines_of_utt)):
@@ -138,7 +158,7 @@ def ProcessUtterance(split_lines_of_utt, remove_deletions=True):
     return new_split_lines_of_utt
 
 
-def ProcessData():
+def ProcessData(args, stats):
     try:
         f_in = open(args.ctm_edits_in, encoding="utf8")
     except:
@@ -149,89 +169,37 @@ def ProcessData():
     except:
         sys.exit("taint_ctm_edits.py: error opening ctm-edits output "
                  "file {0}".format(args.ctm_edits_out))
-    num_lines_processed = 0
-
-
-    # Most of what we're doing in the lines below is splitting the input lines
-    # and grouping them per utterance, before giving them to ProcessUtterance()
-    # and then printing the modified lines.
-    first_line = f_in.readline()
-    if first_line == '':
-        sys.exit("taint_ctm_edits.py: empty input")
-    split_pending_line = first_line.split()
-    if len(split_pending_line) == 0:
-        sys.exit("taint_ctm_edits.py: bad input line " + first_line)
-    cur_utterance = split_pending_line[0]
-    split_lines_of_cur_utterance = []
-
-    while True:
-        if len(split_pending_line) == 0 or split_pending_line[0] != cur_utterance:
-            split_lines_of_cur_utterance = ProcessUtterance(
-                split_lines_of_cur_utterance, args.remove_deletions)
-            for split_line in split_lines_of_cur_utterance:
-                print(' '.join(split_line), file = f_out)
-            split_lines_of_cur_utterance = []
-            if len(split_pending_line) == 0:
-                break
-            else:
-                cur_utterance = split_pending_line[0]
-
-        split_lines_of_cur_utterance.append(split_pending_line)
-        next_line = f_in.readline()
-        split_pending_line = next_line.split()
-        if len(split_pending_line) == 0:
-            if next_line != '':
-                sys.exit("taint_ctm_edits.py: got an empty or whitespace input line")
+
+    # read_ctm_edits_utterances() splits the input lines and groups them per
+    # utterance; we give them to ProcessUtterance() and then print the
+    # modified lines.
+    for utterance_id, split_lines_of_utt in \
+            ctm_edits_lib.read_ctm_edits_utterances(f_in, "taint_ctm_edits.py"):
+        split_lines_of_utt = ProcessUtterance(split_lines_of_utt, stats,
+                                              args.remove_deletions)
+        ctm_edits_lib.write_ctm_edits_lines(f_out, split_lines_of_utt)
     try:
         f_out.close()
     except:
         sys.exit("taint_ctm_edits.py: error closing ctm-edits output "
                  "(broken pipe or full disk?)")
 
-def PrintNonScoredStats():
-    if args.verbose < 1:
-        return
-    if num_lines == 0:
-        print("taint_ctm_edits.py: processed no input.", file = sys.stderr)
-    num_lines_modified = sum(ref_change_stats.values())
-    num_incorrect_lines = num_lines - num_correct_lines
-    percent_lines_incorrect= '%.2f' % (num_incorrect_lines * 100.0 / num_lines)
-    percent_modified = '%.2f' % (num_lines_modified * 100.0 / num_lines);
-    percent_of_incorrect_modified = '%.2f' % (num_lines_modified * 100.0 / num_incorrect_lines)
-    print("taint_ctm_edits.py: processed {0} lines of ctm ({1}% of which incorrect), "
-          "of which {2} were changed fixing the reference for non-scored words "
-          "({3}% of lines, or {4}% of incorrect lines)".format(
-            num_lines, percent_lines_incorrect, num_lines_modified,
-            percent_modified, percent_of_incorrect_modified),
-          file = sys.stderr)
-
-    keys = sorted(list(ref_change_stats.keys()), reverse=True,
-                  key = lambda x: ref_change_stats[x])
-    num_keys_to_print = 40 if args.verbose >= 2 else 10
-
-    print("taint_ctm_edits.py: most common edits (as percentages "
-          "of all such edits) are:\n" +
-          ('\n'.join([ '%s [%.2f%%]' % (k, ref_change_stats[k]*100.0/num_lines_modified)
-                     for k in keys[0:num_keys_to_print]]))
-          + '\n...'if num_keys_to_print < len(keys) else '',
-          file = sys.stderr)
-
 
-def PrintStats():
-    tot_lines = sum(num_lines_of_type.values())
-    if args.verbose < 1 or tot_lines == 0:
+def PrintStats(stats, verbose):
+    tot_lines = sum(stats.num_lines_of_type.values())
+    if verbose < 1 or tot_lines == 0:
         return
     print("taint_ctm_edits.py: processed {0} input lines, whose edit-types were: ".format(tot_lines) +
-          ', '.join([ '%s = %.2f%%' % (k, num_lines_of_type[k] * 100.0 / tot_lines)
-                      for k in sorted(list(num_lines_of_type.keys()), reverse = True,
-                                      key = lambda k: num_lines_of_type[k])  ]),
+          ', '.join([ '%s = %.2f%%' % (k, stats.num_lines_of_type[k] * 100.0 / tot_lines)
+                      for k in sorted(list(stats.num_lines_of_type.keys()), reverse = True,
+                                      key = lambda k: stats.num_lines_of_type[k])  ]),
           file = sys.stderr)
 
 
-    del_giving_taint_percent = num_del_lines_giving_taint * 100.0 / tot_lines
-    sub_giving_taint_percent = num_sub_lines_giving_taint * 100.0 / tot_lines
-    ins_giving_taint_percent = num_ins_lines_giving_taint * 100.0 / tot_lines
-    tainted_lines_percent = num_tainted_lines * 100.0 / tot_lines
+    del_giving_taint_percent = stats.num_del_lines_giving_taint * 100.0 / tot_lines
+    sub_giving_taint_percent = stats.num_sub_lines_giving_taint * 100.0 / tot_lines
+    ins_giving_taint_percent = stats.num_ins_lines_giving_taint * 100.0 / tot_lines
+    tainted_lines_percent = stats.num_tainted_lines * 100.0 / tot_lines
 
     print("taint_ctm_edits.py: as a percentage of all lines, (%.2f%%, %.2f%%, %.2f%%) were "
           "(deletions, substitutions, insertions) that tainted adjacent lines.  %.2f%% of all "
@@ -240,13 +208,13 @@ def PrintStats():
           file = sys.stderr)
 
 
+def main():
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf8")
+    args = GetArgs()
+    stats = TaintStats()
+    ProcessData(args, stats)
+    PrintStats(stats, args.verbose)
 
-# num_lines_of_type will map from line-type ('cor', 'sub', etc.) to count.
-num_lines_of_type = defaultdict(int)
-num_tainted_lines = 0
-num_del_lines_giving_taint = 0
-num_sub_lines_giving_taint = 0
-num_ins_lines_giving_taint = 0
 
-ProcessData()
-PrintStats()
+if __name__ == '__main__':
+    main()
@@ -7,17 +7,49 @@ for Term-frequency and Inverse-document-frequency values.
 
 from __future__ import print_function
 from __future__ import division
+import hashlib
 import logging
 import math
+import os
 import re
 import sys
 
+import numpy as np
+
 sys.path.insert(0, 'steps')
 
 logger = logging.getLogger('__name__')
 logger.addHandler(logging.NullHandler())
 
 
+def _get_inverse_document_frequency(n_t, num_docs, weighting_scheme):
+    """Returns idf(t,D) given n(t) and the number of documents N; see
+    IDFStats.get_inverse_document_frequency()."""
+    n_t = float(n_t)
+    if weighting_scheme == "unary":
+        return 1
+    if weighting_scheme == "log":
+        return math.log(float(num_docs) / (1.0 + n_t))
+    if weighting_scheme == "log-smoothed":
+        return math.log(1.0 + float(num_docs) / (1.0 + n_t))
+    if weighting_scheme == "probabilistic":
+        return math.log((num_docs - n_t - 1) / (1.0 + n_t))
+    raise KeyError("Unknown idf-weighting-scheme {0}".format(
+        weighting_scheme))
+
+
+def get_term_ids(terms):
+    """Returns an array of the ids of the terms in the list 'terms', where a
+    term is given as the words of the n-gram joined by spaces. The id is a
+    64-bit hash of the term, which, unlike hash(), is the same in every
+    process, so it can be stored in files.
+    """
+    return np.frombuffer(
+        b"".join([hashlib.blake2b(term.encode("utf-8"),
+                                  digest_size=8).digest()
+                  for term in terms]), dtype="<i8").astype(np.int64)
+
+
 class IDFStats(object):
     """Stores stats for computing inverse-document-frequencies.
     """
@@ -39,20 +71,14 @@ class IDFStats(object):
         log-smoothed : idf(t,D) = log(1 + N / n(t))
         probabilistic: idf(t,D) = log((N - n(t)) / n(t))
         """
-        n_t = float(self.num_docs_for_term.get(term, 0))
         num_terms = len(self.num_docs_for_term)
 
         if num_terms == 0:
             raise RuntimeError("No IDF stats have been accumulated.")
 
-        if weighting_scheme == "unary":
-            return 1
-        if weighting_scheme == "log":
-            return math.log(float(self.num_docs) / (1.0 + n_t))
-        if weighting_scheme == "log-smoothed":
-            return math.log(1.0 + float(self.num_docs) / (1.0 + n_t))
-        if weighting_scheme == "probabilitic":
-            return math.log((self.num_docs - n_t - 1) / (1.0 + n_t))
+        return _get_inverse_document_frequency(
+            self.num_docs_for_term.get(term, 0), self.num_docs,
+            weighting_scheme)
 
     def accumulate(self, term):
         """Adds one count to the number of docs containing the term "term".
@@ -85,6 +111,20 @@ class IDFStats(object):
         if len(self.num_docs_for_term) == 0:
             raise RuntimeError("Read no IDF stats.")
 
+    def get_num_docs_for_terms(self, term_ids):
+        """Returns an array of n(t) for the terms with ids term_ids
+        (see get_term_ids()); n(t) is 0 for terms that are not in the stats.
+        """
+        ids = get_term_ids([" ".join(term) for term in self.num_docs_for_term])
+        num_docs_for_term = np.array(list(self.num_docs_for_term.values()),
+                                     dtype=np.float64)
+        order = np.argsort(ids)
+        ids = ids[order]
+        num_docs_for_term = num_docs_for_term[order]
+
+        index = np.minimum(np.searchsorted(ids, term_ids), len(ids) - 1)
+        return np.where(ids[index] == term_ids, num_docs_for_term[index], 0.0)
+
 
 class TFStats(object):
     """Store stats for TF-IDF computation.
@@ -184,6 +224,275 @@ class TFStats(object):
             raise RuntimeError("Read no TF stats.")
 
 
+class NgramCounts(object):
+    """Stores the raw counts f(t,d) of terms in documents, i.e. the same stats
+    as TFStats.raw_counts, as arrays. This is used to accumulate the stats
+    for a large number of documents, which are split into shards that are
+    accumulated separately (possibly in parallel) and combined by merge().
+
+    Parameters:
+        term_ids - A sorted array of the ids of the terms (see get_term_ids())
+        terms - A list of the terms in the order of term_ids. A term is
+                stored as the words of the n-gram joined by spaces.
+        docs - A list of the document-ids
+        entry_terms, entry_docs - Arrays with the index in term_ids and docs
+                of each (term, doc) entry. The entries are sorted on the term
+                and then on the document.
+        counts - An array of the count f(t,d) of each entry
+        first_positions - An array of the position in the input at which each
+                entry was first seen. Writing the entries in this order gives
+                the same order as TFStats.raw_counts.
+        num_positions - The number of positions in the input
+    """
+
+    def __init__(self, term_ids, terms, docs, entry_terms, entry_docs, counts,
+                 first_positions, num_positions):
+        self.term_ids = term_ids
+        self.terms = terms
+        self.docs = docs
+        self.entry_terms = entry_terms
+        self.entry_docs = entry_docs
+        self.counts = counts
+        self.first_positions = first_positions
+        self.num_positions = num_positions
+
+    @staticmethod
+    def _reduce(entry_terms, entry_docs, counts, first_positions):
+        """Sorts the entries on (term, doc) and adds up the counts of the
+        entries for the same (term, doc)."""
+        order = np.lexsort((first_positions, entry_docs, entry_terms))
+        entry_terms = entry_terms[order]
+        entry_docs = entry_docs[order]
+        is_first = np.ones(len(order), dtype=bool)
+        is_first[1:] = ((entry_terms[1:] != entry_terms[:-1])
+                        | (entry_docs[1:] != entry_docs[:-1]))
+        starts = np.nonzero(is_first)[0]
+        if len(starts) == 0:
+            return entry_terms, entry_docs, counts, first_positions
+        return (entry_terms[starts], entry_docs[starts],
+                np.add.reduceat(counts[order], starts),
+                first_positions[order][starts])
+
+    @classmethod
+    def accumulate(cls, lines, ngram_order):
+        """Accumulates the counts for the documents in 'lines', which are in
+        the format <document-id> <text>, for terms up to the specified
+        ngram-order. The terms are the same as in TFStats.accumulate(), i.e.
+        the n-grams starting near the end of a document are truncated.
+        """
+        word2id = {}
+        doc2id = {}
+        words = []
+        line_docs = []
+        line_lengths = []
+        for line in lines:
+            parts = line.strip().split()
+            line_docs.append(doc2id.setdefault(parts[0], len(doc2id)))
+            line_lengths.append(len(parts) - 1)
+            words.extend([word2id.setdefault(x, len(word2id))
+                          for x in parts[1:]])
+
+        words = np.array(words, dtype=np.int64)
+        line_lengths = np.array(line_lengths, dtype=np.int64)
+        num_words = len(words)
+        word_lines = np.repeat(np.arange(len(line_lengths)), line_lengths)
+        word_line_starts = (np.cumsum(line_lengths)
+                            - line_lengths)[word_lines]
+        word_line_lengths = line_lengths[word_lines]
+        word_positions = np.arange(num_words)
+
+        # Each row of 'keys' holds the word-ids of an n-gram, padded with -1,
+        # for each order n and each starting word. 'positions' orders them
+        # as TFStats.accumulate() sees them: by line, order and word.
+        keys = np.full((ngram_order * num_words, ngram_order), -1,
+                       dtype=np.int64)
+        positions = np.empty(ngram_order * num_words, dtype=np.int64)
+        for n in range(1, ngram_order + 1):
+            rows = slice((n - 1) * num_words, n * num_words)
+            for k in range(n):
+                valid = (word_positions + k
+                         < word_line_starts + word_line_lengths)
+                column = keys[rows, k]
+                column[valid] = words[word_positions[valid] + k]
+            positions[rows] = (ngram_order * word_line_starts
+                               + (n - 1) * word_line_lengths
+                               + word_positions - word_line_starts)
+
+        key_terms, key_index = np.unique(keys, axis=0, return_inverse=True)
+        id2word = list(word2id)
+        terms = [" ".join([id2word[x] for x in key if x >= 0])
+                 for key in key_terms.tolist()]
+        term_ids = get_term_ids(terms)
+        order = np.argsort(term_ids)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        entry_terms, entry_docs, counts, first_positions = cls._reduce(
+            rank[key_index.reshape(-1)],
+            np.tile(np.array(line_docs, dtype=np.int64)[word_lines],
+                    ngram_order),
+            np.ones(len(positions), dtype=np.int64), positions)
+        return cls(term_ids[order], [terms[i] for i in order.tolist()],
+                   list(doc2id), entry_terms, entry_docs, counts,
+                   first_positions, ngram_order * num_words)
+
+    @classmethod
+    def merge(cls, shards):
+        """Combines the NgramCounts objects in the list 'shards', which were
+        accumulated from consecutive parts of the input, into one."""
+        term_ids, term_index, term_inverse = np.unique(
+            np.concatenate([x.term_ids for x in shards]),
+            return_index=True, return_inverse=True)
+        all_terms = [term for x in shards for term in x.terms]
+        terms = [all_terms[i] for i in term_index.tolist()]
+
+        doc2id = {}
+        entry_terms = []
+        entry_docs = []
+        first_positions = []
+        term_offset = 0
+        position_offset = 0
+        for x in shards:
+            doc_map = np.array([doc2id.setdefault(doc, len(doc2id))
+                                for doc in x.docs], dtype=np.int64)
+            entry_terms.append(
+                term_inverse[term_offset:(term_offset + len(x.term_ids))][
+                    x.entry_terms])
+            entry_docs.append(doc_map[x.entry_docs])
+            first_positions.append(x.first_positions + position_offset)
+            term_offset += len(x.term_ids)
+            position_offset += x.num_positions
+
+        entry_terms, entry_docs, counts, first_positions = cls._reduce(
+            np.concatenate(entry_terms), np.concatenate(entry_docs),
+            np.concatenate([x.counts for x in shards]),
+            np.concatenate(first_positions))
+        return cls(term_ids, terms, list(doc2id), entry_terms, entry_docs,
+                   counts, first_positions, position_offset)
+
+    @classmethod
+    def merge_all(cls, shards):
+        """Combines the NgramCounts objects yielded by the iterable 'shards',
+        which were accumulated from consecutive parts of the input, into one,
+        or returns None if there are none. The shards are merged as they are
+        yielded, into runs of 1, 2, 4, ... consecutive shards, so that only
+        a few runs (rather than all the shards) are held at a time."""
+        runs = []  # pairs (number of shards, NgramCounts), in input order
+        for shard in shards:
+            num_shards = 1
+            while len(runs) > 0 and runs[-1][0] == num_shards:
+                num_previous, previous = runs.pop()
+                shard = cls.merge([previous, shard])
+                num_shards += num_previous
+            runs.append((num_shards, shard))
+        if len(runs) == 0:
+            return None
+        if len(runs) == 1:
+            return runs[0][1]
+        return cls.merge([x for _, x in runs])
+
+    def _get_term_starts(self):
+        """Returns the index of the first entry of each term."""
+        return np.searchsorted(self.entry_terms, np.arange(len(self.terms)))
+
+    def get_num_docs_for_terms(self):
+        """Returns an array of n(t) = |d in D: t in d| for each term."""
+        return np.bincount(self.entry_terms, minlength=len(self.terms))
+
+    def get_num_docs(self):
+        """Returns the number of documents N as IDFStats would compute it in
+        TFStats.compute_term_stats(), i.e. the number of (term, doc) entries
+        for unigram terms."""
+        is_unigram = np.array([" " not in term for term in self.terms],
+                              dtype=bool)
+        return int(np.sum(is_unigram[self.entry_terms]))
+
+    def write_idf_stats(self, file_handle):
+        """Writes the IDF stats computed from these counts in the format of
+        IDFStats.write()."""
+        num_docs_for_terms = self.get_num_docs_for_terms().tolist()
+        first_positions = np.minimum.reduceat(self.first_positions,
+                                              self._get_term_starts())
+        file_handle.writelines(
+            ["{0} {1}\n".format(self.terms[i], num_docs_for_terms[i])
+             for i in np.argsort(first_positions).tolist()])
+
+    def get_tfidf_values(self, num_docs_for_terms, num_docs,
+                         tf_weighting_scheme="raw",
+                         idf_weighting_scheme="log",
+                         tf_normalization_factor=0.5):
+        """Returns the TF-IDF value of each entry, which are the same as
+        those written by write_tfidf_from_stats() for the TFStats object with
+        these counts on which compute_term_stats() was called.
+
+        Arguments:
+            num_docs_for_terms - The n(t) for each term, for the IDF
+            num_docs - The number of documents N, for the IDF
+            tf_weighting_scheme - See doc_string in TFStats class
+            idf_weighting_scheme - See doc_string in IDFStats class
+            tf_normalization_factor - See doc_string in TFStats class
+        """
+        if len(self.counts) == 0:
+            raise RuntimeError("Supplied tf-stats object is empty.")
+        if num_docs == 0:
+            raise RuntimeError("Supplied idf-stats object is empty.")
+
+        counts = self.counts
+        if tf_weighting_scheme == "binary":
+            tf_values = np.ones(len(counts), dtype=np.int64)
+        elif tf_weighting_scheme == "raw":
+            tf_values = counts
+        elif tf_weighting_scheme == "log":
+            tf_values = np.array([1 + math.log(x) for x in counts.tolist()])
+        elif tf_weighting_scheme == "normalized":
+            max_counts = np.maximum.reduceat(counts, self._get_term_starts())
+            tf_values = (tf_normalization_factor
+                         + (1 - tf_normalization_factor) * counts
+                         / (1.0 + max_counts[self.entry_terms]))
+        else:
+            raise KeyError("Unknown tf-weighting-scheme {0}".format(
+                tf_weighting_scheme))
+
+        if idf_weighting_scheme == "unary":
+            return tf_values
+        idf_values = np.array(
+            [_get_inverse_document_frequency(x, num_docs,
+                                             idf_weighting_scheme)
+             for x in num_docs_for_terms.tolist()], dtype=np.float64)
+        return tf_values * idf_values[self.entry_terms]
+
+    def write_tfidf(self, tf_idf_file, values):
+        """Writes the TF-IDF values 'values' of the entries in the format
+        of write_tfidf_from_stats()."""
+        orders = [term.count(" ") + 1 for term in self.terms]
+        entry_terms = self.entry_terms.tolist()
+        entry_docs = self.entry_docs.tolist()
+        values = values.tolist()
+
+        print ("<TFIDF>", file=tf_idf_file)
+        lines = []
+        for i in np.argsort(self.first_positions).tolist():
+            term = entry_terms[i]
+            lines.append("%d %s %s %r\n" % (orders[term], self.terms[term],
+                                            self.docs[entry_docs[i]],
+                                            values[i]))
+            if len(lines) >= 10000:
+                tf_idf_file.writelines(lines)
+                lines = []
+        tf_idf_file.writelines(lines)
+        print ("</TFIDF>", file=tf_idf_file)
+
+    def get_sparse_tfidf(self, values):
+        """Returns a SparseTFIDF object with the TF-IDF values 'values' of the
+        entries."""
+        row_ptr = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.entry_terms, minlength=len(self.terms)),
+                  out=row_ptr[1:])
+        return SparseTFIDF(self.term_ids, self.docs, row_ptr,
+                           self.entry_docs,
+                           np.asarray(values, dtype=np.float64))
+
+
 class TFIDF(object):
     """Class to store TF-IDF values for term-document pairs.
 
@@ -337,6 +646,244 @@ class TFIDF(object):
         print ("</TFIDF>", file=tf_idf_file)
 
 
+# The first bytes of a file written by SparseTFIDF.write_binary().
+_SPARSE_TFIDF_MAGIC = b"<TFIDFB>"
+
+
+class SparseTFIDF(object):
+    """Stores TF-IDF values for term-document pairs as a sparse matrix in
+    compressed sparse row (CSR) format, with a row for each term and a column
+    for each document. This is used for computing the similarity scores
+    of many query documents against many source documents at once.
+
+    Parameters:
+        term_ids - A sorted array of the ids of the terms (see get_term_ids()),
+                   in the order of the rows.
+        docs - A list of the document-ids, in the order of the columns
+        row_ptr, col_idx, values - The CSR arrays i.e. the TF-IDF values for
+                the term term_ids[t] are values[row_ptr[t]:row_ptr[t+1]] for
+                the documents col_idx[row_ptr[t]:row_ptr[t+1]].
+    """
+
+    def __init__(self, term_ids, docs, row_ptr, col_idx, values):
+        self.term_ids = term_ids
+        self.docs = docs
+        self.row_ptr = row_ptr
+        self.col_idx = col_idx
+        self.values = values
+        self.doc2id = {doc: i for i, doc in enumerate(docs)}
+
+    @classmethod
+    def from_entries(cls, entry_terms, entry_docs, entry_values):
+        """Creates the object from a list of (term, doc, value) entries,
+        given as three parallel lists. Terms are strings with the words of
+        the n-gram joined by spaces."""
+        term_ids, term_index = np.unique(get_term_ids(entry_terms),
+                                         return_inverse=True)
+        term_index = term_index.reshape(-1)
+        doc2id = {}
+        doc_ids = np.array([doc2id.setdefault(x, len(doc2id))
+                            for x in entry_docs], dtype=np.int64)
+        entry_values = np.array(entry_values, dtype=np.float64)
+
+        order = np.lexsort((doc_ids, term_index))
+        term_index = term_index[order]
+        doc_ids = doc_ids[order]
+        duplicates = np.nonzero((term_index[1:] == term_index[:-1])
+                                & (doc_ids[1:] == doc_ids[:-1]))[0]
+        if len(duplicates) > 0:
+            raise RuntimeError("Duplicate entry {0} found while reading "
+                               "TFIDF object.".format(
+                                   (entry_terms[order[duplicates[0]]],
+                                    entry_docs[order[duplicates[0]]])))
+
+        row_ptr = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_index, minlength=len(term_ids)),
+                  out=row_ptr[1:])
+        return cls(term_ids, list(doc2id), row_ptr,
+                   doc_ids, entry_values[order])
+
+    @classmethod
+    def read(cls, tf_idf_file):
+        """Reads the TF-IDF values from a file in the format written by
+        TFIDF.write()."""
+        entry_terms = []
+        entry_docs = []
+        entry_values = []
+        seen_header = False
+        seen_footer = False
+        for line in tf_idf_file:
+            parts = line.split()
+            if len(parts) == 0:
+                continue
+            if not seen_header:
+                if parts[0] != "<TFIDF>":
+                    raise TypeError(
+                        "Invalid format of TD-IDF object. "
+                        "Missing header <TFIDF>; got {0}".format(line))
+                seen_header = True
+                parts = parts[1:]
+                if len(parts) == 0:
+                    continue
+            if parts[0] == "</TFIDF>":
+                if len(parts) > 1:
+                    raise TypeError(
+                        "Expecting footer </TFIDF> "
+                        "to be on a separate line; got {0}".format(line))
+                seen_footer = True
+                break
+            order = int(parts[0])
+            if len(parts) != order + 3:
+                raise TypeError("Invalid line {0} in TFIDF object".format(
+                    line))
+            entry_terms.append(" ".join(parts[1:(order + 1)]))
+            entry_docs.append(parts[-2])
+            entry_values.append(float(parts[-1]))
+        if not seen_footer:
+            raise TypeError(
+                "Did not see footer </TFIDF> in TFIDF object")
+        if len(entry_terms) == 0:
+            raise RuntimeError(
+                "Read no TF-IDF values from file {0}".format(
+                    tf_idf_file.name))
+        return cls.from_entries(entry_terms, entry_docs, entry_values)
+
+    @classmethod
+    def read_binary(cls, filename):
+        """Reads the object from a file written by write_binary(). The arrays
+        are memory-mapped from the file rather than read into memory."""
+        with open(filename, 'rb') as f:
+            if f.read(len(_SPARSE_TFIDF_MAGIC)) != _SPARSE_TFIDF_MAGIC:
+                raise TypeError("Invalid format of binary TF-IDF file "
+                                "{0}".format(filename))
+        data = np.memmap(filename, dtype=np.uint8, mode='r')
+        offset = len(_SPARSE_TFIDF_MAGIC)
+        num_terms, num_docs, num_entries, docs_size = np.frombuffer(
+            data, dtype='<i8', count=4, offset=offset).tolist()
+        offset += 32
+        arrays = []
+        for dtype, size in [('<i8', num_terms), ('<i8', num_terms + 1),
+                            ('<i8', num_entries), ('<f8', num_entries)]:
+            arrays.append(np.frombuffer(data, dtype=dtype, count=size,
+                                        offset=offset))
+            offset += 8 * size
+        docs = bytes(data[offset:(offset + docs_size)]).decode(
+            "utf-8").split("\n")
+        assert len(docs) == num_docs
+        term_ids, row_ptr, col_idx, values = arrays
+        return cls(term_ids, docs, row_ptr, col_idx, values)
+
+    def write_binary(self, filename):
+        """Writes the object to filename in a binary format that can be
+        memory-mapped: a header with the sizes, followed by the arrays
+        term_ids, row_ptr, col_idx and values (as 64-bit little-endian
+        numbers) and the document-ids, separated by newlines.
+        The file is written to a temporary file that is renamed at the end,
+        as parallel jobs may be reading the same file.
+        """
+        docs = "\n".join(self.docs).encode("utf-8")
+        tmp_filename = "{0}.{1}.tmp".format(filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            f.write(_SPARSE_TFIDF_MAGIC)
+            f.write(np.array([len(self.term_ids), len(self.docs),
+                              len(self.values), len(docs)],
+                             dtype='<i8').tobytes())
+            for array, dtype in [(self.term_ids, '<i8'),
+                                 (self.row_ptr, '<i8'),
+                                 (self.col_idx, '<i8'),
+                                 (self.values, '<f8')]:
+                f.write(np.asarray(array, dtype=dtype).tobytes())
+            f.write(docs)
+        os.rename(tmp_filename, filename)
+
+    def compute_similarity_scores(self, queries, source_docs,
+                                  query_ids=None):
+        """Computes TF-IDF similarity score between each of the query
+        TFIDF objects in the list 'queries' and each of the documents
+        source_docs in this object. Documents not in this object get a score
+        of 0. The scores are identical to those from
+        TFIDF.compute_similarity_scores(), as the products are summed
+        in the same order.
+
+        Arguments:
+            query_ids - If provided, check that queries[i] contains values
+                        only for document with id query_ids[i].
+
+        Returns a numpy array of shape (len(queries), len(source_docs)).
+        """
+        query_index = []
+        query_terms = []
+        query_values = []
+        for i, query in enumerate(queries):
+            for (term, doc), value in query.tf_idf.items():
+                if query_ids is not None and doc != query_ids[i]:
+                    raise RuntimeError(
+                        "TF-IDF contains document {0}, which is "
+                        "not the required query {1}. \n"
+                        "Something wrong in how this TF-IDF object "
+                        "was created or a bug in the "
+                        "calling script.".format(doc, query_ids[i]))
+                query_index.append(i)
+                query_terms.append(" ".join(term))
+                query_values.append(value)
+
+        # Look up the rows of the query terms, and keep those that are found.
+        query_term_ids = get_term_ids(query_terms)
+        query_rows = np.minimum(
+            np.searchsorted(self.term_ids, query_term_ids),
+            len(self.term_ids) - 1)
+        found = self.term_ids[query_rows] == query_term_ids
+        query_index = np.array(query_index, dtype=np.int64)[found]
+        query_rows = query_rows[found]
+        query_values = np.array(query_values, dtype=np.float64)[found]
+
+        # Expand each query term into the non-zero entries of its row.
+        starts = self.row_ptr[query_rows]
+        lengths = self.row_ptr[query_rows + 1] - starts
+        entry = np.repeat(np.arange(len(query_rows)), lengths)
+        positions = (np.arange(len(entry))
+                     + np.repeat(starts - np.cumsum(lengths) + lengths,
+                                 lengths))
+
+        num_docs = len(self.docs)
+        # np.bincount() adds the products in order, i.e. in the order of the
+        # terms in the query.
+        scores = np.bincount(
+            query_index[entry] * num_docs + self.col_idx[positions],
+            weights=self.values[positions] * query_values[entry],
+            minlength=len(queries) * num_docs).reshape(len(queries),
+                                                       num_docs)
+
+        columns = np.array([self.doc2id.get(x, -1) for x in source_docs],
+                           dtype=np.int64)
+        return np.where(columns >= 0, scores[:, columns], 0.0)
+
+
+def get_binary_cache_filename(filename):
+    """Returns the name of the file in which the SparseTFIDF object for the
+    TF-IDF text file 'filename' is cached in binary form."""
+    return filename + ".bin"
+
+
+def read_sparse_tfidf(filename, use_binary_cache=False):
+    """Reads a SparseTFIDF object from the text file 'filename'.
+    If use_binary_cache is True, the object is read from the binary cache
+    (see get_binary_cache_filename()) if it exists and is not older than the
+    text file; otherwise it is written there after reading the text file.
+    """
+    cache_filename = get_binary_cache_filename(filename)
+    if (use_binary_cache and os.path.exists(cache_filename)
+            and os.path.getmtime(cache_filename) >= os.path.getmtime(filename)):
+        return SparseTFIDF.read_binary(cache_filename)
+
+    with open(filename) as f:
+        tf_idf = SparseTFIDF.read(f)
+
+    if use_binary_cache:
+        tf_idf.write_binary(cache_filename)
+    return tf_idf
+
+
 def write_tfidf_from_stats(
         tf_stats, idf_stats, tf_idf_file, tf_weighting_scheme="raw",
         idf_weighting_scheme="log", tf_normalization_factor=0.5,
@@ -3,9 +3,11 @@
 from __future__ import print_function
 import sys
 import argparse
-import math
-import subprocess
-from collections import defaultdict
+import shlex
+
+sys.path.insert(0, 'steps')
+import libs.biased_lm as biased_lm_lib
+import libs.common as common_lib
 
 import io
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer,encoding="utf8")
@@ -13,92 +15,150 @@ sys.stderr = io.TextIOWrapper(sys.stderr.buffer,encoding="utf8")
 sys.stdin = io.TextIOWrapper(sys.stdin.buffer,encoding="utf8")
 
 parser = argparse.ArgumentParser(description="""
-This script is a wrapper for make_one_biased_lm.py that reads a Kaldi archive
-of (integerized) text data from the standard input and writes a Kaldi archive of
-backoff-language-model FSTs to the standard-output.  It takes care of
+This script reads a Kaldi archive of (integerized) text data from the standard
+input and writes a Kaldi archive of backoff-language-model FSTs, as made by
+make_one_biased_lm.py, to the standard-output.  It takes care of
 grouping utterances to respect the --min-words-per-graph option.  It writes
 the graphs to the standard output and also outputs a map from input utterance-ids
-to the per-group utterance-ids that index the output graphs.""")
+to the per-group utterance-ids that index the output graphs.  The LMs are
+estimated in this process (or in --num-jobs worker processes), rather than by
+calling make_one_biased_lm.py once per group, and the --top-words file is only
+read once.""")
 
 parser.add_argument("--lm-opts", type = str, default = "",
-                    help = "Options to pass in to make_one_biased_lm.py (which "
-                    "creates the individual LM graphs), e.g. '--word-disambig-symbol=8721'.")
+                    help = "Options of make_one_biased_lm.py (which "
+                    "describes the individual LM graphs), e.g. '--word-disambig-symbol=8721'.")
 parser.add_argument("--min-words-per-graph", type = int, default = 100,
                     help = "Minimum number of words per utterance group; this program "
                     "will try to arrange the input utterances into groups such that each "
                     "one has at least this many words in total.")
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help = "Number of worker processes that estimate the LMs; if 1, "
+                    "everything is done in this process.")
+parser.add_argument("--batch-size", type = int, default = 100,
+                    help = "Number of utterance groups given to a worker process "
+                    "at a time.")
 parser.add_argument("utterance_map", type = str,
                     help = "Filename to which a map from input utterances to grouped "
                     "utterances, is written")
 
-args = parser.parse_args()
-
-
 
-try:
-    utterance_map_file = open(args.utterance_map, "w", encoding="utf-8")
-except:
-    sys.exit("make_biased_lms.py: error opening {0} to write utterance map".format(
-            args.utterance_map))
+def GetLmArgs(lm_opts):
+    # Parses the --lm-opts as make_one_biased_lm.py would parse them.
+    lm_parser = argparse.ArgumentParser(prog = "make_one_biased_lm.py")
+    biased_lm_lib.add_biased_lm_options(lm_parser)
+    return lm_parser.parse_args(shlex.split(lm_opts))
+
+
+def InitWorker(lm_args, top_words):
+    global _global_lm_args, _global_top_words
+    _global_lm_args = lm_args
+    _global_top_words = top_words
+
+
+# This processes a batch of groups of input lines, as returned by
+# ReadGroupsOfLines(), and returns the text to be written to the standard
+# output for them: for each group, the group utterance-id, the text-form FST
+# and a blank line, which terminates the FST in the Kaldi fst-archive format.
+# It raises ValueError if an input line is not a sequence of integers; that
+# reaches Main() from a worker process too, where it is reported.
+def ProcessBatch(batch):
+    output = []
+    for group_utterance_id, lines in batch:
+        output.append(group_utterance_id + '\n')
+        for fst_line in biased_lm_lib.make_biased_lm(lines, _global_lm_args,
+                                                     _global_top_words):
+            output.append(fst_line + '\n')
+        output.append('\n')
+    return ''.join(output)
+
+
+# This generates the groups of input lines from the standard input, as
+# pairs (group_utterance_id, lines) where 'lines' is an array of the lines of
+# the group without the utterance-ids, e.g. [ '67 89 432\n', '89 48 62\n' ];
+# it writes the utterance map to 'utterance_map_file' as it goes.
+def ReadGroupsOfLines(min_words_per_graph, utterance_map_file):
+    num_words_this_group = 0
+    this_group_of_lines = []  # An array of strings, one per line
+
+    while True:
+        line = sys.stdin.readline();
+        num_words_this_group += len(line.split())
+        if line != '':
+            this_group_of_lines.append(line)
+        if num_words_this_group >= min_words_per_graph or \
+            (line == '' and len(this_group_of_lines) != 0):
+            num_lines = len(this_group_of_lines)
+            try:
+                first_utterance_id = this_group_of_lines[0].split()[0]
+            except:
+                sys.exit("make_biased_lms.py: empty input line")
+            group_utterance_id = '{0}-group-of-{1}'.format(first_utterance_id,
+                                                          num_lines)
+            lines = []
+            for group_line in this_group_of_lines:
+                a = group_line.split()
+                if len(a) == 0:
+                    sys.exit("make_biased_lms.py: empty input line")
+                utterance_id = a[0]
+                # print <utt> <utt-group> to utterance-map file
+                print(utterance_id, group_utterance_id, file = utterance_map_file)
+                lines.append(' '.join(a[1:]) + '\n') # get rid of utterance id.
+            yield group_utterance_id, lines
+            num_words_this_group = 0
+            this_group_of_lines = []
+        if line == '':
+            break
+
+
+def ReadBatches(groups, batch_size):
+    batch = []
+    for group in groups:
+        batch.append(group)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def Main():
+    args = parser.parse_args()
+    if args.num_jobs < 1 or args.batch_size < 1:
+        sys.exit("make_biased_lms.py: --num-jobs and --batch-size must be positive")
+    lm_args = GetLmArgs(args.lm_opts)
+    if lm_args.verbose >= 1:
+        print("make_biased_lms.py: LM options are: " + args.lm_opts,
+              file = sys.stderr)
+
+    top_words = None
+    if lm_args.top_words != None:
+        top_words = biased_lm_lib.read_top_words(lm_args.top_words)
 
-# This processes one group of input lines; 'group_of_lines' is
-# an array of lines of input integerized text, e.g.
-# [ 'utt1 67 89 432', 'utt2 89 48 62' ]
-def ProcessGroupOfLines(group_of_lines):
-    num_lines = len(group_of_lines)
     try:
-        first_utterance_id = group_of_lines[0].split()[0]
+        utterance_map_file = open(args.utterance_map, "w", encoding="utf-8")
     except:
-        sys.exit("make_biased_lms.py: empty input line")
-
-    group_utterance_id = '{0}-group-of-{1}'.format(first_utterance_id, num_lines)
-    # print the group utterance-id to the stdout; it forms the name in
-    # the text-form archive.
-    print(group_utterance_id)
-    sys.stdout.flush()
+        sys.exit("make_biased_lms.py: error opening {0} to write utterance map".format(
+                args.utterance_map))
 
+    batches = ReadBatches(ReadGroupsOfLines(args.min_words_per_graph,
+                                            utterance_map_file),
+                          args.batch_size)
     try:
-        command = "steps/cleanup/internal/make_one_biased_lm.py " + args.lm_opts
-        p = subprocess.Popen(command, shell = True, stdin = subprocess.PIPE,
-                             stdout = sys.stdout, stderr = sys.stderr)
-        for line in group_of_lines:
-            a = line.split()
-            if len(a) == 0:
-                sys.exit("make_biased_lms.py: empty input line")
-            utterance_id = a[0]
-            # print <utt> <utt-group> to utterance-map file
-            print(utterance_id, group_utterance_id, file = utterance_map_file)
-            rest_of_line = ' '.join(a[1:]) + '\n' # get rid of utterance id.
-            p.stdin.write(rest_of_line.encode('utf-8'))
-        p.stdin.close()
-        assert p.wait() == 0
-    except Exception:
-        sys.stderr.write(
-            "make_biased_lms.py: error calling subprocess, command was: " +
-            command)
-        raise
-    # Print a blank line; this terminates the FST in the Kaldi fst-archive
-    # format.
-    print("")
+        for output in common_lib.map_in_order(ProcessBatch, batches,
+                                              num_jobs = args.num_jobs,
+                                              initializer = InitWorker,
+                                              initargs = (lm_args, top_words)):
+            sys.stdout.write(output)
+    except ValueError as e:
+        print("make_biased_lms.py: " + str(e), file = sys.stderr)
+        sys.exit(1)
     sys.stdout.flush()
+    utterance_map_file.close()
 
 
-
-num_words_this_group = 0
-this_group_of_lines = []  # An array of strings, one per line
-
-while True:
-    line = sys.stdin.readline();
-    num_words_this_group += len(line.split())
-    if line != '':
-        this_group_of_lines.append(line)
-    if num_words_this_group >= args.min_words_per_graph or \
-        (line == '' and len(this_group_of_lines) != 0):
-        ProcessGroupOfLines(this_group_of_lines)
-        num_words_this_group = 0
-        this_group_of_lines = []
-    if line == '':
-        break
+if __name__ == "__main__":
+    Main()
 
 
 # test comand [to be run from ../..]
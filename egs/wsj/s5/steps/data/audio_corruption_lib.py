@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# Apache 2.0
+""" This module computes, in-process, the corruption that the wav-reverberate
+    pipelines written by steps/data/reverberate_data_dir.py would apply, and
+    writes the corrupted recordings to wav archives.  It is used by
+    reverberate_data_dir.py when --materialize-dir is given.
+
+    Each recording is described by a corruption plan, a dict with the keys
+        'rir': the rspecifier of the impulse response applied to the speech,
+               or None
+        'noises': a list of dicts with the keys 'rspecifier', 'rir' (or None),
+               'duration' (or None), 'start_time' and 'snr', one for each
+               additive noise, in the order they would be passed to
+               wav-reverberate.
+    The computation follows wav-reverberate (feat/wav-reverberate.cc): the
+    signals are read as unscaled 16-bit sample values, impulse responses are
+    scaled by 1/2^15, the output power is normalized to the input power and
+    the output is shifted by the position of the peak of the impulse
+    response if shift_output is true.  Convolutions are done in double
+    precision, so the output may differ from that of the binary in the last
+    bit of some samples.
+"""
+
+import io
+import math
+import multiprocessing
+import os
+import re
+import struct
+import subprocess
+import wave
+from collections import OrderedDict
+
+import numpy as np
+
+# Cache of the RIRs and noises, from rspecifier to a pair (samp_freq,
+# samples).  It is filled in by preload_audio() before the worker processes
+# are started, so that they share it.
+_audio_cache = {}
+
+# Per-process caches of the spectra of impulse responses and of the
+# reverberated noises, which are reused across the recordings of a room.
+_filter_fft_cache = OrderedDict()
+_noise_cache = OrderedDict()
+_max_filter_cache_size = 256
+_max_noise_cache_size = 32
+
+
+def _cache_get(cache, max_size, key, compute):
+    if key in cache:
+        value = cache.pop(key)
+    else:
+        value = compute()
+        if len(cache) >= max_size:
+            cache.popitem(last=False)
+    cache[key] = value
+    return value
+
+
+def read_wav_bytes(rxfilename):
+    """ Returns the bytes of the wav file referred to by rxfilename, which can
+        be a filename, a piped command ending in '|' or a filename with a
+        byte offset, e.g. foo.ark:1234
+    """
+    rxfilename = rxfilename.strip()
+    if rxfilename.endswith('|'):
+        proc = subprocess.run(rxfilename[:-1], shell=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise Exception("There was an error while running the command "
+                            "{0}\n{1}".format(rxfilename, proc.stderr))
+        return proc.stdout
+    match = re.match(r'^(.*):(\d+)$', rxfilename)
+    if match is not None and not os.path.isfile(rxfilename):
+        with open(match.group(1), 'rb') as f:
+            f.seek(int(match.group(2)))
+            return f.read()
+    with open(rxfilename, 'rb') as f:
+        return f.read()
+
+
+def read_wav(rxfilename):
+    """ Reads the first channel of a 16-bit PCM wav file and returns a pair
+        (samp_freq, samples), where samples is a float64 array of the sample
+        values.
+    """
+    wav = wave.open(io.BytesIO(read_wav_bytes(rxfilename)), 'rb')
+    if wav.getsampwidth() != 2:
+        raise Exception("Only 16-bit wav data is supported when materializing "
+                        "the corrupted data: {0}".format(rxfilename))
+    num_channels = wav.getnchannels()
+    data = wav.readframes(wav.getnframes())
+    # ignore any trailing partial frame
+    data = data[:len(data) - len(data) % (2 * num_channels)]
+    samples = np.frombuffer(data, dtype='<i2').reshape(-1, num_channels)[:, 0]
+    return (wav.getframerate(), samples.astype(np.float64))
+
+
+def to_int16(samples):
+    """ Converts samples to 16-bit integers as Kaldi's wav writer does, by
+        truncating towards zero and clipping.
+    """
+    return np.clip(np.trunc(samples), -32768, 32767).astype('<i2')
+
+
+def wav_to_bytes(samples, samp_freq):
+    """ Returns the bytes of a mono 16-bit wav file with the given samples """
+    data = to_int16(samples).tobytes()
+    header = struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + len(data), b'WAVE',
+                         b'fmt ', 16, 1, 1, int(samp_freq), int(samp_freq) * 2,
+                         2, 16, b'data', len(data))
+    return header + data
+
+
+def preload_audio(rspecifiers):
+    """ Loads each of the rspecifiers into the shared audio cache """
+    for rspecifier in rspecifiers:
+        if rspecifier not in _audio_cache:
+            _audio_cache[rspecifier] = read_wav(rspecifier)
+
+
+def get_audio(rspecifier):
+    if rspecifier not in _audio_cache:
+        _audio_cache[rspecifier] = read_wav(rspecifier)
+    return _audio_cache[rspecifier]
+
+
+def _round_up_to_power_of_two(n):
+    return 1 << max(0, int(n - 1).bit_length())
+
+
+def fft_convolve(signal, filt, key=None):
+    """ Returns the full linear convolution of signal and filt (of length
+        len(signal) + len(filt) - 1), computed by FFT overlap-add with the
+        same block sizes as FFTbasedBlockConvolveSignals().  All blocks are
+        transformed at once.  If key is not None, the spectrum of the filter
+        is cached under it.
+    """
+    filter_length = len(filt)
+    signal_length = len(signal)
+    output_length = signal_length + filter_length - 1
+    fft_length = _round_up_to_power_of_two(4 * filter_length)
+    block_length = fft_length - filter_length + 1
+
+    if key is None:
+        filter_fft = np.fft.rfft(filt, fft_length)
+    else:
+        filter_fft = _cache_get(_filter_fft_cache, _max_filter_cache_size,
+                                (key, fft_length),
+                                lambda: np.fft.rfft(filt, fft_length))
+
+    num_blocks = max(1, -(-signal_length // block_length))
+    blocks = np.zeros((num_blocks, block_length))
+    blocks.reshape(-1)[:signal_length] = signal
+    out_blocks = np.fft.irfft(np.fft.rfft(blocks, fft_length, axis=1) * filter_fft,
+                              fft_length, axis=1)
+
+    # As block_length > filter_length - 1, the tail of each block only
+    # overlaps the next block.
+    output = np.zeros((num_blocks + 1) * block_length)
+    output[:num_blocks * block_length] = out_blocks[:, :block_length].reshape(-1)
+    tails = np.zeros((num_blocks, block_length))
+    tails[:, :filter_length - 1] = out_blocks[:, block_length:]
+    output[block_length:] += tails.reshape(-1)
+    return output[:output_length]
+
+
+def _early_reverb_energy(rir, signal, samp_freq, key):
+    """ Equivalent of ComputeEarlyReverbEnergy() in wav-reverberate """
+    peak_index = int(np.argmax(rir))
+    start = max(0, int(peak_index - 0.001 * samp_freq))
+    end = min(len(rir), peak_index + int(0.05 * samp_freq))
+    early_reverb = fft_convolve(signal, rir[start:end],
+                                None if key is None else ('early', key))
+    return early_reverb.dot(early_reverb) / len(early_reverb)
+
+
+def _add_with_offset(signal1, offset, signal2):
+    """ Adds signal1 to signal2 (in place) starting at offset """
+    add_length = min(len(signal2) - offset, len(signal1))
+    if add_length > 0:
+        signal2[offset:offset + add_length] += signal1[:add_length]
+
+
+def _reverberate_and_normalize(samples, samp_freq, rir_rspecifier, noises):
+    """ Reverberates samples with the RIR (if not None), adds the noises,
+        which are tuples (samples, snr, start_time), and normalizes the power
+        to that of the input.  Returns (samples, shift_index, rir_length).
+    """
+    power_before_reverb = samples.dot(samples) / len(samples)
+    early_energy = power_before_reverb
+    shift_index = 0
+    rir_length = 0
+    if rir_rspecifier is not None:
+        (rir_samp_freq, rir) = get_audio(rir_rspecifier)
+        rir = rir / (1 << 15)
+        rir_length = len(rir)
+        early_energy = _early_reverb_energy(rir, samples, rir_samp_freq,
+                                            rir_rspecifier)
+        samples = fft_convolve(samples, rir, rir_rspecifier)
+        shift_index = int(np.argmax(rir))
+    else:
+        samples = samples.copy()
+
+    for (noise, snr, start_time) in noises:
+        noise_power = noise.dot(noise) / len(noise)
+        scale_factor = math.sqrt(math.pow(10, -snr / 10.0) * early_energy / noise_power)
+        _add_with_offset(noise * scale_factor, int(start_time * samp_freq), samples)
+
+    power_after_reverb = samples.dot(samples) / len(samples)
+    samples *= math.sqrt(power_before_reverb / power_after_reverb)
+    return (samples, shift_index, rir_length)
+
+
+def _select_output(samples, num_samp_input, num_samp_output, shift_index):
+    """ Selects the output of wav-reverberate from the reverberated samples;
+        as in wav-reverberate, whether the output is a shifted part of the
+        samples or the samples repeated is decided by comparing
+        num_samp_output with the length of the input, num_samp_input, not
+        with that of the reverberated samples.
+    """
+    if num_samp_output <= num_samp_input:
+        return samples[shift_index:shift_index + num_samp_output]
+    # repeat the signal to fill up the duration
+    return np.resize(samples, num_samp_output)
+
+
+def get_reverberated_noise(noise):
+    """ Returns the samples of an additive noise, as the pipe
+        'wav-reverberate [--impulse-response=<rir>] [--duration=<d>] <noise> -'
+        would produce them.
+    """
+    (samp_freq, samples) = get_audio(noise['rspecifier'])
+
+    def compute():
+        return _reverberate_and_normalize(samples, samp_freq, noise['rir'], [])
+
+    (reverberated, shift_index, rir_length) = _cache_get(
+        _noise_cache, _max_noise_cache_size, (noise['rspecifier'], noise['rir']),
+        compute)
+    if noise['duration'] is not None and noise['duration'] > 0:
+        num_samp_output = int(samp_freq * noise['duration'])
+    else:
+        num_samp_output = len(samples)
+    output = _select_output(reverberated, len(samples), num_samp_output,
+                            shift_index)
+    # the pipe writes the noise as 16-bit samples
+    return to_int16(output).astype(np.float64)
+
+
+def corrupt_recording(wav_rxfilename, plan, shift_output):
+    """ Returns (samp_freq, samples) for the recording wav_rxfilename
+        corrupted according to plan, as
+        '<wav> wav-reverberate --shift-output=<shift_output> <opts> - - |'
+        would produce it.
+    """
+    (samp_freq, samples) = read_wav(wav_rxfilename)
+    noises = [(get_reverberated_noise(noise), noise['snr'], noise['start_time'])
+              for noise in plan['noises']]
+    (corrupted, shift_index, rir_length) = _reverberate_and_normalize(
+        samples, samp_freq, plan['rir'], noises)
+    if shift_output:
+        num_samp_output = len(samples)
+    else:
+        num_samp_output = len(samples) + rir_length - 1
+        shift_index = 0
+    return (samp_freq, _select_output(corrupted, len(samples), num_samp_output,
+                                      shift_index))
+
+
+def _write_batch(batch):
+    """ Corrupts a batch of recordings and writes them to a wav archive.
+        batch is a tuple (ark_filename, shift_output, recordings), where
+        recordings is a list of (recording_id, wav_rxfilename, plan).
+        Returns a list of (recording_id, rxfilename in the archive).
+    """
+    (ark_filename, shift_output, recordings) = batch
+    locations = []
+    with open(ark_filename, 'wb') as ark:
+        for (recording_id, wav_rxfilename, plan) in recordings:
+            (samp_freq, samples) = corrupt_recording(wav_rxfilename, plan, shift_output)
+            ark.write((recording_id + ' ').encode('utf-8'))
+            locations.append((recording_id, "{0}:{1}".format(ark_filename, ark.tell())))
+            ark.write(wav_to_bytes(samples, samp_freq))
+    return locations
+
+
+def materialize_corrupted_recordings(recordings, output_dir, shift_output,
+                                     num_jobs=1, batch_size=100):
+    """ Corrupts the recordings and writes them to wav archives in output_dir.
+        recordings is a list of tuples (recording_id, wav_rxfilename, plan,
+        room_id).  Recordings are grouped by room, so that the impulse
+        responses of a room are transformed once per batch, and the batches
+        are processed by a pool of num_jobs processes.  The RIRs and noises
+        are loaded once, before the pool is started.
+        Returns a dict from recording_id to its rxfilename in the archives.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    output_dir = os.path.abspath(output_dir)
+
+    rspecifiers = set()
+    for (_, _, plan, _) in recordings:
+        if plan['rir'] is not None:
+            rspecifiers.add(plan['rir'])
+        for noise in plan['noises']:
+            rspecifiers.add(noise['rspecifier'])
+            if noise['rir'] is not None:
+                rspecifiers.add(noise['rir'])
+    preload_audio(sorted(rspecifiers))
+
+    # sort by room and RIR (stably, keeping the order of the recordings
+    # otherwise), and split into batches that don't mix rooms
+    recordings = sorted(recordings, key=lambda x: (x[3], x[2]['rir'] or ''))
+    batches = []
+    for (recording_id, wav_rxfilename, plan, room_id) in recordings:
+        if (len(batches) == 0 or batches[-1][0] != room_id or
+                len(batches[-1][1]) >= batch_size):
+            batches.append((room_id, []))
+        batches[-1][1].append((recording_id, wav_rxfilename, plan))
+    batches = [("{0}/corrupted.{1}.ark".format(output_dir, i + 1), shift_output, batch)
+               for i, (_, batch) in enumerate(batches)]
+
+    if num_jobs > 1:
+        pool = multiprocessing.Pool(num_jobs)
+        try:
+            results = pool.map(_write_batch, batches, chunksize=1)
+        finally:
+            pool.terminate()
+    else:
+        results = [_write_batch(batch) for batch in batches]
+
+    locations = {}
+    for result in results:
+        locations.update(result)
+    return locations
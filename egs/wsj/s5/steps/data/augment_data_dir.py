@@ -13,9 +13,8 @@ import sys, random, argparse, os, imp
 sys.path.append("steps/data/")
 sys.path.insert(0, 'steps/')
 
-from reverberate_data_dir import parse_file_to_dict
-from reverberate_data_dir import write_dict_to_file
 import libs.common as common_lib
+import libs.data_dir as data_dir_lib
 data_lib = imp.load_source('dml', 'steps/data/data_dir_manipulation_lib.py')
 
 def get_args():
@@ -91,15 +90,8 @@ def check_args(args):
     return args
 
 def get_noise_list(noise_wav_scp_filename):
-    noise_wav_scp_file = open(noise_wav_scp_filename, 'r', encoding='utf-8').readlines()
-    noise_wavs = {}
-    noise_utts = []
-    for line in noise_wav_scp_file:
-        toks=line.split(" ")
-        wav = " ".join(toks[1:])
-        noise_utts.append(toks[0])
-        noise_wavs[toks[0]] = wav.rstrip()
-    return noise_utts, noise_wavs
+    noise_wav_scp = data_dir_lib.DataTable.read(noise_wav_scp_filename)
+    return noise_wav_scp.keys.tolist(), noise_wav_scp.to_dict()
 
 def augment_wav(utt, wav, dur, fg_snr_opts, bg_snr_opts, fg_noise_utts, \
     bg_noise_utts, noise_wavs, noise2dur, interval, num_opts):
@@ -167,32 +159,27 @@ def get_new_id(utt, utt_modifier_type, utt_modifier):
 def copy_file_if_exists(input_file, output_file, utt_modifier_type,
                         utt_modifier, fields=[0]):
     if os.path.isfile(input_file):
-        clean_dict = parse_file_to_dict(input_file,
-            value_processor = lambda x: " ".join(x))
-        new_dict = {}
-        for key in clean_dict.keys():
-            modified_key = get_new_id(key, utt_modifier_type, utt_modifier)
-            if len(fields) > 1:
-                values = clean_dict[key].split(" ")
-                modified_values = values
-                for idx in range(1, len(fields)):
-                    modified_values[idx-1] = get_new_id(values[idx-1],
-                                            utt_modifier_type, utt_modifier)
-                new_dict[modified_key] = " ".join(modified_values)
-            else:
-                new_dict[modified_key] = clean_dict[key]
-        write_dict_to_file(new_dict, output_file)
+        def modify_values(value):
+            values = value.split()
+            for idx in range(1, len(fields)):
+                values[idx-1] = get_new_id(values[idx-1],
+                                           utt_modifier_type, utt_modifier)
+            return " ".join(values)
+
+        table = data_dir_lib.DataTable.read(
+            input_file, normalize_whitespace = True).map_keys(
+            lambda key: get_new_id(key, utt_modifier_type, utt_modifier))
+        if len(fields) > 1:
+            table = table.map_values(modify_values)
+        table.unique().sorted().write(output_file)
 
 def create_augmented_utt2uniq(input_dir, output_dir,
                             utt_modifier_type, utt_modifier):
     clean_utt2spk_file = input_dir + "/utt2spk"
-    clean_utt2spk_dict = parse_file_to_dict(clean_utt2spk_file,
-                            value_processor = lambda x: " ".join(x))
-    augmented_utt2uniq_dict = {}
-    for key in clean_utt2spk_dict.keys():
-        modified_key = get_new_id(key, utt_modifier_type, utt_modifier)
-        augmented_utt2uniq_dict[modified_key] = key
-    write_dict_to_file(augmented_utt2uniq_dict, output_dir + "/utt2uniq")
+    keys = data_dir_lib.DataTable.read(clean_utt2spk_file).keys
+    augmented_utt2uniq = data_dir_lib.DataTable(keys, keys).map_keys(
+        lambda key: get_new_id(key, utt_modifier_type, utt_modifier))
+    augmented_utt2uniq.unique().sorted().write(output_dir + "/utt2uniq")
 
 def main():
     args = get_args()
@@ -202,9 +189,9 @@ def main():
     fg_snrs = [int(i) for i in args.fg_snr_str.split(":")]
     bg_snrs = [int(i) for i in args.bg_snr_str.split(":")]
     num_bg_noises = [int(i) for i in args.num_bg_noises.split(":")]
-    reco2dur = parse_file_to_dict(input_dir + "/reco2dur",
-        value_processor = lambda x: float(x[0]))
-    wav_scp_file = open(input_dir + "/wav.scp", 'r', encoding='utf-8').readlines()
+    reco2dur = data_dir_lib.DataTable.read(input_dir + "/reco2dur",
+        value_type = float)
+    wav_scp = data_dir_lib.DataTable.read(input_dir + "/wav.scp")
 
     noise_wavs = {}
     noise_reco2dur = {}
@@ -215,8 +202,8 @@ def main():
     if args.bg_noise_dir:
         bg_noise_wav_filename = args.bg_noise_dir + "/wav.scp"
         bg_noise_utts, bg_noise_wavs = get_noise_list(bg_noise_wav_filename)
-        bg_noise_reco2dur = parse_file_to_dict(args.bg_noise_dir + "/reco2dur",
-            value_processor = lambda x: float(x[0]))
+        bg_noise_reco2dur = data_dir_lib.DataTable.read(
+            args.bg_noise_dir + "/reco2dur", value_type = float).to_dict()
         noise_wavs.update(bg_noise_wavs)
         noise_reco2dur.update(bg_noise_reco2dur)
 
@@ -225,8 +212,8 @@ def main():
         fg_noise_wav_filename = args.fg_noise_dir + "/wav.scp"
         fg_noise_reco2dur_filename = args.fg_noise_dir + "/reco2dur"
         fg_noise_utts, fg_noise_wavs = get_noise_list(fg_noise_wav_filename)
-        fg_noise_reco2dur = parse_file_to_dict(args.fg_noise_dir + "/reco2dur",
-            value_processor = lambda x: float(x[0]))
+        fg_noise_reco2dur = data_dir_lib.DataTable.read(
+            args.fg_noise_dir + "/reco2dur", value_type = float).to_dict()
         noise_wavs.update(fg_noise_wavs)
         noise_reco2dur.update(fg_noise_reco2dur)
 
@@ -234,12 +221,14 @@ def main():
     new_utt2wav = {}
     new_utt2spk = {}
 
+    index = reco2dur.lookup(wav_scp.keys)
+    if (index < 0).any():
+        raise KeyError("No duration found in {0}/reco2dur for {1}".format(
+            input_dir, wav_scp.keys[index < 0][0]))
+    durs = reco2dur.values[index].tolist()
+
     # Augment each line in the wav file
-    for line in wav_scp_file:
-        toks = line.rstrip().split(" ")
-        utt = toks[0]
-        wav = " ".join(toks[1:])
-        dur = reco2dur[utt]
+    for (utt, wav), dur in zip(wav_scp.items(), durs):
         new_wav = augment_wav(utt, wav, dur, fg_snrs, bg_snrs, fg_noise_utts,
             bg_noise_utts, noise_wavs, noise_reco2dur, args.fg_interval,
             num_bg_noises)
@@ -251,7 +240,9 @@ def main():
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    write_dict_to_file(new_utt2wav, output_dir + "/wav.scp")
+    data_dir_lib.DataTable(list(new_utt2wav.keys()),
+                           list(new_utt2wav.values())).sorted().write(
+                               output_dir + "/wav.scp")
     copy_file_if_exists(input_dir + "/reco2dur", output_dir + "/reco2dur",
                                 args.utt_modifier_type, args.utt_modifier)
     copy_file_if_exists(input_dir + "/utt2dur", output_dir + "/utt2dur",
@@ -7,6 +7,11 @@
 
 import argparse, shlex, glob, math, os, random, sys, warnings, copy, imp, ast
 
+import numpy as np
+
+sys.path.insert(0, 'steps')
+import libs.data_dir as data_dir_lib
+
 data_lib = imp.load_source('dml', 'steps/data/data_dir_manipulation_lib.py')
 
 def get_args():
@@ -71,6 +76,13 @@ def get_args():
                         "the RIRs/noises will be resampled to the rate of the source data.")
     parser.add_argument("--include-original-data", type=str, help="If true, the output data includes one copy of the original data",
                          choices=['true', 'false'], default = "false")
+    parser.add_argument("--materialize-dir", type=str, default = None,
+                        help="If specified, the corrupted recordings are computed in this process "
+                        "and written to wav archives in this directory, and the output wav.scp points to them "
+                        "instead of to wav-reverberate pipes. Each RIR and noise is read only once. "
+                        "The random choices are the same as without this option.")
+    parser.add_argument("--num-jobs", type=int, default = 1,
+                        help="Number of processes used to compute the corrupted recordings with --materialize-dir")
     parser.add_argument("input_dir",
                         help="Input data directory")
     parser.add_argument("output_dir",
@@ -113,6 +125,9 @@ def check_args(args):
     if args.source_sampling_rate is not None and args.source_sampling_rate <= 0:
         raise Exception("--source-sampling-rate cannot be non-positive")
 
+    if args.num_jobs <= 0:
+        raise Exception("--num-jobs must be positive")
+
     return args
 
 
@@ -152,55 +167,21 @@ def pick_item_with_probability(x):
     assert False, "Shouldn't get here as the accumulated probability should always equal to 1"
 
 
-def parse_file_to_dict(file, assert2fields = False, value_processor = None):
-    """ This function parses a file and pack the data into a dictionary
-        It is useful for parsing file like wav.scp, utt2spk, text...etc
-    """
-    if value_processor is None:
-        value_processor = lambda x: x[0]
-    dict = {}
-    for line in open(file, 'r', encoding='utf-8'):
-        parts = line.split()
-        if assert2fields:
-            assert(len(parts) == 2)
-
-        dict[parts[0]] = value_processor(parts[1:])
-    return dict
-
-def write_dict_to_file(dict, file_name):
-    """ This function creates a file and write the content of a dictionary into it
-    """
-    file = open(file_name, 'w', encoding='utf-8')
-    keys = sorted(dict.keys())
-    for key in keys:
-        value = dict[key]
-        if type(value) in [list, tuple] :
-            if type(value) is tuple:
-                value = list(value)
-            value = sorted(value)
-            value = ' '.join(str(value))
-        file.write('{0} {1}\n'.format(key, value))
-    file.close()
-
-
 def create_corrupted_utt2uniq(input_dir, output_dir, num_replicas, include_original, prefix):
     """This function creates the utt2uniq file from the utterance id in utt2spk file
     """
-    corrupted_utt2uniq = {}
     # Parse the utt2spk to get the utterance id
-    utt2spk = parse_file_to_dict(input_dir + "/utt2spk", value_processor = lambda x: " ".join(x))
-    keys = sorted(utt2spk.keys())
+    keys = data_dir_lib.DataTable.read(input_dir + "/utt2spk").unique().sorted().keys
     if include_original:
         start_index = 0
     else:
         start_index = 1
 
-    for i in range(start_index, num_replicas+1):
-        for utt_id in keys:
-            new_utt_id = get_new_id(utt_id, prefix, i)
-            corrupted_utt2uniq[new_utt_id] = utt_id
-
-    write_dict_to_file(corrupted_utt2uniq, output_dir + "/utt2uniq")
+    corrupted_utt2uniq = data_dir_lib.DataTable(
+        [get_new_id(utt_id, prefix, i)
+         for i in range(start_index, num_replicas+1) for utt_id in keys.tolist()],
+        np.tile(keys, num_replicas + 1 - start_index))
+    corrupted_utt2uniq.unique().sorted().write(output_dir + "/utt2uniq")
 
 
 def add_point_source_noise(noise_addition_descriptor,  # descriptor to store the information of the noise added
@@ -210,7 +191,8 @@ def add_point_source_noise(noise_addition_descriptor,  # descriptor to store the
                         foreground_snrs, # the SNR for adding the foreground noises
                         background_snrs, # the SNR for adding the background noises
                         speech_dur,  # duration of the recording
-                        max_noises_recording  # Maximum number of point-source noises that can be added
+                        max_noises_recording,  # Maximum number of point-source noises that can be added
+                        corruption_plan = None  # if not None, the noises added are also recorded here
                         ):
     if len(pointsource_noise_list) > 0 and random.random() < pointsource_noise_addition_probability and max_noises_recording >= 1:
         for k in range(random.randint(1, max_noises_recording)):
@@ -223,10 +205,19 @@ def add_point_source_noise(noise_addition_descriptor,  # descriptor to store the
                 noise_rvb_command = """wav-reverberate --impulse-response="{0}" --duration={1}""".format(noise_rir.rir_rspecifier, speech_dur)
                 noise_addition_descriptor['start_times'].append(0)
                 noise_addition_descriptor['snrs'].append(next(background_snrs))
+                noise_duration = speech_dur
             else:
                 noise_rvb_command = """wav-reverberate --impulse-response="{0}" """.format(noise_rir.rir_rspecifier)
                 noise_addition_descriptor['start_times'].append(round(random.random() * speech_dur, 2))
                 noise_addition_descriptor['snrs'].append(next(foreground_snrs))
+                noise_duration = None
+
+            if corruption_plan is not None:
+                corruption_plan['noises'].append({'rspecifier': noise.noise_rspecifier,
+                                                  'rir': noise_rir.rir_rspecifier,
+                                                  'duration': noise_duration,
+                                                  'start_time': noise_addition_descriptor['start_times'][-1],
+                                                  'snr': noise_addition_descriptor['snrs'][-1]})
 
             # check if the rspecifier is a pipe or not
             if len(noise.noise_rspecifier.split()) == 1:
@@ -246,12 +237,18 @@ def generate_reverberation_opts(room_dict,  # the room dictionary, please refer
                               isotropic_noise_addition_probability, # Probability of adding isotropic noises
                               pointsource_noise_addition_probability, # Probability of adding point-source noises
                               speech_dur,  # duration of the recording
-                              max_noises_recording  # Maximum number of point-source noises that can be added
+                              max_noises_recording,  # Maximum number of point-source noises that can be added
+                              corruption_plan = None  # if not None, a dict in which the choices are also recorded
                               ):
     """ This function randomly decides whether to reverberate, and sample a RIR if it does
         It also decides whether to add the appropriate noises
         This function return the string of options to the binary wav-reverberate
+        If corruption_plan is given, the same choices are stored in it in the form used by
+        audio_corruption_lib.py, i.e. it gets the keys 'room_id', 'rir' and 'noises'.
     """
+    if corruption_plan is not None:
+        corruption_plan['rir'] = None
+        corruption_plan['noises'] = []
     reverberate_opts = ""
     noise_addition_descriptor = {'noise_io': [],
                                  'start_times': [],
@@ -264,6 +261,10 @@ def generate_reverberation_opts(room_dict,  # the room dictionary, please refer
     if random.random() < speech_rvb_probability:
         # pick the RIR to reverberate the speech
         reverberate_opts += """--impulse-response="{0}" """.format(speech_rir.rir_rspecifier)
+        if corruption_plan is not None:
+            corruption_plan['rir'] = speech_rir.rir_rspecifier
+    if corruption_plan is not None:
+        corruption_plan['room_id'] = speech_rir.room_id
 
     rir_iso_noise_list = []
     if speech_rir.room_id in iso_noise_dict:
@@ -279,6 +280,12 @@ def generate_reverberation_opts(room_dict,  # the room dictionary, please refer
             noise_addition_descriptor['noise_io'].append("{0} wav-reverberate --duration={1} - - |".format(isotropic_noise.noise_rspecifier, speech_dur))
         noise_addition_descriptor['start_times'].append(0)
         noise_addition_descriptor['snrs'].append(next(background_snrs))
+        if corruption_plan is not None:
+            corruption_plan['noises'].append({'rspecifier': isotropic_noise.noise_rspecifier,
+                                              'rir': None,
+                                              'duration': speech_dur,
+                                              'start_time': 0,
+                                              'snr': noise_addition_descriptor['snrs'][-1]})
 
     noise_addition_descriptor = add_point_source_noise(noise_addition_descriptor,  # descriptor to store the information of the noise added
                                                     room,  # the room selected
@@ -287,7 +294,8 @@ def generate_reverberation_opts(room_dict,  # the room dictionary, please refer
                                                     foreground_snrs, # the SNR for adding the foreground noises
                                                     background_snrs, # the SNR for adding the background noises
                                                     speech_dur,  # duration of the recording
-                                                    max_noises_recording  # Maximum number of point-source noises that can be added
+                                                    max_noises_recording,  # Maximum number of point-source noises that can be added
+                                                    corruption_plan
                                                     )
 
     assert len(noise_addition_descriptor['noise_io']) == len(noise_addition_descriptor['start_times'])
@@ -312,8 +320,8 @@ def get_new_id(id, prefix=None, copy=0):
     return new_id
 
 
-def generate_reverberated_wav_scp(wav_scp,  # a dictionary whose values are the Kaldi-IO strings of the speech recordings
-                               durations, # a dictionary whose values are the duration (in sec) of the speech recordings
+def generate_reverberated_wav_scp(wav_scp,  # a DataTable (see libs/data_dir.py) whose values are the Kaldi-IO strings of the speech recordings
+                               durations, # a DataTable whose values are the duration (in sec) of the speech recordings
                                output_dir, # output directory to write the corrupted wav.scp
                                room_dict,  # the room dictionary, please refer to make_room_dict() for the format
                                pointsource_noise_list, # the point source noise list
@@ -327,30 +335,42 @@ def generate_reverberated_wav_scp(wav_scp,  # a dictionary whose values are the
                                shift_output, # option whether to shift the output waveform
                                isotropic_noise_addition_probability, # Probability of adding isotropic noises
                                pointsource_noise_addition_probability, # Probability of adding point-source noises
-                               max_noises_per_minute # maximum number of point-source noises that can be added to a recording according to its duration
+                               max_noises_per_minute, # maximum number of point-source noises that can be added to a recording according to its duration
+                               materialize_dir = None, # if not None, directory to write the corrupted recordings to
+                               num_jobs = 1 # number of processes used to write the corrupted recordings
                                ):
     """ This is the main function to generate pipeline command for the corruption
         The generic command of wav-reverberate will be like:
         wav-reverberate --duration=t --impulse-response=rir.wav
         --additive-signals='noise1.wav,noise2.wav' --snrs='snr1,snr2' --start-times='s1,s2' input.wav output.wav
+        If materialize_dir is given, the corrupted recordings are instead computed by
+        audio_corruption_lib.py and wav.scp points to the wav archives it writes.
     """
     foreground_snrs = list_cyclic_iterator(foreground_snr_array)
     background_snrs = list_cyclic_iterator(background_snr_array)
     corrupted_wav_scp = {}
-    keys = sorted(wav_scp.keys())
+    recordings_to_materialize = []
+    wav_scp = wav_scp.unique().sorted()
+    keys = wav_scp.keys.tolist()
+    wav_rxfilenames = wav_scp.values.tolist()
+    index = durations.lookup(wav_scp.keys)
+    if np.any(index < 0):
+        raise KeyError("No duration found for recording {0}".format(
+            keys[np.argmin(index)]))
+    speech_durs = durations.values[index].tolist()
     if include_original:
         start_index = 0
     else:
         start_index = 1
 
     for i in range(start_index, num_replicas+1):
-        for recording_id in keys:
-            wav_original_pipe = wav_scp[recording_id]
+        for recording_id, wav_rxfilename, speech_dur in zip(keys, wav_rxfilenames, speech_durs):
+            wav_original_pipe = wav_rxfilename
             # check if it is really a pipe
             if len(wav_original_pipe.split()) == 1:
                 wav_original_pipe = "cat {0} |".format(wav_original_pipe)
-            speech_dur = durations[recording_id]
             max_noises_recording = math.floor(max_noises_per_minute * speech_dur / 60)
+            corruption_plan = {} if materialize_dir is not None else None
 
             reverberate_opts = generate_reverberation_opts(room_dict,  # the room dictionary, please refer to make_room_dict() for the format
                                                          pointsource_noise_list, # the point source noise list
@@ -361,7 +381,8 @@ def generate_reverberated_wav_scp(wav_scp,  # a dictionary whose values are the
                                                          isotropic_noise_addition_probability, # Probability of adding isotropic noises
                                                          pointsource_noise_addition_probability, # Probability of adding point-source noises
                                                          speech_dur,  # duration of the recording
-                                                         max_noises_recording  # Maximum number of point-source noises that can be added
+                                                         max_noises_recording,  # Maximum number of point-source noises that can be added
+                                                         corruption_plan
                                                          )
 
             # prefix using index 0 is reserved for original data e.g. rvb0_swb0035 corresponds to the swb0035 recording in original data
@@ -372,8 +393,20 @@ def generate_reverberated_wav_scp(wav_scp,  # a dictionary whose values are the
 
             new_recording_id = get_new_id(recording_id, prefix, i)
             corrupted_wav_scp[new_recording_id] = wav_corrupted_pipe
+            if corruption_plan is not None and not (reverberate_opts == "" or i == 0):
+                recordings_to_materialize.append((new_recording_id, wav_rxfilename,
+                                                  corruption_plan, corruption_plan['room_id']))
+
+    if len(recordings_to_materialize) > 0:
+        import audio_corruption_lib
+        print("Writing {0} corrupted recordings to {1}...".format(len(recordings_to_materialize),
+                                                                  materialize_dir))
+        locations = audio_corruption_lib.materialize_corrupted_recordings(
+            recordings_to_materialize, materialize_dir, shift_output == "true", num_jobs)
+        corrupted_wav_scp.update(locations)
 
-    write_dict_to_file(corrupted_wav_scp, output_dir + "/wav.scp")
+    data_dir_lib.DataTable(list(corrupted_wav_scp.keys()),
+                           list(corrupted_wav_scp.values())).sorted().write(output_dir + "/wav.scp")
 
 
 def add_prefix_to_fields(input_file, output_file, num_replicas, include_original, prefix, field = [0]):
@@ -412,44 +445,48 @@ def create_reverberated_copy(input_dir,
                            shift_output, # option whether to shift the output waveform
                            isotropic_noise_addition_probability, # Probability of adding isotropic noises
                            pointsource_noise_addition_probability, # Probability of adding point-source noises
-                           max_noises_per_minute  # maximum number of point-source noises that can be added to a recording according to its duration
+                           max_noises_per_minute,  # maximum number of point-source noises that can be added to a recording according to its duration
+                           materialize_dir = None, # if not None, directory to write the corrupted recordings to
+                           num_jobs = 1 # number of processes used to write the corrupted recordings
                            ):
     """ This function creates multiple copies of the necessary files,
         e.g. utt2spk, wav.scp ...
     """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    wav_scp = parse_file_to_dict(input_dir + "/wav.scp", value_processor = lambda x: " ".join(x))
-    if not os.path.isfile(input_dir + "/reco2dur"):
+    data_dir = data_dir_lib.DataDir(input_dir, normalize_whitespace = True)
+    wav_scp = data_dir['wav.scp']
+    if not data_dir.has("reco2dur"):
         print("Getting the duration of the recordings...");
         data_lib.RunKaldiCommand("utils/data/get_reco2dur.sh {}".format(input_dir))
-    durations = parse_file_to_dict(input_dir + "/reco2dur", value_processor = lambda x: float(x[0]))
+    durations = data_dir.get_durations("reco2dur")
     foreground_snr_array = [float(x) for x in foreground_snr_string.split(':')]
     background_snr_array = [float(x) for x in background_snr_string.split(':')]
 
     generate_reverberated_wav_scp(wav_scp, durations, output_dir, room_dict, pointsource_noise_list, iso_noise_dict,
                foreground_snr_array, background_snr_array, num_replicas, include_original, prefix,
                speech_rvb_probability, shift_output, isotropic_noise_addition_probability,
-               pointsource_noise_addition_probability, max_noises_per_minute)
+               pointsource_noise_addition_probability, max_noises_per_minute,
+               materialize_dir, num_jobs)
 
-    add_prefix_to_fields(input_dir + "/utt2spk", output_dir + "/utt2spk", num_replicas, include_original, prefix, field = [0,1])
+    add_prefix_to_fields(data_dir.path("utt2spk"), output_dir + "/utt2spk", num_replicas, include_original, prefix, field = [0,1])
     data_lib.RunKaldiCommand("utils/utt2spk_to_spk2utt.pl <{output_dir}/utt2spk >{output_dir}/spk2utt"
                     .format(output_dir = output_dir))
 
-    if os.path.isfile(input_dir + "/utt2uniq"):
-        add_prefix_to_fields(input_dir + "/utt2uniq", output_dir + "/utt2uniq", num_replicas, include_original, prefix, field =[0])
+    if data_dir.has("utt2uniq"):
+        add_prefix_to_fields(data_dir.path("utt2uniq"), output_dir + "/utt2uniq", num_replicas, include_original, prefix, field =[0])
     else:
         # Create the utt2uniq file
         create_corrupted_utt2uniq(input_dir, output_dir, num_replicas, include_original, prefix)
 
-    if os.path.isfile(input_dir + "/text"):
-        add_prefix_to_fields(input_dir + "/text", output_dir + "/text", num_replicas, include_original, prefix, field =[0])
-    if os.path.isfile(input_dir + "/segments"):
-        add_prefix_to_fields(input_dir + "/segments", output_dir + "/segments", num_replicas, include_original, prefix, field = [0,1])
-    if os.path.isfile(input_dir + "/reco2file_and_channel"):
-        add_prefix_to_fields(input_dir + "/reco2file_and_channel", output_dir + "/reco2file_and_channel", num_replicas, include_original, prefix, field = [0,1])
-    if os.path.isfile(input_dir + "/vad.scp"):
-        add_prefix_to_fields(input_dir + "/vad.scp", output_dir + "/vad.scp", num_replicas, include_original, prefix, field=[0])
+    if data_dir.has("text"):
+        add_prefix_to_fields(data_dir.path("text"), output_dir + "/text", num_replicas, include_original, prefix, field =[0])
+    if data_dir.has("segments"):
+        add_prefix_to_fields(data_dir.path("segments"), output_dir + "/segments", num_replicas, include_original, prefix, field = [0,1])
+    if data_dir.has("reco2file_and_channel"):
+        add_prefix_to_fields(data_dir.path("reco2file_and_channel"), output_dir + "/reco2file_and_channel", num_replicas, include_original, prefix, field = [0,1])
+    if data_dir.has("vad.scp"):
+        add_prefix_to_fields(data_dir.path("vad.scp"), output_dir + "/vad.scp", num_replicas, include_original, prefix, field=[0])
 
     data_lib.RunKaldiCommand("utils/validate_data_dir.sh --no-feats --no-text {output_dir}"
                     .format(output_dir = output_dir))
@@ -672,7 +709,9 @@ def main():
                            shift_output = args.shift_output,
                            isotropic_noise_addition_probability = args.isotropic_noise_addition_probability,
                            pointsource_noise_addition_probability = args.pointsource_noise_addition_probability,
-                           max_noises_per_minute = args.max_noises_per_minute)
+                           max_noises_per_minute = args.max_noises_per_minute,
+                           materialize_dir = args.materialize_dir,
+                           num_jobs = args.num_jobs)
 
 
     data_lib.RunKaldiCommand("utils/validate_data_dir.sh --no-feats --no-text {output_dir}"
@@ -10,6 +10,7 @@
 iter=final
 cmd=run.pl
 acwt=0.1
+num_threads=1  # number of processes used to accumulate the lattice-depth stats.
 #end configuration section.
 
 echo "$0 $@"  # Print the command line for logging
@@ -22,6 +23,7 @@ if [ $# -ne 2 ]; then
   echo " Options:"
   echo "    --cmd (run.pl|queue.pl...)      # specify how to run the sub-processes."
   echo "    --acwt <acoustic-scale>         # Acoustic scale for getting best-path (default: 0.1)"
+  echo "    --num-threads <n>               # Number of processes used to analyze the lattice depths (default: 1)"
   echo "e.g.:"
   echo "$0 data/lang exp/tri4b/decode_dev"
   echo "This script writes some diagnostics to <decode-dir>/log/alignments.log"
@@ -65,9 +67,9 @@ echo "$0: see stats in $dir/log/analyze_alignments.log"
 $cmd $dir/log/dump_ali_frame.log \
   ali-to-phones --per-frame=true "$model" "ark:gunzip -c $dir/ali_tmp.*.gz|" "ark,t:|gzip -c >$dir/ali_frame_tmp.gz"
 
-$cmd $dir/log/analyze_lattice_depth_stats.log \
-  gunzip -c "$dir/depth_tmp.*.gz" \| \
-  steps/diagnostic/analyze_lattice_depth_stats.py $lang "$dir/ali_frame_tmp.gz" || exit 1
+$cmd --num-threads $num_threads $dir/log/analyze_lattice_depth_stats.log \
+  steps/diagnostic/analyze_lattice_depth_stats.py --num-jobs $num_threads \
+    $lang "$dir/ali_frame_tmp.gz" "$dir/depth_tmp.*.gz" || exit 1
 
 grep Overall $dir/log/analyze_lattice_depth_stats.log
 echo "$0: see stats in $dir/log/analyze_lattice_depth_stats.log"
@@ -8,11 +8,17 @@ from __future__ import print_function
 from __future__ import division
 import argparse
 import sys, os
-from collections import defaultdict
 from io import open
 import codecs
 import gzip
 
+import numpy as np
+
+sys.path.insert(0, 'steps')
+import libs.common as common_lib
+import libs.diagnostic_stats as diagnostic_stats_lib
+import libs.segmentation as segmentation_lib
+
 # reference: http://www.macfreek.nl/memory/Encoding_of_Python_stdout
 if sys.version_info.major == 2:
     sys.stdout = codecs.getwriter('utf-8')(sys.stdout, 'strict')
@@ -31,152 +37,223 @@ parser.add_argument("--frequency-cutoff-percentage", type = float,
                     "(between 0 and 100), of frequency at which we print stats "
                     "for a phone.")
 
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help="Number of processes used to accumulate the stats of "
+                    "the depth_per_frame files (one file per process at a "
+                    "time).")
+
 parser.add_argument("lang",
                     help="Language directory, e.g. data/lang.")
 
 parser.add_argument("ali_per_frame",
                     help="Gzipped alignment per frame, e.g. ali_frame_tmp.gz")
 
-args = parser.parse_args()
-
-# set up phone_int2text to map from phone to printed form.
-phone_int2text = {}
-try:
-    f = open(args.lang + "/phones.txt", "r", encoding='utf-8')
-    for line in f.readlines():
-        [ word, number] = line.split()
-        phone_int2text[int(number)] = word
-    f.close()
-except:
-    sys.exit(u"analyze_lattice_depth_stats.py: error opening or reading {0}/phones.txt".format(
-            args.lang))
-# this is a special case... for begin- and end-of-sentence stats,
-# we group all nonsilence phones together.
-phone_int2text[0] = 'nonsilence'
-
-# populate the set and 'nonsilence', which will contain the integer phone-ids of
-# nonsilence phones (and disambig phones, which won't matter).
-nonsilence = set(phone_int2text.keys())
-nonsilence.remove(0)
-try:
-    # open lang/phones/silence.csl-- while there are many ways of obtaining the
-    # silence/nonsilence phones, we read this because it's present in graph
-    # directories as well as lang directories.
-    filename = u"{0}/phones/silence.csl".format(args.lang)
-    f = open(filename, "r")
-    line = f.readline()
-    for silence_phone in line.split(":"):
-        nonsilence.remove(int(silence_phone))
-    f.close()
-except Exception as e:
-    sys.exit(u"analyze_lattice_depth_stats.py: error processing {0}/phones/silence.csl: {1}".format(
-            args.lang, str(e)))
-
-# phone_depth_counts is a dict of dicts.
-# for each integer phone-id 'phone',
-# phone_depth_counts[phone] is a map from depth to count (of frames on which
-# that was the 1-best phone in the alignment, and the lattice depth
-# had that value).  So we'd access it as
-# count = phone_depth_counts[phone][depth].
-
-phone_depth_counts = dict()
-
-# note: -1 is for all phones put in one bucket.
-for p in [ -1 ] + list(phone_int2text.keys()):
-    phone_depth_counts[p] = defaultdict(int)
-
-total_frames = 0
-
-ali_per_frame = {}
-for line in gzip.open(args.ali_per_frame, mode='rt', encoding='utf-8'):
-   uttid, ali = line.split(" ", 1)
-   ali_per_frame[uttid] = ali
-
-for line in sys.stdin:
-    uttid, depth = line.split(" ", 1)
-    if uttid in ali_per_frame:
-        apf = ali_per_frame[uttid].split()
-        dpf = depth.split()
-        for p, d in zip(apf, dpf):
-              p, d = int(p), int(d)
-              phone_depth_counts[p][d] += 1
-              total_frames += 1
-              if p in nonsilence:
-                  nonsilence_phone = 0
-                  phone_depth_counts[nonsilence_phone][d] += 1
-              universal_phone = -1
-              phone_depth_counts[universal_phone][d] += 1
-
-if total_frames == 0:
-    sys.exit(u"analyze_lattice_depth_stats.py: read no input")
-
-# If depth_to_count is a map from depth-in-frames to count,
-# return the depth-in-frames that equals the (fraction * 100)'th
-# percentile of the distribution.
-def GetPercentile(depth_to_count, fraction):
-    this_total_frames = sum(depth_to_count.values())
-    if this_total_frames == 0:
-        return 0
+parser.add_argument("depth_per_frame", nargs = "*",
+                    help="Lattice depth per frame, e.g. depth_tmp.1.gz "
+                    "(gzipped if the name ends in .gz).  If none are given, "
+                    "it is read from the standard input.")
+
+# The histograms are flushed after this many frames have been collected, to
+# limit the memory used.
+MAX_FRAMES_PER_FLUSH = 1000000
+
+# These are set in the worker processes (and in the main process) by
+# init_worker().
+_ali_per_frame = None
+_num_phones = None
+
+
+def init_worker(ali_per_frame, num_phones):
+    global _ali_per_frame, _num_phones
+    _ali_per_frame = ali_per_frame
+    _num_phones = num_phones
+
+
+def AccumulateDepthStats(depth_lines, filename=None):
+    """Returns a diagnostic_stats_lib.Histograms object whose row p is the
+    histogram of the lattice depths of the frames on which p was the 1-best
+    phone in the alignment, for the utterances in 'depth_lines' (lines of
+    'utt-id depth1 depth2 ...').  'filename' is only used in error
+    messages."""
+    histograms = diagnostic_stats_lib.Histograms(_num_phones)
+    phones = []
+    depths = []
+    num_frames = 0
+
+    def Flush():
+        if num_frames == 0:
+            return
+        all_phones = np.concatenate(phones)
+        if all_phones.min() < 0 or all_phones.max() >= _num_phones:
+            bad = all_phones[(all_phones < 0) | (all_phones >= _num_phones)]
+            raise ValueError("phone {0} is not covered on phones.txt "
+                             "(lang/alignment mismatch?)".format(bad[0]))
+        histograms.add(all_phones, np.concatenate(depths))
+        del phones[:]
+        del depths[:]
+
+    for uttid, dpf in segmentation_lib.read_int_vector_ark(
+            depth_lines, filename, allow_empty=True):
+        if uttid in _ali_per_frame:
+            apf = _ali_per_frame[uttid]
+            length = min(len(apf), len(dpf))
+            phones.append(apf[:length])
+            depths.append(dpf[:length])
+            num_frames += length
+            if num_frames >= MAX_FRAMES_PER_FLUSH:
+                Flush()
+                num_frames = 0
+    Flush()
+    return histograms
+
+
+def AccumulateDepthStatsFromFile(filename):
+    if filename.endswith(".gz"):
+        f = gzip.open(filename, mode='rt', encoding='utf-8')
     else:
-        items = sorted(depth_to_count.items())
-        count_cutoff = int(fraction * this_total_frames)
-        cur_count_total = 0
-        for depth,count in items:
-            assert count >= 0
-            cur_count_total += count
-            if cur_count_total >= count_cutoff:
-                return depth
-        assert false # we shouldn't reach here.
+        f = open(filename, "r", encoding='utf-8')
+    try:
+        return AccumulateDepthStats(f, filename)
+    finally:
+        f.close()
 
-def GetMean(depth_to_count):
-    this_total_frames = sum(depth_to_count.values())
-    if this_total_frames == 0:
-        return 0.0
-    this_total_depth = sum([ float(l * c) for l,c in depth_to_count.items() ])
-    return this_total_depth / this_total_frames
 
+def ReadDepthStats(args, ali_per_frame, num_phones):
+    """Returns the histograms of AccumulateDepthStats() for the
+    depth_per_frame files (or the standard input) of 'args', accumulated
+    by args.num_jobs processes and added up."""
+    if len(args.depth_per_frame) == 0:
+        init_worker(ali_per_frame, num_phones)
+        return AccumulateDepthStats(sys.stdin, "standard input")
+    histograms = diagnostic_stats_lib.Histograms(num_phones)
+    for file_histograms in common_lib.map_in_order(
+            AccumulateDepthStatsFromFile, args.depth_per_frame,
+            num_jobs = args.num_jobs, initializer = init_worker,
+            initargs = (ali_per_frame, num_phones)):
+        histograms.add_histograms(file_histograms)
+    return histograms
 
-print(u"The total amount of data analyzed assuming 100 frames per second "
-      u"is {0} hours".format("%.1f" % (total_frames / 360000.0)))
 
-# the next block prints lines like (to give some examples):
-# Nonsilence phones as a group account for 74.4% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,2,7) and mean=3.1
-# Phone SIL accounts for 25.5% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,1,4) and mean=2.5
-# Phone Z_E accounts for 2.5% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,2,6) and mean=2.9
-# ...
+def Main():
+    args = parser.parse_args()
 
+    # set up phone_int2text to map from phone to printed form.
+    phone_int2text = {}
+    try:
+        f = open(args.lang + "/phones.txt", "r", encoding='utf-8')
+        for line in f.readlines():
+            [ word, number] = line.split()
+            phone_int2text[int(number)] = word
+        f.close()
+    except:
+        sys.exit(u"analyze_lattice_depth_stats.py: error opening or reading {0}/phones.txt".format(
+                args.lang))
+    # this is a special case... for begin- and end-of-sentence stats,
+    # we group all nonsilence phones together.
+    phone_int2text[0] = 'nonsilence'
 
-# sort the phones in decreasing order of count.
-for phone,depths in sorted(phone_depth_counts.items(), key = lambda x : -sum(x[1].values())):
+    # populate the set and 'nonsilence', which will contain the integer phone-ids of
+    # nonsilence phones (and disambig phones, which won't matter).
+    nonsilence = set(phone_int2text.keys())
+    nonsilence.remove(0)
+    try:
+        # open lang/phones/silence.csl-- while there are many ways of obtaining the
+        # silence/nonsilence phones, we read this because it's present in graph
+        # directories as well as lang directories.
+        filename = u"{0}/phones/silence.csl".format(args.lang)
+        f = open(filename, "r")
+        line = f.readline()
+        for silence_phone in line.split(":"):
+            nonsilence.remove(int(silence_phone))
+        f.close()
+    except Exception as e:
+        sys.exit(u"analyze_lattice_depth_stats.py: error processing {0}/phones/silence.csl: {1}".format(
+                args.lang, str(e)))
 
-    frequency_percentage = sum(depths.values()) * 100.0 / total_frames
-    if frequency_percentage < args.frequency_cutoff_percentage:
-        continue
+    num_phones = max(phone_int2text.keys()) + 1
+    try:
+        # the phones are stored as int32 to save memory.
+        ali_per_frame = {}
+        with gzip.open(args.ali_per_frame, mode='rt', encoding='utf-8') as f:
+            for uttid, ali in segmentation_lib.read_int_vector_ark(
+                    f, args.ali_per_frame, allow_empty=True):
+                ali_per_frame[uttid] = ali.astype(np.int32)
 
+        # phone_depth_counts.counts[phone, depth] is the count of frames on
+        # which 'phone' was the 1-best phone in the alignment, and the
+        # lattice depth had that value.
+        phone_depth_counts = ReadDepthStats(args, ali_per_frame, num_phones)
+    except (ValueError, RuntimeError) as e:
+        sys.exit(u"analyze_lattice_depth_stats.py: {0}".format(str(e)))
 
-    depth_percentile_10 = GetPercentile(depths, 0.1)
-    depth_percentile_50 = GetPercentile(depths, 0.5)
-    depth_percentile_90 = GetPercentile(depths, 0.9)
-    depth_mean = GetMean(depths)
+    total_frames = int(phone_depth_counts.totals().sum())
+    if total_frames == 0:
+        sys.exit(u"analyze_lattice_depth_stats.py: read no input")
 
-    if phone > 0:
-        try:
-            phone_text = phone_int2text[phone]
-        except:
+    for phone in np.flatnonzero(phone_depth_counts.totals()).tolist():
+        if phone not in phone_int2text:
             sys.exit(u"analyze_lattice_depth_stats.py: phone {0} is not covered on phones.txt "
                      u"(lang/alignment mismatch?)".format(phone))
-        preamble = u"Phone {phone_text} accounts for {percent}% of frames, with".format(
-            phone_text = phone_text, percent = "%.1f" % frequency_percentage)
-    elif phone == 0:
-        preamble = u"Nonsilence phones as a group account for {percent}% of frames, with".format(
-            percent = "%.1f" % frequency_percentage)
-    else:
-        assert phone == -1
-        preamble = "Overall,";
-
-    print(u"{preamble} lattice depth (10,50,90-percentile)=({p10},{p50},{p90}) and mean={mean}".format(
-            preamble = preamble,
-            p10 = depth_percentile_10,
-            p50 = depth_percentile_50,
-            p90 = depth_percentile_90,
-            mean = "%.1f" % depth_mean))
+
+    # 'phones' are the phones we print stats for, where -1 is for all phones
+    # put in one bucket and 0 is for the nonsilence phones as a group (plus
+    # phone 0 itself, if it was seen); 'depths' has their histograms.
+    phones = [ -1 ] + list(phone_int2text.keys())
+    counts = phone_depth_counts.counts
+    depths = np.empty((len(phones), counts.shape[1]), dtype=np.int64)
+    for i, phone in enumerate(phones):
+        if phone == -1:
+            depths[i] = counts.sum(axis=0)
+        elif phone == 0:
+            depths[i] = counts[0] + counts[sorted(nonsilence)].sum(axis=0)
+        else:
+            depths[i] = counts[phone]
+    depths = diagnostic_stats_lib.Histograms(len(phones), depths)
+
+    # sort the phones in decreasing order of count, and keep the ones we
+    # print stats for.
+    totals = depths.totals()
+    printed = [ i for i in np.argsort(-totals, kind='stable').tolist()
+                if int(totals[i]) * 100.0 / total_frames >=
+                args.frequency_cutoff_percentage ]
+    depth_percentile_10 = depths.percentiles(0.1, printed).tolist()
+    depth_percentile_50 = depths.percentiles(0.5, printed).tolist()
+    depth_percentile_90 = depths.percentiles(0.9, printed).tolist()
+    depth_mean = depths.means().tolist()
+
+    print(u"The total amount of data analyzed assuming 100 frames per second "
+          u"is {0} hours".format("%.1f" % (total_frames / 360000.0)))
+
+    # the next block prints lines like (to give some examples):
+    # Nonsilence phones as a group account for 74.4% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,2,7) and mean=3.1
+    # Phone SIL accounts for 25.5% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,1,4) and mean=2.5
+    # Phone Z_E accounts for 2.5% of phone occurrences, with lattice depth (10,50,90-percentile)=(1,2,6) and mean=2.9
+    # ...
+
+
+    for j, i in enumerate(printed):
+        phone = phones[i]
+
+        frequency_percentage = int(totals[i]) * 100.0 / total_frames
+
+        if phone > 0:
+            phone_text = phone_int2text[phone]
+            preamble = u"Phone {phone_text} accounts for {percent}% of frames, with".format(
+                phone_text = phone_text, percent = "%.1f" % frequency_percentage)
+        elif phone == 0:
+            preamble = u"Nonsilence phones as a group account for {percent}% of frames, with".format(
+                percent = "%.1f" % frequency_percentage)
+        else:
+            assert phone == -1
+            preamble = "Overall,";
+
+        print(u"{preamble} lattice depth (10,50,90-percentile)=({p10},{p50},{p90}) and mean={mean}".format(
+                preamble = preamble,
+                p10 = depth_percentile_10[j],
+                p50 = depth_percentile_50[j],
+                p90 = depth_percentile_90[j],
+                mean = "%.1f" % depth_mean[i]))
+
+
+if __name__ == "__main__":
+    Main()
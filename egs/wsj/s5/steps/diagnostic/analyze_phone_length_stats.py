@@ -11,6 +11,11 @@ from collections import defaultdict
 from io import open
 import codecs
 
+import numpy as np
+
+sys.path.insert(0, 'steps')
+import libs.diagnostic_stats as diagnostic_stats_lib
+
 # reference: http://www.macfreek.nl/memory/Encoding_of_Python_stdout
 if sys.version_info.major == 2:
     sys.stdout = codecs.getwriter('utf-8')(sys.stdout, 'strict')
@@ -72,48 +77,67 @@ except Exception as e:
             args.lang, str(e)))
 
 
-# phone_length is a dict of dicts of dicts;
 # phone_lengths[boundary_type] for boundary_type in [ 'begin', 'end', 'all' ] is
-# a dict indexed by phone, containing dicts from length to a count of occurrences.
-# Phones are ints and lengths are integers representing numbers of frames.
-# So: count == phone_lengths[boundary_type][phone][length].
+# a diagnostic_stats_lib.Histograms object whose row 'phone' is the histogram of
+# the lengths of the occurrences of that phone.  Phones are ints and lengths are
+# integers representing numbers of frames.
+# So: count == phone_lengths[boundary_type].counts[phone, length].
 # note: for the 'begin' and 'end' boundary-types, we group all nonsilence phones
 # into phone-id zero.
+num_phones = max(phone_int2text.keys()) + 1
 phone_lengths = dict()
+# the columns (count, phone, length) of the input lines, for each boundary_type.
+boundary_stats = dict()
 for boundary_type in [ 'begin', 'end', 'all' ]:
-    phone_lengths[boundary_type] = dict()
-    for p in phone_int2text.keys():
-        phone_lengths[boundary_type][p] = defaultdict(int)
+    phone_lengths[boundary_type] = diagnostic_stats_lib.Histograms(num_phones)
+    boundary_stats[boundary_type] = ([], [], [])
 
 # total_phones is a dict from boundary_type to total count [of phone occurrences]
 total_phones = defaultdict(int)
 # total_frames is a dict from boundary_type to total number of frames.
 total_frames = defaultdict(int)
-# total_frames is a dict from num-frames to count of num-utterances with that
-# num-frames.
 
-while True:
-    line = sys.stdin.readline()
-    if line == '':
-        break
+num_lines = 0
+for line in sys.stdin:
     a = line.split()
     if len(a) != 4:
         sys.exit("analyze_phone_length_stats.py: reading stdin, could not interpret line: " + line)
     try:
         count, boundary_type, phone, length = a
-        total_phones[boundary_type] += int(count)
-        total_frames[boundary_type] += int(count) * int(length)
-        phone_lengths[boundary_type][int(phone)][int(length)] += int(count)
-        if int(phone) in nonsilence:
-            nonsilence_phone = 0
-            phone_lengths[boundary_type][nonsilence_phone][int(length)] += int(count)
+        counts, phones, lengths = boundary_stats[boundary_type]
+        if int(phone) not in phone_int2text:
+            raise KeyError(int(phone))
+        counts.append(int(count))
+        phones.append(int(phone))
+        lengths.append(int(length))
     except Exception as e:
         sys.exit("analyze_phone_length_stats.py: unexpected phone {0} "
                  "seen (lang directory mismatch?): {1}".format(phone, str(e)))
+    num_lines += 1
 
-if len(phone_lengths) == 0:
+if num_lines == 0:
     sys.exit("analyze_phone_length_stats.py: read no input")
 
+nonsilence_array = np.array(sorted(nonsilence), dtype=np.int64)
+for boundary_type in [ 'begin', 'end', 'all' ]:
+    counts, phones, lengths = [ np.array(x, dtype=np.int64)
+                                for x in boundary_stats[boundary_type] ]
+    total_phones[boundary_type] = int(counts.sum())
+    total_frames[boundary_type] = int((counts * lengths).sum())
+    try:
+        phone_lengths[boundary_type].add(phones, lengths, counts)
+        is_nonsilence = np.isin(phones, nonsilence_array)
+        nonsilence_phone = 0
+        phone_lengths[boundary_type].add(
+            np.full(np.count_nonzero(is_nonsilence), nonsilence_phone),
+            lengths[is_nonsilence], counts[is_nonsilence])
+    except ValueError as e:
+        sys.exit("analyze_phone_length_stats.py: {0}".format(str(e)))
+# make the histograms of the three boundary types cover the same lengths.
+max_num_lengths = max([ h.num_values for h in phone_lengths.values() ])
+for h in phone_lengths.values():
+    h.reserve(max_num_lengths)
+
 # work out the optional-silence phone
 try:
     f = open(args.lang + "/phones/optional_silence.int", "r")
@@ -126,9 +150,10 @@ try:
 except:
     largest_count = 0
     optional_silence_phone = 1
+    all_phone_frames = phone_lengths['all'].value_totals().tolist()
     for p in phone_int2text.keys():
         if p > 0 and not p in nonsilence:
-            this_count = sum([ l * c for l,c in phone_lengths['all'][p].items() ])
+            this_count = all_phone_frames[p]
             if this_count > largest_count:
                 largest_count = this_count
                 optional_silence_phone = p
@@ -139,32 +164,6 @@ except:
 
 
 
-# If length_to_count is a map from length-in-frames to count,
-# return the length-in-frames that equals the (fraction * 100)'th
-# percentile of the distribution.
-def GetPercentile(length_to_count, fraction):
-    total_phones = sum(length_to_count.values())
-    if total_phones == 0:
-        return 0
-    else:
-        items = sorted(length_to_count.items())
-        count_cutoff = int(fraction * total_phones)
-        cur_count_total = 0
-        for length,count in items:
-            assert count >= 0
-            cur_count_total += count
-            if cur_count_total >= count_cutoff:
-                return length
-        assert false # we shouldn't reach here.
-
-def GetMean(length_to_count):
-    total_phones = sum(length_to_count.values())
-    if total_phones == 0:
-        return 0.0
-    total_frames = sum([ float(l * c) for l,c in length_to_count.items() ])
-    return total_frames / total_phones
-
-
 # Analyze frequency, median and mean of optional-silence at beginning and end of utterances.
 # The next block will print something like
 #  "At utterance begin, SIL is seen 15.0% of the time; when seen, duration (median, mean) is (5, 7.6) frames."
@@ -174,11 +173,10 @@ def GetMean(length_to_count):
 # This block will print warnings if silence is seen less than 80% of the time at utterance
 # beginning and end.
 for boundary_type in 'begin', 'end':
-    phone_to_lengths = phone_lengths[boundary_type]
     num_utterances = total_phones[boundary_type]
     assert num_utterances > 0
-    opt_sil_lengths = phone_to_lengths[optional_silence_phone]
-    frequency_percentage = sum(opt_sil_lengths.values()) * 100.0 / num_utterances
+    opt_sil_count = int(phone_lengths[boundary_type].counts[optional_silence_phone].sum())
+    frequency_percentage = opt_sil_count * 100.0 / num_utterances
     # The reason for this warning is that the tradition in speech recognition is
     # to supply a little silence at the beginning and end of utterances... up to
     # maybe half a second.  If your database is not like this, you should know;
@@ -203,31 +201,30 @@ boundary_to_text['all'] = 'Overall'
 # ...
 # Overall, R_I accounts for 3.2% of phone occurrences, with duration (median, mean, 95-percentile) is (6,6.9,12) frames.
 
+phones = list(phone_int2text.keys())
 for boundary_type in 'begin', 'end', 'all':
-    phone_to_lengths = phone_lengths[boundary_type]
+    phone_to_lengths = phone_lengths[boundary_type].select(phones)
     tot_num_phones = total_phones[boundary_type]
-    # sort the phones in decreasing order of count.
-    for phone,lengths in sorted(phone_to_lengths.items(), key = lambda x : -sum(x[1].values())):
-        frequency_percentage = sum(lengths.values()) * 100.0 / tot_num_phones
-        if frequency_percentage < args.frequency_cutoff_percentage:
-            continue
-
-        duration_median = GetPercentile(lengths, 0.5)
-        duration_percentile_95 = GetPercentile(lengths, 0.95)
-        duration_mean = GetMean(lengths)
+    phone_counts = phone_to_lengths.totals()
+    # sort the phones in decreasing order of count, and keep the ones we
+    # print stats for.
+    printed = [ i for i in np.argsort(-phone_counts, kind='stable').tolist()
+                if int(phone_counts[i]) * 100.0 / tot_num_phones >=
+                args.frequency_cutoff_percentage ]
+    duration_median = phone_to_lengths.percentiles(0.5, printed).tolist()
+    duration_percentile_95 = phone_to_lengths.percentiles(0.95, printed).tolist()
+    duration_mean = phone_to_lengths.means().tolist()
+    for j, i in enumerate(printed):
+        frequency_percentage = int(phone_counts[i]) * 100.0 / tot_num_phones
 
         text = boundary_to_text[boundary_type]  # e.g. 'At utterance begin'.
-        try:
-            phone_text = phone_int2text[phone]
-        except:
-            sys.exit("analyze_phone_length_stats.py: phone {0} is not covered on phones.txt "
-                     "(lang/alignment mismatch?)".format(phone))
+        phone_text = phone_int2text[phones[i]]
         print(u"{text}, {phone_text} accounts for {percent}% of phone occurrences, with "
               u"duration (median, mean, 95-percentile) is ({median},{mean},{percentile95}) frames.".format(
                 text = text, phone_text = phone_text,
                 percent = "%.1f" % frequency_percentage,
-                median = duration_median, mean = "%.1f" % duration_mean,
-                percentile95 = duration_percentile_95))
+                median = duration_median[j], mean = "%.1f" % duration_mean[i],
+                percentile95 = duration_percentile_95[j]))
 
 
 ## Print stats on frequency and average length of word-internal optional-silences.
@@ -236,20 +233,17 @@ for boundary_type in 'begin', 'end', 'all':
 total_frames['internal'] = total_frames['all'] - total_frames['begin'] - total_frames['end']
 total_phones['internal'] = total_phones['all'] - total_phones['begin'] - total_phones['end']
 
-internal_opt_sil_phone_lengths = dict(phone_lengths['all'][optional_silence_phone])
-# internal_opt_sil_phone_lenghts is a dict from length to count.
-for length in list(internal_opt_sil_phone_lengths.keys()):
-    # subtract the counts for begin and end from the overall counts to get the
-    # word-internal count.
-    internal_opt_sil_phone_lengths[length] -= (phone_lengths['begin'][optional_silence_phone][length] +
-                                               phone_lengths['end'][optional_silence_phone][length])
-    if internal_opt_sil_phone_lengths[length] == 0:
-        del internal_opt_sil_phone_lengths[length]
+# subtract the counts for begin and end from the overall counts to get the
+# word-internal counts.
+opt_sil_phone_lengths = phone_lengths['all'].select([ optional_silence_phone ])
+internal_opt_sil_phone_lengths = diagnostic_stats_lib.Histograms(
+    1, opt_sil_phone_lengths.counts
+    - phone_lengths['begin'].counts[[ optional_silence_phone ]]
+    - phone_lengths['end'].counts[[ optional_silence_phone ]])
 
 if total_phones['internal'] != 0.0:
-    total_internal_optsil_frames = sum([ float(l * c) for l,c in internal_opt_sil_phone_lengths.items() ])
-    total_optsil_frames = sum([ float(l * c)
-                                for l,c in phone_lengths['all'][optional_silence_phone].items() ])
+    total_internal_optsil_frames = float(internal_opt_sil_phone_lengths.value_totals()[0])
+    total_optsil_frames = float(opt_sil_phone_lengths.value_totals()[0])
     opt_sil_internal_frame_percent = total_internal_optsil_frames * 100.0 / total_frames['internal']
     opt_sil_total_frame_percent = total_optsil_frames * 100.0 / total_frames['all']
     internal_frame_percent = total_frames['internal'] * 100.0 / total_frames['all']
@@ -266,11 +260,11 @@ if total_phones['internal'] != 0.0:
           u"or {1} hours if {2} frames are excluded.".format(
             "%.1f" % hours_total, "%.1f" % hours_nonsil, optional_silence_phone_text))
 
-    opt_sil_internal_phone_percent = (sum(internal_opt_sil_phone_lengths.values()) *
+    opt_sil_internal_phone_percent = (int(internal_opt_sil_phone_lengths.totals()[0]) *
                                       100.0 / total_phones['internal'])
-    duration_median = GetPercentile(internal_opt_sil_phone_lengths, 0.5)
-    duration_mean = GetMean(internal_opt_sil_phone_lengths)
-    duration_percentile_95 = GetPercentile(internal_opt_sil_phone_lengths, 0.95)
+    duration_median = int(internal_opt_sil_phone_lengths.percentiles(0.5)[0])
+    duration_mean = float(internal_opt_sil_phone_lengths.means()[0])
+    duration_percentile_95 = int(internal_opt_sil_phone_lengths.percentiles(0.95)[0])
     print(u"Utterance-internal optional-silences {0} comprise {1}% of utterance-internal phones, with duration "
           u"(median, mean, 95-percentile) = ({2},{3},{4})".format(
                 optional_silence_phone_text, "%.1f" % opt_sil_internal_phone_percent,
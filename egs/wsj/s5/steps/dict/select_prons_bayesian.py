@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2016  Xiaohui Zhang
 # Apache 2.0.
@@ -10,6 +10,11 @@ import argparse
 import sys
 import math
 
+import numpy as np
+
+sys.path.insert(0, 'steps')
+import libs.pron_stats as pron_stats_lib
+
 def GetArgs():
     parser = argparse.ArgumentParser(description = "Use a Bayesian framework to select"
                                      "pronunciation candidates from three sources: reference lexicon"
@@ -206,53 +211,37 @@ def ComputePosteriors(args, stats, ref_lexicon, g2p_lexicon, phonetic_decoding_l
     # pairs for each word, where the posteriors are normalized soft counts. Before normalization,
     # The soft-counts were augmented by a user-specified prior count, according the source 
     # (ref/G2P/phonetic-decoding) of this pronunciation.
+    candidates = pron_stats_lib.PronCandidates(
+        [ref_lexicon, g2p_lexicon, phonetic_decoding_lexicon], stats)
 
-    for word, prons in ref_lexicon.items():
-        for pron in prons:
-            # c is the augmented soft count (observed count + prior count)
-            c = float(prior_counts[word][0]) / len(ref_lexicon[word]) + stats.get((word, pron), 0)
-            posteriors[word].append((pron, c))
-
-    for word, prons in g2p_lexicon.items():
-        for pron in prons:
-            c = float(prior_counts[word][1]) / len(g2p_lexicon[word]) + stats.get((word, pron), 0)
-            posteriors[word].append((pron, c))
-
-    for word, prons in phonetic_decoding_lexicon.items():
-        for pron in prons:
-            c = float(prior_counts[word][2]) / len(phonetic_decoding_lexicon[word]) + stats.get((word, pron), 0)
-            posteriors[word].append((pron, c))
-
-    num_prons_from_ref = sum(len(ref_lexicon[i]) for i in ref_lexicon)
-    num_prons_from_g2p = sum(len(g2p_lexicon[i]) for i in g2p_lexicon)
-    num_prons_from_phonetic_decoding = sum(len(phonetic_decoding_lexicon[i]) for i in phonetic_decoding_lexicon)
+    num_prons = candidates.num_prons_per_source().sum(axis=0)
+    num_prons_from_ref = num_prons[0]
+    num_prons_from_g2p = num_prons[1]
+    num_prons_from_phonetic_decoding = num_prons[2]
     print ("---------------------------------------------------------------------------------------------------", file=sys.stderr)
-    print ('Total num. words is {}:'.format(len(posteriors)), file=sys.stderr)
+    print ('Total num. words is {}:'.format(len(candidates.word_list)), file=sys.stderr)
     print ('{0} candidate prons came from the reference lexicon; {1} came from G2P;{2} came from'
            'phonetic_decoding'.format(num_prons_from_ref, num_prons_from_g2p, num_prons_from_phonetic_decoding), file=sys.stderr)
     print ("---------------------------------------------------------------------------------------------------", file=sys.stderr)
 
     # Normalize the augmented soft counts to get posteriors.
-    count_sum = defaultdict(float) # This dict stores the pronunciation which has 
-    # the sum of augmented soft counts for each word.
-    
-    for word in posteriors:
-        # each entry is a pair: (prounciation, count)
-        count_sum[word] = sum([entry[1] for entry in posteriors[word]])
-    
-    for word, entry in posteriors.items():
-        new_entry = []
-        for pron, count in entry:      
-            post = float(count) / count_sum[word]
-            new_entry.append((pron, post))
+    prior_counts = np.array([prior_counts[word] for word in candidates.word_list],
+                            dtype=np.float64).reshape(-1, 3)
+    posts = candidates.posteriors(prior_counts).tolist()
+    entries = [[] for word in candidates.word_list]
+    for word_index, word, pron, post in zip(candidates.word_indexes.tolist(), candidates.words,
+                                            candidates.prons, posts):
+        entries[word_index].append((pron, post))
+
+    for word, entry in zip(candidates.word_list, entries):
+        for pron, post in entry:
             source = 'R'
             if word in g2p_lexicon and pron in g2p_lexicon[word]:
                 source = 'G'
             elif word in phonetic_decoding_lexicon and pron in phonetic_decoding_lexicon[word]:
                 source = 'P'
             print(word, source, "%3.2f" % post, pron, file=args.pron_posteriors_handle)
-        del entry[:]
-        entry.extend(sorted(new_entry, key=lambda new_entry: new_entry[1]))
+        posteriors[word] = sorted(entry, key=lambda new_entry: new_entry[1])
     return posteriors
 
 def SelectPronsBayesian(args, counts, posteriors, ref_lexicon, g2p_lexicon, phonetic_decoding_lexicon):
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2018  Xiaohui Zhang
 # Apache 2.0.
@@ -9,6 +9,10 @@ import argparse
 import sys
 import math
 
+sys.path.insert(0, 'steps')
+import libs.common as common_lib
+import libs.pron_stats as pron_stats_lib
+
 def GetArgs():
     parser = argparse.ArgumentParser(
         description = "Use a greedy framework to select pronunciation candidates"
@@ -38,6 +42,8 @@ def GetArgs():
                         help = "Floor value of the pronunciation posterior statistics."
                         "The valid range is (0, 0.01),"
                         "See Section 3 in the paper for details.")
+    parser.add_argument("--num-jobs", type = int, default = 1,
+                        help = "Number of processes among which the words are divided.")
     parser.add_argument("silence_phones_file", metavar = "<silphone-file>", type = str,
                         help = "File containing a list of silence phones.")
     parser.add_argument("arc_stats_file", metavar = "<arc-stats-file>", type = str,
@@ -115,28 +121,6 @@ def CheckArgs(args):
 
     return args
 
-def ReadArcStats(arc_stats_file_handle):
-    stats = defaultdict(lambda : defaultdict(dict))
-    stats_summed = defaultdict(float)
-    for line in arc_stats_file_handle.readlines():
-        splits = line.strip().split()
-
-        if (len(splits) == 0):
-            continue
-
-        if (len(splits) < 5):
-            raise Exception('Invalid format of line ' + line
-                                + ' in ' + arc_stats_file)
-        utt = splits[1]
-        start_frame = int(splits[2])
-        word = splits[0]
-        count = float(splits[3])
-        phones = splits[4:]
-        phones = ' '.join(phones)
-        stats[word][(utt, start_frame)][phones] = count
-        stats_summed[(word, phones)] += count
-    return stats, stats_summed
-
 def ReadWordCounts(word_counts_file_handle):
     counts = {}
     for line in word_counts_file_handle.readlines():
@@ -173,7 +157,7 @@ def FilterPhoneticDecodingLexicon(args, pd_lexicon):
     for line in args.silence_phones_file_handle:
         silphones.add(line.strip())
     rejected_candidates = set()
-    for word, prons in pd_lexicon.iteritems():
+    for word, prons in pd_lexicon.items():
         for pron in prons:
             for phone in pron.split():
                 if phone in silphones:
@@ -183,31 +167,140 @@ def FilterPhoneticDecodingLexicon(args, pd_lexicon):
         pd_lexicon[word].remove(pron)
     return pd_lexicon
 
-# One iteration of Expectation-Maximization computation (Eq. 3-4 in the paper).
-def OneEMIter(args, word, stats, prons, pron_probs, debug=False):
-    prob_acc = [0.0 for i in range(len(prons[word]))]
-    s = sum(pron_probs)
-    for i in range(len(pron_probs)):
-        pron_probs[i] = pron_probs[i] / s
-    log_like = 0.0
-    for (utt, start_frame) in stats[word]:
-        prob = []
-        soft_counts = []
-        for i in range(len(prons[word])):
-            phones = prons[word][i]
-            soft_count = stats[word][(utt, start_frame)].get(phones, 0)
-            if soft_count < args.delta: 
-                soft_count = args.delta
-            soft_counts.append(soft_count)
-        prob = [i[0] * i[1] for i in zip(soft_counts, pron_probs)]
-        for i in range(len(prons[word])):
-            prob_acc[i] += prob[i] / sum(prob)
-        log_like += math.log(sum(prob))
-    pron_probs = [1.0 / float(len(stats[word])) * p for p in prob_acc]
-    log_like = 1.0 / float(len(stats[word])) * log_like
-    if debug:
-        print("Log_like of the word: ", log_like, "pron probs: ", pron_probs)
-    return pron_probs, log_like
+# These are set in the worker processes by InitWorker().
+_global_args = None
+_global_stats = None
+
+def InitWorker(args, stats):
+    global _global_args, _global_stats
+    _global_args = args
+    _global_stats = stats
+
+def SelectPronsOfWord(args, word, prons, sources, soft_counts, dianostic_info=False):
+    # Returns the indexes (into prons) of the pronunciations of the word that are selected.
+    # sources are the sources of the prons and soft_counts are their soft counts in each
+    # example of the word, as returned by pron_stats_lib.ArcStats.soft_counts().
+    num_examples = soft_counts.shape[0]
+    n = len(prons)
+    pron_probs = [1/float(n) for i in range(n)]
+    if dianostic_info:
+        print("pronunciations of word '{}': {}".format(word, prons))
+    active_indexes = set(range(len(prons)))
+
+    deleted_prons = [] # indexes of prons to be deleted
+    soft_counts_normalized = []
+    while len(active_indexes) > 1:
+        # Running EM (Eq. 3-4 in the paper) until convengence
+        pron_probs, log_like, num_iters, first_pron_probs = pron_stats_lib.run_em(
+            soft_counts, pron_probs, 1e-7)
+        pron_probs = pron_probs[0].tolist()
+        log_like = float(log_like[0])
+        num_iters = int(num_iters[0])
+        if len(soft_counts_normalized) == 0: # the first iteration
+            soft_counts_normalized = first_pron_probs[0].tolist()
+            if dianostic_info:
+                print("Avg.(over all egs) soft counts: {}".format(soft_counts_normalized))
+        if dianostic_info:
+            print("\n Log_like after {} iters of EM: {}, estimated pron_probs: {} \n".format(
+                    num_iters, log_like, pron_probs))
+        candidates_to_delete = []
+
+        # For each active pron, set its pron_prob to zero and run EM again; this is done
+        # for all the active prons at once.
+        indexes = sorted(active_indexes)
+        pron_probs_mod = []
+        for i in indexes:
+            probs = [p for p in pron_probs]
+            probs[i] = 0.0
+            for j in range(len(probs)):
+                if j in active_indexes and j != i:
+                    probs[j] += 0.01
+            pron_probs_mod.append([s / sum(probs) for s in probs])
+        pron_probs_mod, log_likes2, num_iters2, _ = pron_stats_lib.run_em(
+            soft_counts, pron_probs_mod, 0.001)
+
+        log_delta = math.log(args.delta)
+        for k, i in enumerate(indexes):
+            loss_abs = log_like - float(log_likes2[k]) # absolute likelihood loss before normalization
+            # (supposed to be positive, but could be negative near zero because of numerical precision limit).
+            thr = -log_delta
+            loss = loss_abs
+            source = sources[i]
+            if dianostic_info:
+                print("\n set the pron_prob of '{}' whose source is {}, to zero results in {}"
+                " loss in avg. log-likelihood; Num. iters until converging:{}. ".format(
+                  prons[i], source, loss, num_iters2[k]))
+            # Compute quality score q_b = loss_abs * / (M_w + beta_s(b)) + alpha_s(b) * log_delta
+            # See Sec. 4.3 and Alg. 1 in the paper.
+            if source == 'P':
+               thr *= args.alpha[0]
+               loss *= float(num_examples) / (float(num_examples) + args.beta[0])
+            if source == 'G':
+               thr *= args.alpha[1]
+               loss *= float(num_examples) / (float(num_examples) + args.beta[1])
+            if source == 'R':
+               thr *= args.alpha[2]
+               loss *= float(num_examples) / (float(num_examples) + args.beta[2])
+            if loss - thr < 0: # loss - thr here is just q_b
+               if dianostic_info:
+                   print("Smoothed log-like loss {} is smaller than threshold {} so that the quality"
+                         "score {} is negative, adding the pron to the list of candidates to delete"
+                         ". ".format(loss, thr, loss-thr))
+               candidates_to_delete.append((loss-thr, i))
+        if len(candidates_to_delete) == 0:
+            break
+        candidates_to_delete_sorted = sorted(candidates_to_delete, 
+                                             key=lambda candidates_to_delete: candidates_to_delete[0])
+
+        deleted_candidate = candidates_to_delete_sorted[0]
+        active_indexes.remove(deleted_candidate[1])
+        pron_probs[deleted_candidate[1]] = 0.0
+        for i in range(len(pron_probs)):
+            if i in active_indexes:
+                pron_probs[i] += 0.01
+        pron_probs = [s / sum(pron_probs) for s in pron_probs]
+        source = sources[deleted_candidate[1]]
+        pron = prons[deleted_candidate[1]]
+        soft_count = soft_counts_normalized[deleted_candidate[1]]
+        quality_score = deleted_candidate[0]
+        # This part of diagnostic info provides hints to the user on how to adjust the parameters.
+        if dianostic_info:
+            print("removed pron {}, from source {} with quality score {:.5f}".format(
+                    pron, source, quality_score)) 
+            if (source == 'P' and soft_count > 0.7 and num_examples > 5):
+                print("WARNING: alpha_{pd} or beta_{pd} may be too large!"
+                      "    For the word '{}' whose count is {}, the candidate "
+                      "    pronunciation from phonetic decoding '{}' with normalized "
+                      "    soft count {} (out of 1) is rejected. It shouldn't have been"
+                      "    rejected if alpha_{pd} is smaller than {}".format(
+                        word, num_examples, pron, soft_count, -loss / log_delta, 
+                        -args.alpha[0] * num_examples + (objf_change + args.beta[0])),
+                        file=sys.stderr)
+                if loss_abs > thr:
+                    print("    or beta_{pd} is smaller than {}".format(
+                            (loss_abs / thr - 1) * num_examples), file=sys.stderr)
+            if (source == 'G' and soft_count > 0.7 and num_examples > 5):
+                print("WARNING: alpha_{g2p} or beta_{g2p} may be too large!"
+                      "    For the word '{}' whose count is {}, the candidate "
+                      "    pronunciation from G2P '{}' with normalized "
+                      "    soft count {} (out of 1) is rejected. It shouldn't have been"
+                      "    rejected if alpha_{g2p} is smaller than {} ".format(
+                        word, num_examples, pron, soft_count, -loss / log_delta, 
+                        -args.alpha[1] * num_examples + (objf_change + args.beta[1])),
+                      file=sys.stderr)
+                if loss_abs > thr:
+                    print("    or beta_{g2p} is smaller than {}.".format((
+                            loss_abs / thr - 1) * num_examples), file=sys.stderr)
+        deleted_prons.append(deleted_candidate[1])
+    return [i for i in range(len(prons)) if i not in deleted_prons]
+
+def ProcessWords(tasks):
+    results = []
+    for word, prons, sources in tasks:
+        soft_counts = _global_stats.soft_counts(word, prons, _global_args.delta)
+        results.append(SelectPronsOfWord(_global_args, word, prons, sources,
+                                         soft_counts))
+    return results
 
 def SelectPronsGreedy(args, stats, counts, ref_lexicon, g2p_lexicon, pd_lexicon, dianostic_info=False):
     prons = defaultdict(list) # Put all possible prons from three source lexicons into this dictionary
@@ -225,132 +318,39 @@ def SelectPronsGreedy(args, stats, counts, ref_lexicon, g2p_lexicon, pd_lexicon,
                 src[(word, pron)] = 'G'
             if word in ref_lexicon and pron in ref_lexicon[word]:
                 src[(word, pron)] = 'R'
-   
-    for word in prons:
-        if word not in stats:
-            continue
-        n = len(prons[word])
-        pron_probs = [1/float(n) for i in range(n)]
-        if dianostic_info:
-            print("pronunciations of word '{}': {}".format(word, prons[word]))
-        active_indexes = set(range(len(prons[word])))
-       
-        deleted_prons = [] # indexes of prons to be deleted
-        soft_counts_normalized = []
-        while len(active_indexes) > 1:
-            log_like = 1.0
-            log_like_last = -1.0
-            num_iters = 0
-            while abs(log_like - log_like_last) > 1e-7:
-                num_iters += 1
-                log_like_last = log_like
-                pron_probs, log_like = OneEMIter(args, word, stats, prons, pron_probs, False)
-                if log_like_last == 1.0 and len(soft_counts_normalized) == 0: # the first iteration
-                    soft_counts_normalized = pron_probs
-                    if dianostic_info: 
-                        print("Avg.(over all egs) soft counts: {}".format(soft_counts_normalized))
-            if dianostic_info:
-                print("\n Log_like after {} iters of EM: {}, estimated pron_probs: {} \n".format(
-                        num_iters, log_like, pron_probs))
-            candidates_to_delete = []
-            
-            for i in active_indexes:
-                pron_probs_mod = [p for p in pron_probs]
-                pron_probs_mod[i] = 0.0
-                for j in range(len(pron_probs_mod)):
-                    if j in active_indexes and j != i:
-                        pron_probs_mod[j] += 0.01
-                pron_probs_mod = [s / sum(pron_probs_mod) for s in pron_probs_mod]
-                log_like2 = 1.0
-                log_like2_last = -1.0
-                num_iters2 = 0
-                # Running EM until convengence
-                while abs(log_like2 - log_like2_last) > 0.001 :
-                    num_iters2 += 1
-                    log_like2_last = log_like2
-                    pron_probs_mod, log_like2 = OneEMIter(args, word, stats,
-                                                          prons, pron_probs_mod, False)
-                
-                loss_abs = log_like - log_like2 # absolute likelihood loss before normalization
-                # (supposed to be positive, but could be negative near zero because of numerical precision limit).
-                log_delta = math.log(args.delta)
-                thr = -log_delta
-                loss = loss_abs
-                source = src[(word, prons[word][i])]
-                if dianostic_info:
-                    print("\n set the pron_prob of '{}' whose source is {}, to zero results in {}"
-                    " loss in avg. log-likelihood; Num. iters until converging:{}. ".format(
-                      prons[word][i], source, loss, num_iters2))
-                # Compute quality score q_b = loss_abs * / (M_w + beta_s(b)) + alpha_s(b) * log_delta
-                # See Sec. 4.3 and Alg. 1 in the paper.
-                if source == 'P':
-                   thr *= args.alpha[0]
-                   loss *= float(len(stats[word])) / (float(len(stats[word])) + args.beta[0])
-                if source == 'G':
-                   thr *= args.alpha[1]
-                   loss *= float(len(stats[word])) / (float(len(stats[word])) + args.beta[1])
-                if source == 'R':
-                   thr *= args.alpha[2]
-                   loss *= float(len(stats[word])) / (float(len(stats[word])) + args.beta[2])
-                if loss - thr < 0: # loss - thr here is just q_b
-                   if dianostic_info:
-                       print("Smoothed log-like loss {} is smaller than threshold {} so that the quality"
-                             "score {} is negative, adding the pron to the list of candidates to delete"
-                             ". ".format(loss, thr, loss-thr))
-                   candidates_to_delete.append((loss-thr, i))
-            if len(candidates_to_delete) == 0:
-                break
-            candidates_to_delete_sorted = sorted(candidates_to_delete, 
-                                                 key=lambda candidates_to_delete: candidates_to_delete[0])
 
-            deleted_candidate = candidates_to_delete_sorted[0]
-            active_indexes.remove(deleted_candidate[1])
-            pron_probs[deleted_candidate[1]] = 0.0
-            for i in range(len(pron_probs)):
-                if i in active_indexes:
-                    pron_probs[i] += 0.01
-            pron_probs = [s / sum(pron_probs) for s in pron_probs]
-            source = src[(word, prons[word][deleted_candidate[1]])]
-            pron = prons[word][deleted_candidate[1]]
-            soft_count = soft_counts_normalized[deleted_candidate[1]]
-            quality_score = deleted_candidate[0]
-            # This part of diagnostic info provides hints to the user on how to adjust the parameters.
-            if dianostic_info:
-                print("removed pron {}, from source {} with quality score {:.5f}".format(
-                        pron, source, quality_score)) 
-                if (source == 'P' and soft_count > 0.7 and len(stats[word]) > 5):
-                    print("WARNING: alpha_{pd} or beta_{pd} may be too large!"
-                          "    For the word '{}' whose count is {}, the candidate "
-                          "    pronunciation from phonetic decoding '{}' with normalized "
-                          "    soft count {} (out of 1) is rejected. It shouldn't have been"
-                          "    rejected if alpha_{pd} is smaller than {}".format(
-                            word, len(stats[word]), pron, soft_count, -loss / log_delta, 
-                            -args.alpha[0] * len(stats[word]) + (objf_change + args.beta[0])),
-                            file=sys.stderr)
-                    if loss_abs > thr:
-                        print("    or beta_{pd} is smaller than {}".format(
-                                (loss_abs / thr - 1) * len(stats[word])), file=sys.stderr)
-                if (source == 'G' and soft_count > 0.7 and len(stats[word]) > 5):
-                    print("WARNING: alpha_{g2p} or beta_{g2p} may be too large!"
-                          "    For the word '{}' whose count is {}, the candidate "
-                          "    pronunciation from G2P '{}' with normalized "
-                          "    soft count {} (out of 1) is rejected. It shouldn't have been"
-                          "    rejected if alpha_{g2p} is smaller than {} ".format(
-                            word, len(stats[word]), pron, soft_count, -loss / log_delta, 
-                            -args.alpha[1] * len(stats[word]) + (objf_change + args.beta[1])),
-                          file=sys.stderr)
-                    if loss_abs > thr:
-                        print("    or beta_{g2p} is smaller than {}.".format((
-                                loss_abs / thr - 1) * len(stats[word])), file=sys.stderr)
-            deleted_prons.append(deleted_candidate[1])
-        for i in range(len(prons[word])):
-            if i not in deleted_prons:
-                learned_lexicon[word].add(prons[word][i])
+    tasks = [(word, prons[word], [src[(word, pron)] for pron in prons[word]])
+             for word in prons if word in stats]
+    if args.num_jobs > 1 and not dianostic_info:
+        # The words are processed independently, in parallel, in batches; the
+        # results come back in the order of the words.  The workers only get
+        # the options SelectPronsOfWord() uses, not args, which holds open
+        # file handles.
+        worker_args = argparse.Namespace(alpha=args.alpha, beta=args.beta,
+                                         delta=args.delta)
+        batch_size = max(1, len(tasks) // (args.num_jobs * 16))
+        batches = [tasks[i:i + batch_size]
+                   for i in range(0, len(tasks), batch_size)]
+        results = []
+        for batch_results in common_lib.map_in_order(
+                ProcessWords, batches, num_jobs=args.num_jobs,
+                initializer=InitWorker, initargs=(worker_args, stats)):
+            results.extend(batch_results)
+    else:
+        results = []
+        for word, prons_of_word, sources in tasks:
+            soft_counts = stats.soft_counts(word, prons_of_word, args.delta)
+            results.append(SelectPronsOfWord(args, word, prons_of_word, sources,
+                                             soft_counts, dianostic_info))
+
+    for (word, prons_of_word, sources), selected in zip(tasks, results):
+        for i in selected:
+            learned_lexicon[word].add(prons_of_word[i])
 
     return learned_lexicon
 
 def WriteLearnedLexicon(learned_lexicon, file_handle):
-    for word, prons in learned_lexicon.iteritems():
+    for word, prons in learned_lexicon.items():
         for pron in prons:
             print('{0} {1}'.format(word, pron), file=file_handle)
     file_handle.close()
@@ -363,7 +363,7 @@ def Main():
     ref_lexicon = ReadLexicon(args, args.ref_lexicon_handle, counts)
     g2p_lexicon = ReadLexicon(args, args.g2p_lexicon_handle, counts)
     pd_lexicon =  ReadLexicon(args, args.pd_lexicon_handle, counts)
-    stats, stats_summed = ReadArcStats(args.arc_stats_file_handle)
+    stats = pron_stats_lib.read_arc_stats(args.arc_stats_file_handle, args.arc_stats_file)
     pd_lexicon = FilterPhoneticDecodingLexicon(args, pd_lexicon)
                   
     # Select prons to construct the learned lexicon.
@@ -0,0 +1,61 @@
+# Apache 2.0.
+
+""" This module contains streaming reading and writing of ARPA language
+models, shared by utils/lang/limit_arpa_unk_history.py and
+utils/reverse_arpa.py, so that an ARPA file never has to be held in memory as
+a whole.
+
+The input is read in chunks of lines, which can be processed by several
+processes with libs.common.map_in_order().  The n-gram counts in the \\data\\
+header are only known once all the n-grams have been processed, so
+SpooledArpaWriter keeps the first lines of the output in memory and the rest
+in a temporary file, and writes the header, with the counts patched in, when
+it is closed; the input is only read once.
+"""
+
+import itertools
+import shutil
+import tempfile
+
+
+def read_line_chunks(stream, chunk_size):
+    """Yields the lines of 'stream' in lists of 'chunk_size' lines (the last
+    one may be shorter)."""
+    while True:
+        lines = list(itertools.islice(stream, chunk_size))
+        if len(lines) == 0:
+            break
+        yield lines
+
+
+class SpooledArpaWriter(object):
+    """Writes an ARPA language model (or any text whose first lines are only
+    known at the end) to 'out_stream'.  The first 'num_head_lines' lines that
+    are written are kept in the list self.head_lines, and the rest go to a
+    temporary file (in 'temp_dir', if specified).  close(head_lines) writes
+    'head_lines' (normally a modified self.head_lines) to 'out_stream',
+    followed by the contents of the temporary file."""
+
+    def __init__(self, out_stream, num_head_lines=0, temp_dir=None,
+                 encoding='utf-8'):
+        self.out_stream = out_stream
+        self.num_head_lines = num_head_lines
+        self.head_lines = []
+        self.spool = tempfile.TemporaryFile(mode='w+', encoding=encoding,
+                                            newline='', dir=temp_dir)
+
+    def write(self, text):
+        """Writes 'text', which must consist of whole lines."""
+        if len(self.head_lines) < self.num_head_lines:
+            lines = text.splitlines(True)
+            num_lines = self.num_head_lines - len(self.head_lines)
+            self.head_lines.extend(lines[:num_lines])
+            text = ''.join(lines[num_lines:])
+        self.spool.write(text)
+
+    def close(self, head_lines):
+        self.out_stream.writelines(head_lines)
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, self.out_stream)
+        self.spool.close()
+        self.out_stream.flush()
@@ -0,0 +1,318 @@
+# Copyright 2016  Johns Hopkins University (Author: Daniel Povey)
+# Apache 2.0.
+
+""" This module contains the estimation of the small biased language models
+used in data cleanup, which are backoff language models estimated on a few
+utterances of integerized text and written as text-form FSTs.  It is shared
+by steps/cleanup/internal/make_one_biased_lm.py, which makes one such LM, and
+steps/cleanup/make_biased_lms.py, which makes one for each group of
+utterances of its input without starting a process per group.
+"""
+
+from __future__ import print_function
+from __future__ import division
+import math
+import sys
+from collections import defaultdict
+
+
+def add_biased_lm_options(parser):
+    """Adds the options that control the estimation of the biased LM to the
+    argparse parser 'parser'."""
+    parser.add_argument("--word-disambig-symbol", type = int, required = True,
+                        help = "Integer corresponding to the disambiguation "
+                        "symbol (normally #0) for backoff arcs")
+    parser.add_argument("--ngram-order", type = int, default = 4,
+                        choices = [2,3,4,5,6,7],
+                        help = "Maximum order of n-gram to use (but see also "
+                        "--min-lm-state-count; the effective order may be less.")
+    parser.add_argument("--min-lm-state-count", type = int, default = 10,
+                        help = "Minimum count below which we will completely "
+                        "discount an LM-state (if it is of order > 2, i.e. "
+                        "history-length > 1).")
+    parser.add_argument("--top-words", type = str,
+                        help = "File containing frequent words and probabilities to be added into "
+                        "the language model, with lines in the format '<integer-id-of-word> <prob>'. "
+                        "These probabilities will be added to the probabilities in the unigram "
+                        "backoff state and then renormalized; this option allows you to introduce "
+                        "common words to the LM with specified probabilities.")
+    parser.add_argument("--discounting-constant", type = float, default = 0.3,
+                        help = "Discounting constant D for standard (unmodified) Kneser-Ney; "
+                        "must be strictly between 0 and 1.  A value closer to 0 will give "
+                        "you a more-strongly-biased LM.")
+    parser.add_argument("--verbose", type = int, default = 0,
+                        choices=[0,1,2,3,4,5], help = "Verbose level")
+
+
+def read_top_words(top_words_file):
+    """Reads the --top-words file, with lines '<integer-id-of-word> <prob>',
+    and returns a list of (word, prob) pairs in the order of the file."""
+    try:
+        f = open(top_words_file, mode='r', encoding='utf-8')
+    except:
+        sys.exit("make_one_biased_lm.py: error opening top-words file: "
+                 "--top-words=" + top_words_file)
+    top_words = []
+    while True:
+        line = f.readline()
+        if line == '':
+            break
+        try:
+            [ word_index, prob ] = line.split()
+            word_index = int(word_index)
+            prob = float(prob)
+            assert word_index > 0 and prob > 0.0
+            top_words.append((word_index, prob))
+        except Exception as e:
+            sys.exit("make_one_biased_lm.py: could not make sense of the "
+                     "line '{0}' in op-words file: {1} ".format(line, str(e)))
+    f.close()
+    return top_words
+
+
+class NgramCounts(object):
+    """The n-gram counts of a biased LM.
+
+    A note on data-structure.  Firstly, all words are represented as
+    integers.  We store n-gram counts as an array, indexed by
+    (history-length == n-gram order minus one) (note: python calls arrays
+    "lists") of dicts from histories to counts, where histories are arrays of
+    integers and "counts" are dicts from integer to float.  For instance, when
+    accumulating the 4-gram count for the '8' in the sequence '5 6 7 8', we'd
+    do as follows:
+        self.counts[3][[5,6,7]][8] += 1.0
+    where the [3] indexes an array, the [[5,6,7]] indexes a dict, and the [8]
+    indexes a dict.
+    """
+
+    def __init__(self, ngram_order):
+        self.ngram_order = ngram_order
+        # Integerized counts will never contain negative numbers, so
+        # inside this program, we use -3 and -2 for the BOS and EOS symbols
+        # respectively.
+        # Note: it's actually important that the bos-symbol is the most negative;
+        # it helps ensure that we print the state with left-context <s> first
+        # when we print the FST, and this means that the start-state will have
+        # the correct value.
+        self.bos_symbol = -3
+        self.eos_symbol = -2
+        # backoff_symbol is kind of a pseudo-word, it's used in keeping track of
+        # the backoff counts in each state.
+        self.backoff_symbol = -1
+        self.counts = []
+        for n in range(ngram_order):
+            # If we index self.counts[n][history] for a history-length n <
+            # ngram_order and a previously unseen history, it will create a
+            # new defaultdict that defaults to 0.0 [since the function float()
+            # will return 0.0].  This means that we can index self.counts
+            # without worrying about undefined values.
+            self.counts.append(defaultdict(lambda: defaultdict(float)))
+
+    def add_count(self, history, predicted_word, count):
+        """Adds a raw count (called while processing input data).  Suppose we
+        see the sequence '6 7 8 9' and ngram_order=4, 'history' would be
+        (6,7,8) and 'predicted_word' would be 9; 'count' would be 1.0."""
+        self.counts[len(history)][history][predicted_word] += count
+
+    def add_raw_counts_from_line(self, line):
+        """Adds the un-smoothed counts from 'line', a string containing a
+        sequence of integer word-ids.  Raises ValueError if it is not such a
+        sequence."""
+        try:
+            words = [self.bos_symbol] + [ int(x) for x in line.split() ] + [self.eos_symbol]
+        except ValueError:
+            raise ValueError("bad input line {0} (expected a sequence "
+                             "of integers)".format(line.rstrip('\n')))
+
+        for n in range(1, len(words)):
+            predicted_word = words[n]
+            history_start = max(0, n + 1 - self.ngram_order)
+            history = tuple(words[history_start:n])
+            self.add_count(history, predicted_word, 1.0)
+
+    def get_hist_to_total_count(self):
+        """Returns a dict from history (as a tuple of integers of length > 1,
+        ignoring lower-order histories), to the total count of this history
+        state plus all history-states which back off to this history state.
+        It's used inside completely_discount_low_count_states()."""
+        ans = defaultdict(float)
+        for n in range(2, self.ngram_order):
+            for hist, word_to_count in self.counts[n].items():
+                total_count = sum(word_to_count.values())
+                while len(hist) >= 2:
+                    ans[hist] += total_count
+                    hist = hist[1:]
+        return ans
+
+    def completely_discount_low_count_states(self, min_count):
+        """Completely discounts the counts in any LM-states of order > 2 (i.e.
+        history-length > 1) that have total count below 'min_count'; when
+        computing the total counts, we include higher-order LM-states that
+        would back off to 'this' lm-state, in the total."""
+        hist_to_total_count = self.get_hist_to_total_count()
+        for n in reversed(list(range(2, self.ngram_order))):
+            this_order_counts = self.counts[n]
+            to_delete = []
+            for hist in this_order_counts.keys():
+                if hist_to_total_count[hist] < min_count:
+                    # we need to completely back off this count.
+                    word_to_count = this_order_counts[hist]
+                    # mark this key for deleting
+                    to_delete.append(hist)
+                    backoff_hist = hist[1:]  # this will be a tuple not a list.
+                    for word, count in word_to_count.items():
+                        self.add_count(backoff_hist, word, count)
+            for hist in to_delete:
+                del this_order_counts[hist]
+
+    def apply_backoff(self, D):
+        """Backs off the counts according to Kneser-Ney (unmodified, with
+        interpolation) with discounting constant D."""
+        assert D > 0.0 and D < 1.0
+        for n in reversed(list(range(1, self.ngram_order))):
+            this_order_counts = self.counts[n]
+            for hist, word_to_count in this_order_counts.items():
+                backoff_hist = hist[1:]
+                backoff_word_to_count = self.counts[n-1][backoff_hist]
+                this_discount_total = 0.0
+                for word in word_to_count:
+                    assert word_to_count[word] >= 1.0
+                    word_to_count[word] -= D
+                    this_discount_total += D
+                    # Interpret the following line as incrementing the
+                    # count-of-counts for the next-lower order.
+                    backoff_word_to_count[word] += 1.0
+                word_to_count[self.backoff_symbol] += this_discount_total
+
+    def print_counts(self, info_string):
+        """Prints out to stderr the n-gram counts; it's used for debugging."""
+        print(info_string, file=sys.stderr)
+        # these are useful for debug.
+        total = 0.0
+        total_excluding_backoff = 0.0
+        for this_order_counts in self.counts:
+            for hist, word_to_count in this_order_counts.items():
+                this_total_count = sum(word_to_count.values())
+                print('{0}: total={1} '.format(hist, this_total_count),
+                      end='', file=sys.stderr)
+                print(' '.join(['{0} -> {1} '.format(word, count)
+                                for word, count in word_to_count.items() ]),
+                      file = sys.stderr)
+                total += this_total_count
+                total_excluding_backoff += this_total_count
+                if self.backoff_symbol in word_to_count:
+                    total_excluding_backoff -= word_to_count[self.backoff_symbol]
+        print('total count = {0}, excluding discount = {1}'.format(
+                total, total_excluding_backoff), file = sys.stderr)
+
+    def add_top_words(self, top_words):
+        """Adds the probabilities of the list of (word, prob) pairs
+        'top_words' (see read_top_words()) to the unigram state, as counts
+        relative to its total count."""
+        empty_history = ()
+        word_to_count = self.counts[0][empty_history]
+        total = sum(word_to_count.values())
+        for word_index, prob in top_words:
+            word_to_count[word_index] += prob * total
+
+    def get_total_count_map(self):
+        """Returns a map from history to the total-count for that state."""
+        total_count_map = dict()
+        for n in range(0, self.ngram_order):
+            for hist, word_to_count in self.counts[n].items():
+                total_count_map[hist] = sum(word_to_count.values())
+        return total_count_map
+
+    def get_hist_to_state_map(self):
+        """Returns a map from history to integer FST-state."""
+        hist_to_state = dict()
+        fst_state_counter = 0
+        for n in range(0, self.ngram_order):
+            for hist in self.counts[n].keys():
+                hist_to_state[hist] = fst_state_counter
+                fst_state_counter += 1
+        return hist_to_state
+
+    def get_prob(self, hist, word, total_count_map):
+        total_count = total_count_map[hist]
+        word_to_count = self.counts[len(hist)][hist]
+        prob = float(word_to_count[word]) / total_count
+        if len(hist) > 0 and word != self.backoff_symbol:
+            prob_in_backoff = self.get_prob(hist[1:], word, total_count_map)
+            backoff_prob = float(word_to_count[self.backoff_symbol]) / total_count
+            prob += backoff_prob * prob_in_backoff
+        return prob
+
+    def fst_lines(self, word_disambig_symbol):
+        """Returns the estimated language model as a list of the lines
+        (without newlines) of a text-form FST."""
+        # n is the history-length (== order + 1).  We iterate over the
+        # history-length in the order 1, 0, 2, 3, and then iterate over the
+        # histories of each order in sorted order.  Putting order 1 first
+        # and sorting on the histories
+        # ensures that the bigram state with <s> as the left context comes first.
+        # (note: self.bos_symbol is the most negative symbol)
+
+        # History will map from history (as a tuple) to integer FST-state.
+        hist_to_state = self.get_hist_to_state_map()
+        total_count_map = self.get_total_count_map()
+        lines = []
+
+        for n in [ 1, 0 ] + list(range(2, self.ngram_order)):
+            this_order_counts = self.counts[n]
+            # For order 1, make sure the keys are sorted.
+            keys = this_order_counts.keys() if n != 1 else sorted(this_order_counts.keys())
+            for hist in keys:
+                word_to_count = this_order_counts[hist]
+                this_fst_state = hist_to_state[hist]
+
+                for word in word_to_count.keys():
+                    # work out this_cost.  Costs in OpenFst are negative logs.
+                    this_cost = -math.log(self.get_prob(hist, word, total_count_map))
+
+                    if word > 0: # a real word.
+                        next_hist = hist + (word,)  # appending tuples
+                        while not next_hist in hist_to_state:
+                            next_hist = next_hist[1:]
+                        next_fst_state = hist_to_state[next_hist]
+                        lines.append('{0} {1} {2} {2} {3}'.format(
+                            this_fst_state, next_fst_state, word, this_cost))
+                    elif word == self.eos_symbol:
+                        # final-prob for this state.
+                        lines.append('{0} {1}'.format(this_fst_state, this_cost))
+                    else:
+                        assert word == self.backoff_symbol
+                        backoff_fst_state = hist_to_state[hist[1:len(hist)]]
+                        lines.append('{0} {1} {2} 0 {3}'.format(
+                            this_fst_state, backoff_fst_state,
+                            word_disambig_symbol, this_cost))
+        return lines
+
+
+def make_biased_lm(lines, options, top_words=None):
+    """Estimates a biased LM on 'lines', a list of strings of integerized
+    text, with the options 'options' (see add_biased_lm_options(); the
+    --top-words file is not read, the list of (word, prob) pairs
+    'top_words' from read_top_words() is used instead, if not None).
+    Returns the lines of the text-form FST of the LM as a list; raises
+    ValueError if one of 'lines' is not a sequence of integers."""
+    ngram_counts = NgramCounts(options.ngram_order)
+    for line in lines:
+        ngram_counts.add_raw_counts_from_line(line)
+    if len(lines) == 0 or options.verbose > 0:
+        print("make_one_biased_lm.py: processed {0} lines of input".format(
+                len(lines)), file = sys.stderr)
+
+    if options.verbose >= 3:
+        ngram_counts.print_counts("Raw counts:")
+    ngram_counts.completely_discount_low_count_states(options.min_lm_state_count)
+    if options.verbose >= 3:
+        ngram_counts.print_counts("Counts after discounting low-count states:")
+    ngram_counts.apply_backoff(options.discounting_constant)
+    if options.verbose >= 3:
+        ngram_counts.print_counts("Counts after applying Kneser-Ney discounting:")
+    if top_words is not None:
+        ngram_counts.add_top_words(top_words)
+        if options.verbose >= 3:
+            ngram_counts.print_counts("Counts after applying top-n-words")
+    return ngram_counts.fst_lines(options.word_disambig_symbol)
@@ -12,8 +12,10 @@ commonly used in many kaldi python scripts.
 from __future__ import print_function
 from __future__ import division
 import argparse
+import collections
 import logging
 import math
+import multiprocessing
 import os
 import subprocess
 import sys
@@ -212,6 +214,38 @@ def background_command_waiter(command, popen_object, require_zero_status):
             logger.warning(str)
 
 
+def map_in_order(function, items, num_jobs=1, initializer=None, initargs=()):
+    """Yields function(item) for each item of the iterable 'items', in order.
+    If num_jobs > 1 the calls are made by that many worker processes, with at
+    most 2 * num_jobs items in flight, so that 'items' is consumed only as fast
+    as the results are used; otherwise they are made in this process.
+    'initializer', if not None, is called with 'initargs' in each process that
+    makes calls (including this one if num_jobs is 1)."""
+    if num_jobs <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield function(item)
+        return
+
+    pool = multiprocessing.Pool(processes=num_jobs, initializer=initializer,
+                                initargs=initargs)
+    try:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.apply_async(function, (item,)))
+            if len(pending) >= 2 * num_jobs:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
 def get_number_of_leaves_from_tree(alidir):
     stdout = get_command_stdout(
         "tree-info {0}/tree 2>/dev/null | grep num-pdfs".format(alidir))
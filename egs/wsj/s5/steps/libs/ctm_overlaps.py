@@ -0,0 +1,366 @@
+# Copyright 2014  Johns Hopkins University (Authors: Daniel Povey)
+#           2014  Vijayaditya Peddinti
+#           2016  Vimal Manohar
+# Apache 2.0
+
+""" This module contains the code shared by utils/ctm/resolve_ctm_overlaps.py
+and steps/cleanup/internal/resolve_ctm_edits_overlaps.py, which combine the
+CTMs (or ctm-edits) of overlapping segments of a recording, e.g. those
+created by utils/data/subsegment_data_dir.sh, into a CTM for the recording.
+
+The lines are stored by column: times in NumPy arrays, and the text of the
+other fields in lists.  For each recording, the utterances are ordered by
+start time and the points at which the CTMs of consecutive utterances are
+split are found with vectorized operations over all the lines of the
+recording; only the decisions about which lines to keep are made in a loop,
+over the utterances.  Recordings may be processed by several processes, with
+the output written in the order of the recordings.
+"""
+
+from __future__ import division
+import collections
+
+import numpy as np
+
+import libs.common as common_lib
+
+
+def read_segments(segments_file):
+    """Read from segments and returns two dictionaries and the number of lines
+    read,
+    {utterance-id: (recording_id, start_time, end_time)}
+    {recording_id: list-of-utterances}
+    """
+    segments = {}
+    reco2utt = collections.defaultdict(list)
+
+    num_lines = 0
+    for line in segments_file:
+        num_lines += 1
+        parts = line.strip().split()
+        assert len(parts) in [4, 5]
+        segments[parts[0]] = (parts[1], float(parts[2]), float(parts[3]))
+        reco2utt[parts[1]].append(parts[0])
+
+    segments_file.close()
+    return segments, reco2utt, num_lines
+
+
+class CtmColumns(object):
+    """The lines of a CTM or ctm-edits file, stored by column.
+
+    Attributes:
+        utterances, channels -- lists of the first two fields of the lines
+        start_times, durations -- lists of the (float) third and fourth fields
+        tails -- list of the text of the remaining fields, as they are
+            written out
+        is_word, is_error -- for ctm-edits only: numpy arrays of 0/1 values
+            saying whether the edit-type of the line is not 'sil', and
+            whether it is one of 'ins', 'del' and 'sub'
+        utt2lines -- dict from utterance-id to the list of indexes of its
+            lines, in the order they were read
+    """
+
+    def __init__(self, ctm_edits=False):
+        self.ctm_edits = ctm_edits
+        self.utterances = []
+        self.channels = []
+        self.start_times = []
+        self.durations = []
+        self.tails = []
+        self.is_word = None
+        self.is_error = None
+        self.utt2lines = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.utterances)
+
+
+def read_ctm(ctm_file, segments, ctm_edits=False):
+    """Reads a CTM, or a ctm-edits file if 'ctm_edits' is true, into a
+    CtmColumns object.  Every utterance in the file must be in 'segments'.
+    The conf field of a ctm-edits file (the sixth) is written out as a
+    float, as are the times.
+    """
+    ctm = CtmColumns(ctm_edits)
+    edit_types = []
+    for line in ctm_file:
+        parts = line.split()
+
+        utt = parts[0]
+        if utt not in segments:
+            raise KeyError("Utterance {0} in CTM is not in segments".format(
+                utt))
+        index = len(ctm.utterances)
+        lines = ctm.utt2lines.get(utt)
+        if lines is None:
+            lines = ctm.utt2lines[utt] = []
+        lines.append(index)
+
+        ctm.utterances.append(utt)
+        ctm.channels.append(parts[1])
+        ctm.start_times.append(float(parts[2]))
+        ctm.durations.append(float(parts[3]))
+        if ctm_edits:
+            ctm.tails.append("{0} {1} {2}".format(parts[4], float(parts[5]),
+                                                  " ".join(parts[6:])))
+            edit_types.append(parts[7])
+        else:
+            ctm.tails.append(" ".join(parts[4:]))
+
+    ctm_file.close()
+    if ctm_edits:
+        edit_types = np.array(edit_types, dtype=object)
+        ctm.is_word = (edit_types != 'sil').astype(np.int64)
+        ctm.is_error = np.isin(edit_types,
+                               ['ins', 'del', 'sub']).astype(np.int64)
+    return ctm
+
+
+class RecordingCtm(object):
+    """The CTM lines of one recording, as needed to resolve the overlaps:
+    the utterances with CTM lines in order of their start times, with the
+    lines of each utterance contiguous.
+
+    Attributes:
+        recording -- the recording-id
+        utt_starts, utt_ends -- numpy arrays of the start and end times of
+            the utterances in the recording
+        line_offsets -- numpy array; the lines of the i'th utterance are
+            line_offsets[i] to line_offsets[i+1] - 1
+        start_times, durations -- numpy arrays of the times of the lines
+            (relative to the utterance start)
+        texts -- list of tuples (utterance, channel, start_time, duration,
+            tail) for each line, used to write it out
+        is_word, is_error -- for ctm-edits only, as in CtmColumns
+    """
+
+    def __init__(self, recording, utts, ctm, segments):
+        self.recording = recording
+        lines = [ctm.utt2lines[utt] for utt in utts]
+        self.utt_starts = np.array([segments[utt][1] for utt in utts])
+        self.utt_ends = np.array([segments[utt][2] for utt in utts])
+        self.line_offsets = np.concatenate(
+            ([0], np.cumsum([len(x) for x in lines]))).astype(np.int64)
+        index = [i for x in lines for i in x]
+        self.start_times = np.array([ctm.start_times[i] for i in index],
+                                    dtype=np.float64)
+        self.durations = np.array([ctm.durations[i] for i in index],
+                                  dtype=np.float64)
+        self.texts = [(ctm.utterances[i], ctm.channels[i],
+                       ctm.start_times[i], ctm.durations[i], ctm.tails[i])
+                      for i in index]
+        if ctm.ctm_edits:
+            index = np.array(index, dtype=np.int64)
+            self.is_word = ctm.is_word[index]
+            self.is_error = ctm.is_error[index]
+        else:
+            self.is_word = None
+            self.is_error = None
+
+    def num_utterances(self):
+        return len(self.utt_starts)
+
+
+def _first_true_per_utterance(cond, line_offsets):
+    """Returns, for each utterance, the index (relative to the first line of
+    the utterance) of the first of its lines for which 'cond' is true, or
+    the number of its lines if there is none."""
+    num_lines = line_offsets[1:] - line_offsets[:-1]
+    utt_of_line = np.repeat(np.arange(len(num_lines)), num_lines)
+    local_index = np.arange(len(cond)) - line_offsets[utt_of_line]
+    values = np.where(cond, local_index, num_lines[utt_of_line])
+    return np.minimum.reduceat(values, line_offsets[:-1])
+
+
+def _next_true_line(cond, line_offsets):
+    """Returns an array that, for each line j, gives the index of the first
+    line k >= j of the same utterance for which 'cond' is true, or the index
+    of the line after the last line of the utterance if there is none."""
+    num_lines = line_offsets[1:] - line_offsets[:-1]
+    utt_ends = np.repeat(line_offsets[1:], num_lines)
+    values = np.where(cond, np.arange(len(cond)), utt_ends)
+    # The minimum over the lines from j onwards is the right answer, because
+    # the values of the lines of later utterances are all >= utt_ends[j].
+    return np.minimum.accumulate(values[::-1])[::-1]
+
+
+def get_split_points(recording_ctm, midpoint_split):
+    """Works out the split points for the pairs of consecutive utterances of
+    a recording.  Returns (end_lines, start_indexes) where, for the pair of
+    utterances i and i+1:
+        end_lines[j] is the first line >= j of utterance i whose midpoint is
+            in the part of the overlap that is to be taken from utterance
+            i+1, where j is a line of utterance i;
+        start_indexes[i+1] is the index within utterance i+1 of its first
+            line whose midpoint is beyond the part of the overlap that is to
+            be taken from utterance i (or the number of lines if none is).
+    If 'midpoint_split' is true, the overlap is split at its middle;
+    otherwise, the whole overlap is considered on both sides.
+    """
+    utt_starts = recording_ctm.utt_starts
+    utt_ends = recording_ctm.utt_ends
+    line_offsets = recording_ctm.line_offsets
+    num_lines = line_offsets[1:] - line_offsets[:-1]
+
+    window_lengths = utt_ends - utt_starts
+    # overlap of each segment with the next segment i.e.
+    # current_utterance_end_time - next_utterance_start_time.
+    # Note: It is possible for this to be negative when there is
+    # actually no overlap between consecutive segments.
+    overlaps = utt_ends[:-1] - utt_starts[1:]
+    if midpoint_split:
+        overlaps = overlaps / 2.0
+    end_thresholds = np.append(window_lengths[:-1] - overlaps, np.inf)
+    start_thresholds = np.append(np.inf, overlaps)
+
+    midpoints = (recording_ctm.start_times
+                 + recording_ctm.durations / 2.0)
+    end_lines = _next_true_line(
+        midpoints > np.repeat(end_thresholds, num_lines), line_offsets)
+    start_indexes = _first_true_per_utterance(
+        midpoints > np.repeat(start_thresholds, num_lines), line_offsets)
+    return end_lines, start_indexes
+
+
+def resolve_overlaps_by_midpoint(recording_ctm):
+    """Resolve overlaps within segments of the same recording, by ignoring
+    the words which are hypothesized in the half of the overlapped region
+    that is closer to the utterance boundary.  If the next utterance is
+    entirely within the current one, it is ignored.
+
+    Returns a list of ranges (begin, end) of the lines of recording_ctm to
+    output.
+    """
+    num_utts = recording_ctm.num_utterances()
+    line_offsets = recording_ctm.line_offsets.tolist()
+    utt_starts = recording_ctm.utt_starts.tolist()
+    utt_ends = recording_ctm.utt_ends.tolist()
+    end_lines, start_indexes = get_split_points(recording_ctm, True)
+    end_lines = end_lines.tolist()
+    start_indexes = start_indexes.tolist()
+
+    # first_line[i] is the first line of utterance i that is still to be
+    # output, or None if none of it is.
+    first_line = line_offsets[:-1]
+    ranges = []
+    for i in range(num_utts - 1):
+        if first_line[i] is None:
+            continue
+        overlap = utt_ends[i] - utt_starts[i + 1]
+        if overlap > 0 and utt_ends[i + 1] <= utt_ends[i]:
+            # Next utterance is entirely within this utterance.
+            # So we leave this ctm as is and make the next one empty.
+            ranges.append((first_line[i], line_offsets[i + 1]))
+            first_line[i + 1] = None
+            continue
+
+        # Ignore the hypotheses beyond the midpoint of the overlap. They will
+        # be considered as part of the next segment.
+        ranges.append((first_line[i], end_lines[first_line[i]]))
+
+        if start_indexes[i + 1] == line_offsets[i + 2] - line_offsets[i + 1]:
+            # This can happen if there is no word hypothesized after
+            # half the overlap region.
+            first_line[i + 1] = None
+        else:
+            first_line[i + 1] += start_indexes[i + 1]
+
+    # merge the last ctm entirely
+    if first_line[-1] is not None:
+        ranges.append((first_line[-1], line_offsets[-1]))
+    return ranges
+
+
+def resolve_overlaps_by_wer(recording_ctm):
+    """Resolve overlaps within segments of the same recording, using the WER
+    of the ctm-edits (w.r.t. the reference text): the overlapped region is
+    taken from whichever of the two overlapping segments has the lower WER
+    in it (the first one on ties).
+
+    Returns a list of ranges (begin, end) of the lines of recording_ctm to
+    output.
+    """
+    num_utts = recording_ctm.num_utterances()
+    line_offsets = recording_ctm.line_offsets.tolist()
+    end_lines, start_indexes = get_split_points(recording_ctm, False)
+    end_lines = end_lines.tolist()
+    start_indexes = start_indexes.tolist()
+    word_counts = np.concatenate(
+        ([0], np.cumsum(recording_ctm.is_word))).tolist()
+    error_counts = np.concatenate(
+        ([0], np.cumsum(recording_ctm.is_error))).tolist()
+
+    def wer(begin, end):
+        num_words = word_counts[end] - word_counts[begin]
+        num_incorrect_words = error_counts[end] - error_counts[begin]
+        if num_words == 0 and num_incorrect_words > 0:
+            return float('inf')
+        if num_words == 0 and num_incorrect_words == 0:
+            return 0
+        return float(num_incorrect_words) / num_words
+
+    first_line = line_offsets[:-1]
+    ranges = []
+    for i in range(num_utts - 1):
+        # the lines at the end of the cur utt that are in the overlap
+        cur_utt_end_line = end_lines[first_line[i]]
+        # the lines at the beginning of the next utt that are in the overlap
+        next_utt_start_line = line_offsets[i + 1] + start_indexes[i + 1]
+        if next_utt_start_line == line_offsets[i + 2]:
+            next_utt_start_line = line_offsets[i + 1]
+
+        if (wer(line_offsets[i + 1], next_utt_start_line)
+                < wer(cur_utt_end_line, line_offsets[i + 1])):
+            ranges.append((first_line[i], cur_utt_end_line))
+        else:
+            ranges.append((first_line[i], line_offsets[i + 1]))
+            first_line[i + 1] = next_utt_start_line
+
+    # merge the last ctm entirely
+    ranges.append((first_line[-1], line_offsets[-1]))
+    return ranges
+
+
+def resolve_overlaps(recording_ctm):
+    """Returns the text of the CTM for the recording with the overlaps
+    resolved; see resolve_overlaps_by_midpoint() and
+    resolve_overlaps_by_wer()."""
+    if recording_ctm.is_word is None:
+        ranges = resolve_overlaps_by_midpoint(recording_ctm)
+    else:
+        ranges = resolve_overlaps_by_wer(recording_ctm)
+    texts = recording_ctm.texts
+    return "".join(["{0} {1} {2} {3} {4}\n".format(*texts[j])
+                    for begin, end in ranges for j in range(begin, end)])
+
+
+class RecordingError(Exception):
+    """Raised by resolve_overlaps_for_recordings() when the overlaps of a
+    recording could not be resolved; 'recording' is the recording-id."""
+
+    def __init__(self, recording, message):
+        super(RecordingError, self).__init__(recording, message)
+        self.recording = recording
+
+    def __str__(self):
+        return "recording {0}: {1}".format(*self.args)
+
+
+def _resolve_recording_overlaps(recording_ctm):
+    try:
+        return recording_ctm.recording, resolve_overlaps(recording_ctm)
+    except Exception as e:
+        raise RecordingError(recording_ctm.recording,
+                             "{0}: {1}".format(type(e).__name__, e)) from e
+
+
+def resolve_overlaps_for_recordings(recording_ctms, num_jobs=1):
+    """Yields, for each RecordingCtm from the iterable 'recording_ctms', a pair
+    (recording, text) where text is the output of resolve_overlaps().  If
+    num_jobs > 1, the recordings are processed in that many processes (see
+    libs.common.map_in_order()); the results are yielded in the order of the
+    input.  A failure to resolve the overlaps of a recording is raised as a
+    RecordingError, which holds the recording-id."""
+    return common_lib.map_in_order(_resolve_recording_overlaps,
+                                   recording_ctms, num_jobs=num_jobs)
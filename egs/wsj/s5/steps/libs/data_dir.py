@@ -0,0 +1,259 @@
+# Apache 2.0
+
+""" This module contains the reading, manipulation and writing of the files of
+Kaldi data directories (wav.scp, utt2spk, text, segments, utt2dur...), shared
+by the Python scripts in utils/data/, steps/data/ and steps/cleanup/.
+
+A file with lines "<key> <value>" is held as a DataTable, in which the keys
+and the values are two NumPy object arrays, in the order of the file.  The
+strings are interned, so that e.g. the speaker-ids in utt2spk, or the same
+utterance-ids in several files of a data directory, are stored only once.
+Looking up keys uses a sorted index of the keys, which is only built when
+it is first needed.  A key that occurs more than once in a file is kept as
+many times in its DataTable; as in a dict read from the file, looking it up
+gives its last value, and unique() and join_tables() keep it once, with its
+last value.  A DataDir loads the files of a directory on first use.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+
+def _to_object_array(strings):
+    """Returns a 1-d NumPy object array with the strings of the iterable
+    'strings' (np.array() would turn a list of equal-length lists into a 2-d
+    array, and a list of strings into a fixed-width string array)."""
+    strings = list(strings)
+    array = np.empty(len(strings), dtype=object)
+    array[:] = strings
+    return array
+
+
+class DataTable(object):
+    """ This class represents a Kaldi table file such as wav.scp, utt2spk,
+        text or utt2dur, i.e. lines of the form "<key> <value>", where the
+        value is the rest of the line.
+
+        Parameters:
+            keys - A NumPy object array of the keys, in the order of the file
+            values - A NumPy object array of the values (strings, unless
+                     they were converted by the 'value_type' of read())
+    """
+
+    def __init__(self, keys, values):
+        self.keys = (keys if isinstance(keys, np.ndarray)
+                     else _to_object_array(keys))
+        self.values = (values if isinstance(values, np.ndarray)
+                       else _to_object_array(values))
+        assert len(self.keys) == len(self.values)
+        self._sort_order = None
+        self._sorted_keys = None
+
+    @classmethod
+    def read(cls, filename, value_type=None, assert2fields=False,
+             normalize_whitespace=False, encoding='utf-8'):
+        """Reads the table from 'filename'.  Empty lines are ignored.
+
+        Arguments:
+            value_type - If not None, a function such as float which is
+                         applied to each value; the values are then stored
+                         in a NumPy array of the type it returns.
+            assert2fields - If True, checks that each value is a single field.
+            normalize_whitespace - If True, the fields of each value are
+                         separated by single spaces; otherwise only the
+                         whitespace around the value is removed.
+        """
+        intern = sys.intern
+        keys = []
+        values = []
+        with open(filename, 'r', encoding=encoding) as f:
+            for line in f:
+                parts = line.split(None, 1)
+                if len(parts) == 0:
+                    continue
+                value = parts[1].strip() if len(parts) > 1 else ''
+                if normalize_whitespace:
+                    value = " ".join(value.split())
+                if assert2fields and (value == '' or len(value.split()) != 1):
+                    raise ValueError("Expected 2 fields in line '{0}' of "
+                                     "{1}".format(line.strip(), filename))
+                keys.append(intern(parts[0]))
+                values.append(intern(value))
+        if value_type is not None:
+            return cls(keys, np.array([value_type(x) for x in values]))
+        return cls(keys, values)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _get_index(self):
+        if self._sort_order is None:
+            self._sort_order = np.argsort(self.keys, kind='stable')
+            self._sorted_keys = self.keys[self._sort_order]
+        return self._sort_order, self._sorted_keys
+
+    def lookup(self, keys):
+        """Returns an array with the position in this table of each of the
+        'keys' (the last one, if a key occurs more than once), or -1 for the
+        keys that are not in the table."""
+        keys = keys if isinstance(keys, np.ndarray) else _to_object_array(keys)
+        if len(self.keys) == 0 or len(keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        sort_order, sorted_keys = self._get_index()
+        index = np.searchsorted(sorted_keys, keys, side='right') - 1
+        found = index >= 0
+        index = np.maximum(index, 0)
+        found &= sorted_keys[index] == keys
+        return np.where(found, sort_order[index], -1)
+
+    def __contains__(self, key):
+        return self.lookup([key])[0] >= 0
+
+    def __getitem__(self, key):
+        i = self.lookup([key])[0]
+        if i < 0:
+            raise KeyError(key)
+        return self.values[i]
+
+    def get(self, key, default=None):
+        i = self.lookup([key])[0]
+        return default if i < 0 else self.values[i]
+
+    def items(self):
+        """Returns an iterator over the (key, value) pairs, in order."""
+        return zip(self.keys.tolist(), self.values.tolist())
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def unique(self):
+        """Returns a DataTable in which each key occurs once, at the position
+        of its first occurrence and with its last value, like the items of a
+        dict read from the file."""
+        if len(self.keys) == 0:
+            return self
+        sort_order, sorted_keys = self._get_index()
+        is_first = np.ones(len(sorted_keys), dtype=bool)
+        is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        if is_first.all():
+            return self
+        is_last = np.ones(len(sorted_keys), dtype=bool)
+        is_last[:-1] = is_first[1:]
+        first = sort_order[is_first]
+        order = np.argsort(first, kind='stable')
+        return DataTable(self.keys[first[order]],
+                         self.values[sort_order[is_last][order]])
+
+    def select(self, index):
+        """Returns a DataTable with the entries at the positions 'index'
+        (an array of indexes or a boolean mask), in that order."""
+        return DataTable(self.keys[index], self.values[index])
+
+    def sorted(self):
+        """Returns a DataTable with the entries sorted on the keys, as
+        utils/fix_data_dir.sh would write them."""
+        sort_order, _ = self._get_index()
+        return self.select(sort_order)
+
+    def map_keys(self, function):
+        """Returns a DataTable with the keys replaced by function(key)."""
+        intern = sys.intern
+        return DataTable([intern(function(x)) for x in self.keys.tolist()],
+                         self.values)
+
+    def map_values(self, function):
+        """Returns a DataTable with the values replaced by function(value)."""
+        intern = sys.intern
+        return DataTable(self.keys,
+                         [intern(function(x)) for x in self.values.tolist()])
+
+    def write(self, filename, value_format="{}", separator=" ",
+              encoding='utf-8', chunk_size=10000):
+        """Writes the table to 'filename', in order, formatting the values
+        with 'value_format' (e.g. "{:0.3f}").  The lines are written in
+        chunks of 'chunk_size'."""
+        line_format = "{}" + separator + value_format + "\n"
+        keys = self.keys.tolist()
+        values = self.values.tolist()
+        with open(filename, 'w', encoding=encoding) as f:
+            for start in range(0, len(keys), chunk_size):
+                end = start + chunk_size
+                f.writelines([line_format.format(key, value)
+                              for key, value in zip(keys[start:end],
+                                                    values[start:end])])
+
+
+def join_tables(tables):
+    """Returns the keys of the first DataTable in the list 'tables' that are
+    in all of them, in the order of the first table (see unique()), and a
+    list with the array of the values of each table for those keys."""
+    tables = [tables[0].unique()] + list(tables[1:])
+    keys = tables[0].keys
+    indexes = [np.arange(len(keys))]
+    found = np.ones(len(keys), dtype=bool)
+    for table in tables[1:]:
+        index = table.lookup(keys)
+        found &= index >= 0
+        indexes.append(index)
+    return (keys[found],
+            [table.values[index[found]]
+             for table, index in zip(tables, indexes)])
+
+
+def concatenate_tables(tables):
+    """Returns a DataTable with the entries of the DataTables in the list
+    'tables', one table after the other."""
+    return DataTable(np.concatenate([table.keys for table in tables]),
+                     np.concatenate([table.values for table in tables]))
+
+
+def write_spk2utt(utt2spk, filename, encoding='utf-8'):
+    """Writes the spk2utt file for the DataTable 'utt2spk', with the speakers
+    in the order of their first utterance and the utterances in the order of
+    utt2spk."""
+    speakers = {}
+    for utt, spk in utt2spk.items():
+        speakers.setdefault(spk, []).append(utt)
+    with open(filename, 'w', encoding=encoding) as f:
+        f.writelines(["{} {} \n".format(spk, " ".join(utts))
+                      for spk, utts in speakers.items()])
+
+
+class DataDir(object):
+    """ This class represents a Kaldi data directory like data/train.  Its
+        files are read as DataTable objects when they are first used, e.g.
+        data_dir['utt2spk'], and kept for later uses.
+    """
+
+    def __init__(self, dir, normalize_whitespace=False, encoding='utf-8'):
+        self.dir = dir
+        self.normalize_whitespace = normalize_whitespace
+        self.encoding = encoding
+        self._tables = {}
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def has(self, name):
+        return os.path.isfile(self.path(name))
+
+    def get(self, name, value_type=None, assert2fields=False):
+        """Returns the DataTable for the file 'name', reading it if needed;
+        'value_type' and 'assert2fields' are as for DataTable.read()."""
+        if (name, value_type) not in self._tables:
+            self._tables[(name, value_type)] = DataTable.read(
+                self.path(name), value_type=value_type,
+                assert2fields=assert2fields,
+                normalize_whitespace=self.normalize_whitespace,
+                encoding=self.encoding)
+        return self._tables[(name, value_type)]
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def get_durations(self, name='utt2dur'):
+        """Returns the DataTable for a file of durations such as utt2dur or
+        reco2dur, with the values as a float array."""
+        return self.get(name, value_type=float)
@@ -0,0 +1,120 @@
+# Copyright 2016 Johns Hopkins University (author: Daniel Povey)
+# Apache 2.0
+
+""" This module contains the histogram code shared by
+steps/diagnostic/analyze_lattice_depth_stats.py and
+steps/diagnostic/analyze_phone_length_stats.py.
+
+The stats are histograms of non-negative integers (lattice depths, phone
+lengths in frames) per phone.  They are held as a dense 2-D NumPy array of
+counts indexed by [row, value], so that they are accumulated with
+np.unique() and np.bincount() and the histograms of different jobs are merged
+by adding the arrays; the percentiles and means of all the rows are then
+computed at once.
+"""
+
+import numpy as np
+
+
+class Histograms(object):
+    """A histogram of non-negative integer values for each of 'num_rows'
+    rows (e.g. phone ids).  self.counts[row, value] is the count of 'value'
+    in row 'row'; the number of columns grows as larger values are added.
+    """
+
+    def __init__(self, num_rows, counts=None):
+        if counts is None:
+            counts = np.zeros((num_rows, 0), dtype=np.int64)
+        assert counts.shape[0] == num_rows
+        self.counts = counts
+
+    @property
+    def num_rows(self):
+        return self.counts.shape[0]
+
+    @property
+    def num_values(self):
+        return self.counts.shape[1]
+
+    def reserve(self, num_values):
+        """Makes sure there are at least 'num_values' columns, i.e. that the
+        histograms cover the values 0 to num_values - 1."""
+        if num_values > self.num_values:
+            counts = np.zeros((self.num_rows, num_values), dtype=np.int64)
+            counts[:, :self.num_values] = self.counts
+            self.counts = counts
+
+    def add(self, rows, values, weights=None):
+        """Adds 'weights' (default: 1) to the counts of 'values' in the rows
+        'rows'; all three are numpy integer arrays of the same length."""
+        if len(values) == 0:
+            return
+        rows = np.asarray(rows, dtype=np.int64)
+        values = np.asarray(values, dtype=np.int64)
+        if values.min() < 0:
+            raise ValueError("Expecting non-negative values, got {0}".format(
+                values.min()))
+        if rows.min() < 0 or rows.max() >= self.num_rows:
+            raise ValueError("Row index out of range [0, {0})".format(
+                self.num_rows))
+        num_values = max(self.num_values, int(values.max()) + 1)
+        self.reserve(num_values)
+        if weights is not None:
+            # np.bincount() sums weights as floats; the counts are integers
+            # well within the range where that is exact.
+            weights = np.asarray(weights, dtype=np.float64)
+        # Only the (row, value) pairs that occur are counted, so that the
+        # memory used is bounded by the number of values added, not by the
+        # size of self.counts.
+        pairs, pair_index = np.unique(rows * num_values + values,
+                                      return_inverse=True)
+        counts = np.bincount(pair_index.reshape(-1), weights=weights)
+        self.counts[pairs // num_values, pairs % num_values] += \
+            np.rint(counts).astype(np.int64)
+
+    def add_histograms(self, other):
+        """Adds the counts of the Histograms object 'other', which must have
+        the same number of rows."""
+        assert other.num_rows == self.num_rows
+        self.reserve(other.num_values)
+        self.counts[:, :other.num_values] += other.counts
+
+    def select(self, rows):
+        """Returns a Histograms object whose rows are rows 'rows' of this
+        one."""
+        return Histograms(len(rows), self.counts[rows])
+
+    def totals(self):
+        """Returns an array of the total count of each row."""
+        return self.counts.sum(axis=1)
+
+    def value_totals(self):
+        """Returns an array of the sum of the values (times their counts) of
+        each row, e.g. the total number of frames when the values are phone
+        lengths."""
+        return self.counts.dot(np.arange(self.num_values, dtype=np.int64))
+
+    def percentiles(self, fraction, rows=None):
+        """Returns an array of the (fraction * 100)'th percentile of each of
+        the rows 'rows' (default: all rows): the smallest value whose
+        cumulative count is at least int(fraction * total count of the row),
+        among the values that have nonzero count; rows with no counts get
+        0."""
+        counts = self.counts if rows is None else self.counts[rows]
+        # the counts may have been obtained by subtracting histograms; only
+        # the rows we report on have to be consistent.
+        assert (counts >= 0).all()
+        totals = counts.sum(axis=1)
+        if self.num_values == 0:
+            return np.zeros(len(counts), dtype=np.int64)
+        cutoffs = (fraction * totals.astype(np.float64)).astype(np.int64)
+        reached = ((np.cumsum(counts, axis=1) >= cutoffs[:, np.newaxis])
+                   & (counts > 0))
+        return np.where(totals > 0, np.argmax(reached, axis=1), 0)
+
+    def means(self):
+        """Returns an array of the mean value of each row; rows with no
+        counts get 0.0."""
+        totals = self.totals()
+        value_totals = self.value_totals().astype(np.float64)
+        return np.where(totals > 0, value_totals / np.maximum(totals, 1), 0.0)
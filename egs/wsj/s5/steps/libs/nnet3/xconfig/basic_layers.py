@@ -53,11 +53,15 @@ class XconfigLayerBase(object):
         # existing model, which is added to all_layers using layer type 'existing',
         # and 'output-node' of type 'output-layer' with the same name 'output' in
         # 'all_layers'.
-        for prev_layer in all_layers:
-            if (self.name == prev_layer.name and
-                prev_layer.layer_type is not 'existing'):
-                raise RuntimeError("Name '{0}' is used for more than one "
-                                   "layer.".format(self.name))
+        if isinstance(all_layers, xutils.XconfigLayerList):
+            name_is_used = all_layers.has_layer_named(self.name)
+        else:
+            name_is_used = any([self.name == prev_layer.name and
+                                prev_layer.layer_type is not 'existing'
+                                for prev_layer in all_layers])
+        if name_is_used:
+            raise RuntimeError("Name '{0}' is used for more than one "
+                               "layer.".format(self.name))
 
         self.config = {}
         # the following, which should be overridden in the child class, sets
@@ -189,16 +193,12 @@ class XconfigLayerBase(object):
         layers, and get dimensions from them.
         """
 
+        if isinstance(all_layers, xutils.XconfigLayerList):
+            # this uses the index of layer names and the cache of parsed
+            # Descriptors of 'all_layers'.
+            return all_layers.get_descriptor(descriptor_string, self)
         prev_names = xutils.get_prev_names(all_layers, self)
-        tokens = xutils.tokenize_descriptor(descriptor_string, prev_names)
-        pos = 0
-        (descriptor, pos) = xutils.parse_new_descriptor(tokens, pos, prev_names)
-        # note: 'pos' should point to the 'end of string' marker
-        # that terminates 'tokens'.
-        if pos != len(tokens) - 1:
-            raise RuntimeError("Parsing Descriptor, saw junk at end: {0}"
-                               "".format(' '.join(tokens[pos:-1])))
-        return descriptor
+        return xutils.parse_descriptor(descriptor_string, prev_names)
 
     def get_dim_for_descriptor(self, descriptor, all_layers):
         """Returns the dimension of a Descriptor object. This is a convenience
@@ -125,7 +125,7 @@ def get_model_component_info(model_filename):
          'existing name=tdnn1.affine dim=500'
     """
 
-    all_layers = []
+    all_layers = xutils.XconfigLayerList()
     try:
         f = open(model_filename, 'r')
     except Exception as e:
@@ -183,6 +183,10 @@ def get_model_component_info(model_filename):
 def read_xconfig_file(xconfig_filename, existing_layers=None):
     if existing_layers is None:
         existing_layers = []
+    if not isinstance(existing_layers, xutils.XconfigLayerList):
+        # The layers are looked up by name in 'existing_layers' as each
+        # line is parsed.
+        existing_layers = xutils.XconfigLayerList(existing_layers)
     try:
         f = open(xconfig_filename, 'r')
     except Exception as e:
@@ -20,6 +20,8 @@ import sys
 # This will be used in parsing expressions like [-1] in descriptors
 # (which is an alias for the previous layer).
 def get_prev_names(all_layers, current_layer):
+    if isinstance(all_layers, XconfigLayerList):
+        return all_layers.get_prev_names(current_layer)
     prev_names = []
     for layer in all_layers:
         if layer is current_layer:
@@ -66,6 +68,18 @@ def split_layer_name(full_layer_name):
 # (because that's not allowed).
 def get_dim_from_layer_name(all_layers, current_layer, full_layer_name):
     layer_name, auxiliary_output = split_layer_name(full_layer_name)
+    if isinstance(all_layers, XconfigLayerList):
+        (index, is_full_name) = all_layers.find_layer(current_layer,
+                                                      full_layer_name)
+        if is_full_name:
+            return all_layers.output_dim(index)
+        layer = all_layers[index]
+        if (not auxiliary_output in layer.auxiliary_outputs()
+            and auxiliary_output is not None):
+            raise RuntimeError("Layer '{0}' has no such auxiliary output:"
+                               "'{1}' ({0}.{1})".format(layer_name,
+                                                        auxiliary_output))
+        return all_layers.output_dim(index, auxiliary_output)
     for layer in all_layers:
         if layer is current_layer:
             break
@@ -109,6 +123,18 @@ def get_dim_from_layer_name(all_layers, current_layer, full_layer_name):
 # (because that's not allowed).
 def get_string_from_layer_name(all_layers, current_layer, full_layer_name):
     layer_name, auxiliary_output = split_layer_name(full_layer_name)
+    if isinstance(all_layers, XconfigLayerList):
+        (index, is_full_name) = all_layers.find_layer(current_layer,
+                                                      full_layer_name)
+        layer = all_layers[index]
+        if is_full_name:
+            return layer.output_name()
+        if (not auxiliary_output in layer.auxiliary_outputs() and
+            auxiliary_output is not None):
+            raise RuntimeError("Layer '{0}' has no such auxiliary output: "
+                               "'{1}' ({0}.{1})".format(
+                layer_name, auxiliary_output))
+        return layer.output_name(auxiliary_output)
     for layer in all_layers:
         if layer is current_layer:
             break
@@ -141,6 +167,158 @@ def get_string_from_layer_name(all_layers, current_layer, full_layer_name):
         raise RuntimeError("No such layer: '{0}'".format(layer_name))
 
 
+# This class is a list of objects inheriting from XconfigLayerBase (an
+# 'all_layers' list, as used above) which also keeps an index of the layers
+# by name, so that get_prev_names(), get_dim_from_layer_name() and
+# get_string_from_layer_name() can find a layer without scanning all the
+# layers before it; this matters for xconfig files with thousands of layers.
+# It also caches the output dims of the layers, and the Descriptors parsed in
+# the context of a position in the list (see get_descriptor()).  The index is
+# rebuilt and the caches are cleared whenever the list is modified other than
+# by appending layers; if you change the config of a layer that is already
+# in the list, call invalidate().
+class XconfigLayerList(list):
+    def __init__(self, layers=()):
+        list.__init__(self)
+        self._clear_index()
+        self.extend(layers)
+
+    def _clear_index(self):
+        # map from id() of each layer to its position in the list.
+        self._layer_to_index = {}
+        # map from each name to the position of the first layer with that name.
+        self._name_to_index = {}
+        # the names of the layers other than 'existing' layers, in order.
+        self._prev_names = []
+        self._prev_names_set = set()
+        # _num_prev_names[i] is the number of names in _prev_names that come
+        # from layers before position i.
+        self._num_prev_names = []
+        # the position in _prev_names of the first name that is repeated, if any.
+        self._first_repeated_name = None
+        # map from (position, auxiliary_output) to output dim.
+        self._dims = {}
+        # map from (descriptor_string, len(prev_names)) to Descriptor.
+        self._descriptors = {}
+
+    def _add_to_index(self, layer):
+        index = len(self._num_prev_names)
+        self._layer_to_index.setdefault(id(layer), index)
+        self._name_to_index.setdefault(layer.get_name(), index)
+        self._num_prev_names.append(len(self._prev_names))
+        if layer.layer_type != 'existing':
+            name = layer.get_name()
+            if (name in self._prev_names_set and
+                self._first_repeated_name is None):
+                self._first_repeated_name = len(self._prev_names)
+            self._prev_names.append(name)
+            self._prev_names_set.add(name)
+
+    def invalidate(self):
+        """Rebuilds the index of the layers and clears the cached dims and
+        Descriptors."""
+        self._clear_index()
+        for layer in self:
+            self._add_to_index(layer)
+
+    def append(self, layer):
+        list.append(self, layer)
+        self._add_to_index(layer)
+
+    def extend(self, layers):
+        for layer in layers:
+            self.append(layer)
+
+    def __iadd__(self, layers):
+        self.extend(layers)
+        return self
+
+    def has_layer_named(self, name):
+        """Returns true if a layer other than an 'existing' layer is called
+        'name'."""
+        return name in self._prev_names_set
+
+    def _num_prev_names_for(self, current_layer):
+        index = self._layer_to_index.get(id(current_layer))
+        if index is None:
+            num_names = len(self._prev_names)
+        else:
+            num_names = self._num_prev_names[index]
+        if (self._first_repeated_name is not None and
+            self._first_repeated_name < num_names):
+            raise RuntimeError("{0}: Layer name {1} is used more than once.".format(
+                    sys.argv[0], self._prev_names[self._first_repeated_name]))
+        return num_names
+
+    def get_prev_names(self, current_layer):
+        """Does the same as the function get_prev_names() above."""
+        return self._prev_names[:self._num_prev_names_for(current_layer)]
+
+    def find_layer(self, current_layer, full_layer_name):
+        """Finds the first layer before 'current_layer' (or in the whole list,
+        if 'current_layer' is not in it) whose name is either
+        'full_layer_name' or the part of it before the first '.', and returns
+        a pair (position, is_full_name), where is_full_name is true if the
+        layer's name is 'full_layer_name'.  Raises an exception if there is
+        no such layer."""
+        layer_name, auxiliary_output = split_layer_name(full_layer_name)
+        end = self._layer_to_index.get(id(current_layer), len(self))
+        full_index = self._name_to_index.get(full_layer_name, end)
+        index = self._name_to_index.get(layer_name, end)
+        if full_index < end and full_index <= index:
+            return (full_index, True)
+        if index < end:
+            return (index, False)
+        # No such layer was found.
+        if layer_name in self._name_to_index:
+            raise RuntimeError("Layer '{0}' was requested before it appeared in "
+                            "the xconfig file (circular dependencies or out-of-order "
+                            "layers".format(layer_name))
+        else:
+            raise RuntimeError("No such layer: '{0}'".format(layer_name))
+
+    def output_dim(self, index, auxiliary_output=None):
+        """Returns self[index].output_dim(auxiliary_output), computing it only
+        the first time it is asked for."""
+        key = (index, auxiliary_output)
+        dim = self._dims.get(key)
+        if dim is None:
+            if auxiliary_output is None:
+                dim = self[index].output_dim()
+            else:
+                dim = self[index].output_dim(auxiliary_output)
+            self._dims[key] = dim
+        return dim
+
+    def get_descriptor(self, descriptor_string, current_layer):
+        """Returns the Descriptor parsed from 'descriptor_string' for a layer
+        'current_layer' (see get_prev_names()).  The Descriptors are cached,
+        so the returned object may be shared and must not be modified."""
+        num_names = self._num_prev_names_for(current_layer)
+        key = (descriptor_string, num_names)
+        descriptor = self._descriptors.get(key)
+        if descriptor is None:
+            descriptor = parse_descriptor(descriptor_string,
+                                          self._prev_names[:num_names])
+            self._descriptors[key] = descriptor
+        return descriptor
+
+
+def _invalidating_method(name):
+    list_method = getattr(list, name)
+    def method(self, *args, **kwargs):
+        ans = list_method(self, *args, **kwargs)
+        self.invalidate()
+        return ans
+    method.__name__ = name
+    return method
+
+for name in ['__setitem__', '__delitem__', '__setslice__', '__delslice__',
+             '__imul__', 'insert', 'pop', 'remove', 'reverse', 'sort', 'clear']:
+    if hasattr(list, name):
+        setattr(XconfigLayerList, name, _invalidating_method(name))
+
+
 # This function, used in converting string values in config lines to
 # configuration values in self.config in layers, attempts to
 # convert 'string_value' to an instance dest_type (which is of type Type)
@@ -554,6 +732,20 @@ def tokenize_descriptor(descriptor_string,
     return ans
 
 
+# This function parses 'descriptor_string' into an object of type
+# Descriptor, and returns it.  'prev_names' is as for tokenize_descriptor().
+def parse_descriptor(descriptor_string, prev_names):
+    tokens = tokenize_descriptor(descriptor_string, prev_names)
+    pos = 0
+    (descriptor, pos) = parse_new_descriptor(tokens, pos, prev_names)
+    # note: 'pos' should point to the 'end of string' marker
+    # that terminates 'tokens'.
+    if pos != len(tokens) - 1:
+        raise RuntimeError("Parsing Descriptor, saw junk at end: {0}"
+                           "".format(' '.join(tokens[pos:-1])))
+    return descriptor
+
+
 # This function parses a line in a config file, something like
 # affine-layer name=affine1 input=Append(-3, 0, 3)
 # and returns a pair,
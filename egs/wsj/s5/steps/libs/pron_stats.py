@@ -0,0 +1,279 @@
+# Copyright 2016-2018  Xiaohui Zhang
+# Apache 2.0
+
+""" This module contains the pronunciation statistics and the computations on
+them that are shared by steps/dict/select_prons_greedy.py and
+steps/dict/select_prons_bayesian.py.
+
+The statistics are held as NumPy arrays rather than as nested dicts:
+ArcStats holds the per-example soft counts of the arc-stats file as a sparse
+(example x pronunciation) matrix for each word, and PronCandidates holds the
+candidate pronunciations of all the words from the three source lexicons
+together with their pron-stats counts, so that the posteriors of all of them
+are computed at once.  The EM iterations of the greedy selection are done for
+all the candidate pronunciation-probability vectors of a word at once.
+"""
+
+from __future__ import division
+
+import math
+import numpy as np
+
+
+class ArcStats(object):
+    """The soft counts of the arc-stats file (lines of the form
+    <word> <utt-id> <start-frame> <count> <phones>), stored per word as a
+    sparse matrix whose rows are the examples of the word (the distinct
+    (utt-id, start-frame) pairs) and whose columns are pronunciations.
+
+    The entries of word w are entries word_offsets[w] to word_offsets[w+1]-1
+    of the arrays entry_examples (the row, i.e. the index of the example of
+    the word), entry_prons (the column, as an index into self.prons) and
+    entry_counts.
+    """
+
+    def __init__(self):
+        self.words = []
+        self.word_to_index = {}
+        self.prons = []
+        self.pron_to_index = {}
+        self.num_examples = None
+        self.word_offsets = None
+        self.entry_examples = None
+        self.entry_prons = None
+        self.entry_counts = None
+
+    def __contains__(self, word):
+        return word in self.word_to_index
+
+    def num_examples_of_word(self, word):
+        """Returns the number of examples of 'word' (its count in the
+        training data)."""
+        return int(self.num_examples[self.word_to_index[word]])
+
+    def soft_counts(self, word, prons, floor=0.0):
+        """Returns a numpy array of shape (number of examples of 'word',
+        len(prons)) of the soft counts of the pronunciations 'prons' of the
+        word in each example, floored at 'floor'.  'prons' may contain
+        pronunciations that have no stats, and repeated pronunciations."""
+        w = self.word_to_index[word]
+        begin, end = self.word_offsets[w], self.word_offsets[w + 1]
+        examples = self.entry_examples[begin:end]
+        entry_prons = self.entry_prons[begin:end]
+        counts = self.entry_counts[begin:end]
+
+        soft_counts = np.zeros((self.num_examples[w], len(prons)))
+        for i, pron in enumerate(prons):
+            p = self.pron_to_index.get(pron)
+            if p is None:
+                continue
+            selected = (entry_prons == p)
+            soft_counts[examples[selected], i] = counts[selected]
+        return np.maximum(soft_counts, floor)
+
+
+def read_arc_stats(file_handle, filename=None):
+    """Reads an arc-stats file from the open file 'file_handle' into an
+    ArcStats object.  If a (word, utt-id, start-frame, phones) tuple appears
+    more than once, the last count is used.  'filename' is only used in error
+    messages."""
+    arc_stats = ArcStats()
+    # For each word, a dict from (utt-id, start-frame) to the example index.
+    examples = []
+    # A dict from (word-index, example-index, pron-index) to the entry
+    # index.
+    entry_index = {}
+    entry_words = []
+    entry_examples = []
+    entry_prons = []
+    entry_counts = []
+    for line in file_handle:
+        splits = line.strip().split()
+
+        if len(splits) == 0:
+            continue
+
+        if len(splits) < 5:
+            raise Exception('Invalid format of line ' + line
+                            + ' in ' + str(filename))
+        word = splits[0]
+        example = (splits[1], int(splits[2]))
+        count = float(splits[3])
+        phones = ' '.join(splits[4:])
+
+        w = arc_stats.word_to_index.get(word)
+        if w is None:
+            w = arc_stats.word_to_index[word] = len(arc_stats.words)
+            arc_stats.words.append(word)
+            examples.append({})
+        e = examples[w].setdefault(example, len(examples[w]))
+        p = arc_stats.pron_to_index.get(phones)
+        if p is None:
+            p = arc_stats.pron_to_index[phones] = len(arc_stats.prons)
+            arc_stats.prons.append(phones)
+
+        key = (w, e, p)
+        if key in entry_index:
+            entry_counts[entry_index[key]] = count
+        else:
+            entry_index[key] = len(entry_counts)
+            entry_words.append(w)
+            entry_examples.append(e)
+            entry_prons.append(p)
+            entry_counts.append(count)
+
+    entry_words = np.array(entry_words, dtype=np.int64)
+    order = np.argsort(entry_words, kind='stable')
+    arc_stats.num_examples = np.array([len(x) for x in examples],
+                                      dtype=np.int64)
+    arc_stats.word_offsets = np.searchsorted(
+        entry_words[order], np.arange(len(arc_stats.words) + 1))
+    arc_stats.entry_examples = np.array(entry_examples,
+                                        dtype=np.int64)[order]
+    arc_stats.entry_prons = np.array(entry_prons, dtype=np.int64)[order]
+    arc_stats.entry_counts = np.array(entry_counts, dtype=np.float64)[order]
+    return arc_stats
+
+
+def _sum_columns(matrix):
+    """Returns the sums over the last axis of 'matrix', added up from left to
+    right as python's sum() would do, so that the results do not depend on
+    how many pronunciations are summed."""
+    total = matrix[..., 0].copy()
+    for i in range(1, matrix.shape[-1]):
+        total += matrix[..., i]
+    return total
+
+
+def _sum_rows(matrix):
+    """Returns the sums over the first axis of 'matrix', added up from the
+    first row to the last as a python loop would do (np.sum() would use
+    pairwise summation when the other axes have a single element)."""
+    return np.cumsum(matrix, axis=0)[-1]
+
+
+_log = np.frompyfunc(math.log, 1, 1)
+
+
+def one_em_iter(soft_counts, pron_probs):
+    """One iteration of Expectation-Maximization computation (Eq. 3-4 in the
+    paper "Acoustic data-driven lexicon learning based on a greedy
+    pronunciation selection framework", Interspeech 2017), done for several
+    vectors of pronunciation probabilities at once.
+
+    Arguments:
+        soft_counts -- array of shape (num-examples, num-prons) of the
+            (floored) soft counts of the pronunciations of a word.
+        pron_probs -- array of shape (K, num-prons) of K vectors of
+            pronunciation probabilities (which need not be normalized).
+    Returns a pair (pron_probs, log_likes) of the updated probabilities,
+    of shape (K, num-prons), and the average log-likelihoods of the
+    examples (before the update), of shape (K,).
+    """
+    num_examples = soft_counts.shape[0]
+    pron_probs = pron_probs / _sum_columns(pron_probs)[:, np.newaxis]
+    # prob has shape (num-examples, K, num-prons).  The sums over the
+    # examples (axis 0) are accumulated one example after the other, and the
+    # logs are taken with math.log(), so that the log-likelihoods compared
+    # against the convergence and pruning thresholds are exactly those of a
+    # per-example loop.
+    prob = soft_counts[:, np.newaxis, :] * pron_probs[np.newaxis, :, :]
+    prob_sum = _sum_columns(prob)
+    prob_acc = _sum_rows(prob / prob_sum[:, :, np.newaxis])
+    log_like = _sum_rows(_log(prob_sum).astype(np.float64))
+    scale = 1.0 / float(num_examples)
+    return scale * prob_acc, scale * log_like
+
+
+def run_em(soft_counts, pron_probs, tolerance):
+    """Runs EM iterations (see one_em_iter()) for each row of 'pron_probs'
+    until the average log-likelihood changes by no more than 'tolerance'
+    from one iteration to the next.  Each row is iterated independently,
+    but the rows that haven't converged yet are updated together.
+
+    Returns a tuple (pron_probs, log_likes, num_iters, first_pron_probs)
+    where the last two are the number of iterations done for each row and
+    the probabilities after the first iteration.
+    """
+    pron_probs = np.array(pron_probs, dtype=np.float64, ndmin=2)
+    num_rows = pron_probs.shape[0]
+    log_likes = np.full(num_rows, 1.0)
+    log_likes_last = np.full(num_rows, -1.0)
+    num_iters = np.zeros(num_rows, dtype=np.int64)
+    first_pron_probs = None
+    active = np.arange(num_rows)
+    while len(active) > 0:
+        log_likes_last[active] = log_likes[active]
+        pron_probs[active], log_likes[active] = one_em_iter(
+            soft_counts, pron_probs[active])
+        num_iters[active] += 1
+        if first_pron_probs is None:
+            first_pron_probs = pron_probs.copy()
+        active = active[np.abs(log_likes[active] - log_likes_last[active])
+                        > tolerance]
+    return pron_probs, log_likes, num_iters, first_pron_probs
+
+
+class PronCandidates(object):
+    """The candidate pronunciations of words from the three sources (the
+    reference lexicon, G2P and phonetic-decoding), in that order, stored by
+    column.  For each candidate, 'words' and 'prons' are its word and
+    pronunciation, 'sources' is 0, 1 or 2 for the reference, G2P and
+    phonetic-decoding lexicons respectively, 'word_indexes' is the index of
+    the word in 'word_list' (the words in order of first appearance) and
+    'counts' is its soft count from the pron-stats (0 if it has none).
+    Candidates of the same word from the same source are consecutive.
+    """
+
+    def __init__(self, lexicons, stats):
+        """'lexicons' is a list of the three source lexicons (dicts from word
+        to a collection of prons), in the order of the sources; 'stats' is a
+        dict from (word, pron) to soft count."""
+        self.word_list = []
+        word_to_index = {}
+        self.words = []
+        self.prons = []
+        sources = []
+        word_indexes = []
+        counts = []
+        for source, lexicon in enumerate(lexicons):
+            for word, prons in lexicon.items():
+                for pron in prons:
+                    w = word_to_index.get(word)
+                    if w is None:
+                        w = word_to_index[word] = len(self.word_list)
+                        self.word_list.append(word)
+                    self.words.append(word)
+                    self.prons.append(pron)
+                    sources.append(source)
+                    word_indexes.append(w)
+                    counts.append(stats.get((word, pron), 0))
+        self.sources = np.array(sources, dtype=np.int64)
+        self.word_indexes = np.array(word_indexes, dtype=np.int64)
+        self.counts = np.array(counts, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.words)
+
+    def num_prons_per_source(self):
+        """Returns an array of shape (num-words, 3) of the number of candidate
+        pronunciations of each word from each source."""
+        num_prons = np.zeros((len(self.word_list), 3), dtype=np.int64)
+        np.add.at(num_prons, (self.word_indexes, self.sources), 1)
+        return num_prons
+
+    def posteriors(self, prior_counts):
+        """Returns the posteriors of the candidates, which are their soft
+        counts augmented by prior counts, normalized per word.
+        'prior_counts' is an array of shape (num-words, 3) of the total prior
+        counts of each word for each source, which are divided equally among
+        the candidates of the word from the source."""
+        num_prons = self.num_prons_per_source()
+        index = (self.word_indexes, self.sources)
+        # c is the augmented soft count (observed count + prior count)
+        c = prior_counts[index] / num_prons[index] + self.counts
+        # np.bincount() adds up the counts of each word in the order of the
+        # candidates.
+        count_sum = np.bincount(self.word_indexes, weights=c,
+                                minlength=len(self.word_list))
+        return c / count_sum[self.word_indexes]
@@ -0,0 +1,250 @@
+# Copyright 2017  Vimal Manohar
+#           2018  Capital One (Author: Zhiyuan Guan)
+# Apache 2.0
+
+""" This module contains the code shared by
+steps/segmentation/internal/sad_to_segments.py and
+steps/overlap/output_to_rttm.py, which convert frame-level labels (e.g.
+speech activity detection marks) into segments.  The labels of an utterance
+are held in a NumPy integer array and the segments in float arrays of start
+and end times, so that the per-frame work is done by NumPy rather than in
+python loops.
+"""
+
+import functools
+import operator
+import warnings
+
+import numpy as np
+
+
+def read_int_vector_ark(file_handle, filename=None, allow_empty=False):
+    """Reads a kaldi integer-vector archive in text format, e.g. the output of
+    'ali-to-phones --write-lengths=false ... ark,t:-', from the open file
+    'file_handle', and yields pairs (key, vector) where vector is a numpy
+    integer array.  Empty vectors are an error unless 'allow_empty' is True.
+    'filename' is only used in error messages.
+    """
+    for line in file_handle:
+        parts = line.split(None, 1)
+        if len(parts) == 1 and allow_empty:
+            yield parts[0], np.zeros(0, dtype=np.int64)
+            continue
+        if len(parts) < 2 or parts[1].strip() == "":
+            raise RuntimeError("Unable to parse line '{0}' in {1}"
+                               "".format(line.strip(), filename))
+        try:
+            # np.fromstring() only warns if it could not read all the text,
+            # and then returns what it read; we make that an error.
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", DeprecationWarning)
+                vector = np.fromstring(parts[1], dtype=np.int64, sep=' ')
+        except (ValueError, DeprecationWarning):
+            raise ValueError("Expecting integers in line '{0}' in {1}"
+                             "".format(line.strip(), filename))
+        yield parts[0], vector
+
+
+def _sequential_sum(values):
+    """Returns the sum of 'values' (a numpy array) accumulated from left to
+    right like 'x += value' in a python loop, so that the stats are the same
+    to the last bit as when they were accumulated that way.  (python's sum()
+    does compensated summation of floats since python 3.12.)"""
+    return functools.reduce(operator.add, values.tolist(), 0.0)
+
+
+class SegmenterStats(object):
+    """Stores stats about the post-process stages"""
+
+    def __init__(self):
+        self.num_segments_initial = 0
+        self.num_short_segments_filtered = 0
+        self.num_merges = 0
+        self.num_segments_final = 0
+        self.initial_duration = 0.0
+        self.padding_duration = 0.0
+        self.filter_short_duration = 0.0
+        self.final_duration = 0.0
+
+    def add(self, other):
+        """Adds stats from another object"""
+        self.num_segments_initial += other.num_segments_initial
+        self.num_short_segments_filtered += other.num_short_segments_filtered
+        self.num_merges += other.num_merges
+        self.num_segments_final += other.num_segments_final
+        self.initial_duration += other.initial_duration
+        self.filter_short_duration += other.filter_short_duration
+        self.padding_duration += other.padding_duration
+        self.final_duration += other.final_duration
+
+    def __str__(self):
+        return ("num-segments-initial={num_segments_initial}, "
+                "num-short-segments-filtered={num_short_segments_filtered}, "
+                "num-merges={num_merges}, "
+                "num-segments-final={num_segments_final}, "
+                "initial-duration={initial_duration}, "
+                "filter-short-duration={filter_short_duration}, "
+                "padding-duration={padding_duration}, "
+                "final-duration={final_duration}".format(
+            num_segments_initial=self.num_segments_initial,
+            num_short_segments_filtered=self.num_short_segments_filtered,
+            num_merges=self.num_merges,
+            num_segments_final=self.num_segments_final,
+            initial_duration=self.initial_duration,
+            filter_short_duration=self.filter_short_duration,
+            padding_duration=self.padding_duration,
+            final_duration=self.final_duration))
+
+
+class Segmentation(object):
+    """Stores segmentation for an utterance: the regions whose frames have
+    the label 'label', as arrays 'start_times' and 'end_times' (in seconds).
+
+    Arguments:
+        label -- the label of the frames that make up the segments
+        valid_labels -- the labels that are allowed in the input alignment
+    """
+
+    def __init__(self, label, valid_labels):
+        self.label = label
+        self.valid_labels = np.array(sorted(valid_labels), dtype=np.int64)
+        self.start_times = None
+        self.end_times = None
+        self.stats = SegmenterStats()
+
+    def check_labels(self, alignment):
+        """Raises ValueError if 'alignment' contains labels that are not
+        in self.valid_labels."""
+        invalid = np.flatnonzero(~np.isin(alignment, self.valid_labels))
+        if len(invalid) > 0:
+            raise ValueError(
+                "Expecting labels to be one of {0}; got {1}".format(
+                    ", ".join([str(x) for x in self.valid_labels]),
+                    alignment[invalid[0]]))
+
+    def initialize_segments(self, alignment, frame_shift=0.01):
+        """Initializes segments from input alignment, a numpy integer array
+        of frame-level labels.  Each maximal run of frames with label
+        self.label becomes a segment."""
+        alignment = np.asarray(alignment)
+        assert len(alignment) > 0
+        self.check_labels(alignment)
+
+        # run_starts are the indexes of the first frames of the runs of
+        # identical labels.
+        run_starts = np.concatenate(
+            ([0], np.flatnonzero(np.diff(alignment)) + 1))
+        run_ends = np.append(run_starts[1:], len(alignment))
+        selected = alignment[run_starts] == self.label
+        run_starts = run_starts[selected]
+        run_ends = run_ends[selected]
+
+        self.start_times = run_starts.astype(np.float64) * frame_shift
+        self.end_times = run_ends.astype(np.float64) * frame_shift
+        self.stats.initial_duration += _sequential_sum(
+            (run_ends - run_starts).astype(np.float64) * frame_shift)
+
+        self.stats.num_segments_initial = len(self.start_times)
+        self.stats.num_segments_final = len(self.start_times)
+        self.stats.final_duration = self.stats.initial_duration
+
+    def filter_short_segments(self, min_dur):
+        """Filters out segments with durations shorter than 'min_dur'."""
+        if min_dur <= 0:
+            return
+
+        durations = self.end_times - self.start_times
+        short = durations < min_dur
+        self.stats.filter_short_duration += _sequential_sum(durations[short])
+        self.stats.num_short_segments_filtered += int(np.count_nonzero(short))
+        self.start_times = self.start_times[~short]
+        self.end_times = self.end_times[~short]
+        self.stats.num_segments_final = len(self.start_times)
+        self.stats.final_duration -= self.stats.filter_short_duration
+
+    def pad_segments(self, segment_padding, max_duration=float("inf")):
+        """Pads segments by duration 'segment_padding' on either sides, but
+        ensures that the segments don't go beyond the neighboring segments
+        or the duration of the utterance 'max_duration'.  A segment's start
+        may not go before the padded end of the previous segment, and its end
+        may not go beyond the unpadded start of the next segment."""
+        if max_duration is None:
+            max_duration = float("inf")
+        num_segments = len(self.start_times)
+        if num_segments == 0:
+            return
+        starts = self.start_times
+        ends = self.end_times
+
+        # Padding must not take the segment start to before the beginning of
+        # the utterance.
+        padded_starts = starts - segment_padding
+        before_zero = padded_starts < 0.0
+        left_terms = np.where(before_zero, padded_starts, 0.0)
+        padded_starts = np.where(before_zero, 0.0, padded_starts)
+
+        # Padding must not take the segment end beyond the max duration of
+        # the utterance, or beyond the start of the next segment.
+        padded_ends = ends + segment_padding
+        beyond_max = padded_ends >= max_duration
+        max_terms = np.where(beyond_max, padded_ends - max_duration, 0.0)
+        padded_ends = np.where(beyond_max, max_duration, padded_ends)
+        next_starts = np.append(starts[1:], np.inf)
+        beyond_next = padded_ends > next_starts
+        next_terms = np.where(beyond_next, padded_ends - next_starts, 0.0)
+        padded_ends = np.where(beyond_next, next_starts, padded_ends)
+
+        # ... and the segment start must not go before the end of the
+        # previous segment (after that was padded).
+        prev_ends = np.concatenate(([-np.inf], padded_ends[:-1]))
+        before_prev = prev_ends > padded_starts
+        prev_terms = np.where(before_prev, prev_ends - padded_starts, 0.0)
+        padded_starts = np.where(before_prev, prev_ends, padded_starts)
+
+        # The padding stats are accumulated in the order the adjustments
+        # are made to each segment in turn.
+        terms = np.empty((num_segments, 6))
+        terms[:, 0] = segment_padding
+        terms[:, 1] = left_terms
+        terms[:, 2] = -prev_terms
+        terms[:, 3] = segment_padding
+        terms[:, 4] = -max_terms
+        terms[:, 5] = -next_terms
+        self.stats.padding_duration += _sequential_sum(terms.ravel())
+
+        self.start_times = padded_starts
+        self.end_times = padded_ends
+        self.stats.final_duration += self.stats.padding_duration
+
+    def merge_consecutive_segments(self, max_dur):
+        """Merge consecutive segments (happens after padding), provided that
+        the merged segment is no longer than 'max_dur'."""
+        if max_dur <= 0 or len(self.start_times) == 0:
+            return
+
+        # Only segments that start at the same time the previous one ends can
+        # be merged; the merging within each run of touching segments is
+        # greedy from the left, which is done in a loop over the segments.
+        touching = (self.start_times[1:] == self.end_times[:-1]).tolist()
+        starts = self.start_times.tolist()
+        ends = self.end_times.tolist()
+        merged_starts = [starts[0]]
+        merged_ends = [ends[0]]
+        for i in range(1, len(starts)):
+            if touching[i - 1] and ends[i] - merged_starts[-1] <= max_dur:
+                # The merged segment is shorter than 'max_dur'.
+                # Extend the previous segment.
+                merged_ends[-1] = ends[i]
+                self.stats.num_merges += 1
+            else:
+                merged_starts.append(starts[i])
+                merged_ends.append(ends[i])
+
+        self.start_times = np.array(merged_starts)
+        self.end_times = np.array(merged_ends)
+        self.stats.num_segments_final = len(self.start_times)
+
+    def segments(self):
+        """Returns the segments as a list of pairs (start-time, end-time) of
+        python floats."""
+        return list(zip(self.start_times.tolist(), self.end_times.tolist()))
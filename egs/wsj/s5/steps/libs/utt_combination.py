@@ -0,0 +1,349 @@
+# Copyright 2016  Vijayaditya Peddinti
+#           2016  Johns Hopkins University (author: Daniel Povey)
+# Apache 2.0
+
+""" This module contains the planning of which consecutive utterances to
+combine so that the combined utterances have a minimum duration.  It is
+shared by utils/data/internal/choose_utts_to_combine.py (called from
+utils/data/combine_short_segments.sh) and the deprecated
+steps/cleanup/combine_short_segments.py, which use different strategies for
+choosing the neighbours to combine with.
+
+A plan is returned as a NumPy integer array of group boundaries: group k
+consists of the utterances with indexes boundaries[k] to
+boundaries[k + 1] - 1, so e.g. [0, 1, 3] means that the first utterance is on
+its own and the second and third are combined.  The utterances of different
+speakers are planned independently, optionally in several processes.
+"""
+
+from __future__ import division
+import multiprocessing
+
+import numpy as np
+
+
+def less_than(x, y):
+    """This less_than is designed to be impervious to roundoff effects in
+    cases where numbers are really always separated by a distance >> 1.0e-05.
+    It will return false if x and y are almost identical, differing only by
+    roundoff effects."""
+    return x < y - 1.0e-5
+
+
+def boundaries_to_ranges(boundaries):
+    """Returns the groups of the plan 'boundaries' as a list of
+    (start, end) pairs."""
+    boundaries = np.asarray(boundaries).tolist()
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def combine_list(min_duration, durations):
+    """This function implements the core of the utterance-combination code of
+    choose_utts_to_combine.py.  The input 'durations' is a list (or array) of
+    durations, which must all be > 0.0.  This function tries to combine
+    consecutive indexes into groups such that for each group, the total
+    duration is at least 'min_duration', and returns the group boundaries.
+
+    For example, combine_list(0.1, [5.0, 6.0, 7.0]) would return [0, 1, 2, 3]
+    because no combination is necessary; combine_list(1.0, [0.5, 0.6, 0.7])
+    would return [0, 3] and combine_list(1.0, [0.5, 0.6, 1.7]) would return
+    [0, 2, 3].  Note: if sum(durations) < min_duration, this function will
+    return everything in one group but of course the sum of durations will be
+    less than the total.
+
+    The groups that are below the minimum duration are processed from the
+    last to the first (a group that is still too short after combining with
+    its right neighbour is processed again straight away); only the short
+    groups are visited, and each combination takes time proportional to the
+    size of the group that is absorbed.
+    """
+    durations = list(durations)
+    assert min_duration >= 0.0 and min(durations) > 0.0
+    num_utts = len(durations)
+
+    queue = [ i for i in range(num_utts)
+              if less_than(durations[i], min_duration) ]
+    if len(queue) == 0:
+        return np.arange(num_utts + 1)
+
+    # if utterance-index i currently corresponds to the start of a group
+    # of utterances, then group_durations[i] is the total duration of
+    # that utterance-group, and group_end[i] is its end-index (i.e. last index
+    # plus one); otherwise they are undefined.
+    group_durations = list(durations)
+    group_end = list(range(1, num_utts + 1))
+    # is_start[i] is true if utterance-index i is the start of a group.
+    is_start = [True] * num_utts
+    # if utterance-index i currently is the last index of a group, then
+    # last_to_start[i] is the start-index of that group, otherwise undefined.
+    last_to_start = list(range(num_utts))
+
+    while len(queue) > 0:
+        i = queue.pop()
+        if not is_start[i] or not less_than(group_durations[i], min_duration):
+            # this group no longer exists or already has at least the minimum
+            # duration.
+            continue
+        this_dur = group_durations[i]
+        # left_dur is the duration of the group to the left of this group,
+        # or 0.0 if there is no such group.
+        left_dur = group_durations[last_to_start[i - 1]] if i > 0 else 0.0
+        # right_dur is the duration of the group to the right of this group,
+        # or 0.0 if there is no such group.
+        right_dur = (group_durations[group_end[i]]
+                     if group_end[i] < num_utts else 0.0)
+
+        if left_dur == 0.0 and right_dur == 0.0:
+            # there is only one group.  Nothing more to merge; break
+            assert i == 0 and group_end[i] == num_utts
+            break
+        # work out whether to combine left or right,
+        # by means of the combine_left variable [ True or False ]
+        if left_dur == 0.0:
+            combine_left = False
+        elif right_dur == 0.0:
+            combine_left = True
+        elif less_than(left_dur + this_dur, min_duration):
+            # combining left would still be below the minimum duration->
+            # combine right... if it's above the min duration then good;
+            # otherwise it still doesn't really matter so we might as well
+            # pick one.
+            combine_left = False
+        elif less_than(right_dur + this_dur, min_duration):
+            # combining right would still be below the minimum duration,
+            # and combining left would be >= the min duration (else we
+            # wouldn't have reached this line) -> combine left.
+            combine_left = True
+        elif less_than(left_dur, right_dur):
+            # if we reached here then combining either way would take us >=
+            # the minimum duration; but if left_dur < right_dur then we
+            # combine left because that would give us more evenly sized
+            # segments.
+            combine_left = True
+        else:
+            # if we reached here then combining either way would take us >=
+            # the minimum duration; but left_dur >= right_dur, so we combine
+            # right because that would give us more evenly sized segments.
+            combine_left = False
+
+        if combine_left:
+            new_group_start = last_to_start[i - 1]
+            end = group_end[i]
+            group_end[new_group_start] = end
+            last_to_start[end - 1] = new_group_start
+            is_start[i] = False
+            # the durations are added one utterance at a time rather than
+            # group by group; this affects the roundoff, and so the choices.
+            for j in range(i, end):
+                group_durations[new_group_start] += durations[j]
+            # note: there is no need to add new_group_start to the queue even
+            # if it is still below the minimum length, because it would have
+            # previously had to have been below the minimum length, therefore
+            # it would already be in the queue.
+        else:
+            # group start doesn't change, group end changes.
+            old_group_end = group_end[i]
+            new_group_end = group_end[old_group_end]
+            group_end[i] = new_group_end
+            last_to_start[new_group_end - 1] = i
+            is_start[old_group_end] = False
+            for j in range(old_group_end, new_group_end):
+                group_durations[i] += durations[j]
+            if less_than(group_durations[i], min_duration):
+                # the group starting at i is still below the minimum length,
+                # so we need to put it back on the queue.
+                queue.append(i)
+
+    boundaries = [0]
+    while boundaries[-1] < num_utts:
+        boundaries.append(group_end[boundaries[-1]])
+    return np.array(boundaries, dtype=np.int64)
+
+
+def _get_combined_index_range(index, durations, minimum_duration):
+    """Returns a tuple (left_index, right_index, duration) of the range of
+    items of 'durations' around item 'index' to combine in
+    plan_short_segment_combination(), and their combined duration.  We want
+    the minimum number of concatenations to reach the minimum_duration.  If
+    two concatenations satisfy the minimum duration constraint we choose the
+    shorter one."""
+    num_items = len(durations)
+    left_index = index - 1
+    right_index = index + 1
+    num_remaining_segments = num_items - 1
+    cur_dur = durations[index]
+
+    while num_remaining_segments > 0:
+        left_dur = durations[left_index] if left_index >= 0 else 0
+        right_dur = durations[right_index] if right_index < num_items else 0
+
+        right_combined_dur = cur_dur + right_dur
+        left_combined_dur = cur_dur + left_dur
+        left_right_combined_dur = cur_dur + left_dur + right_dur
+
+        combine_left_exit = False
+        combine_right_exit = False
+        if right_combined_dur >= minimum_duration:
+            if left_combined_dur >= minimum_duration:
+                if left_combined_dur <= right_combined_dur:
+                    combine_left_exit = True
+                else:
+                    combine_right_exit = True
+            else:
+                combine_right_exit = True
+        elif left_combined_dur >= minimum_duration:
+            combine_left_exit = True
+        elif left_right_combined_dur >= minimum_duration:
+            combine_left_exit = True
+            combine_right_exit = True
+
+        if combine_left_exit and combine_right_exit:
+            cur_dur = left_right_combined_dur
+            break
+        elif combine_left_exit:
+            cur_dur = left_combined_dur
+            # move back the right_index as we don't need to combine it
+            right_index = right_index - 1
+            break
+        elif combine_right_exit:
+            cur_dur = right_combined_dur
+            # move back the left_index as we don't need to combine it
+            left_index = left_index + 1
+            break
+
+        # couldn't satisfy minimum duration requirement so continue search
+        if left_index >= 0:
+            num_remaining_segments = num_remaining_segments - 1
+        if right_index < num_items:
+            num_remaining_segments = num_remaining_segments - 1
+
+        left_index = left_index - 1
+        right_index = right_index + 1
+
+        cur_dur = left_right_combined_dur
+    left_index = max(0, left_index)
+    right_index = min(num_items - 1, right_index)
+    return left_index, right_index, cur_dur
+
+
+def plan_short_segment_combination(minimum_duration, durations):
+    """This implements the strategy of steps/cleanup/combine_short_segments.py:
+    the utterances (of a speaker, in order) are scanned from left to right,
+    and each one shorter than 'minimum_duration' is combined with the fewest
+    neighbours (the combination being treated as one utterance from then on)
+    needed to reach the minimum duration.
+
+    Returns a pair (boundaries, num_unsatisfied) where 'num_unsatisfied' is
+    the number of times an utterance could not be brought up to the minimum
+    duration, in which case it was left as it was.
+    """
+    # the durations and end-indexes of the current items, each of which
+    # is an utterance or a combination of consecutive utterances.
+    items = list(durations)
+    item_ends = list(range(1, len(items) + 1))
+    num_unsatisfied = 0
+    index = 0
+    while index < len(items):
+        if items[index] < minimum_duration:
+            left_index, right_index, cur_dur = _get_combined_index_range(
+                index, items, minimum_duration)
+            if not cur_dur >= minimum_duration:
+                num_unsatisfied += 1
+                index = index + 1
+                continue
+            combined_duration = 0
+            for duration in items[left_index:right_index + 1]:
+                combined_duration += duration
+            assert cur_dur == combined_duration
+            items[left_index:right_index + 1] = [combined_duration]
+            item_ends[left_index:right_index + 1] = [item_ends[right_index]]
+            index = left_index
+        index = index + 1
+    return np.array([0] + item_ends, dtype=np.int64), num_unsatisfied
+
+
+def group_durations(durations, boundaries):
+    """Returns a list of the durations of the groups of the plan 'boundaries',
+    each of which is the sum() of the durations of its utterances."""
+    durations = np.asarray(durations, dtype=np.float64)
+    boundaries = np.asarray(boundaries)
+    # the duration of a group of one utterance is that of the utterance.
+    ans = durations[boundaries[:-1]].tolist()
+    durations = durations.tolist()
+    for k in np.flatnonzero(np.diff(boundaries) > 1).tolist():
+        ans[k] = sum(durations[boundaries[k]:boundaries[k + 1]])
+    return ans
+
+
+def _plan_speakers(args):
+    plan_function, min_duration, durations_list = args
+    return [plan_function(min_duration, durations)
+            for durations in durations_list]
+
+
+def plan_per_speaker(plan_function, min_duration, durations, speaker_offsets,
+                     num_jobs=1):
+    """Plans the combination of the utterances of each speaker separately.
+    'durations' is a numpy array of the durations of all the utterances,
+    speaker by speaker: those of speaker s are speaker_offsets[s] to
+    speaker_offsets[s + 1] - 1.  plan_function is e.g. combine_list or
+    plan_short_segment_combination.
+
+    Returns a list with, for each speaker, the result of
+    plan_function(min_duration, durations-of-the-speaker), or None if none of
+    the speaker's utterances is shorter than min_duration, in which case there
+    is nothing to combine.  If num_jobs > 1, the speakers are divided into
+    chunks that are planned by that many processes.
+    """
+    durations = np.asarray(durations, dtype=np.float64)
+    speaker_offsets = np.asarray(speaker_offsets, dtype=np.int64)
+    num_speakers = len(speaker_offsets) - 1
+    # num_short[s] is the number of utterances of speaker s shorter than
+    # min_duration.
+    short_start = np.concatenate(([0], np.cumsum(durations < min_duration)))
+    num_short = short_start[speaker_offsets[1:]] - short_start[
+        speaker_offsets[:-1]]
+    speakers = np.flatnonzero(num_short > 0).tolist()
+    durations = durations.tolist()
+    durations_list = [durations[speaker_offsets[s]:speaker_offsets[s + 1]]
+                      for s in speakers]
+
+    if num_jobs <= 1 or len(durations_list) <= 1:
+        results = _plan_speakers((plan_function, min_duration,
+                                  durations_list))
+    else:
+        num_chunks = min(len(durations_list), 4 * num_jobs)
+        chunk_size = (len(durations_list) + num_chunks - 1) // num_chunks
+        chunks = [(plan_function, min_duration,
+                   durations_list[i:i + chunk_size])
+                  for i in range(0, len(durations_list), chunk_size)]
+        pool = multiprocessing.Pool(processes=num_jobs)
+        try:
+            results = [result for chunk in pool.map(_plan_speakers, chunks)
+                       for result in chunk]
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    plans = [None] * num_speakers
+    for s, result in zip(speakers, results):
+        plans[s] = result
+    return plans
+
+
+def concatenate_plans(plans, speaker_offsets):
+    """Given the plans of the utterances of each speaker as returned by
+    plan_per_speaker() (with None meaning that every utterance of the speaker
+    is on its own), returns the boundaries of the groups of all the
+    utterances, speaker by speaker."""
+    speaker_offsets = np.asarray(speaker_offsets, dtype=np.int64)
+    is_boundary = np.ones(speaker_offsets[-1] + 1, dtype=bool)
+    for s, plan in enumerate(plans):
+        if plan is not None:
+            start, end = speaker_offsets[s], speaker_offsets[s + 1]
+            is_boundary[start + 1:end] = False
+            is_boundary[start + np.asarray(plan)] = True
+    return np.flatnonzero(is_boundary)
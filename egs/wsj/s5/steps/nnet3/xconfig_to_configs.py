@@ -100,43 +100,37 @@ def write_expanded_xconfig_files(config_dir, all_layers):
     """ This functions writes config_dir/xconfig.expanded.1 and
     config_dir/xconfig.expanded.2, showing some of the internal stages of
     processing the xconfig file before turning it into config files.
+    Both files are written in one pass over the layers.
     """
-    try:
-        xconfig_file_out = open(config_dir + '/xconfig.expanded.1', 'w')
-    except:
-        raise Exception('{0}: error opening file '
-                        '{1}/xconfig.expanded.1 for output'.format(
-                            sys.argv[0], config_dir))
+    xconfig_files_out = []
+    for i in [1, 2]:
+        try:
+            xconfig_files_out.append(
+                open(config_dir + '/xconfig.expanded.{0}'.format(i), 'w'))
+        except:
+            raise Exception('{0}: error opening file '
+                            '{1}/xconfig.expanded.{2} for output'.format(
+                                sys.argv[0], config_dir, i))
 
     print('# This file was created by the command:\n'
           '# ' + ' '.join(sys.argv) + '\n'
           '#It contains the same content as ./xconfig but it was parsed and\n'
           '#default config values were set.\n'
-          '# See also ./xconfig.expanded.2\n', file=xconfig_file_out)
-
-    for layer in all_layers:
-        print('{}'.format(layer), file=xconfig_file_out)
-    xconfig_file_out.close()
-
-    try:
-        xconfig_file_out = open(config_dir + '/xconfig.expanded.2', 'w')
-    except:
-        raise Exception('{0}: error opening file '
-                        '{1}/xconfig.expanded.2 for output'.format(
-                            sys.argv[0], config_dir))
-
+          '# See also ./xconfig.expanded.2\n', file=xconfig_files_out[0])
     print('# This file was created by the command:\n'
           '# ' + ' '.join(sys.argv) + '\n'
           '# It contains the same content as ./xconfig but it was parsed,\n'
           '# default config values were set, \n'
           '# and Descriptors (input=xxx) were normalized.\n'
           '# See also ./xconfig.expanded.1\n',
-          file=xconfig_file_out)
+          file=xconfig_files_out[1])
 
     for layer in all_layers:
+        print('{}'.format(layer), file=xconfig_files_out[0])
         layer.normalize_descriptors()
-        print('{}'.format(layer), file=xconfig_file_out)
-    xconfig_file_out.close()
+        print('{}'.format(layer), file=xconfig_files_out[1])
+    for xconfig_file_out in xconfig_files_out:
+        xconfig_file_out.close()
 
 
 def get_config_headers():
@@ -178,14 +172,20 @@ def write_config_files(config_dir, all_layers):
     # config, as a string (i.e. 'ref', 'all', 'init') to a list of
     # strings representing lines to put in the config file.
     config_basename_to_lines = defaultdict(list)
+    # the number of lines starting with 'output-node' in each config.
+    config_basename_to_num_output_nodes = defaultdict(int)
 
     config_basename_to_header = get_config_headers()
 
+    # All the configs ('ref', 'final', 'init' and so on) are produced in one
+    # pass over the layers.
     for layer in all_layers:
         try:
             pairs = layer.get_full_config()
             for config_basename, line in pairs:
                 config_basename_to_lines[config_basename].append(line)
+                if line.startswith('output-node'):
+                    config_basename_to_num_output_nodes[config_basename] += 1
         except Exception as e:
             print("{0}: error producing config lines from xconfig "
                   "line '{1}': error was: {2}".format(sys.argv[0],
@@ -203,9 +203,7 @@ def write_config_files(config_dir, all_layers):
 
     for basename, lines in config_basename_to_lines.items():
         # check the lines num start with 'output-node':
-        num_output_node_lines = sum( [ 1 if line.startswith('output-node' ) else 0
-                                       for line in lines ] )
-        if num_output_node_lines == 0:
+        if config_basename_to_num_output_nodes[basename] == 0:
             if basename == 'init':
                 continue # do not write the init.config
             else:
@@ -20,6 +20,8 @@ speaker_only=false  # If true, utterances are only combined from the same speake
                     # It may be useful for the speaker recognition task.
                     # If false, utterances are preferentially combined from the same speaker,
                     # and then combined across different speakers.
+nj=1                # Number of processes used to choose the utterances to
+                    # combine.
 # end configuration section
 
 
@@ -32,6 +34,7 @@ if [ $# != 3 ]; then
   echo " $0 data/train 1.55 data/train_comb"
   echo " Options:"
   echo "  --speaker-only <true|false>  # options to internal/choose_utts_to_combine.py, default false."
+  echo "  --nj <num-jobs>              # number of processes used by internal/choose_utts_to_combine.py, default 1."
   exit 1;
 fi
 
@@ -78,7 +81,7 @@ set -o pipefail
 utils/data/get_utt2dur.sh $srcdir
 
 utils/data/internal/choose_utts_to_combine.py --min-duration=$min_seg_len \
-  --merge-within-speakers-only=$speaker_only \
+  --merge-within-speakers-only=$speaker_only --num-jobs=$nj \
   $srcdir/spk2utt $srcdir/utt2dur $dir/utt2utts $dir/utt2spk $dir/utt2dur
 
 utils/utt2spk_to_spk2utt.pl < $dir/utt2spk > $dir/spk2utt
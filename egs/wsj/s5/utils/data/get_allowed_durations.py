@@ -19,6 +19,7 @@ import logging
 
 sys.path.insert(0, 'steps')
 import libs.common as common_lib
+import libs.data_dir as data_dir_lib
 
 logger = logging.getLogger('libs')
 logger.setLevel(logging.INFO)
@@ -86,21 +87,6 @@ def get_args():
     return args
 
 
-def read_kaldi_mapfile(path):
-    """ Read any Kaldi mapping file - like text, .scp files, etc.
-    """
-
-    m = {}
-    with open(path, 'r', encoding='latin-1') as f:
-        for line in f:
-            line = line.strip(" \t\r\n")
-            sp_pos = line.find(' ')
-            key = line[:sp_pos]
-            val = line[sp_pos+1:]
-            m[key] = val
-    return m
-
-
 def find_duration_range(utt2dur, coverage_factor):
     """Given a list of utterance durations, find the start and end duration to cover
 
@@ -196,7 +182,8 @@ def get_trivial_allowed_durations(utt2dur, args):
 
 def main():
     args = get_args()
-    utt2dur = read_kaldi_mapfile(os.path.join(args.data_dir, 'utt2dur'))
+    utt2dur = data_dir_lib.DataDir(args.data_dir,
+                                   encoding='latin-1').get_durations().unique()
 
     if args.factor == 0.0:
         get_trivial_allowed_durations(utt2dur, args)
@@ -11,6 +11,9 @@ import sys
 import os
 from collections import defaultdict
 
+sys.path.insert(0, 'steps')
+import libs.utt_combination as utt_combination_lib
+
 
 parser = argparse.ArgumentParser(description="""
 This script, called from data/utils/combine_short_segments.sh, chooses consecutive
@@ -43,6 +46,9 @@ parser.add_argument("--merge-within-speakers-only", type = str, default = 'false
                     "It may be useful for the speaker recognition task."
                     "If false, utterances are preferentially combined from the same speaker,"
                     "and then combined across different speakers.")
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help="Number of processes used to combine the utterances "
+                    "of the speakers.")
 parser.add_argument("spk2utt_in", type = str, metavar = "<spk2utt-in>",
                     help="Filename of [input] speaker to utterance map needed "
                     "because this script tries to merge utterances from the "
@@ -62,128 +68,19 @@ parser.add_argument("utt2dur_out", type = str, metavar = "<utt2spk-out>",
                     "the durations of the source utterances.")
 
 
-args = parser.parse_args()
-
 
-# This LessThan is designed to be impervious to roundoff effects in cases where
-# numbers are really always separated by a distance >> 1.0e-05.  It will return
-# false if x and y are almost identical, differing only by roundoff effects.
-def LessThan(x, y):
-    return x < y - 1.0e-5
+LessThan = utt_combination_lib.less_than
 
 
-# This function implements the core of the utterance-combination code.
-# The input 'durations' is a list of durations, which must all be
-# >=0.0  This function tries to combine consecutive indexes
-# into groups such that for each group, the total duration is at
-# least 'min_duration'.  It returns a list of (start,end) indexes.
-# For example, CombineList(0.1, [5.0,6.0,7.0]) would return
-# [ (0,1), (1,2), (2,3) ] because no combination is necessary; each
-# returned pair represents a singleton group.
-# Or CombineList(1.0, [0.5, 0.6, 0.7]) would return
-# [ (0,3) ].
-# Or CombineList(1.0, [0.5, 0.6, 1.7]) would return
-# [ (0,2), (2,3) ].
-# Note: if sum(durations) < min_duration, this function will
-# return everything in one group but of course the sum of durations
-# will be less than the total.
+# CombineList(min_duration, durations) returns the list of (start,end) indexes
+# of the groups of consecutive utterances that utt_combination_lib.combine_list()
+# chooses to combine so that each group has a duration of at least
+# 'min_duration'.  For example, CombineList(0.1, [5.0,6.0,7.0]) would return
+# [ (0,1), (1,2), (2,3) ] because no combination is necessary; each returned
+# pair represents a singleton group.
 def CombineList(min_duration, durations):
-    assert min_duration >= 0.0 and min(durations) > 0.0
-
-    num_utts = len(durations)
-
-    # for each utterance-index i, group_start[i] gives us the
-    # start-index of the group of utterances of which it's currently
-    # a member.
-    group_start = list(range(num_utts))
-    # if utterance-index i currently corresponds to the start of a group
-    # of utterances, then group_durations[i] is the total duration of
-    # that utterance-group, otherwise undefined.
-    group_durations = list(durations)
-    # if utterance-index i currently corresponds to the start of a group
-    # of utterances, then group_end[i] is the end-index (i.e. last index plus one
-    # of that utterance-group, otherwise undefined.
-    group_end = [ x + 1 for x in range(num_utts) ]
-
-    queue = [ i for i in range(num_utts) if LessThan(group_durations[i], min_duration) ]
-
-    while len(queue) > 0:
-        i = queue.pop()
-        if group_start[i] != i or not LessThan(group_durations[i], min_duration):
-            # this group no longer exists or already has at least the minimum duration.
-            continue
-        this_dur = group_durations[i]
-        # left_dur is the duration of the group to the left of this group,
-        # or 0.0 if there is no such group.
-        left_dur = group_durations[group_start[i-1]] if i > 0 else 0.0
-        # right_dur is the duration of the group to the right of this group,
-        # or 0.0 if there is no such group.
-        right_dur = group_durations[group_end[i]] if group_end[i] < num_utts else 0.0
-
-
-        if left_dur == 0.0 and right_dur == 0.0:
-            # there is only one group.  Nothing more to merge; break
-            assert group_start[i] == 0 and group_end[i] == num_utts
-            break
-        # work out whether to combine left or right,
-        # by means of the combine_left variable [ True or False ]
-        if left_dur == 0.0:
-            combine_left = False
-        elif right_dur == 0.0:
-            combine_left = True
-        elif LessThan(left_dur + this_dur, min_duration):
-            # combining left would still be below the minimum duration->
-            # combine right... if it's above the min duration then good;
-            # otherwise it still doesn't really matter so we might as well
-            # pick one.
-            combine_left = False
-        elif LessThan(right_dur + this_dur, min_duration):
-            # combining right would still be below the minimum duration,
-            # and combining left would be >= the min duration (else we wouldn't
-            # have reached this line) -> combine left.
-            combine_left = True
-        elif LessThan(left_dur, right_dur):
-            # if we reached here then combining either way would take us >= the
-            # minimum duration; but if left_dur < right_dur then we combine left
-            # because that would give us more evenly sized segments.
-            combine_left = True
-        else:
-            # if we reached here then combining either way would take us >= the
-            # minimum duration; but  left_dur >= right_dur, so we combine right
-            # because that would give us more evenly sized segments.
-            combine_left = False
-
-        if combine_left:
-            assert left_dur != 0.0
-            new_group_start = group_start[i-1]
-            group_end[new_group_start] = group_end[i]
-            for j in range(group_start[i], group_end[i]):
-                group_start[j] = new_group_start
-                group_durations[new_group_start] += durations[j]
-            # note: there is no need to add group_durations[new_group_start] to
-            # the queue even if it is still below the minimum length, because it
-            # would have previously had to have been below the minimum length,
-            # therefore it would already be in the queue.
-        else:
-            assert right_dur != 0.0
-            # group start doesn't change, group end changes.
-            old_group_end = group_end[i]
-            new_group_end = group_end[old_group_end]
-            group_end[i] = new_group_end
-            for j in range(old_group_end, new_group_end):
-                group_durations[i] += durations[j]
-                group_start[j] = i
-            if LessThan(group_durations[i], min_duration):
-                # the group starting at i is still below the minimum length, so
-                # we need to put it back on the queue.
-                queue.append(i)
-
-    ans = []
-    cur_group_start = 0
-    while cur_group_start < num_utts:
-        ans.append( (cur_group_start, group_end[cur_group_start]) )
-        cur_group_start = group_end[cur_group_start]
-    return ans
+    return utt_combination_lib.boundaries_to_ranges(
+        utt_combination_lib.combine_list(min_duration, durations))
 
 def SelfTest():
     assert CombineList(0.1, [5.0, 6.0, 7.0]) == [ (0,1), (1,2), (2,3) ]
@@ -226,33 +123,39 @@ def SelfTest():
 # If true, then utterances are only combined if they belong to the same speaker.
 # 'spk2utt' which is a list of pairs (speaker-id, [list-of-utterances])
 # 'utt2dur' which is a dict from utterance-id to duration (as a float)
-# It returns a lists of lists of utterances; each list corresponds to
-# a group, e.g.
-# [ ['utt1'], ['utt2', 'utt3'] ]
-def GetUtteranceGroups(min_duration, merge_within_speakers_only, spk2utt, utt2dur):
-    # utt_groups will be a list of lists of utterance-ids formed from the
-    # first pass of combination.
-    utt_groups = []
-    # group_durations will be the durations of the corresponding elements of
-    # 'utt_groups'.
-    group_durations = []
-
-    # This block calls CombineList for the utterances of each speaker
-    # separately, in the 'first pass' of combination.
-    for i in range(len(spk2utt)):
-        (spk, utts) = spk2utt[i]
-        durations = [] # durations for this group of utts.
-        for utt in utts:
+# 'num_jobs' which is the number of processes used for the speakers.
+# It returns a pair (utts, boundaries) where 'utts' is the list of all the
+# utterances of 'spk2utt', in order, and 'boundaries' is a numpy array of
+# the boundaries of the groups of consecutive elements of 'utts': the k'th
+# group is utts[boundaries[k]:boundaries[k+1]].
+def GetUtteranceGroups(min_duration, merge_within_speakers_only, spk2utt, utt2dur,
+                       num_jobs = 1):
+    utts = []
+    # durations will be the durations of the utterances in 'utts', and the
+    # utterances of the i'th speaker are utts[speaker_offsets[i]] to
+    # utts[speaker_offsets[i+1] - 1].
+    durations = []
+    speaker_offsets = [ 0 ]
+    for (spk, spk_utts) in spk2utt:
+        for utt in spk_utts:
             try:
                 durations.append(utt2dur[utt])
             except:
                 sys.exit("choose_utts_to_combine.py: no duration available "
                          "in utt2dur file {0} for utterance {1}".format(
                         args.utt2dur_in, utt))
-        ranges = CombineList(min_duration, durations)
-        for start, end in ranges:  # each element of 'ranges' is a 2-tuple (start, end)
-            utt_groups.append( [ utts[i] for i in range(start, end) ])
-            group_durations.append(sum([ durations[i] for i in range(start, end) ]))
+        utts.extend(spk_utts)
+        speaker_offsets.append(len(utts))
+
+    # This block combines the utterances of each speaker separately, in the
+    # 'first pass' of combination.
+    plans = utt_combination_lib.plan_per_speaker(
+        utt_combination_lib.combine_list, min_duration, durations,
+        speaker_offsets, num_jobs)
+    boundaries = utt_combination_lib.concatenate_plans(plans, speaker_offsets)
+    # group_durations will be the durations of the groups formed from the first
+    # pass of combination.
+    group_durations = utt_combination_lib.group_durations(durations, boundaries)
 
     old_dur_sum = sum(utt2dur.values())
     new_dur_sum = sum(group_durations)
@@ -265,100 +168,98 @@ def GetUtteranceGroups(min_duration, merge_within_speakers_only, spk2utt, utt2du
     # the combination of all the utterances of one speaker were still below
     # the minimum duration.
     if merge_within_speakers_only == 'true':
-      return utt_groups
+      return utts, boundaries
     else:
-      new_utt_groups = []
-      ranges = CombineList(min_duration, group_durations)
-      for start, end in ranges:
-          # the following code is destructive of 'utt_groups' but it doesn't
-          # matter.
-          this_group = utt_groups[start]
-          for i in range(start + 1, end):
-              this_group += utt_groups[i]
-          new_utt_groups.append(this_group)
+      new_boundaries = boundaries[
+          utt_combination_lib.combine_list(min_duration, group_durations)]
       print("choose_utts_to_combine.py: combined {0} utterances to {1} utterances "
             "while respecting speaker boundaries, and then to {2} utterances "
             "with merging across speaker boundaries.".format(
-              len(utt2dur), len(utt_groups), len(new_utt_groups)),
+              len(utt2dur), len(group_durations), len(new_boundaries) - 1),
             file = sys.stderr)
-      return new_utt_groups
-
-
-SelfTest()
-
-if args.min_duration < 0.0:
-    print("choose_utts_to_combine.py: bad minium duration {0}".format(
-            args.min_duration))
-
-# spk2utt is a list of 2-tuples (speaker-id, [list-of-utterances])
-spk2utt = []
-# utt2spk is a dict from speaker-id to utternace-id.
-utt2spk = dict()
-try:
-    f = open(args.spk2utt_in)
-except:
-    sys.exit("choose_utts_to_combine.py: error opening --spk2utt={0}".format(args.spk2utt_in))
-while True:
-    line = f.readline()
-    if line == '':
-        break
-    a = line.split()
-    if len(a) < 2:
-        sys.exit("choose_utts_to_combine.py: bad line in spk2utt file: " + line)
-    spk = a[0]
-    utts = a[1:]
-    spk2utt.append((spk, utts))
-    for utt in utts:
-        if utt in utt2spk:
-            sys.exit("choose_utts_to_combine.py: utterance {0} is listed more than once"
-                     "in the spk2utt file {1}".format(utt, args.spk2utt_in))
-        utt2spk[utt] = spk
-f.close()
-
-# utt2dur is a dict from utterance-id (as a string) to duration in seconds (as a float)
-utt2dur = dict()
-try:
-    f = open(args.utt2dur_in)
-except:
-    sys.exit("choose_utts_to_combine.py: error opening utt2dur file {0}".format(args.utt2dur_in))
-while True:
-    line = f.readline()
-    if line == '':
-        break
+      return utts, new_boundaries
+
+
+def Main():
+    global args
+    args = parser.parse_args()
+
+    SelfTest()
+
+    if args.min_duration < 0.0:
+        print("choose_utts_to_combine.py: bad minium duration {0}".format(
+                args.min_duration))
+
+    # spk2utt is a list of 2-tuples (speaker-id, [list-of-utterances])
+    spk2utt = []
+    # utt2spk is a dict from speaker-id to utternace-id.
+    utt2spk = dict()
     try:
-        [ utt, dur ] = line.split()
-        dur = float(dur)
-        utt2dur[utt] = dur
+        f = open(args.spk2utt_in)
     except:
-        sys.exit("choose_utts_to_combine.py: bad line in utt2dur file {0}: {1}".format(
-                args.utt2dur_in, line))
+        sys.exit("choose_utts_to_combine.py: error opening --spk2utt={0}".format(args.spk2utt_in))
+    while True:
+        line = f.readline()
+        if line == '':
+            break
+        a = line.split()
+        if len(a) < 2:
+            sys.exit("choose_utts_to_combine.py: bad line in spk2utt file: " + line)
+        spk = a[0]
+        utts = a[1:]
+        spk2utt.append((spk, utts))
+        for utt in utts:
+            if utt in utt2spk:
+                sys.exit("choose_utts_to_combine.py: utterance {0} is listed more than once"
+                         "in the spk2utt file {1}".format(utt, args.spk2utt_in))
+            utt2spk[utt] = spk
+    f.close()
+
+    # utt2dur is a dict from utterance-id (as a string) to duration in seconds (as a float)
+    utt2dur = dict()
+    try:
+        f = open(args.utt2dur_in)
+    except:
+        sys.exit("choose_utts_to_combine.py: error opening utt2dur file {0}".format(args.utt2dur_in))
+    while True:
+        line = f.readline()
+        if line == '':
+            break
+        try:
+            [ utt, dur ] = line.split()
+            dur = float(dur)
+            utt2dur[utt] = dur
+        except:
+            sys.exit("choose_utts_to_combine.py: bad line in utt2dur file {0}: {1}".format(
+                    args.utt2dur_in, line))
 
 
-utt_groups = GetUtteranceGroups(args.min_duration, args.merge_within_speakers_only, spk2utt, utt2dur)
+    utts, boundaries = GetUtteranceGroups(args.min_duration, args.merge_within_speakers_only,
+                                          spk2utt, utt2dur, args.num_jobs)
+    utt_groups = [ utts[start:end]
+                   for start, end in utt_combination_lib.boundaries_to_ranges(boundaries) ]
 
-# set utt_group names to an array like [ 'utt1', 'utt2-comb2', 'utt4', ... ]
-utt_group_names = [ group[0] if len(group)==1 else "{0}-comb{1}".format(group[0], len(group))
-                    for group in utt_groups ]
+    # set utt_group names to an array like [ 'utt1', 'utt2-comb2', 'utt4', ... ]
+    utt_group_names = [ group[0] if len(group)==1 else "{0}-comb{1}".format(group[0], len(group))
+                        for group in utt_groups ]
 
 
-# write the utt2utts file.
-try:
-    with open(args.utt2utts_out, 'w') as f:
-        for i in range(len(utt_groups)):
-            print(utt_group_names[i], ' '.join(utt_groups[i]), file = f)
-except Exception as e:
-    sys.exit("choose_utts_to_combine.py: exception writing to "
-             "<utt2utts-out>={0}: {1}".format(args.utt2utts_out, str(e)))
-
-# write the utt2spk file.
-try:
-    with open(args.utt2spk_out, 'w') as f:
+    # write the utt2utts file.
+    try:
+        with open(args.utt2utts_out, 'w') as f:
+            f.write(''.join([ u"{0} {1}\n".format(utt_group_names[i], ' '.join(utt_groups[i]))
+                              for i in range(len(utt_groups)) ]))
+    except Exception as e:
+        sys.exit("choose_utts_to_combine.py: exception writing to "
+                 "<utt2utts-out>={0}: {1}".format(args.utt2utts_out, str(e)))
+
+    # write the utt2spk file.
+    try:
+        lines = []
         for i in range(len(utt_groups)):
             utt_group = utt_groups[i]
-            spk_list = [ utt2spk[utt] for utt in utt_group ]
-            if spk_list == [ spk_list[0] ] * len(utt_group):
-                spk = spk_list[0]
-            else:
+            spk = utt2spk[utt_group[0]]
+            if len(utt_group) > 1 and any([ utt2spk[utt] != spk for utt in utt_group ]):
                 spk2dur = defaultdict(float)
                 # spk2dur is a map from the speaker-id to the duration within this
                 # utt, that it comprises.
@@ -375,20 +276,24 @@ try:
                         longest_spk_dur = spk2dur[this_spk]
                         spk = this_spk
                 assert spk != None
-            new_utt = utt_group_names[i]
-            print(new_utt, spk, file = f)
-except Exception as e:
-    sys.exit("choose_utts_to_combine.py: exception writing to "
-             "<utt2spk-out>={0}: {1}".format(args.utt2spk_out, str(e)))
-
-# write the utt2dur file.
-try:
-    with open(args.utt2dur_out, 'w') as f:
-        for i in range(len(utt_groups)):
-            utt_name = utt_group_names[i]
-            duration = sum([ utt2dur[utt] for utt in utt_groups[i]])
-            print(utt_name, duration, file = f)
-except Exception as e:
-    sys.exit("choose_utts_to_combine.py: exception writing to "
-             "<utt2dur-out>={0}: {1}".format(args.utt2dur_out, str(e)))
-
+            lines.append(u"{0} {1}\n".format(utt_group_names[i], spk))
+        with open(args.utt2spk_out, 'w') as f:
+            f.write(''.join(lines))
+    except Exception as e:
+        sys.exit("choose_utts_to_combine.py: exception writing to "
+                 "<utt2spk-out>={0}: {1}".format(args.utt2spk_out, str(e)))
+
+    # write the utt2dur file; the durations are the sums of the durations of
+    # the utterances in each group.
+    try:
+        group_durations = utt_combination_lib.group_durations(
+            [ utt2dur[utt] for utt in utts ], boundaries)
+        with open(args.utt2dur_out, 'w') as f:
+            f.write(''.join([ u"{0} {1}\n".format(utt_group_names[i], group_durations[i])
+                              for i in range(len(utt_groups)) ]))
+    except Exception as e:
+        sys.exit("choose_utts_to_combine.py: exception writing to "
+                 "<utt2dur-out>={0}: {1}".format(args.utt2dur_out, str(e)))
+
+if __name__ == "__main__":
+    Main()
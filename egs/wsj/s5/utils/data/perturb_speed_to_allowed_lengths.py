@@ -11,12 +11,14 @@
 import argparse
 import os
 import sys
-import copy
 import math
 import logging
 
+import numpy as np
+
 sys.path.insert(0, 'steps')
 import libs.common as common_lib
+import libs.data_dir as data_dir_lib
 
 logger = logging.getLogger('libs')
 logger.setLevel(logging.INFO)
@@ -60,37 +62,34 @@ def get_args():
     args.speed_perturb = True if args.speed_perturb == 'true' else False
     return args
 
-class Utterance(object):
-    """ This class represents a Kaldi utterance
-        in a data directory like data/train
+class Utterances(object):
+    """ This class represents the Kaldi utterances in a data directory like
+        data/train, stored column-wise: the i'th utterance has id ids[i],
+        wave-file command wavefiles[i], speaker speakers[i], transcription
+        transcriptions[i] and duration durs[i] (a numpy array).
     """
 
-    def __init__(self, uid, wavefile, speaker, transcription, dur):
-        self.wavefile = (wavefile if wavefile.rstrip(" \t\r\n").endswith('|') else
-                         'cat {} |'.format(wavefile))
-        self.speaker = speaker
-        self.transcription = transcription
-        self.id = uid
-        self.dur = float(dur)
-
-    def to_kaldi_utt_str(self):
-        return self.id + " " + self.transcription
+    def __init__(self, ids, wavefiles, speakers, transcriptions, durs):
+        self.ids = ids
+        self.wavefiles = wavefiles
+        self.speakers = speakers
+        self.transcriptions = transcriptions
+        self.durs = np.asarray(durs, dtype=np.float64)
 
-    def to_kaldi_wave_str(self):
-        return self.id + " " + self.wavefile
-
-    def to_kaldi_dur_str(self):
-        return "{} {:0.3f}".format(self.id, self.dur)
+    def __len__(self):
+        return len(self.ids)
 
 
 def read_kaldi_datadir(dir):
     """ Read a data directory like
-        data/train as a list of utterances
+        data/train as an Utterances object
     """
 
+    data_dir = data_dir_lib.DataDir(dir, encoding='latin-1')
+
     # check to make sure that no segments file exists as this script won't work
     # with data directories which use a segments file.
-    if os.path.isfile(os.path.join(dir, 'segments')):
+    if data_dir.has('segments'):
         logger.info("The data directory '{}' seems to use a 'segments' file. "
                     "This script does not yet support a 'segments' file. You'll need "
                     "to use utils/data/extract_wav_segments_data_dir.sh "
@@ -99,84 +98,54 @@ def read_kaldi_datadir(dir):
         sys.exit(1)
 
     logger.info("Loading the data from {}...".format(dir))
-    utterances = []
-    wav_scp = read_kaldi_mapfile(os.path.join(dir, 'wav.scp'))
-    text = read_kaldi_mapfile(os.path.join(dir, 'text'))
-    utt2dur = read_kaldi_mapfile(os.path.join(dir, 'utt2dur'))
-    utt2spk = read_kaldi_mapfile(os.path.join(dir, 'utt2spk'))
-
-    num_fail = 0
-    for utt in wav_scp:
-        if utt in text and utt in utt2dur and utt in utt2spk:
-            utterances.append(Utterance(utt, wav_scp[utt], utt2spk[utt],
-                                  text[utt], utt2dur[utt]))
-        else:
-            num_fail += 1
-
-    if float(len(utterances)) / len(wav_scp) < 0.5:
+    wav_scp = data_dir['wav.scp'].unique()
+    ids, (wavefiles, speakers, transcriptions, durs) = \
+        data_dir_lib.join_tables([wav_scp, data_dir['utt2spk'],
+                                  data_dir['text'],
+                                  data_dir.get_durations('utt2dur')])
+    num_fail = len(wav_scp) - len(ids)
+
+    if float(len(ids)) / len(wav_scp) < 0.5:
         logger.info("More than half your data is problematic. Try "
                     "fixing using fix_data_dir.sh.")
         sys.exit(1)
 
+    wavefiles = [wavefile if wavefile.endswith('|')
+                 else 'cat {} |'.format(wavefile)
+                 for wavefile in wavefiles.tolist()]
+    utterances = Utterances(ids.tolist(), wavefiles, speakers.tolist(),
+                            transcriptions.tolist(), durs)
+
     logger.info("Successfully read {} utterances. Failed for {} "
                 "utterances.".format(len(utterances), num_fail))
     return utterances
 
 
-def read_kaldi_mapfile(path):
-    """ Read any Kaldi mapping file - like text, .scp files, etc.
-    """
-
-    m = {}
-    with open(path, 'r', encoding='latin-1') as f:
-        for line in f:
-            line = line.strip(" \t\r\n")
-            sp_pos = line.find(' ')
-            key = line[:sp_pos]
-            val = line[sp_pos+1:]
-            m[key] = val
-    return m
-
 def generate_kaldi_data_files(utterances, outdir):
-    """ Write out a list of utterances as Kaldi data files into an
+    """ Write out an Utterances object as Kaldi data files into an
         output data directory.
     """
 
     logger.info("Exporting to {}...".format(outdir))
-    speakers = {}
-
-    with open(os.path.join(outdir, 'text'), 'w', encoding='latin-1') as f:
-        for utt in utterances:
-            f.write(utt.to_kaldi_utt_str() + "\n")
-
-    with open(os.path.join(outdir, 'wav.scp'), 'w', encoding='latin-1') as f:
-        for utt in utterances:
-            f.write(utt.to_kaldi_wave_str() + "\n")
-
-    with open(os.path.join(outdir, 'utt2dur'), 'w', encoding='latin-1') as f:
-        for utt in utterances:
-            f.write(utt.to_kaldi_dur_str() + "\n")
-
-    with open(os.path.join(outdir, 'utt2spk'), 'w', encoding='latin-1') as f:
-        for utt in utterances:
-            f.write(utt.id + " " + utt.speaker + "\n")
-            if utt.speaker not in speakers:
-                speakers[utt.speaker] = [utt.id]
-            else:
-                speakers[utt.speaker].append(utt.id)
-
-    with open(os.path.join(outdir, 'spk2utt'), 'w', encoding='latin-1') as f:
-        for s in speakers:
-            f.write(s + " ")
-            for utt in speakers[s]:
-                f.write(utt + " ")
-            f.write('\n')
+
+    def write_table(filename, values, value_format="{}"):
+        data_dir_lib.DataTable(utterances.ids, values).write(
+            os.path.join(outdir, filename), value_format=value_format,
+            encoding='latin-1')
+
+    write_table('text', utterances.transcriptions)
+    write_table('wav.scp', utterances.wavefiles)
+    write_table('utt2dur', utterances.durs, value_format="{:0.3f}")
+    utt2spk = data_dir_lib.DataTable(utterances.ids, utterances.speakers)
+    utt2spk.write(os.path.join(outdir, 'utt2spk'), encoding='latin-1')
+    data_dir_lib.write_spk2utt(utt2spk, os.path.join(outdir, 'spk2utt'),
+                               encoding='latin-1')
 
     logger.info("Successfully wrote {} utterances to data "
                 "directory '{}'".format(len(utterances), outdir))
 
 def find_duration_range(utterances, coverage_factor):
-    """Given a list of utterances, find the start and end duration to cover
+    """Given the utterances, find the start and end duration to cover
 
      If we try to cover
      all durations which occur in the training set, the number of
@@ -187,23 +156,15 @@ def find_duration_range(utterances, coverage_factor):
      start_dur: int
      end_dur: int
     """
-    durs = []
-    for u in utterances:
-        durs.append(u.dur)
-    durs.sort()
-    to_ignore_dur = 0
-    tot_dur = sum(durs)
-    for d in durs:
-        to_ignore_dur += d
-        if to_ignore_dur * 100.0 / tot_dur > coverage_factor:
-            start_dur = d
-            break
-    to_ignore_dur = 0
-    for d in reversed(durs):
-        to_ignore_dur += d
-        if to_ignore_dur * 100.0 / tot_dur > coverage_factor:
-            end_dur = d
-            break
+    durs = np.sort(utterances.durs)
+    tot_dur = sum(durs.tolist())
+    # the first duration (from each side) at which the durations so far
+    # make up more than coverage_factor% of the total.
+    start_dur = durs[np.argmax(np.cumsum(durs) * 100.0 / tot_dur
+                               > coverage_factor)]
+    end_dur = durs[::-1][np.argmax(np.cumsum(durs[::-1]) * 100.0 / tot_dur
+                                   > coverage_factor)]
+    start_dur, end_dur = float(start_dur), float(end_dur)
     if start_dur < 0.3:
         start_dur = 0.3  # a hard limit to avoid too many allowed lengths --not critical
     return start_dur, end_dur
@@ -243,67 +204,79 @@ def perturb_utterances(utterances, allowed_durations, args):
     """Given a set of utterances and a set of allowed durations, generate
        an extended set of perturbed utterances (all having an allowed duration)
 
+       Up to 3 versions of each utterance are generated, in this order:
+       pv1 is speed-perturbed to the next smaller allowed duration, pv2 is
+       speed-perturbed and pv3 extended by silence to the next larger
+       allowed duration.
+
      Returns
      -------
-     perturbed_utterances: list of pertubed utterances
+     perturbed_utterances: Utterances object with the pertubed utterances
     """
 
-    perturbed_utterances = []
-    for u in utterances:
-        # find i such that: allowed_durations[i-1] <= u.dur <= allowed_durations[i]
-        # i = len(allowed_durations) --> no upper bound
-        # i = 0         --> no lower bound
-        if u.dur < allowed_durations[0]:
-            i = 0
-        elif u.dur > allowed_durations[-1]:
-            i = len(allowed_durations)
+    allowed_durations = np.asarray(allowed_durations, dtype=np.float64)
+    num_allowed = len(allowed_durations)
+    durs = utterances.durs
+
+    # find i such that: allowed_durations[i-1] <= dur <= allowed_durations[i]
+    # i = num_allowed --> no upper bound
+    # i = 0           --> no lower bound
+    i = np.searchsorted(allowed_durations, durs, side='left')
+    i[(i == 0) & (durs >= allowed_durations[0])] = 1
+
+    lower_durs = allowed_durations[np.maximum(i - 1, 0)]
+    upper_durs = allowed_durations[np.minimum(i, num_allowed - 1)]
+    with np.errstate(divide='ignore'):
+        # speeds of more than args.factor could happen for very short/long
+        # utterances
+        lower_speeds = durs / lower_durs
+        lower_ok = (np.maximum(lower_speeds, 1.0 / lower_speeds)
+                    <= args.factor)
+        upper_speeds = durs / upper_durs
+        upper_ok = (np.maximum(upper_speeds, 1.0 / upper_speeds)
+                    <= args.factor)
+
+    # we have a smaller allowed duration; if it can't be reached, the
+    # utterance is dropped altogether.
+    has_lower = (i > 0) & args.speed_perturb
+    # we have a larger allowed duration
+    has_upper = (i < num_allowed) & ~(has_lower & ~lower_ok) & upper_ok
+    ## Add two versions for the larger allowed duration:
+    ## one version is by using speed modification using sox
+    ## the other is by extending by silence
+    deltas = upper_durs - durs
+    keep = np.stack([has_lower & lower_ok,
+                     has_upper & args.speed_perturb,
+                     has_upper & (deltas > 1e-4)], axis=1)
+
+    # np.nonzero() goes through 'keep' row by row, i.e. the versions of an
+    # utterance are consecutive, as are the utterances.
+    index, versions = np.nonzero(keep)
+    index = index.tolist()
+    versions = versions.tolist()
+    lower_speeds = lower_speeds.tolist()
+    upper_speeds = upper_speeds.tolist()
+    deltas = deltas.tolist()
+
+    wavefiles = []
+    for n, v in zip(index, versions):
+        if v < 2:
+            wavefiles.append('{} sox -t wav - -t wav - speed {} | '.format(
+                utterances.wavefiles[n],
+                lower_speeds[n] if v == 0 else upper_speeds[n]))
         else:
-            i = 1
-            while i < len(allowed_durations):
-                if u.dur <= allowed_durations[i] and u.dur >= allowed_durations[i - 1]:
-                    break
-                i += 1
-
-        if i > 0 and args.speed_perturb:  # we have a smaller allowed duration
-            allowed_dur = allowed_durations[i - 1]
-            speed = u.dur / allowed_dur
-            if max(speed, 1.0/speed) > args.factor:  # this could happen for very short/long utterances
-                continue
-            u1 = copy.deepcopy(u)
-            u1.id = 'pv1-' + u.id
-            u1.speaker = 'pv1-' + u.speaker
-            u1.wavefile = '{} sox -t wav - -t wav - speed {} | '.format(u.wavefile, speed)
-            u1.dur = allowed_dur
-            perturbed_utterances.append(u1)
-
-
-        if i < len(allowed_durations):  # we have a larger allowed duration
-            allowed_dur2 = allowed_durations[i]
-            speed = u.dur / allowed_dur2
-            if max(speed, 1.0/speed) > args.factor:
-                continue
-
-            ## Add two versions for the second allowed_duration
-            ## one version is by using speed modification using sox
-            ## the other is by extending by silence
-            if args.speed_perturb:
-                u2 = copy.deepcopy(u)
-                u2.id = 'pv2-' + u.id
-                u2.speaker = 'pv2-' + u.speaker
-                u2.wavefile = '{} sox -t wav - -t wav - speed {} | '.format(u.wavefile, speed)
-                u2.dur = allowed_dur2
-                perturbed_utterances.append(u2)
-
-            delta = allowed_dur2 - u.dur
-            if delta <= 1e-4:
-                continue
-            u3 = copy.deepcopy(u)
-            u3.id = 'pv3-' + u.id
-            u3.speaker = 'pv3-' + u.speaker
-            u3.wavefile = '{} extend-wav-with-silence --extra-silence-length={} - - | '.format(u.wavefile, delta)
-            u3.dur = allowed_dur2
-            perturbed_utterances.append(u3)
-    return perturbed_utterances
+            wavefiles.append(
+                '{} extend-wav-with-silence --extra-silence-length={} - - | '
+                ''.format(utterances.wavefiles[n], deltas[n]))
+    prefixes = ['pv1-', 'pv2-', 'pv3-']
+    return Utterances(
+        [prefixes[v] + utterances.ids[n] for n, v in zip(index, versions)],
+        wavefiles,
+        [prefixes[v] + utterances.speakers[n]
+         for n, v in zip(index, versions)],
+        [utterances.transcriptions[n] for n in index],
+        np.where(np.array(versions, dtype=np.int64) == 0,
+                 lower_durs[index], upper_durs[index]))
 
 
 
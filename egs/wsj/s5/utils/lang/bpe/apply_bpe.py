@@ -14,19 +14,53 @@ Proceedings of the 54th Annual Meeting of the Association for Computational Ling
 
 from __future__ import unicode_literals, division
 
+import os
 import sys
 import codecs
 import io
 import argparse
 import re
+from collections import OrderedDict
+from itertools import islice
 
 # hack for python2/3 compatibility
 from io import open
 argparse.open = open
 
+class LRUCache(object):
+    """Dict-like cache that holds at most max_size entries, evicting the
+    least recently used one.  max_size <= 0 means unbounded."""
+
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        value = self._data.pop(key)
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._data:
+            del self._data[key]
+        elif self.max_size > 0 and len(self._data) >= self.max_size:
+            self._data.popitem(last=False)
+        self._data[key] = value
+
+
 class BPE(object):
 
-    def __init__(self, codes, merges=-1, separator='@@', vocab=None, glossaries=None):
+    def __init__(self, codes, merges=-1, separator='@@', vocab=None, glossaries=None,
+                 cache=None, cache_size=1000000):
+        """If cache is given (e.g. an LRUCache shared with another BPE object
+        using the same codes), it is used for the word-level cache; otherwise
+        a new LRUCache of at most cache_size words is created."""
 
         codes.seek(0)
 
@@ -56,8 +90,17 @@ class BPE(object):
         self.vocab = vocab
 
         self.glossaries = glossaries if glossaries else []
-
-        self.cache = {}
+        self.glossaries_set = frozenset(self.glossaries)
+        # a single pattern lets the common case (a word containing none of
+        # the glossaries) skip the per-glossary splitting altogether
+        self.glossaries_regex = (
+            re.compile('|'.join(re.escape(gloss) for gloss in self.glossaries))
+            if self.glossaries else None)
+
+        self.cache = cache if cache is not None else LRUCache(cache_size)
+        # bpe_codes_reverse is unchanged by vocab filtering, so the splits of
+        # OOV segments can be shared across words
+        self.split_cache = LRUCache(cache_size)
 
     def process_line(self, line):
         """segment line, dealing with leading and trailing whitespace"""
@@ -91,7 +134,8 @@ class BPE(object):
                                           self.separator,
                                           self.version,
                                           self.cache,
-                                          self.glossaries)]
+                                          self.glossaries_set,
+                                          self.split_cache)]
 
             for item in new_word[:-1]:
                 output.append(item + self.separator)
@@ -99,7 +143,13 @@ class BPE(object):
 
         return ' '.join(output)
 
+    def process_lines(self, lines):
+        """segment a batch of lines; see process_line"""
+        return [self.process_line(line) for line in lines]
+
     def _isolate_glossaries(self, word):
+        if self.glossaries_regex is None or not self.glossaries_regex.search(word):
+            return [word]
         word_segments = [word]
         for gloss in self.glossaries:
             word_segments = [out_segments for segment in word_segments
@@ -144,6 +194,16 @@ def create_parser():
         metavar="STR",
         help="Glossaries. The strings provided in glossaries will not be affected"+
              "by the BPE (i.e. they will neither be broken into subwords, nor concatenated with other subwords")
+    parser.add_argument(
+        '--num-workers', '-j', type=int, default=1, metavar='INT',
+        help="Number of processes used to segment the input (default: %(default)s)")
+    parser.add_argument(
+        '--chunk-size', type=int, default=10000, metavar='INT',
+        help="Number of lines read and segmented at a time (default: %(default)s)")
+    parser.add_argument(
+        '--cache-size', type=int, default=1000000, metavar='INT',
+        help="Maximum number of words kept in the segmentation cache of each process;"
+             " <= 0 means unbounded (default: %(default)s)")
 
     return parser
 
@@ -159,57 +219,68 @@ def get_pairs(word):
         prev_char = char
     return pairs
 
-def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache, glossaries=None):
+def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache, glossaries=None,
+           split_cache=None):
     """Encode word based on list of BPE merge operations, which are applied consecutively
+
+    The rank of each adjacent pair is looked up once; after a merge only the
+    pairs next to the merged symbols are looked up again.
     """
 
     if orig in cache:
         return cache[orig]
 
-    if orig in glossaries:
+    if glossaries and orig in glossaries:
         cache[orig] = (orig,)
         return (orig,)
 
     if version == (0, 1):
-        word = tuple(orig) + ('</w>',)
+        word = list(orig) + ['</w>']
     elif version == (0, 2): # more consistent handling of word-final segments
-        word = tuple(orig[:-1]) + ( orig[-1] + '</w>',)
+        word = list(orig[:-1]) + [orig[-1] + '</w>']
     else:
         raise NotImplementedError
 
-    pairs = get_pairs(word)
-
-    if not pairs:
+    if len(word) < 2:
         return orig
 
-    while True:
-        bigram = min(pairs, key = lambda pair: bpe_codes.get(pair, float('inf')))
-        if bigram not in bpe_codes:
+    inf = float('inf')
+    ranks = [bpe_codes.get((word[i], word[i+1]), inf) for i in range(len(word)-1)]
+
+    while ranks:
+        best = min(ranks)
+        if best == inf:
             break
-        first, second = bigram
+        i = ranks.index(best)
+        first, second = word[i], word[i+1]
+        merged_symbol = first + second
+
+        # merge all occurrences of the bigram, left to right, remembering
+        # where each symbol of the new word came from
         new_word = []
+        origin = []  # index in word, or -1 for merged symbols
         i = 0
-        while i < len(word):
-            try:
-                j = word.index(first, i)
-                new_word.extend(word[i:j])
-                i = j
-            except:
-                new_word.extend(word[i:])
-                break
-
-            if word[i] == first and i < len(word)-1 and word[i+1] == second:
-                new_word.append(first+second)
+        n = len(word)
+        while i < n:
+            if word[i] == first and i < n-1 and word[i+1] == second:
+                new_word.append(merged_symbol)
+                origin.append(-1)
                 i += 2
             else:
                 new_word.append(word[i])
+                origin.append(i)
                 i += 1
-        new_word = tuple(new_word)
+
+        new_ranks = []
+        for k in range(len(new_word)-1):
+            if origin[k] >= 0 and origin[k+1] >= 0:
+                new_ranks.append(ranks[origin[k]])
+            else:
+                new_ranks.append(bpe_codes.get((new_word[k], new_word[k+1]), inf))
         word = new_word
-        if len(word) == 1:
-            break
-        else:
-            pairs = get_pairs(word)
+        ranks = new_ranks
+
+    word = tuple(word)
 
     # don't print end-of-word symbols
     if word[-1] == '</w>':
@@ -218,7 +289,7 @@ def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache,
         word = word[:-1] + (word[-1].replace('</w>',''),)
 
     if vocab:
-        word = check_vocab_and_split(word, bpe_codes_reverse, vocab, separator)
+        word = check_vocab_and_split(word, bpe_codes_reverse, vocab, separator, split_cache)
 
     cache[orig] = word
     return word
@@ -250,9 +321,11 @@ def recursive_split(segment, bpe_codes, vocab, separator, final=False):
         for item in recursive_split(right, bpe_codes, vocab, separator, final):
             yield item
 
-def check_vocab_and_split(orig, bpe_codes, vocab, separator):
+def check_vocab_and_split(orig, bpe_codes, vocab, separator, split_cache=None):
     """Check for each segment in word if it is in-vocabulary,
-    and segment OOV segments into smaller units by reversing the BPE merge operations"""
+    and segment OOV segments into smaller units by reversing the BPE merge operations
+
+    If split_cache is given, the splits of OOV segments are memoized in it."""
 
     out = []
 
@@ -261,20 +334,27 @@ def check_vocab_and_split(orig, bpe_codes, vocab, separator):
             out.append(segment)
         else:
             #sys.stderr.write('OOV: {0}\n'.format(segment))
-            for item in recursive_split(segment, bpe_codes, vocab, separator, False):
-                out.append(item)
+            out.extend(_split_oov(segment, bpe_codes, vocab, separator, False, split_cache))
 
     segment = orig[-1]
     if segment in vocab:
         out.append(segment)
     else:
         #sys.stderr.write('OOV: {0}\n'.format(segment))
-        for item in recursive_split(segment, bpe_codes, vocab, separator, True):
-            out.append(item)
+        out.extend(_split_oov(segment, bpe_codes, vocab, separator, True, split_cache))
 
     return out
 
 
+def _split_oov(segment, bpe_codes, vocab, separator, final, split_cache):
+    if split_cache is None:
+        return recursive_split(segment, bpe_codes, vocab, separator, final)
+    key = (segment, final)
+    if key not in split_cache:
+        split_cache[key] = tuple(recursive_split(segment, bpe_codes, vocab, separator, final))
+    return split_cache[key]
+
+
 def read_vocabulary(vocab_file, threshold):
     """read vocabulary file produced by get_vocab.py, and filter according to frequency threshold.
     """
@@ -305,6 +385,47 @@ def isolate_glossary(word, glossary):
         segments = [segment.strip() for split in splits[:-1] for segment in [split, glossary] if segment != '']
         return segments + [splits[-1].strip()] if splits[-1] != '' else segments
 
+_worker_bpe = None
+
+def _init_worker(bpe):
+    global _worker_bpe
+    _worker_bpe = bpe
+
+def _process_chunk(lines):
+    return ''.join(_worker_bpe.process_lines(lines))
+
+def _iter_chunks(fobj, chunk_size):
+    while True:
+        chunk = list(islice(fobj, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def segment_file(bpe, infile, outfile, num_workers=1, chunk_size=10000):
+    """Segment every line of infile with bpe and write the result to outfile,
+    in order.  The input is read in chunks of chunk_size lines, which are
+    segmented by a pool of num_workers processes if num_workers > 1, with
+    only a few chunks read ahead of the output.
+    Each worker starts from a copy of bpe, including its cache."""
+    if num_workers <= 1:
+        for lines in _iter_chunks(infile, chunk_size):
+            outfile.write(''.join(bpe.process_lines(lines)))
+        return
+
+    # This script is otherwise standalone, so steps/libs is only needed (and
+    # located relative to this file, not the working directory) for the
+    # worker processes.
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                    os.pardir, os.pardir, os.pardir, 'steps'))
+    import libs.common as common_lib
+
+    for out in common_lib.map_in_order(_process_chunk,
+                                       _iter_chunks(infile, chunk_size),
+                                       num_jobs=num_workers,
+                                       initializer=_init_worker,
+                                       initargs=(bpe,)):
+        outfile.write(out)
+
 if __name__ == '__main__':
 
     # python 2/3 compatibility
@@ -334,7 +455,7 @@ if __name__ == '__main__':
     else:
         vocabulary = None
 
-    bpe = BPE(args.codes, args.merges, args.separator, vocabulary, args.glossaries)
+    bpe = BPE(args.codes, args.merges, args.separator, vocabulary, args.glossaries,
+              cache_size=args.cache_size)
 
-    for line in args.input:
-        args.output.write(bpe.process_line(line))
+    segment_file(bpe, args.input, args.output, args.num_workers, args.chunk_size)
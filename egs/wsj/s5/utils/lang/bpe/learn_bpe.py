@@ -18,10 +18,11 @@ from __future__ import print_function
 
 import sys
 import codecs
-import re
-import copy
 import argparse
+import multiprocessing
+from array import array
 from collections import defaultdict, Counter
+from itertools import islice
 
 # hack for python2/3 compatibility
 from io import open
@@ -49,189 +50,270 @@ def create_parser():
         help='Stop if no symbol pair has frequency >= FREQ (default: %(default)s))')
     parser.add_argument('--dict-input', action="store_true",
         help="If set, input file is interpreted as a dictionary where each line contains a word-count pair")
+    parser.add_argument(
+        '--num-workers', '-j', type=int, default=1, metavar='INT',
+        help="Number of processes used to count the vocabulary of the input text (default: %(default)s))")
     parser.add_argument(
         '--verbose', '-v', action="store_true",
         help="verbose mode.")
 
     return parser
 
-def get_vocabulary(fobj, is_dict=False):
+def _count_words(lines):
+    """Count the whitespace-separated words in a list of lines"""
+    counts = Counter()
+    for line in lines:
+        for word in line.strip().split(' '):
+            if word:
+                counts[word] += 1
+    return counts
+
+
+def _iter_chunks(fobj, chunk_size):
+    """Yield lists of (at most) chunk_size lines from fobj"""
+    while True:
+        chunk = list(islice(fobj, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_vocabulary(fobj, is_dict=False, num_workers=1, chunk_size=100000):
     """Read text and return dictionary that encodes vocabulary
+
+    If num_workers > 1, the text is read in chunks of chunk_size lines which
+    are counted in a pool of worker processes.
     """
     vocab = Counter()
-    for i, line in enumerate(fobj):
-        if is_dict:
+    if is_dict:
+        for i, line in enumerate(fobj):
             try:
                 word, count = line.strip().split(' ')
             except:
                 print('Failed reading vocabulary file at line {0}: {1}'.format(i, line))
                 sys.exit(1)
             vocab[word] += int(count)
-        else:
-            for word in line.strip().split(' '):
-                if word:
-                    vocab[word] += 1
+    elif num_workers > 1:
+        pool = multiprocessing.Pool(num_workers)
+        try:
+            for counts in pool.imap_unordered(
+                    _count_words, _iter_chunks(fobj, chunk_size)):
+                vocab.update(counts)
+        finally:
+            pool.terminate()
+    else:
+        vocab = _count_words(fobj)
     return vocab
 
-def update_pair_statistics(pair, changed, stats, indices):
-    """Minimally update the indices and frequency of symbol pairs
 
-    if we merge a pair of symbols, only pairs that overlap with occurrences
-    of this pair are affected, and need to be updated.
+class PairQueue(object):
+    """Indexed max-heap over symbol pairs.
+
+    Pairs are ordered by (frequency, first symbol, second symbol), which is
+    the same order as max(stats, key=lambda x: (stats[x], x)) over pairs of
+    strings.  Each pair keeps its position in the heap, so that its
+    frequency can be changed in O(log n) without rebuilding the heap.
     """
-    stats[pair] = 0
-    indices[pair] = defaultdict(int)
-    first, second = pair
-    new_pair = first+second
-    for j, word, old_word, freq in changed:
 
-        # find all instances of pair, and update frequency/indices around it
-        i = 0
-        while True:
-            # find first symbol
-            try:
-                i = old_word.index(first, i)
-            except ValueError:
-                break
-            # if first symbol is followed by second symbol, we've found an occurrence of pair (old_word[i:i+2])
-            if i < len(old_word)-1 and old_word[i+1] == second:
-                # assuming a symbol sequence "A B C", if "B C" is merged, reduce the frequency of "A B"
-                if i:
-                    prev = old_word[i-1:i+1]
-                    stats[prev] -= freq
-                    indices[prev][j] -= 1
-                if i < len(old_word)-2:
-                    # assuming a symbol sequence "A B C B", if "B C" is merged, reduce the frequency of "C B".
-                    # however, skip this if the sequence is A B C B C, because the frequency of "C B" will be reduced by the previous code block
-                    if old_word[i+2] != first or i >= len(old_word)-3 or old_word[i+3] != second:
-                        nex = old_word[i+1:i+3]
-                        stats[nex] -= freq
-                        indices[nex][j] -= 1
-                i += 2
+    def __init__(self, symbols):
+        self.symbols = symbols
+        # heap entries are [freq, first_str, second_str, pair]
+        self.heap = []
+        self.pos = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def freq(self, pair):
+        if pair in self.pos:
+            return self.heap[self.pos[pair]][0]
+        return 0
+
+    def top(self):
+        """Return (pair, freq) with the highest priority"""
+        entry = self.heap[0]
+        return entry[3], entry[0]
+
+    def update(self, pair, delta):
+        """Add delta to the frequency of pair, removing it if it drops to 0"""
+        if pair in self.pos:
+            i = self.pos[pair]
+            entry = self.heap[i]
+            entry[0] += delta
+            if entry[0] <= 0:
+                self._remove(i)
+            elif delta > 0:
+                self._sift_up(i)
             else:
-                i += 1
-
-        i = 0
+                self._sift_down(i)
+        elif delta > 0:
+            entry = [delta, self.symbols[pair[0]], self.symbols[pair[1]], pair]
+            self.heap.append(entry)
+            self.pos[pair] = len(self.heap) - 1
+            self._sift_up(len(self.heap) - 1)
+
+    def _remove(self, i):
+        heap = self.heap
+        del self.pos[heap[i][3]]
+        last = heap.pop()
+        if i < len(heap):
+            heap[i] = last
+            self.pos[last[3]] = i
+            self._sift_up(i)
+            self._sift_down(self.pos[last[3]])
+
+    def _sift_up(self, i):
+        heap, pos = self.heap, self.pos
+        entry = heap[i]
+        while i:
+            parent = (i - 1) >> 1
+            if not heap[parent] < entry:
+                break
+            heap[i] = heap[parent]
+            pos[heap[i][3]] = i
+            i = parent
+        heap[i] = entry
+        pos[entry[3]] = i
+
+    def _sift_down(self, i):
+        heap, pos = self.heap, self.pos
+        n = len(heap)
+        entry = heap[i]
         while True:
-            try:
-                # find new pair
-                i = word.index(new_pair, i)
-            except ValueError:
+            child = 2 * i + 1
+            if child >= n:
                 break
-            # assuming a symbol sequence "A BC D", if "B C" is merged, increase the frequency of "A BC"
-            if i:
-                prev = word[i-1:i+1]
-                stats[prev] += freq
-                indices[prev][j] += 1
-            # assuming a symbol sequence "A BC B", if "B C" is merged, increase the frequency of "BC B"
-            # however, if the sequence is A BC BC, skip this step because the count of "BC BC" will be incremented by the previous code block
-            if i < len(word)-1 and word[i+1] != new_pair:
-                nex = word[i:i+2]
-                stats[nex] += freq
-                indices[nex][j] += 1
-            i += 1
+            if child + 1 < n and heap[child] < heap[child + 1]:
+                child += 1
+            if not entry < heap[child]:
+                break
+            heap[i] = heap[child]
+            pos[heap[i][3]] = i
+            i = child
+        heap[i] = entry
+        pos[entry[3]] = i
 
 
-def get_pair_statistics(vocab):
-    """Count frequency of all symbol pairs, and create index"""
+def get_word_pairs(word):
+    """Count the (overlapping) symbol pairs of a word of symbol ids"""
+    pairs = defaultdict(int)
+    for i in range(len(word) - 1):
+        pairs[word[i], word[i + 1]] += 1
+    return pairs
 
-    # data structure of pair frequencies
-    stats = defaultdict(int)
 
-    #index from pairs to words
-    indices = defaultdict(lambda: defaultdict(int))
+def get_pair_statistics(vocab, symbols):
+    """Count frequency of all symbol pairs, and create index
+
+    Returns a PairQueue with the pair frequencies, and a dict from each pair
+    to a dict from word index to the number of occurrences in that word.
+    """
+    stats = defaultdict(int)
+    indices = defaultdict(dict)
 
     for i, (word, freq) in enumerate(vocab):
-        prev_char = word[0]
-        for char in word[1:]:
-            stats[prev_char, char] += freq
-            indices[prev_char, char][i] += 1
-            prev_char = char
+        for pair, count in get_word_pairs(word).items():
+            stats[pair] += freq * count
+            indices[pair][i] = count
 
-    return stats, indices
+    queue = PairQueue(symbols)
+    for pair, freq in stats.items():
+        queue.update(pair, freq)
+    return queue, indices
 
 
-def replace_pair(pair, vocab, indices):
-    """Replace all occurrences of a symbol pair ('A', 'B') with a new symbol 'AB'"""
+def replace_pair(pair, new_id, word):
+    """Replace all occurrences of the symbol pair (A, B) in word with the
+    symbol new_id, scanning left to right; returns the new word"""
     first, second = pair
-    pair_str = ''.join(pair)
-    pair_str = pair_str.replace('\\','\\\\')
-    changes = []
-    pattern = re.compile(r'(?<!\S)' + re.escape(first + ' ' + second) + r'(?!\S)')
-    if sys.version_info < (3, 0):
-        iterator = indices[pair].iteritems()
-    else:
-        iterator = indices[pair].items()
-    for j, freq in iterator:
-        if freq < 1:
-            continue
-        word, freq = vocab[j]
-        new_word = ' '.join(word)
-        new_word = pattern.sub(pair_str, new_word)
-        new_word = tuple(new_word.split(' '))
-
-        vocab[j] = (new_word, freq)
-        changes.append((j, new_word, word, freq))
-
-    return changes
-
-def prune_stats(stats, big_stats, threshold):
-    """Prune statistics dict for efficiency of max()
+    new_word = array('i')
+    i = 0
+    n = len(word)
+    while i < n:
+        if word[i] == first and i < n - 1 and word[i + 1] == second:
+            new_word.append(new_id)
+            i += 2
+        else:
+            new_word.append(word[i])
+            i += 1
+    return new_word
 
-    The frequency of a symbol pair never increases, so pruning is generally safe
-    (until we the most frequent pair is less frequent than a pair we previously pruned)
-    big_stats keeps full statistics for when we need to access pruned items
-    """
-    for item,freq in list(stats.items()):
-        if freq < threshold:
-            del stats[item]
-            if freq < 0:
-                big_stats[item] += freq
-            else:
-                big_stats[item] = freq
 
+def merge_pair(pair, new_id, vocab, queue, indices):
+    """Merge pair into new_id in every word that contains it, and minimally
+    update the pair frequencies and indices of the affected words."""
+    deltas = defaultdict(int)
+    for j in list(indices.pop(pair, {})):
+        word, freq = vocab[j]
+        new_word = replace_pair(pair, new_id, word)
+        vocab[j] = (new_word, freq)
 
-def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False):
+        old_pairs = get_word_pairs(word)
+        new_pairs = get_word_pairs(new_word)
+        for p, count in old_pairs.items():
+            if new_pairs.get(p, 0) != count:
+                deltas[p] -= freq * count
+                if p != pair:
+                    del indices[p][j]
+        for p, count in new_pairs.items():
+            if old_pairs.get(p, 0) != count:
+                deltas[p] += freq * count
+                indices[p][j] = count
+
+    for p, delta in deltas.items():
+        if delta:
+            queue.update(p, delta)
+        if p in indices and not indices[p]:
+            del indices[p]
+
+
+def main(infile, outfile, num_symbols, min_frequency=2, verbose=False,
+         is_dict=False, num_workers=1):
     """Learn num_symbols BPE operations from vocabulary, and write to outfile.
+
+    Words are stored as arrays of integer symbol ids.  The pair frequencies
+    are kept in an indexed priority queue, so the most frequent pair is
+    found in constant time and only the pairs in words touched by a merge
+    are re-scored.
     """
 
     # version 0.2 changes the handling of the end-of-word token ('</w>');
     # version numbering allows bckward compatibility
     outfile.write('#version: 0.2\n')
 
-    vocab = get_vocabulary(infile, is_dict)
+    vocab = get_vocabulary(infile, is_dict, num_workers)
     vocab = dict([(tuple(x[:-1])+(x[-1]+'</w>',) ,y) for (x,y) in vocab.items()])
     sorted_vocab = sorted(vocab.items(), key=lambda x: x[1], reverse=True)
 
-    stats, indices = get_pair_statistics(sorted_vocab)
-    big_stats = copy.deepcopy(stats)
-    # threshold is inspired by Zipfian assumption, but should only affect speed
-    threshold = max(stats.values()) / 10
+    # symbols are interned, so that merges which produce the same string
+    # (e.g. 'a'+'bc' and 'ab'+'c') share a symbol id
+    symbols = []
+    symbol_to_id = {}
+    def get_id(symbol):
+        if symbol not in symbol_to_id:
+            symbol_to_id[symbol] = len(symbols)
+            symbols.append(symbol)
+        return symbol_to_id[symbol]
+
+    sorted_vocab = [(array('i', [get_id(s) for s in word]), freq)
+                    for word, freq in sorted_vocab]
+
+    queue, indices = get_pair_statistics(sorted_vocab, symbols)
     for i in range(num_symbols):
-        if stats:
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
-
-        # we probably missed the best pair because of pruning; go back to full statistics
-        if not stats or (i and stats[most_frequent] < threshold):
-            prune_stats(stats, big_stats, threshold)
-            stats = copy.deepcopy(big_stats)
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
-            # threshold is inspired by Zipfian assumption, but should only affect speed
-            threshold = stats[most_frequent] * i/(i+10000.0)
-            prune_stats(stats, big_stats, threshold)
-
-        if stats[most_frequent] < min_frequency:
+        if not queue:
+            sys.stderr.write('no pair has frequency >= {0}. Stopping\n'.format(min_frequency))
+            break
+        most_frequent, freq = queue.top()
+        if freq < min_frequency:
             sys.stderr.write('no pair has frequency >= {0}. Stopping\n'.format(min_frequency))
             break
 
+        first, second = symbols[most_frequent[0]], symbols[most_frequent[1]]
         if verbose:
-            sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, most_frequent[0], most_frequent[1], stats[most_frequent]))
-        outfile.write('{0} {1}\n'.format(*most_frequent))
-        changes = replace_pair(most_frequent, sorted_vocab, indices)
-        update_pair_statistics(most_frequent, changes, stats, indices)
-        stats[most_frequent] = 0
-        if not i % 100:
-            prune_stats(stats, big_stats, threshold)
+            sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, first, second, freq))
+        outfile.write('{0} {1}\n'.format(first, second))
+        merge_pair(most_frequent, get_id(first + second), sorted_vocab,
+                   queue, indices)
 
 
 if __name__ == '__main__':
@@ -255,4 +337,5 @@ if __name__ == '__main__':
     if args.output.name != '<stdout>':
         args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
 
-    main(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input)
+    main(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input,
+         num_workers=args.num_workers)
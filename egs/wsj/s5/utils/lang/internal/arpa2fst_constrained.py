@@ -9,6 +9,7 @@ import sys
 import argparse
 import math
 from collections import defaultdict
+import numpy as np
 
 # note, this was originally based
 
@@ -46,6 +47,8 @@ if args.verbose >= 1:
 
 
 class HistoryState(object):
+    __slots__ = ['backoff_prob', 'word_to_prob']
+
     def __init__(self):
         # note: neither backoff_prob nor the floats
         # in word_to_prob are in log space.
@@ -182,6 +185,44 @@ class ArpaModel(object):
             else:
                 return self.GetProb(hist[1:], word)
 
+    # Returns a numpy array containing GetProb(hist, word) for each word in
+    # successors[hist[-1]], where 'successors' maps from a word to the list of
+    # words that the bigram constraints allow to follow it.  Because the
+    # histories that back off to each other all end in the same word, the
+    # probabilities for 'hist' can be worked out from those for hist[1:];
+    # 'cache' is a dict from history to the returned array, which makes sure
+    # we only do this once for each history.  The probabilities are computed
+    # with the same floating-point operations as GetProb().
+    def GetSuccessorProbs(self, hist, successors, successor_index, cache):
+        ans = cache.get(hist)
+        if ans is not None:
+            return ans
+        word_list = successors[hist[-1]]
+        word_index = successor_index[hist[-1]]
+        if len(hist) == 1:
+            unigram_word_to_prob = self.orders[0][()].word_to_prob
+            lower_order_probs = np.array(
+                [ unigram_word_to_prob.get(word, np.nan) for word in word_list ],
+                dtype=np.float64)
+        else:
+            lower_order_probs = self.GetSuccessorProbs(
+                hist[1:], successors, successor_index, cache)
+        if hist in self.orders[len(hist)]:
+            hist_state = self.orders[len(hist)][hist]
+            ans = hist_state.backoff_prob * lower_order_probs
+            for word, prob in hist_state.word_to_prob.items():
+                i = word_index.get(word)
+                if i is not None:
+                    ans[i] = prob
+        else:
+            ans = lower_order_probs
+        if len(hist) == 1 and np.isnan(ans).any():
+            word = word_list[int(np.nonzero(np.isnan(ans))[0][0])]
+            sys.exit("{0}: no probability in unigram for word {1}".format(
+                sys.argv[0], word))
+        cache[hist] = ans
+        return ans
+
     # This gets the state corresponding to 'hist' in 'hist_to_state', but backs
     # off for us if there is no such state.
     def GetStateForHist(self, hist_to_state, hist):
@@ -243,6 +284,26 @@ class ArpaModel(object):
         # History will map from history (as a tuple) to integer FST-state.
         (hist_to_state, state_to_hist) = self.GetHistToStateMap()
 
+        # successors[word] is list(bigram_map[word]) and successor_index[word]
+        # maps from each word in it to its position; they are filled in as we
+        # reach the bigram states, and used by GetSuccessorProbs().
+        successors = dict()
+        successor_index = dict()
+        prob_cache = dict()
+        def GetSuccessors(word):
+            if not word in successors:
+                successors[word] = list(bigram_map[word])
+                successor_index[word] = dict(
+                    [ (w, i) for i, w in enumerate(successors[word]) ])
+            return successors[word]
+
+        # The lines of the FST are collected in 'lines' and written out in
+        # blocks, which is much faster than printing them one by one.
+        lines = []
+        def FlushLines():
+            if len(lines) != 0:
+                sys.stdout.write('\n'.join(lines) + '\n')
+                del lines[:]
 
         # The following 3 things are just for diagnostics.
         normalization_stats = [ [0, 0.0] for x in range(len(self.orders)) ]
@@ -261,12 +322,13 @@ class ArpaModel(object):
                               sys.argv[0], context_word), file = sys.stderr)
                     continue
                 # word list is a list of words that can follow this word.  It must be nonempty.
-                word_list = list(bigram_map[context_word])
+                word_list = GetSuccessors(context_word)
+                probs = self.GetSuccessorProbs(hist, successors, successor_index,
+                                               prob_cache).tolist()
 
                 normalization_stats[hist_len][0] += 1
 
-                for word in word_list:
-                    prob = self.GetProb((context_word,), word)
+                for word, prob in zip(word_list, probs):
                     assert prob != 0
                     normalization_stats[hist_len][1] += prob
                     cost = -math.log(prob)
@@ -275,40 +337,42 @@ class ArpaModel(object):
                             sys.argv[0], cost, context_word, word), file=sys.stderr)
                     if word == '</s>':
                         # print the final-prob of this state.
-                        print("%d %.3f" % (state, cost))
+                        lines.append("%d %.3f" % (state, cost))
                     else:
                         next_state = self.GetStateForHist(hist_to_state,
                                                           (context_word, word))
-                        print("%d %d %s %s %.3f" %
-                              (state, next_state, word, word, cost))
+                        lines.append("%d %d %s %s %.3f" %
+                                     (state, next_state, word, word, cost))
             else:  # it's a higher-order than bigram state.
                 assert hist in self.orders[hist_len]
                 hist_state = self.orders[hist_len][hist]
                 most_recent_word = hist[-1]
+                allowed_words = bigram_map[most_recent_word]
+                GetSuccessors(most_recent_word)
 
                 normalization_stats[hist_len][0] += 1
                 normalization_stats[hist_len][1] += \
-                  sum([ self.GetProb(hist, word) for word in bigram_map[most_recent_word]])
+                  sum(self.GetSuccessorProbs(hist, successors, successor_index,
+                                             prob_cache).tolist())
 
                 for word, prob in hist_state.word_to_prob.items():
                     cost = -math.log(prob)
-                    if word in bigram_map[most_recent_word]:
+                    if word in allowed_words:
                         num_ngrams_allowed += 1
                     else:
                         num_ngrams_disallowed += 1
                         continue
                     if word == '</s>':
                         # print the final-prob of this state.
-                        print("%d %.3f" % (state, cost))
+                        lines.append("%d %.3f" % (state, cost))
                     else:
                         next_state = self.GetStateForHist(hist_to_state,
                                                           (hist) + (word,))
-                        print("%d %d %s %s %.3f" %
-                              (state, next_state, word, word, cost))
+                        lines.append("%d %d %s %s %.3f" %
+                                     (state, next_state, word, word, cost))
                 # Now deal with the backoff probability of this state (back off
                 # to the lower-order state).
-                assert hist in self.orders[hist_len]
-                backoff_prob = self.orders[hist_len][hist].backoff_prob
+                backoff_prob = hist_state.backoff_prob
                 assert backoff_prob != 0.0
                 cost = -math.log(backoff_prob)
                 backoff_hist = hist[1:]
@@ -321,8 +385,11 @@ class ArpaModel(object):
                 # For hist-states that completely back off (they have no words coming out of them),
                 # there is no need to disambiguate, we can print an epsilon that will later be removed.
                 this_disambig_symbol = disambig_symbol if len(hist_state.word_to_prob) != 0 else '<eps>'
-                print("%d %d %s <eps> %.3f" %
-                      (state, backoff_state, this_disambig_symbol, cost))
+                lines.append("%d %d %s <eps> %.3f" %
+                             (state, backoff_state, this_disambig_symbol, cost))
+            if len(lines) >= 10000:
+                FlushLines()
+        FlushLines()
         if args.verbose >= 1:
             for hist_len in range(1, len(self.orders)):
                 num_states = normalization_stats[hist_len][0]
@@ -14,21 +14,39 @@ This keeps the graph compact after adding the unk model.
 
 import argparse
 import io
+import itertools
 import re
 import sys
 from collections import defaultdict
 
+sys.path.insert(0, 'steps')
+import libs.arpa as arpa_lib
+import libs.common as common_lib
+
 
 parser = argparse.ArgumentParser(
     description='''This script takes an existing ARPA lanugage model
     and limits the <unk> history to make it suitable
     for downstream <unk> modeling.
-    It supports up to 5-grams.''',
+    It supports up to 5-grams.  The LM is processed as a stream, in chunks
+    of lines, so it does not need to fit in memory; the output apart from
+    the header is kept in a temporary file until the n-gram counts in the
+    header are known.''',
     usage='''utils/lang/limit_arpa_unk_history.py
     <oov-dict-entry> <input-arpa >output-arpa''',
     epilog='''E.g.: gunzip -c src.arpa.gz |
     utils/lang/limit_arpa_unk_history.py "<unk>" | gzip -c >dest.arpa.gz''')
 
+parser.add_argument(
+    '--num-jobs', type=int, default=1,
+    help='Number of worker processes; if 1, everything is done in this process')
+parser.add_argument(
+    '--chunk-size', type=int, default=100000,
+    help='Number of lines of the ARPA given to a worker process at a time')
+parser.add_argument(
+    '--temp-dir', type=str,
+    help='Directory for the temporary file that holds the output '
+    '(default: the system default)')
 parser.add_argument(
     'oov_dict_entry',
     help='oov identifier, for example "<unk>"', type=str)
@@ -56,31 +74,52 @@ def get_ngram_stats(old_lm_lines):
     return max_ngrams, skip_rows, ngram_counts
 
 
-def find_and_replace_unks(old_lm_lines, max_ngrams, skip_rows):
+def update_section(line, max_ngrams, section):
+    ''' Returns the section (passed_2grams, last_ngram, ngram) of the ARPA
+    we are in after the line 'line', given the section 'section' we were in
+    before it.  'ngram' is the order of the n-grams in the section. '''
+    passed_2grams, last_ngram, ngram = section
+    if "\\{}-grams:".format(3) in line:
+        passed_2grams = True
+    if "\\{}-grams:".format(max_ngrams) in line:
+        last_ngram = True
+
+    for i in range(max_ngrams):
+        if "\\{}-grams:".format(i+1) in line:
+            ngram = i+1
+    return passed_2grams, last_ngram, ngram
+
+
+def init_worker(oov_dict_entry, max_ngrams):
+    global _global_max_ngrams, _global_unk_pattern, _global_backoff_pattern
+    _global_max_ngrams = max_ngrams
+    _global_unk_pattern = re.compile(
+        r"[0-9.-]+(?:[\s\t]\S+){1,3}[\s\t]" + oov_dict_entry +
+        r"[\s\t](?!-[0-9]+\.[0-9]+).*")
+    _global_backoff_pattern = re.compile(
+        r"[0-9.-]+(?:[\s\t]\S+){1,3}[\s\t]<unk>[\s\t]-[0-9]+\.[0-9]+")
+
+
+def find_and_replace_unks(chunk):
+    ''' Processes the chunk (lines, section) of the ARPA, where 'section' is
+    the section we are in at the start of the lines (see update_section()).
+    Returns (text, ngram_diffs, unk_row_count, backoff_row_count), where
+    'text' is the output for the lines. '''
+    old_lm_lines, section = chunk
     ngram_diffs = defaultdict(int)
     whitespace_pattern = re.compile("[ \t]+")
-    unk_pattern = re.compile(
-        "[0-9.-]+(?:[\s\\t]\S+){1,3}[\s\\t]" + args.oov_dict_entry +
-        "[\s\\t](?!-[0-9]+\.[0-9]+).*")
-    backoff_pattern = re.compile(
-        "[0-9.-]+(?:[\s\\t]\S+){1,3}[\s\\t]<unk>[\s\\t]-[0-9]+\.[0-9]+")
-    passed_2grams, last_ngram = False, False
+    unk_pattern = _global_unk_pattern
+    backoff_pattern = _global_backoff_pattern
     unk_row_count, backoff_row_count = 0, 0
 
-    print("Upadting the language model .. ", file=sys.stderr)
-    new_lm_lines = old_lm_lines[:skip_rows]
-
-    for i in range(skip_rows, len(old_lm_lines)):
-            line = old_lm_lines[i].strip(" \t\r\n")
+    new_lm_lines = []
 
-            if "\{}-grams:".format(3) in line:
-                passed_2grams = True
-            if "\{}-grams:".format(max_ngrams) in line:
-                last_ngram = True
+    for line in old_lm_lines:
+            line = line.strip(" \t\r\n")
 
-            for i in range(max_ngrams):
-                if "\{}-grams:".format(i+1) in line:
-                    ngram = i+1
+            if "-grams:" in line:
+                section = update_section(line, _global_max_ngrams, section)
+            passed_2grams, last_ngram, ngram = section
 
             # remove any n-gram states of the form: foo <unk> -> X
             # that is, any n-grams of order > 2 where <unk>
@@ -111,29 +150,54 @@ def find_and_replace_unks(old_lm_lines, max_ngrams, skip_rows):
 
             new_lm_lines.append(line+"\n")
 
-    print("Removed {} lines including {} as second-to-last term.".format(
-        unk_row_count, args.oov_dict_entry), file=sys.stderr)
-    print("Removed backoff probabilties from {} lines.".format(
-        backoff_row_count), file=sys.stderr)
+    return ''.join(new_lm_lines), ngram_diffs, unk_row_count, backoff_row_count
 
-    return new_lm_lines, ngram_diffs
 
+def get_chunks(old_lm_lines, max_ngrams):
+    ''' Yields the chunks (lines, section) of the lines of the ARPA in
+    'old_lm_lines' for find_and_replace_unks(). '''
+    section = (False, False, None)
+    for lines in arpa_lib.read_line_chunks(old_lm_lines, args.chunk_size):
+        yield lines, section
+        for line in lines:
+            if "-grams:" in line:
+                section = update_section(line, max_ngrams, section)
 
-def read_old_lm():
-    print("Reading ARPA LM frome input stream .. ", file=sys.stderr)
 
-    with io.TextIOWrapper(
-            sys.stdin.buffer,
-            encoding="latin-1") as input_stream:
-        old_lm_lines = input_stream.readlines()
+def write_new_lm(writer, old_lm_lines, max_ngrams, skip_rows):
+    ''' Writes the rows of the new LM, apart from the header, to 'writer'.
+    The first 'skip_rows' lines are copied; returns ngram_diffs. '''
+    print("Upadting the language model .. ", file=sys.stderr)
+    for lines in arpa_lib.read_line_chunks(
+            itertools.islice(old_lm_lines, skip_rows), args.chunk_size):
+        writer.write(''.join(lines))
 
-    return old_lm_lines
+    ngram_diffs = defaultdict(int)
+    unk_row_count, backoff_row_count = 0, 0
+    for text, chunk_ngram_diffs, chunk_unk_row_count, chunk_backoff_row_count in \
+            common_lib.map_in_order(find_and_replace_unks,
+                                    get_chunks(old_lm_lines, max_ngrams),
+                                    num_jobs=args.num_jobs,
+                                    initializer=init_worker,
+                                    initargs=(args.oov_dict_entry, max_ngrams)):
+        writer.write(text)
+        for n, diff in chunk_ngram_diffs.items():
+            ngram_diffs[n] += diff
+        unk_row_count += chunk_unk_row_count
+        backoff_row_count += chunk_backoff_row_count
 
+    print("Removed {} lines including {} as second-to-last term.".format(
+        unk_row_count, args.oov_dict_entry), file=sys.stderr)
+    print("Removed backoff probabilties from {} lines.".format(
+        backoff_row_count), file=sys.stderr)
 
-def write_new_lm(new_lm_lines, ngram_counts, ngram_diffs):
+    return ngram_diffs
+
+
+def update_header(new_lm_lines, ngram_counts, ngram_diffs):
     ''' Update n-gram counts that go in the header of the arpa lm '''
 
-    for i in range(10):
+    for i in range(min(10, len(new_lm_lines))):
         g = re.search(r"ngram (\d)=(\d+)", new_lm_lines[i])
         if g:
             n = int(g.group(1))
@@ -142,19 +206,30 @@ def write_new_lm(new_lm_lines, ngram_counts, ngram_diffs):
                 new_num_ngrams = ngram_counts[n] + ngram_diffs[n]
                 new_lm_lines[i] = "ngram {}={}\n".format(
                     n, new_num_ngrams)
+    return new_lm_lines
+
+
+def main():
+    if args.num_jobs < 1 or args.chunk_size < 1:
+        sys.exit("--num-jobs and --chunk-size must be positive")
+    print("Reading ARPA LM frome input stream .. ", file=sys.stderr)
 
     with io.TextIOWrapper(
+            sys.stdin.buffer,
+            encoding="latin-1") as input_stream, io.TextIOWrapper(
             sys.stdout.buffer,
             encoding="latin-1") as output_stream:
-        output_stream.writelines(new_lm_lines)
-
-
-def main():
-    old_lm_lines = read_old_lm()
-    max_ngrams, skip_rows,  ngram_counts = get_ngram_stats(old_lm_lines)
-    new_lm_lines, ngram_diffs = find_and_replace_unks(
-        old_lm_lines, max_ngrams, skip_rows)
-    write_new_lm(new_lm_lines, ngram_counts, ngram_diffs)
+        # the header is in the first 10 lines.
+        head_lines = list(itertools.islice(input_stream, 10))
+        max_ngrams, skip_rows, ngram_counts = get_ngram_stats(head_lines)
+        old_lm_lines = itertools.chain(head_lines, input_stream)
+
+        writer = arpa_lib.SpooledArpaWriter(output_stream, num_head_lines=10,
+                                            temp_dir=args.temp_dir,
+                                            encoding="latin-1")
+        ngram_diffs = write_new_lm(writer, old_lm_lines, max_ngrams, skip_rows)
+        writer.close(update_header(writer.head_lines, ngram_counts,
+                                   ngram_diffs))
 
 
 if __name__ == "__main__":
@@ -12,7 +12,7 @@
 # $ ngram-count -order 4 -kn-modify-counts-at-end -ukndiscount -gt1min 0 -gt2min 0 -gt3min 0 -gt4min 0 \
 # -text corpus.txt -lm lm.arpa
 #
-# The data structure is based on: kaldi/egs/wsj/s5/utils/lang/make_phone_lm.py
+# The n-gram counts are kept in sorted numpy arrays (see class NgramTable).
 # The smoothing algorithm is based on: http://www.speech.sri.com/projects/srilm/manpages/ngram-discount.7.html
 
 import sys
@@ -21,7 +21,8 @@ import re
 import io
 import math
 import argparse
-from collections import Counter, defaultdict
+
+import numpy as np
 
 
 parser = argparse.ArgumentParser(description="""
@@ -43,69 +44,129 @@ strip_chars = " \t\r\n"
 whitespace = re.compile("[ \t]+")
 
 
-class CountsForHistory:
-    # This class (which is more like a struct) stores the counts seen in a
-    # particular history-state.  It is used inside class NgramCounts.
-    # It really does the job of a dict from int to float, but it also
-    # keeps track of the total count.
+class NgramTable:
+    # This class stores the distinct n-grams of one order, with their counts,
+    # as numpy arrays sorted on 'keys'.  It is used inside class NgramCounts.
+    # Words are represented by integer ids; an n-gram whose first n-1 words
+    # are the (n-1)-gram with index h in the table of the order below (h is 0
+    # for unigrams) and whose last word is w has the key
+    # h * word_multiplier + w, so the n-grams sharing a history are
+    # consecutive in the table and their history index is key //
+    # word_multiplier.
     def __init__(self):
-        # The 'lambda: defaultdict(float)' is an anonymous function taking no
-        # arguments that returns a new defaultdict(float).
-        self.word_to_count = defaultdict(int)
-        self.word_to_context = defaultdict(set)  # using a set to count the number of unique contexts
-        self.word_to_f = dict()  # discounted probability
-        self.word_to_bow = dict()  # back-off weight
-        self.total_count = 0
-
-    def words(self):
-        return self.word_to_count.keys()
-
-    def __str__(self):
-        # e.g. returns ' total=12: 3->4, 4->6, -1->2'
-        return ' total={0}: {1}'.format(
-            str(self.total_count),
-            ', '.join(['{0} -> {1}'.format(word, count)
-                      for word, count in self.word_to_count.items()]))
-
-    def add_count(self, predicted_word, context_word, count):
-        assert count >= 0
-
-        self.total_count += count
-        self.word_to_count[predicted_word] += count
-        if context_word is not None:
-            self.word_to_context[predicted_word].add(context_word)
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        # position in the corpus (counting words, including <s> and </s>)
+        # where each n-gram was first seen; the ARPA file lists the n-grams
+        # in order of first appearance.
+        self.first_pos = np.zeros(0, dtype=np.int64)
+        # index in the table of the order below of the n-gram without its
+        # first word (only for n >= 2).  The number of distinct left contexts
+        # of an n-gram is the number of (n+1)-grams that have it as suffix.
+        self.suffix = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def histories(self, word_multiplier):
+        return self.keys // word_multiplier
+
+    def words(self, word_multiplier):
+        return self.keys % word_multiplier
+
+    def merge(self, keys, counts, first_pos, suffix):
+        # Adds the counts of the n-grams with (sorted, distinct) keys 'keys',
+        # whose first appearances are after those of the n-grams already in
+        # the table.  Returns a pair (old_to_new, new_index): the new indexes
+        # of the n-grams that were in the table and of the added ones.
+        num_old = len(self.keys)
+        all_keys = np.concatenate((self.keys, keys))
+        # the two parts are sorted already, which the stable sort (timsort)
+        # takes advantage of.
+        order = np.argsort(all_keys, kind='stable')
+        sorted_keys = all_keys[order]
+        is_first = np.ones(len(sorted_keys), dtype=bool)
+        is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        index = np.empty(len(sorted_keys), dtype=np.int64)
+        index[order] = np.cumsum(is_first) - 1
+        old_to_new, new_index = index[:num_old], index[num_old:]
+
+        self.keys = sorted_keys[is_first]
+        num_ngrams = len(self.keys)
+        new_counts = np.zeros(num_ngrams, dtype=np.int64)
+        new_counts[old_to_new] = self.counts
+        new_counts[new_index] += counts
+        self.counts = new_counts
+        # for n-grams that were already in the table, the old first position
+        # and suffix win.
+        new_first_pos = np.empty(num_ngrams, dtype=np.int64)
+        new_first_pos[new_index] = first_pos
+        new_first_pos[old_to_new] = self.first_pos
+        self.first_pos = new_first_pos
+        if suffix is not None:
+            new_suffix = np.empty(num_ngrams, dtype=np.int64)
+            new_suffix[new_index] = suffix
+            new_suffix[old_to_new] = self.suffix
+            self.suffix = new_suffix
+        return old_to_new, new_index
+
+    def renumber_lower_order(self, old_to_new, word_multiplier):
+        # Called when the n-grams of the order below have been renumbered by
+        # merge(); the order of the keys is unchanged.
+        if len(self.keys) == 0:
+            return
+        self.keys = (old_to_new[self.keys // word_multiplier] * word_multiplier
+                     + self.keys % word_multiplier)
+        self.suffix = old_to_new[self.suffix]
+
+    def change_word_multiplier(self, old_multiplier, new_multiplier):
+        self.keys = ((self.keys // old_multiplier) * new_multiplier
+                     + self.keys % old_multiplier)
+
+
+def sum_by_history(histories, values, num_histories):
+    # Returns the (exact, integer) sums of 'values' for each history;
+    # 'histories' is sorted.
+    cumulative = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(values, out=cumulative[1:])
+    boundaries = np.searchsorted(histories, np.arange(num_histories + 1))
+    return cumulative[boundaries[1:]] - cumulative[boundaries[:-1]]
 
 
 class NgramCounts:
     # A note on data-structure.  Firstly, all words are represented as
-    # integers.  We store n-gram counts as an array, indexed by (history-length
-    # == n-gram order minus one) (note: python calls arrays "lists") of dicts
-    # from histories to counts, where histories are arrays of integers and
-    # "counts" are dicts from integer to float.  For instance, when
-    # accumulating the 4-gram count for the '8' in the sequence '5 6 7 8', we'd
-    # do as follows: self.counts[3][[5,6,7]][8] += 1.0 where the [3] indexes an
-    # array, the [[5,6,7]] indexes a dict, and the [8] indexes a dict.
-    def __init__(self, ngram_order, bos_symbol='<s>', eos_symbol='</s>'):
+    # integers.  We store the n-gram counts as an array, indexed by
+    # (history-length == n-gram order minus one) (note: python calls arrays
+    # "lists") of NgramTable objects, which hold the distinct n-grams of that
+    # order in sorted numpy arrays.  The input is counted in chunks: the
+    # n-grams of a chunk are counted by sorting them (np.unique()), and the
+    # result is merged into the tables.  This takes memory proportional to
+    # the number of distinct n-grams, rather than a python object per n-gram
+    # and a set of left contexts per n-gram.
+    def __init__(self, ngram_order, bos_symbol='<s>', eos_symbol='</s>',
+                 chunk_size=1000000):
         assert ngram_order >= 2
 
         self.ngram_order = ngram_order
         self.bos_symbol = bos_symbol
         self.eos_symbol = eos_symbol
+        self.chunk_size = chunk_size  # number of words counted at a time
 
-        self.counts = []
-        for n in range(ngram_order):
-            self.counts.append(defaultdict(lambda: CountsForHistory()))
+        self.words = [bos_symbol, eos_symbol]
+        self.word_to_id = {bos_symbol: 0, eos_symbol: 1}
+        self.word_multiplier = 1024  # a power of two >= len(self.words)
 
-        self.d = []  # list of discounting factor for each order of ngram
+        self.counts = [NgramTable() for n in range(ngram_order)]
+        self.num_words_counted = 0
+        self.pending_ids = []  # word-ids of the lines not counted yet
+        self.pending_lengths = []
 
-    # adds a raw count (called while processing input data).
-    # Suppose we see the sequence '6 7 8 9' and ngram_order=4, 'history'
-    # would be (6,7,8) and 'predicted_word' would be 9; 'count' would be
-    # 1.
-    def add_count(self, history, predicted_word, context_word, count):
-        self.counts[len(history)][history].add_count(predicted_word, context_word, count)
+        self.d = []  # list of discounting factor for each order of ngram
+        self.f = []  # discounted probabilities, indexed like self.counts
+        self.bow = []  # back-off weights (nan where there is none)
+        self.modified_counts = []  # number of distinct left contexts
 
-    # 'line' is a string containing a sequence of integer word-ids.
+    # 'line' is a string containing a sequence of words.
     # This function adds the un-smoothed counts from this line of text.
     def add_raw_counts_from_line(self, line):
         if line == '':
@@ -113,19 +174,63 @@ class NgramCounts:
         else:
             words = [self.bos_symbol] + whitespace.split(line) + [self.eos_symbol]
 
-        for i in range(len(words)):
-            for n in range(1, self.ngram_order+1):
-                if i + n > len(words):
-                    break
-                ngram = words[i: i + n]
-                predicted_word = ngram[-1]
-                history = tuple(ngram[: -1])
-                if i == 0 or n == self.ngram_order:
-                    context_word = None
-                else:
-                    context_word = words[i-1]
-
-                self.add_count(history, predicted_word, context_word, 1)
+        word_to_id = self.word_to_id
+        for word in words:
+            word_id = word_to_id.get(word)
+            if word_id is None:
+                word_id = word_to_id[word] = len(self.words)
+                self.words.append(word)
+            self.pending_ids.append(word_id)
+        self.pending_lengths.append(len(words))
+        if len(self.pending_ids) >= self.chunk_size:
+            self.count_pending_lines()
+
+    def count_pending_lines(self):
+        if len(self.pending_lengths) == 0:
+            return
+        word_ids = np.array(self.pending_ids, dtype=np.int64)
+        lengths = np.array(self.pending_lengths, dtype=np.int64)
+        self.pending_ids = []
+        self.pending_lengths = []
+
+        if len(self.words) > self.word_multiplier:
+            new_multiplier = self.word_multiplier
+            while len(self.words) > new_multiplier:
+                new_multiplier *= 2
+            for this_order_counts in self.counts[1:]:
+                this_order_counts.change_word_multiplier(self.word_multiplier,
+                                                         new_multiplier)
+            self.word_multiplier = new_multiplier
+        m = self.word_multiplier
+
+        num_words = len(word_ids)
+        positions = np.arange(num_words)
+        line_end = np.repeat(np.cumsum(lengths), lengths)
+        # lower_index[i] is the index of the n-gram of the order below that
+        # starts at position i (where there is one).
+        lower_index = None
+        for n in range(self.ngram_order):
+            # positions where an n-gram of history-length n starts
+            starts = positions[positions + n + 1 <= line_end]
+            if n == 0:
+                keys = word_ids[starts]
+                suffix = None
+            else:
+                if len(self.counts[n - 1]) >= np.iinfo(np.int64).max // m:
+                    raise ValueError("Too many distinct {0}-grams".format(n))
+                keys = lower_index[starts] * m + word_ids[starts + n]
+            keys, first, inverse, counts = np.unique(
+                keys, return_index=True, return_inverse=True,
+                return_counts=True)
+            if n > 0:
+                suffix = lower_index[starts[first] + 1]
+            old_to_new, new_index = self.counts[n].merge(
+                keys, counts, self.num_words_counted + starts[first], suffix)
+            if n + 1 < self.ngram_order:
+                self.counts[n + 1].renumber_lower_order(old_to_new, m)
+            lower_index = np.zeros(num_words, dtype=np.int64)
+            lower_index[starts] = new_index[inverse.reshape(-1)]
+        self.num_words_counted += num_words
 
     def add_raw_counts_from_standard_input(self):
         lines_processed = 0
@@ -134,6 +239,7 @@ class NgramCounts:
             line = line.strip(strip_chars)
             self.add_raw_counts_from_line(line)
             lines_processed += 1
+        self.count_pending_lines()
         if lines_processed == 0 or args.verbose > 0:
             print("make_phone_lm.py: processed {0} lines of input".format(lines_processed), file=sys.stderr)
 
@@ -144,9 +250,20 @@ class NgramCounts:
                 line = line.strip(strip_chars)
                 self.add_raw_counts_from_line(line)
                 lines_processed += 1
+        self.count_pending_lines()
         if lines_processed == 0 or args.verbose > 0:
             print("make_phone_lm.py: processed {0} lines of input".format(lines_processed), file=sys.stderr)
 
+    def num_histories(self, n):
+        # the number of histories of n-grams with history-length n.
+        return 1 if n == 0 else len(self.counts[n - 1])
+
+    def histories(self, n):
+        # the history index of each n-gram with history-length n.
+        if n == 0:
+            return np.zeros(len(self.counts[0]), dtype=np.int64)
+        return self.counts[n].histories(self.word_multiplier)
+
     def cal_discounting_constants(self):
         # For each order N of N-grams, we calculate discounting constant D_N = n1_N / (n1_N + 2 * n2_N),
         # where n1_N is the number of unique N-grams with count = 1 (counts-of-counts).
@@ -157,17 +274,13 @@ class NgramCounts:
                       # This is a special case: as we currently assumed having seen all vocabularies in the dictionary,
                       # but perhaps this is not the case for some other scenarios.
         for n in range(1, self.ngram_order):
-            this_order_counts = self.counts[n]
-            n1 = 0
-            n2 = 0
-            for hist, counts_for_hist in this_order_counts.items():
-                stat = Counter(counts_for_hist.word_to_count.values())
-                n1 += stat[1]
-                n2 += stat[2]
+            counts = self.counts[n].counts
+            n1 = int(np.count_nonzero(counts == 1))
+            n2 = int(np.count_nonzero(counts == 2))
             assert n1 + 2 * n2 > 0
             self.d.append(max(0.001, n1 * 1.0) / (n1 + 2 * n2))   # We are doing this max(0.001, xxx) to avoid zero discounting constant D due to n1=0,
                                                                   # which could happen if the number of symbols is small.
-                                                                  # Otherwise, zero discounting constant can cause division by zero in computing BOW.            
+                                                                  # Otherwise, zero discounting constant can cause division by zero in computing BOW.
 
     def cal_f(self):
         # f(a_z) is a probability distribution of word sequence a_z.
@@ -177,30 +290,31 @@ class NgramCounts:
         # f(a_z) = (c(a_z) - D0) / c(a_)    ;; for highest order N-grams
         # f(_z)  = (n(*_z) - D1) / n(*_*)	;; for lower order N-grams
 
-        # highest order N-grams
-        n = self.ngram_order - 1
-        this_order_counts = self.counts[n]
-        for hist, counts_for_hist in this_order_counts.items():
-            for w, c in counts_for_hist.word_to_count.items():
-                counts_for_hist.word_to_f[w] = max((c - self.d[n]), 0) * 1.0 / counts_for_hist.total_count
-
-        # lower order N-grams
-        for n in range(0, self.ngram_order - 1):
-            this_order_counts = self.counts[n]
-            for hist, counts_for_hist in this_order_counts.items():
-
-                n_star_star = 0
-                for w in counts_for_hist.word_to_count.keys():
-                    n_star_star += len(counts_for_hist.word_to_context[w])
-
-                if n_star_star != 0:
-                    for w in counts_for_hist.word_to_count.keys():
-                        n_star_z = len(counts_for_hist.word_to_context[w])
-                        counts_for_hist.word_to_f[w] = max((n_star_z - self.d[n]), 0) * 1.0 / n_star_star
-                else:  # patterns begin with <s>, they do not have "modified count", so use raw count instead
-                    for w in counts_for_hist.word_to_count.keys():
-                        n_star_z = counts_for_hist.word_to_count[w]
-                        counts_for_hist.word_to_f[w] = max((n_star_z - self.d[n]), 0) * 1.0 / counts_for_hist.total_count
+        self.f = [None] * self.ngram_order
+        self.modified_counts = [None] * self.ngram_order
+        for n in range(self.ngram_order):
+            counts = self.counts[n].counts
+            hists = self.histories(n)
+            total_count = sum_by_history(hists, counts, self.num_histories(n))[hists]
+            if n == self.ngram_order - 1:
+                # highest order N-grams
+                self.modified_counts[n] = np.zeros(len(counts), dtype=np.int64)
+                self.f[n] = np.maximum(counts - self.d[n], 0) * 1.0 / total_count
+                continue
+
+            # lower order N-grams.  n(*_z) is the number of distinct words
+            # preceding _z, i.e. the number of (n+1)-grams ending in _z.
+            n_star_z = np.bincount(self.counts[n + 1].suffix, minlength=len(counts))
+            n_star_star = sum_by_history(hists, n_star_z, self.num_histories(n))[hists]
+            self.modified_counts[n] = n_star_z
+            # patterns begin with <s>, they do not have "modified count", so use raw count instead
+            has_n_star_star = n_star_star != 0
+            f = np.empty(len(counts))
+            f[has_n_star_star] = (np.maximum(n_star_z[has_n_star_star] - self.d[n], 0) * 1.0
+                                  / n_star_star[has_n_star_star])
+            f[~has_n_star_star] = (np.maximum(counts[~has_n_star_star] - self.d[n], 0) * 1.0
+                                   / total_count[~has_n_star_star])
+            self.f[n] = f
 
     def cal_bow(self):
         # Backoff weights are only necessary for ngrams which form a prefix of a longer ngram.
@@ -213,49 +327,55 @@ class NgramCounts:
 
         # highest order N-grams
         n = self.ngram_order - 1
-        this_order_counts = self.counts[n]
-        for hist, counts_for_hist in this_order_counts.items():
-            for w in counts_for_hist.word_to_count.keys():
-                counts_for_hist.word_to_bow[w] = None
+        self.bow = [None] * self.ngram_order
+        self.bow[n] = np.full(len(self.counts[n]), np.nan)
 
         # lower order N-grams
+        eos_id = self.word_to_id[self.eos_symbol]
         for n in range(0, self.ngram_order - 1):
-            this_order_counts = self.counts[n]
-            for hist, counts_for_hist in this_order_counts.items():
-                for w in counts_for_hist.word_to_count.keys():
-                    if w == self.eos_symbol:
-                        counts_for_hist.word_to_bow[w] = None
-                    else:
-                        a_ = hist + (w,)
-
-                        assert len(a_) < self.ngram_order
-                        assert a_ in self.counts[len(a_)].keys()
-
-                        a_counts_for_hist = self.counts[len(a_)][a_]
-
-                        sum_z1_f_a_z = 0
-                        for u in a_counts_for_hist.word_to_count.keys():
-                            sum_z1_f_a_z += a_counts_for_hist.word_to_f[u]
-
-                        sum_z1_f_z = 0
-                        _ = a_[1:]
-                        _counts_for_hist = self.counts[len(_)][_]
-                        for u in a_counts_for_hist.word_to_count.keys():  # Should be careful here: what is Z1
-                            sum_z1_f_z += _counts_for_hist.word_to_f[u]
-
-                        counts_for_hist.word_to_bow[w] = (1.0 - sum_z1_f_a_z) / (1.0 - sum_z1_f_z)
+            # the n-grams a_ are the histories of the n-grams a_z of the
+            # order above; _z is the suffix of a_z.  The sums are accumulated
+            # in order of first appearance of z, as np.bincount() adds up its
+            # weights in order.
+            num_ngrams = len(self.counts[n])
+            longer_hists = self.histories(n + 1)
+            longer_order = np.lexsort((self.counts[n + 1].first_pos, longer_hists))
+            longer_hists = longer_hists[longer_order]
+            sum_z1_f_a_z = np.bincount(longer_hists, weights=self.f[n + 1][longer_order],
+                                       minlength=num_ngrams)
+            sum_z1_f_z = np.bincount(longer_hists,
+                                     weights=self.f[n][self.counts[n + 1].suffix[longer_order]],
+                                     minlength=num_ngrams)
+
+            has_bow = self.counts[n].words(self.word_multiplier) != eos_id
+            assert np.all(np.bincount(longer_hists, minlength=num_ngrams)[has_bow] > 0)
+            denominator = 1.0 - sum_z1_f_z[has_bow]
+            if np.any(denominator == 0):
+                raise ZeroDivisionError("float division by zero")
+            bow = np.full(num_ngrams, np.nan)
+            bow[has_bow] = (1.0 - sum_z1_f_a_z[has_bow]) / denominator
+            self.bow[n] = bow
+
+    def ngram_strings(self):
+        # yields, for each history-length, the list of the n-grams of that
+        # order as strings, in the order of self.counts[n].
+        strings = None
+        for n in range(self.ngram_order):
+            words = self.counts[n].words(self.word_multiplier).tolist()
+            if n == 0:
+                strings = [self.words[w] for w in words]
+            else:
+                strings = [strings[h] + ' ' + self.words[w]
+                           for h, w in zip(self.histories(n).tolist(), words)]
+            yield strings
 
     def print_raw_counts(self, info_string):
         # these are useful for debug.
         print(info_string)
         res = []
-        for this_order_counts in self.counts:
-            for hist, counts_for_hist in this_order_counts.items():
-                for w in counts_for_hist.word_to_count.keys():
-                    ngram = " ".join(hist) + " " + w
-                    ngram = ngram.strip(strip_chars)
-
-                    res.append("{0}\t{1}".format(ngram, counts_for_hist.word_to_count[w]))
+        for n, strings in enumerate(self.ngram_strings()):
+            for ngram, count in zip(strings, self.counts[n].counts.tolist()):
+                res.append("{0}\t{1}".format(ngram.strip(strip_chars), count))
         res.sort(reverse=True)
         for r in res:
             print(r)
@@ -264,19 +384,14 @@ class NgramCounts:
         # these are useful for debug.
         print(info_string)
         res = []
-        for this_order_counts in self.counts:
-            for hist, counts_for_hist in this_order_counts.items():
-                for w in counts_for_hist.word_to_count.keys():
-                    ngram = " ".join(hist) + " " + w
-                    ngram = ngram.strip(strip_chars)
-
-                    modified_count = len(counts_for_hist.word_to_context[w])
-                    raw_count = counts_for_hist.word_to_count[w]
-
-                    if modified_count == 0:
-                        res.append("{0}\t{1}".format(ngram, raw_count))
-                    else:
-                        res.append("{0}\t{1}".format(ngram, modified_count))
+        for n, strings in enumerate(self.ngram_strings()):
+            for ngram, raw_count, modified_count in zip(
+                    strings, self.counts[n].counts.tolist(),
+                    self.modified_counts[n].tolist()):
+                if modified_count == 0:
+                    res.append("{0}\t{1}".format(ngram.strip(strip_chars), raw_count))
+                else:
+                    res.append("{0}\t{1}".format(ngram.strip(strip_chars), modified_count))
         res.sort(reverse=True)
         for r in res:
             print(r)
@@ -285,17 +400,12 @@ class NgramCounts:
         # these are useful for debug.
         print(info_string)
         res = []
-        for this_order_counts in self.counts:
-            for hist, counts_for_hist in this_order_counts.items():
-                for w in counts_for_hist.word_to_count.keys():
-                    ngram = " ".join(hist) + " " + w
-                    ngram = ngram.strip(strip_chars)
-
-                    f = counts_for_hist.word_to_f[w]
-                    if f == 0:  # f(<s>) is always 0
-                        f = 1e-99
+        for n, strings in enumerate(self.ngram_strings()):
+            for ngram, f in zip(strings, self.f[n].tolist()):
+                if f == 0:  # f(<s>) is always 0
+                    f = 1e-99
 
-                    res.append("{0}\t{1}".format(ngram, math.log(f, 10)))
+                res.append("{0}\t{1}".format(ngram.strip(strip_chars), math.log(f, 10)))
         res.sort(reverse=True)
         for r in res:
             print(r)
@@ -304,21 +414,15 @@ class NgramCounts:
         # these are useful for debug.
         print(info_string)
         res = []
-        for this_order_counts in self.counts:
-            for hist, counts_for_hist in this_order_counts.items():
-                for w in counts_for_hist.word_to_count.keys():
-                    ngram = " ".join(hist) + " " + w
-                    ngram = ngram.strip(strip_chars)
-
-                    f = counts_for_hist.word_to_f[w]
-                    if f == 0:  # f(<s>) is always 0
-                        f = 1e-99
-
-                    bow = counts_for_hist.word_to_bow[w]
-                    if bow is None:
-                        res.append("{1}\t{0}".format(ngram, math.log(f, 10)))
-                    else:
-                        res.append("{1}\t{0}\t{2}".format(ngram, math.log(f, 10), math.log(bow, 10)))
+        for n, strings in enumerate(self.ngram_strings()):
+            for ngram, f, bow in zip(strings, self.f[n].tolist(), self.bow[n].tolist()):
+                if f == 0:  # f(<s>) is always 0
+                    f = 1e-99
+
+                if math.isnan(bow):
+                    res.append("{1}\t{0}".format(ngram.strip(strip_chars), math.log(f, 10)))
+                else:
+                    res.append("{1}\t{0}\t{2}".format(ngram.strip(strip_chars), math.log(f, 10), math.log(bow, 10)))
         res.sort(reverse=True)
         for r in res:
             print(r)
@@ -329,31 +433,37 @@ class NgramCounts:
         print('\\data\\', file=fout)
         for hist_len in range(self.ngram_order):
             # print the number of n-grams.
-            print('ngram {0}={1}'.format(
-                hist_len + 1,
-                sum([len(counts_for_hist.word_to_f) for counts_for_hist in self.counts[hist_len].values()])),
-                file=fout
-            )
+            print('ngram {0}={1}'.format(hist_len + 1, len(self.counts[hist_len])), file=fout)
 
         print('', file=fout)
 
-        for hist_len in range(self.ngram_order):
+        for hist_len, strings in enumerate(self.ngram_strings()):
             print('\\{0}-grams:'.format(hist_len + 1), file=fout)
 
+            # The n-grams are listed by history, in order of first appearance
+            # of the history, and then in order of first appearance.
             this_order_counts = self.counts[hist_len]
-            for hist, counts_for_hist in this_order_counts.items():
-                for word in counts_for_hist.word_to_count.keys():
-                    ngram = hist + (word,)
-                    prob = counts_for_hist.word_to_f[word]
-                    bow = counts_for_hist.word_to_bow[word]
-
-                    if prob == 0:  # f(<s>) is always 0
-                        prob = 1e-99
-
-                    line = '{0}\t{1}'.format('%.7f' % math.log10(prob), ' '.join(ngram))
-                    if bow is not None:
-                        line += '\t{0}'.format('%.7f' % math.log10(bow))
-                    print(line, file=fout)
+            hists = self.histories(hist_len)
+            hist_first_pos = np.full(self.num_histories(hist_len), np.iinfo(np.int64).max)
+            np.minimum.at(hist_first_pos, hists, this_order_counts.first_pos)
+            order = np.lexsort((this_order_counts.first_pos, hist_first_pos[hists]))
+
+            f = self.f[hist_len][order].tolist()
+            bow = self.bow[hist_len][order].tolist()
+            lines = []
+            for i, prob, b in zip(order.tolist(), f, bow):
+                if prob == 0:  # f(<s>) is always 0
+                    prob = 1e-99
+
+                line = '{0}\t{1}'.format('%.7f' % math.log10(prob), strings[i])
+                if not math.isnan(b):
+                    line += '\t{0}'.format('%.7f' % math.log10(b))
+                lines.append(line)
+                if len(lines) >= 10000:
+                    print('\n'.join(lines), file=fout)
+                    lines = []
+            if len(lines) > 0:
+                print('\n'.join(lines), file=fout)
             print('', file=fout)
         print('\\end\\', file=fout)
 
@@ -5,10 +5,12 @@
 
 # see get_args() below for usage message.
 import argparse
+import itertools
 import os
 import sys
 import math
 import re
+import numpy as np
 
 # The use of latin-1 encoding does not preclude reading utf-8.  latin-1
 # encoding means "treat words as sequences of bytes", and it is compatible
@@ -170,6 +172,86 @@ def write_nonterminal_arcs(start_state, loop_state, next_state,
 
 
 
+# The number of pronunciations for which write_pron_arcs() is called at a time.
+lexicon_block_size = 10000
+
+
+def write_arcs(src, dest, phones, words, costs):
+    """Writes the arcs with source-states 'src', destination-states 'dest',
+    input and output labels 'phones' and 'words' and costs 'costs' (lists of
+    the same length) to the standard output, in one block; this is a lot
+    faster than printing the arcs one by one."""
+    if len(src) != 0:
+        sys.stdout.write('\n'.join(["%d\t%d\t%s\t%s\t%r" % arc for arc in
+                                    zip(src, dest, phones, words, costs)]) + '\n')
+
+
+def write_pron_arcs(lexicon, loop_state, next_state, final_states, final_costs):
+    """Writes to the standard output the arcs for the pronunciations in
+    'lexicon', a list of 3-tuples (word, pron-prob, prons) as returned by
+    read_lexiconp(), and returns the updated value of next_state.  It is called
+    from write_fst_no_silence and write_fst_with_silence.
+       loop_state: the state where the pronunciations start.
+       next_state: the number from which this function can start allocating its
+                  own states.
+       final_states: a list of the states where the pronunciations end.  The
+                  last phone of a pronunciation is on an arc to each of them.
+       final_costs: a list of the same length as 'final_states', of costs
+                  that are added to the costs of the arcs to those states, or
+                  None where there is nothing to add.
+    The arcs are the same, and in the same order, as if we went through the
+    pronunciations one by one, allocating the states of each in turn.  The
+    first arc of a pronunciation has the word and the pronunciation cost; the
+    other arcs have <eps> and zero cost (plus the final costs).  Empty
+    pronunciations have only the arcs to the final states, with <eps> as phone.
+    """
+    num_final = len(final_states)
+    words = np.array([word for (word, pronprob, pron) in lexicon], dtype=object)
+    pron_costs = np.array([-math.log(pronprob) for (word, pronprob, pron) in lexicon],
+                          dtype=np.float64)
+    prons = [pron for (word, pronprob, pron) in lexicon]
+    # The arcs of a pronunciation of n > 0 phones are a chain of n - 1 arcs,
+    # each going to a new state, followed by the arcs to the final states.
+    num_chain_arcs = np.maximum(np.array([len(pron) for pron in prons],
+                                         dtype=np.int64) - 1, 0)
+    num_arcs = num_chain_arcs + num_final
+    arc_begin = np.cumsum(num_arcs) - num_arcs
+    state_begin = next_state + np.cumsum(num_chain_arcs) - num_chain_arcs
+
+    # For each arc, pron_index is the index of its pronunciation and position
+    # its index among the arcs of that pronunciation; chain_position is the
+    # number of chain arcs before it, so its source-state is loop_state if
+    # chain_position is 0 and state_begin + chain_position - 1 otherwise.
+    pron_index = np.repeat(np.arange(len(prons), dtype=np.int64), num_arcs)
+    position = np.arange(len(pron_index), dtype=np.int64) - arc_begin[pron_index]
+    chain_length = num_chain_arcs[pron_index]
+    is_final = (position >= chain_length)
+    chain_position = np.minimum(position, chain_length)
+    is_first = (chain_position == 0)
+    src = np.where(is_first, loop_state,
+                   state_begin[pron_index] + chain_position - 1)
+    final_index = (position - chain_length)[is_final]
+    dest = state_begin[pron_index] + position
+    dest[is_final] = np.array(final_states, dtype=np.int64)[final_index]
+
+    phones = np.empty(len(pron_index), dtype=object)
+    phones[~is_final] = np.array(list(itertools.chain.from_iterable(
+        pron[:-1] for pron in prons)), dtype=object)
+    phones[is_final] = np.repeat(np.array(
+        [pron[-1] if len(pron) > 0 else '<eps>' for pron in prons],
+        dtype=object), num_final)
+    arc_words = np.where(is_first, words[pron_index], '<eps>')
+    costs = np.where(is_first, pron_costs[pron_index], 0.0)
+    for i in range(num_final):
+        if final_costs[i] is not None:
+            this_final = np.nonzero(is_final)[0][final_index == i]
+            costs[this_final] = final_costs[i] + costs[this_final]
+
+    write_arcs(src.tolist(), dest.tolist(), phones.tolist(),
+               arc_words.tolist(), costs.tolist())
+    return next_state + int(num_chain_arcs.sum())
+
+
 def write_fst_no_silence(lexicon, nonterminals=None, left_context_phones=None):
     """Writes the text format of L.fst to the standard output.  This version is for
     when --sil-prob=0.0, meaning there is no optional silence allowed.
@@ -186,26 +268,10 @@ def write_fst_no_silence(lexicon, nonterminals=None, left_context_phones=None):
 
     loop_state = 0
     next_state = 1  # the next un-allocated state, will be incremented as we go.
-    for (word, pronprob, pron) in lexicon:
-        cost = -math.log(pronprob)
-        cur_state = loop_state
-        for i in range(len(pron) - 1):
-            print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-                src=cur_state,
-                dest=next_state,
-                phone=pron[i],
-                word=(word if i == 0 else '<eps>'),
-                cost=(cost if i == 0 else 0.0)))
-            cur_state = next_state
-            next_state += 1
-
-        i = len(pron) - 1  # note: i == -1 if pron is empty.
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=cur_state,
-            dest=loop_state,
-            phone=(pron[i] if i >= 0 else '<eps>'),
-            word=(word if i <= 0 else '<eps>'),
-            cost=(cost if i <= 0 else 0.0)))
+    for begin in range(0, len(lexicon), lexicon_block_size):
+        next_state = write_pron_arcs(
+            lexicon[begin:begin + lexicon_block_size], loop_state, next_state,
+            [loop_state], [None])
 
     if nonterminals is not None:
         next_state = write_nonterminal_arcs(
@@ -267,31 +333,10 @@ def write_fst_with_silence(lexicon, sil_prob, sil_phone, sil_disambig,
             phone=sil_disambig, word='<eps>', cost=0.0))
 
 
-    for (word, pronprob, pron) in lexicon:
-        pron_cost = -math.log(pronprob)
-        cur_state = loop_state
-        for i in range(len(pron) - 1):
-            print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-                src=cur_state, dest=next_state,
-                phone=pron[i],
-                word=(word if i == 0 else '<eps>'),
-                cost=(pron_cost if i == 0 else 0.0)))
-            cur_state = next_state
-            next_state += 1
-
-        i = len(pron) - 1  # note: i == -1 if pron is empty.
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=cur_state,
-            dest=loop_state,
-            phone=(pron[i] if i >= 0 else '<eps>'),
-            word=(word if i <= 0 else '<eps>'),
-            cost=no_sil_cost + (pron_cost if i <= 0 else 0.0)))
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=cur_state,
-            dest=sil_state,
-            phone=(pron[i] if i >= 0 else '<eps>'),
-            word=(word if i <= 0 else '<eps>'),
-            cost=sil_cost + (pron_cost if i <= 0 else 0.0)))
+    for begin in range(0, len(lexicon), lexicon_block_size):
+        next_state = write_pron_arcs(
+            lexicon[begin:begin + lexicon_block_size], loop_state, next_state,
+            [loop_state, sil_state], [no_sil_cost, sil_cost])
 
     if nonterminals is not None:
         next_state = write_nonterminal_arcs(
@@ -5,10 +5,12 @@
 # see get_args() below for usage message.
 
 import argparse
+import itertools
 import os
 import sys
 import math
 import re
+import numpy as np
 
 # The use of latin-1 encoding does not preclude reading utf-8.  latin-1
 # encoding means "treat words as sequences of bytes", and it is compatible
@@ -263,6 +265,87 @@ def write_nonterminal_arcs(start_state, sil_state, non_sil_state,
         state=final_state, final_cost=0.0))
     return next_state
 
+# The number of pronunciations for which write_pron_arcs() is called at a time.
+lexicon_block_size = 10000
+
+
+def write_pron_arcs(lexicon, sil_state, non_sil_state, next_state,
+                    sil_phone, sil_disambig):
+    """This function is called from write_fst, and writes to the stdout the
+    arcs for the pronunciations in 'lexicon', a list of 5-tuples as returned
+    by read_lexiconp(); it returns the updated value of next_state.  The
+    output is the same as if we went through the pronunciations one by one,
+    but the states and arcs are worked out as numpy arrays for all of them at
+    once and the text is written in one block.  Each pronunciation of n
+    phones (an empty one is treated as the phone <eps>) gets n new states
+    and n + 3 arcs:
+       - two arcs with the first phone and the word, from non_sil_state and
+         sil_state to the first new state;
+       - a chain of n - 1 arcs with the other phones, without costs;
+       - two arcs from the last new state to non_sil_state and sil_state,
+         with sil_disambig and sil_phone respectively.
+    """
+    prons = [pron if len(pron) > 0 else ['<eps>']
+             for (word, pronprob, wordsilprob, silwordcorrection,
+                  nonsilwordcorrection, pron) in lexicon]
+    pron_cost = np.array([-math.log(entry[1]) for entry in lexicon])
+    word_to_sil_cost = np.array([-math.log(entry[2]) for entry in lexicon])
+    word_to_non_sil_cost = np.array([-math.log(1.0 - entry[2]) for entry in lexicon])
+    sil_to_word_cost = np.array([-math.log(entry[3]) for entry in lexicon])
+    non_sil_to_word_cost = np.array([-math.log(entry[4]) for entry in lexicon])
+
+    pron_length = np.array([len(pron) for pron in prons], dtype=np.int64)
+    num_arcs = pron_length + 3
+    arc_begin = np.cumsum(num_arcs) - num_arcs
+    state_begin = next_state + np.cumsum(pron_length) - pron_length
+
+    # For each arc, 'pron_index' is the index of its pronunciation and
+    # 'position' its index among the arcs of that pronunciation, so the
+    # arcs to non_sil_state and sil_state are at positions n + 1 and n + 2.
+    pron_index = np.repeat(np.arange(len(prons), dtype=np.int64), num_arcs)
+    position = np.arange(len(pron_index), dtype=np.int64) - arc_begin[pron_index]
+    length = pron_length[pron_index]
+    first_state = state_begin[pron_index]
+    is_entry = (position < 2)
+    is_chain = ~is_entry & (position <= length)
+    to_non_sil = np.nonzero(position == length + 1)[0]
+    to_sil = np.nonzero(position == length + 2)[0]
+
+    src = first_state + np.minimum(position - 2, length - 1)
+    src[position == 0] = non_sil_state
+    src[position == 1] = sil_state
+    dest = first_state + np.maximum(position - 1, 0)
+    dest[to_non_sil] = non_sil_state
+    dest[to_sil] = sil_state
+
+    phones = np.empty(len(pron_index), dtype=object)
+    phones[is_entry] = np.repeat(np.array([pron[0] for pron in prons],
+                                          dtype=object), 2)
+    phones[is_chain] = np.array(list(itertools.chain.from_iterable(
+        pron[1:] for pron in prons)), dtype=object)
+    phones[to_non_sil] = sil_disambig
+    phones[to_sil] = sil_phone
+    words = np.full(len(pron_index), '<eps>', dtype=object)
+    words[is_entry] = np.repeat(np.array([entry[0] for entry in lexicon],
+                                         dtype=object), 2)
+
+    # The chain arcs have no cost; for the others, the cost (preceded by a
+    # tab) is the last field.
+    costs = np.zeros(len(pron_index), dtype=np.float64)
+    costs[position == 0] = pron_cost + non_sil_to_word_cost
+    costs[position == 1] = pron_cost + sil_to_word_cost
+    costs[to_non_sil] = word_to_non_sil_cost
+    costs[to_sil] = word_to_sil_cost
+    cost_fields = np.full(len(pron_index), '', dtype=object)
+    cost_fields[~is_chain] = ["\t%r" % cost for cost in costs[~is_chain].tolist()]
+
+    sys.stdout.write('\n'.join(
+        ["%d\t%d\t%s\t%s%s" % arc for arc in
+         zip(src.tolist(), dest.tolist(), phones.tolist(), words.tolist(),
+             cost_fields.tolist())]) + '\n')
+    return next_state + int(pron_length.sum())
+
+
 def write_fst(lexicon, silprobs, sil_phone, sil_disambig,
               nonterminals = None, left_context_phones = None):
     """Writes the text format of L.fst (or L_disambig.fst)  to the standard output.
@@ -301,48 +384,10 @@ def write_fst(lexicon, silprobs, sil_phone, sil_disambig,
         src=start_state, dest=sil_state,
         phone=sil_phone, word='<eps>', cost=initial_sil_cost))
 
-    for (word, pronprob, wordsilprob, silwordcorrection, nonsilwordcorrection, pron) in lexicon:
-        pron_cost = -math.log(pronprob)
-        word_to_sil_cost = -math.log(wordsilprob)
-        word_to_non_sil_cost = -math.log(1.0 - wordsilprob)
-        sil_to_word_cost = -math.log(silwordcorrection)
-        non_sil_to_word_cost = -math.log(nonsilwordcorrection)
-
-        if len(pron) == 0:
-            # this is not really expected but we try to handle it gracefully.
-            pron = ['<eps>']
-
-        new_state = next_state  # allocate a new state
-        next_state += 1
-        # Create transitions from both non_sil_state and sil_state to 'new_state',
-        # with the word label and the word's first phone on them
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=non_sil_state, dest=new_state,
-            phone=pron[0], word=word, cost=(pron_cost + non_sil_to_word_cost)))
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=sil_state, dest=new_state,
-            phone=pron[0], word=word, cost=(pron_cost + sil_to_word_cost)))
-        cur_state = new_state
-
-        # add states and arcs for all but the first phone.
-        for i in range(1, len(pron)):
-            new_state = next_state
-            next_state += 1
-            print("{src}\t{dest}\t{phone}\t<eps>".format(
-                src=cur_state, dest=new_state, phone=pron[i]))
-            cur_state = new_state
-
-        # ... and from there we return via two arcs to the silence and
-        # nonsilence state.  the silence-disambig symbol, if used,q
-        # goes on the nonsilence arc; this saves us having to insert an epsilon.
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=cur_state,  dest=non_sil_state,
-            phone=sil_disambig, word='<eps>',
-            cost=word_to_non_sil_cost))
-        print("{src}\t{dest}\t{phone}\t{word}\t{cost}".format(
-            src=cur_state, dest=sil_state,
-            phone=sil_phone, word='<eps>',
-            cost=word_to_sil_cost))
+    for begin in range(0, len(lexicon), lexicon_block_size):
+        next_state = write_pron_arcs(
+            lexicon[begin:begin + lexicon_block_size],
+            sil_state, non_sil_state, next_state, sil_phone, sil_disambig)
 
     if nonterminals is not None:
         next_state = write_nonterminal_arcs(
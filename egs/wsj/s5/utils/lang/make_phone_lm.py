@@ -9,6 +9,7 @@ import sys
 import argparse
 import math
 from collections import defaultdict
+import numpy as np
 
 # note, this was originally based
 
@@ -71,6 +72,10 @@ class CountsForHistory(object):
     ## particular history-state.  It is used inside class NgramCounts.
     ## It really does the job of a dict from int to float, but it also
     ## keeps track of the total count.
+    # __slots__ keeps the per-state overhead down; there is one of these
+    # objects for every history-state.
+    __slots__ = ['word_to_count', 'total_count']
+
     def __init__(self):
         # The 'lambda: defaultdict(float)' is an anonymous function taking no
         # arguments that returns a new defaultdict(float).
@@ -110,6 +115,152 @@ class CountsForHistory(object):
         else:
             self.word_to_count[predicted_word] = new_count
 
+def ArrayLog(x):
+    # Returns math.log() of each element of the numpy array 'x'.  We don't use
+    # np.log(), which may differ from math.log() in the last bit depending on
+    # the CPU, so that the pruning decisions don't depend on it.
+    return np.fromiter(map(math.log, x.tolist()), dtype=np.float64,
+                       count=len(x))
+
+
+class NgramCountArrays(object):
+    ## This class holds a copy of the counts in an NgramCounts object as numpy
+    ## arrays; it's used in pruning, to compute the likelihood changes of all
+    ## the n-grams at once.  (The NgramCounts object is changed one n-gram at
+    ## a time while pruning, so we make a new copy each time we need one).
+    ## For each history-length n:
+    ##   hists[n] is a list of the histories (tuples) of that length, in the
+    ##       order of NgramCounts.counts[n], and hist_words[n] is the same as a
+    ##       2-d array;
+    ##   total_count[n], backoff_count[n] and has_backoff[n] are arrays giving
+    ##       for each history the total count, the count of the backoff symbol
+    ##       and whether it has a backoff symbol at all;
+    ##   backoff_hist[n] is an array giving for each history the index of
+    ##       hist[1:] in hists[n-1] (-1 if it doesn't exist, or if n == 0);
+    ##   ngram_hist[n], ngram_word[n] and ngram_count[n] are arrays giving the
+    ##       history-index, word and count of each n-gram (not including the
+    ##       backoff symbol), in the order of the word_to_count dicts.
+    def __init__(self, ngram_counts):
+        backoff_symbol = ngram_counts.backoff_symbol
+        self.hists = []
+        self.hist_to_index = []
+        self.hist_words = []
+        self.total_count = []
+        self.backoff_count = []
+        self.has_backoff = []
+        self.backoff_hist = []
+        self.ngram_hist = []
+        self.ngram_word = []
+        self.ngram_count = []
+        for n in range(args.ngram_order):
+            hists = list(ngram_counts.counts[n].keys())
+            hist_to_index = dict(zip(hists, range(len(hists))))
+            total_count = []
+            num_words = []
+            words = []
+            counts = []
+            for counts_for_hist in ngram_counts.counts[n].values():
+                total_count.append(counts_for_hist.total_count)
+                num_words.append(len(counts_for_hist.word_to_count))
+                words.extend(counts_for_hist.word_to_count.keys())
+                counts.extend(counts_for_hist.word_to_count.values())
+            ngram_hist = np.repeat(np.arange(len(hists), dtype=np.int64),
+                                   np.array(num_words, dtype=np.int64))
+            words = np.array(words, dtype=np.int64)
+            counts = np.array(counts, dtype=np.int64)
+            is_backoff = (words == backoff_symbol)
+            backoff_count = np.zeros(len(hists), dtype=np.int64)
+            backoff_count[ngram_hist[is_backoff]] = counts[is_backoff]
+            has_backoff = np.zeros(len(hists), dtype=bool)
+            has_backoff[ngram_hist[is_backoff]] = True
+            if n == 0:
+                backoff_hist = np.full(len(hists), -1, dtype=np.int64)
+            else:
+                backoff_hist = np.array(
+                    [self.hist_to_index[n - 1].get(hist[1:], -1) for hist in hists],
+                    dtype=np.int64)
+
+            self.hists.append(hists)
+            self.hist_to_index.append(hist_to_index)
+            self.hist_words.append(np.array(hists, dtype=np.int64).reshape(len(hists), n))
+            self.total_count.append(np.array(total_count, dtype=np.int64))
+            self.backoff_count.append(backoff_count)
+            self.has_backoff.append(has_backoff)
+            self.backoff_hist.append(backoff_hist)
+            self.ngram_hist.append(ngram_hist[~is_backoff])
+            self.ngram_word.append(words[~is_backoff])
+            self.ngram_count.append(counts[~is_backoff])
+
+        # To look up n-grams, we use sorted keys hist-index * word_multiplier +
+        # word - min_word.  The words are all >= ngram_counts.bos_symbol.
+        self.min_word = ngram_counts.bos_symbol
+        self.word_multiplier = max([int(x.max()) for x in self.ngram_word
+                                    if len(x) > 0] + [0]) - self.min_word + 1
+        self.key_order = []
+        self.sorted_keys = []
+        for n in range(args.ngram_order):
+            keys = self.ngram_hist[n] * self.word_multiplier + (self.ngram_word[n] - self.min_word)
+            key_order = np.argsort(keys)
+            self.key_order.append(key_order)
+            self.sorted_keys.append(keys[key_order])
+        # self.probs[n], once computed, is the array of the probabilities of
+        # the n-grams with history-length n; see GetProbs().
+        self.probs = [ None ] * args.ngram_order
+
+    # Returns the array of the indexes of the n-grams with history-length n
+    # and history-indexes 'hist_indexes' and words 'words' (arrays of the same
+    # size), with -1 for those that don't exist.  hist_indexes may contain -1.
+    def FindNgrams(self, n, hist_indexes, words):
+        keys = hist_indexes * self.word_multiplier + (words - self.min_word)
+        sorted_keys = self.sorted_keys[n]
+        if len(sorted_keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        return np.where((sorted_keys[pos] == keys) & (hist_indexes >= 0),
+                        self.key_order[n][pos], -1)
+
+    # Returns the array of the indexes in hists[n-1] of hist[1:] for the
+    # histories with length n and indexes 'hist_indexes', with -1 where they
+    # don't exist.  hist_indexes may contain -1.
+    def GetBackoffHists(self, n, hist_indexes):
+        ans = np.full(len(hist_indexes), -1, dtype=np.int64)
+        valid = (hist_indexes >= 0)
+        ans[valid] = self.backoff_hist[n][hist_indexes[valid]]
+        return ans
+
+    # Returns the array of the probabilities of the n-grams with
+    # history-length n, as NgramCounts.GetProb() would compute them.  Where
+    # GetProb() would fail (e.g. because an n-gram does not exist in the state
+    # we back off to) the probability is NaN.
+    def GetProbs(self, n):
+        if self.probs[n] is None:
+            hist = self.ngram_hist[n]
+            # states created to hold structurally needed n-grams may have zero
+            # total count; we won't need the probabilities of their n-grams.
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                total_count = self.total_count[n][hist].astype(np.float64)
+                probs = self.ngram_count[n] / total_count
+                if n > 0:
+                    has_backoff = self.has_backoff[n][hist]
+                    backoff_ngrams = self.FindNgrams(
+                        n - 1, self.backoff_hist[n][hist[has_backoff]],
+                        self.ngram_word[n][has_backoff])
+                    probs_in_backoff = np.where(
+                        backoff_ngrams >= 0,
+                        self.GetProbs(n - 1)[np.maximum(backoff_ngrams, 0)],
+                        np.nan)
+                    backoff_prob = self.backoff_count[n][hist[has_backoff]] / \
+                        total_count[has_backoff]
+                    probs[has_backoff] += backoff_prob * probs_in_backoff
+            self.probs[n] = probs
+        return self.probs[n]
+
+    # Returns the n-gram with history-length n and index i as a tuple hist +
+    # (word,).
+    def NgramTuple(self, n, i):
+        return self.hists[n][self.ngram_hist[n][i]] + (int(self.ngram_word[n][i]),)
+
+
 class NgramCounts(object):
     ## A note on data-structure.  Firstly, all words are represented as
     ## integers.  We store n-gram counts as an array, indexed by (history-length
@@ -279,19 +430,22 @@ class NgramCounts(object):
 
         for n in reversed(list(range(args.no_backoff_ngram_order,
                                 args.ngram_order))):
-            num_states_removed = 0
+            # we can't delete states while iterating over the dict, so we
+            # remember them and delete them afterwards.
+            hists_to_remove = []
             for hist, counts_for_hist in self.counts[n].items():
                 l = len(counts_for_hist.word_to_count)
                 assert l > 0 and self.backoff_symbol in counts_for_hist.word_to_count
                 if l == 1 and not hist in protected_histories:  # only the backoff symbol has a count.
-                    del self.counts[n][hist]
-                    num_states_removed += 1
+                    hists_to_remove.append(hist)
                 else:
                     # if this state was not pruned away, then the state that
                     # it backs off to may not be pruned away either.
                     backoff_hist = hist[1:]
                     protected_histories.add(backoff_hist)
-            states_removed_per_hist_len[n] = num_states_removed
+            for hist in hists_to_remove:
+                del self.counts[n][hist]
+            states_removed_per_hist_len[n] = len(hists_to_remove)
         if args.verbose >= 1:
             print("make_phone_lm.py: in PruneEmptyStates(), num states removed for "
                   "each history-length was: " + str(states_removed_per_hist_len),
@@ -375,35 +529,49 @@ class NgramCounts(object):
                         print(this_fst_state, backoff_fst_state,
                               word_disambig_symbol, 0, this_cost)
 
-    # This function returns a set of n-grams that cannot currently be pruned
-    # away, either because a higher-order form of the same n-gram already exists,
-    # or because the n-gram leads to an n-gram state that exists.
+    # This function returns a list, indexed by history-length, of boolean
+    # arrays saying for each n-gram in 'arrays' (an NgramCountArrays object
+    # holding a copy of our counts) whether it cannot currently be pruned
+    # away, either because a higher-order form of the same n-gram already
+    # exists, or because the n-gram leads to an n-gram state that exists.
     # [Note: as we prune, we remove any states that can be removed; see that
     # PruneToIntermediateTarget() calls PruneEmptyStates().
 
-    def GetProtectedNgrams(self):
-        ans = set()
+    def GetProtectedNgrams(self, arrays):
+        ans = [ np.zeros(len(arrays.ngram_word[n]), dtype=bool)
+                for n in range(args.ngram_order) ]
         for n in range(args.no_backoff_ngram_order + 1, args.ngram_order):
-            for hist, counts_for_hist in self.counts[n].items():
-                # If we have an n-gram (6, 7, 8) -> 9, the following loop will
-                # add the backed-off n-grams (7, 8) -> 9 and (8) -> 9 to
-                # 'protected-ngrams'.
-                reduced_hist = hist
-                for m in reversed(list(range(args.no_backoff_ngram_order, n))):
-                    reduced_hist = reduced_hist[1:]  # shift an element off
-                                                     # the history.
-
-                    for word in counts_for_hist.word_to_count.keys():
-                        if word != self.backoff_symbol:
-                            ans.add(reduced_hist + (word,))
-                # The following statement ensures that if we are in a
-                # history-state (6, 7, 8), then n-grams (6, 7, 8) and (6, 7) are
-                # protected.  This assures that the FST states are accessible.
+            # If we have an n-gram (6, 7, 8) -> 9, the following loop will
+            # mark the backed-off n-grams (7, 8) -> 9 and (8) -> 9 as
+            # protected.
+            reduced_hists = arrays.ngram_hist[n]
+            words = arrays.ngram_word[n]
+            for m in reversed(list(range(args.no_backoff_ngram_order, n))):
+                # shift an element off the histories.
+                reduced_hists = arrays.GetBackoffHists(m + 1, reduced_hists)
+                ngrams = arrays.FindNgrams(m, reduced_hists, words)
+                ans[m][ngrams[ngrams >= 0]] = True
+
+            # The following loop ensures that if we are in a
+            # history-state (6, 7, 8), then n-grams (6, 7, 8) and (6, 7) are
+            # protected.  This assures that the FST states are accessible.
+            # protected_hists[m] and protected_words[m] are the history-indexes
+            # and words of the n-grams with history-length m to protect.
+            protected_hists = [ [] for m in range(n) ]
+            protected_words = [ [] for m in range(n) ]
+            for hist in arrays.hists[n]:
                 reduced_hist = hist
                 for m in reversed(list(range(args.no_backoff_ngram_order, n))):
-                    ans.add(reduced_hist)
+                    protected_hists[m].append(
+                        arrays.hist_to_index[m].get(reduced_hist[:-1], -1))
+                    protected_words[m].append(reduced_hist[-1])
                     reduced_hist = reduced_hist[:-1]  # pop an element off the
                                                       # history
+            for m in range(args.no_backoff_ngram_order, n):
+                ngrams = arrays.FindNgrams(
+                    m, np.array(protected_hists[m], dtype=np.int64),
+                    np.array(protected_words[m], dtype=np.int64))
+                ans[m][ngrams[ngrams >= 0]] = True
         return ans
 
     def PruneNgram(self, hist, word):
@@ -439,11 +607,20 @@ class NgramCounts(object):
     #                  extra probability from even-lower-order states as
     #                  if it were a count].  It's a float.
     #  'backoff_total' is the total count in the lower-order state.  It's a float.
+    # Here the arguments are numpy arrays of floats with one element per n-gram
+    # (so that we can compute the likelihood changes of many n-grams at once),
+    # and so is the returned value.
     def PruningLogprobChange(self, count, discount, backoff_count, backoff_total):
-        if count == 0:
-            return 0.0
+        ans = np.zeros(len(count))
+        # the likelihood change is zero for zero counts.
+        nonzero = (count != 0)
+        count = count[nonzero]
+        discount = discount[nonzero]
+        backoff_count = backoff_count[nonzero]
+        backoff_total = backoff_total[nonzero]
 
-        assert discount > 0 and backoff_total >= backoff_count and backoff_total >= 0.99 * discount
+        assert np.all((discount > 0) & (backoff_total >= backoff_count) &
+                      (backoff_total >= 0.99 * discount))
 
 
         # augmented_count is like 'count', but with the extra count for symbol
@@ -460,7 +637,7 @@ class NgramCounts(object):
         # zero).  b_count is also the count of symbol 'b' in the backoff state.
         # Note: b_count will not be negative because backoff_total >= backoff_count.
         b_count = discount * ((backoff_total - backoff_count) / backoff_total)
-        assert b_count >= -0.001 * backoff_total
+        assert np.all(b_count >= -0.001 * backoff_total)
 
         # We imagine a phantom symbol 'c' that represents all symbols other than
         # 'a' and 'b' appearing in the backoff state, which got there from
@@ -469,13 +646,13 @@ class NgramCounts(object):
         # b represent disjoint sets of symbol, even though they might not really
         # be disjoint), and this gives us an upper bound on the divergence.
         c_count = backoff_total - backoff_count - b_count
-        assert c_count >= -0.001 * backoff_total
+        assert np.all(c_count >= -0.001 * backoff_total)
 
         # a_other is the count of 'a' in the backoff state that comes from
         # 'other sources', i.e. it was backed off from history-states other than
         # the current history state.
         a_other_count = backoff_count - discount * backoff_count / backoff_total
-        assert a_other_count >= -0.001 * backoff_count
+        assert np.all(a_other_count >= -0.001 * backoff_count)
 
         # the following sub-expressions are the 'new' versions of certain
         # quantities after we assign the total count 'count' to backoff.  it
@@ -500,7 +677,7 @@ class NgramCounts(object):
         # and the 'count' term is zero in the numerator part of the log expression,
         # because symbol 'a' is completely backed off in 'this' state.
         this_a_change = augmented_count * \
-            math.log((new_discount * new_backoff_count / new_backoff_total)/ \
+            ArrayLog((new_discount * new_backoff_count / new_backoff_total)/ \
                          augmented_count)
 
         # other_a_change is the log-like change of symbol 'a' coming from all
@@ -511,7 +688,7 @@ class NgramCounts(object):
         # distinct symbol when it comes from those other states... as usual,
         # doing so gives us an upper bound on the divergence.
         other_a_change = \
-            a_other_count * math.log((new_backoff_count / new_backoff_total) / \
+            a_other_count * ArrayLog((new_backoff_count / new_backoff_total) / \
                                          (backoff_count / backoff_total)) 
 
         # b_change is the log-like change of phantom symbol 'b' coming from
@@ -523,7 +700,7 @@ class NgramCounts(object):
         #  b_count * logf((new_discount * b_count / new_backoff_total) /
         #                 (discount * b_count / backoff_total),
         # but we cancel b_count to give us the expression below.
-        b_change = b_count * math.log((new_discount / new_backoff_total) / \
+        b_change = b_count * ArrayLog((new_discount / new_backoff_total) / \
                                           (discount / backoff_total))
 
         # c_change is the log-like change of phantom symbol 'c' coming from
@@ -532,41 +709,54 @@ class NgramCounts(object):
         # directly written as a ratio of counts, as c_count * logf((c_count /
         # new_backoff_total) / (c_count / backoff_total)), but we simplified it to
         # the expression below.
-        c_change = c_count * math.log(backoff_total / new_backoff_total)
+        c_change = c_count * ArrayLog(backoff_total / new_backoff_total)
 
-        ans = this_a_change + other_a_change + b_change + c_change
+        this_ans = this_a_change + other_a_change + b_change + c_change
         # the answer should not be positive.
-        assert ans <= 0.0001 * (count + discount + backoff_count + backoff_total)
+        assert np.all(this_ans <= 0.0001 * (count + discount + backoff_count +
+                                            backoff_total))
         if args.verbose >= 4:
-            print("pruning-logprob-change for {0},{1},{2},{3} is {4}".format(
-                    count, discount, backoff_count, backoff_total, ans),
-                  file = sys.stderr)
+            for i in range(len(this_ans)):
+                print("pruning-logprob-change for {0},{1},{2},{3} is {4}".format(
+                        float(count[i]), float(discount[i]), float(backoff_count[i]),
+                        float(backoff_total[i]), float(this_ans[i])),
+                      file = sys.stderr)
+        ans[nonzero] = this_ans
         return ans
 
 
-    def GetLikeChangeFromPruningNgram(self, hist, word):
-        counts_for_hist = self.counts[len(hist)][hist]
-        counts_for_backoff_hist = self.counts[len(hist) - 1][hist[1:]]
-        assert word != self.backoff_symbol and word in counts_for_hist.word_to_count
-        count = counts_for_hist.word_to_count[word]
-        discount = counts_for_hist.word_to_count[self.backoff_symbol]
-        backoff_total = counts_for_backoff_hist.total_count
+    # Returns an array of the likelihood changes from pruning the n-grams with
+    # history-length n and indexes 'ngrams' (an array) in 'arrays', an
+    # NgramCountArrays object holding a copy of our counts.
+    def GetLikeChangesFromPruningNgrams(self, arrays, n, ngrams):
+        hists = arrays.ngram_hist[n][ngrams]
+        words = arrays.ngram_word[n][ngrams]
+        backoff_hists = arrays.GetBackoffHists(n, hists)
+        backoff_ngrams = arrays.FindNgrams(n - 1, backoff_hists, words)
+        count = arrays.ngram_count[n][ngrams]
+        discount = arrays.backoff_count[n][hists]
+        backoff_total = arrays.total_count[n - 1][backoff_hists].astype(np.float64)
         # backoff_count is a pseudo-count: it's like the count of 'word' in the
         # backoff history-state, but adding something to account for further
         # levels of backoff.
-        try:
-            backoff_count = self.GetProb(hist[1:], word) * backoff_total
-        except:
-            print("problem getting backoff count: hist = {0}, word = {1}".format(hist, word),
-                  file = sys.stderr)
+        backoff_count = np.where(
+            backoff_ngrams >= 0,
+            arrays.GetProbs(n - 1)[np.maximum(backoff_ngrams, 0)],
+            np.nan) * backoff_total
+        if np.any(np.isnan(backoff_count)):
+            i = np.argmax(np.isnan(backoff_count))
+            print("problem getting backoff count: hist = {0}, word = {1}".format(
+                    arrays.hists[n][hists[i]], words[i]), file = sys.stderr)
             sys.exit(1)
 
-        return self.PruningLogprobChange(float(count), float(discount),
-                                         backoff_count, float(backoff_total))
+        return self.PruningLogprobChange(count.astype(np.float64),
+                                         discount.astype(np.float64),
+                                         backoff_count, backoff_total)
 
     # note: returns loglike change per word.
     def PruneToIntermediateTarget(self, num_extra_ngrams):
-        protected_ngrams = self.GetProtectedNgrams()
+        arrays = NgramCountArrays(self)
+        protected_ngrams = self.GetProtectedNgrams(arrays)
         initial_num_extra_ngrams = self.GetNumExtraNgrams()
         num_ngrams_to_prune = initial_num_extra_ngrams - num_extra_ngrams
         assert num_ngrams_to_prune > 0
@@ -574,46 +764,62 @@ class NgramCounts(object):
         num_candidates_per_order = [ 0 ] * args.ngram_order
         num_pruned_per_order = [ 0 ] * args.ngram_order
 
-
-        # like_change_and_ngrams this will be a list of tuples consisting
-        # of the likelihood change as a float and then the words of the n-gram
-        # that we're considering pruning,
-        # e.g. (-0.164, 7, 8, 9)
-        # meaning that pruning the n-gram (7, 8) -> 9 leads to
-        # a likelihood change of -0.164.  We'll later sort this list
-        # so we can prune the n-grams that made the least-negative
-        # likelihood change.
-        like_change_and_ngrams = []
+        # For the n-grams that we're considering pruning, 'candidate_orders'
+        # will be their history-lengths, 'candidate_ngrams' their indexes in
+        # 'arrays', 'candidate_words' a matrix whose rows are the words of the
+        # n-grams, padded at the end with a value less than any word, and
+        # 'like_changes' the likelihood change from pruning them.  We'll later
+        # sort them so we can prune the n-grams that made the least-negative
+        # likelihood change.  (The sorting is the same as sorting tuples like
+        # (-0.164, 7, 8, 9) in reverse order, which would mean that pruning the
+        # n-gram (7, 8) -> 9 leads to a likelihood change of -0.164).
+        candidate_orders = []
+        candidate_ngrams = []
+        candidate_words = []
+        like_changes = []
+        padding = arrays.min_word - 1
         for n in range(args.no_backoff_ngram_order, args.ngram_order):
-            for hist, counts_for_hist in self.counts[n].items():
-                for word, count in counts_for_hist.word_to_count.items():
-                    if word != self.backoff_symbol:
-                        if not hist + (word,) in protected_ngrams:
-                            like_change = self.GetLikeChangeFromPruningNgram(hist, word)
-                            like_change_and_ngrams.append((like_change,) + hist + (word,))
-                            num_candidates_per_order[len(hist)] += 1
-
-        like_change_and_ngrams.sort(reverse = True)
-
-        if num_ngrams_to_prune > len(like_change_and_ngrams):
+            ngrams = np.nonzero(~protected_ngrams[n])[0]
+            num_candidates_per_order[n] = len(ngrams)
+            words = np.full((len(ngrams), args.ngram_order), padding, dtype=np.int64)
+            words[:, :n] = arrays.hist_words[n][arrays.ngram_hist[n][ngrams]]
+            words[:, n] = arrays.ngram_word[n][ngrams]
+            candidate_orders.append(np.full(len(ngrams), n, dtype=np.int64))
+            candidate_ngrams.append(ngrams)
+            candidate_words.append(words)
+            like_changes.append(self.GetLikeChangesFromPruningNgrams(arrays, n, ngrams))
+        candidate_orders = np.concatenate(candidate_orders)
+        candidate_ngrams = np.concatenate(candidate_ngrams)
+        candidate_words = np.concatenate(candidate_words)
+        like_changes = np.concatenate(like_changes)
+        # np.lexsort() sorts on the last key first, in increasing order.
+        order = np.lexsort([ -candidate_words[:, i]
+                             for i in reversed(range(args.ngram_order)) ] +
+                           [ -like_changes ])
+        candidate_orders = candidate_orders[order].tolist()
+        candidate_ngrams = candidate_ngrams[order].tolist()
+        like_changes = like_changes[order].tolist()
+
+        if num_ngrams_to_prune > len(like_changes):
             print('make_phone_lm.py: aimed to prune {0} n-grams but could only '
-                  'prune {1}'.format(num_ngrams_to_prune, len(like_change_and_ngrams)),
+                  'prune {1}'.format(num_ngrams_to_prune, len(like_changes)),
                   file = sys.stderr)
-            num_ngrams_to_prune = len(like_change_and_ngrams)
+            num_ngrams_to_prune = len(like_changes)
 
         total_loglike_change = 0.0
 
         for i in range(num_ngrams_to_prune):
-            total_loglike_change += like_change_and_ngrams[i][0]
-            hist = like_change_and_ngrams[i][1:-1]  # all but 1st and last elements
-            word = like_change_and_ngrams[i][-1]  # last element
+            total_loglike_change += like_changes[i]
+            ngram = arrays.NgramTuple(candidate_orders[i], candidate_ngrams[i])
+            hist = ngram[:-1]  # all but the last element
+            word = ngram[-1]  # last element
             num_pruned_per_order[len(hist)] += 1
             self.PruneNgram(hist, word)
 
         like_change_per_word = total_loglike_change / self.total_num_words
 
         if args.verbose >= 1:
-            effective_threshold = (like_change_and_ngrams[num_ngrams_to_prune - 1][0]
+            effective_threshold = (like_changes[num_ngrams_to_prune - 1]
                                    if num_ngrams_to_prune >= 0 else 0.0)
             print("Pruned from {0} ngrams to {1}, with threshold {2}.  Candidates per order were {3}, "
                   "num-ngrams pruned per order were {4}.  Like-change per word was {5}".format(
@@ -625,6 +831,10 @@ class NgramCounts(object):
                     like_change_per_word), file = sys.stderr)
 
         if args.verbose >= 3:
+            like_change_and_ngrams = [
+                (like_change,) + arrays.NgramTuple(n, ngram)
+                for like_change, n, ngram in zip(like_changes, candidate_orders,
+                                                 candidate_ngrams) ]
             print("Pruning: like_change_and_ngrams is:\n" +
                   '\n'.join([str(x) for x in like_change_and_ngrams[:num_ngrams_to_prune]]) +
                   "\n-------- stop pruning here: ----------\n" +
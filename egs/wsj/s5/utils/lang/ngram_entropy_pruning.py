@@ -47,6 +47,8 @@ from collections import defaultdict
 from enum import Enum, unique
 import re
 
+import numpy as np
+
 parser = argparse.ArgumentParser(description="""
     Prune an n-gram language model based on the relative entropy 
     between the original and the pruned model, based on Andreas Stolcke's paper.
@@ -93,23 +95,23 @@ logging.basicConfig(
     level=args.verbose * 10)
 
 
-class Context(dict):
-    """
-    This class stores data for a context h.
-    It behaves like a python dict object, except that it has several
-    additional attributes.
-    """
-    def __init__(self):
-        super().__init__()
-        self.log_bo = None
-
-
 class Arpa:
     """
     This is a class that implement the data structure of an APRA LM.
     It (as well as some other classes) is modified based on the library
     by Stefan Fischer:
     https://github.com/sfischer13/python-arpa
+
+    The n-grams of each order are stored in numpy arrays, in the order in
+    which they were read: the id of their last word, the index of their
+    history h (the n-gram without its last word) among the n-grams of the
+    order below, their log-prob and their log-backoff (nan if there is
+    none).  A history that is not itself an n-gram of the file is added as
+    a context only: it has no log-prob, is never written and its n-grams
+    back off to the lower order with a backoff weight of 0.  An n-gram is
+    looked up by searching for the key (history index, word id) in a sorted
+    array.  Entries are added with add_entry() while reading the
+    file, after which finalize() builds the arrays.
     """
 
     UNK = '<unk>'
@@ -117,6 +119,7 @@ class Arpa:
     EOS = '</s>'
     FLOAT_NDIGITS = 7
     base = 10
+    CHUNK_SIZE = 1000000  # number of n-grams looked up at a time
 
     @staticmethod
     def _check_input(my_input):
@@ -139,13 +142,33 @@ class Arpa:
             raise ValueError
 
     def _replace_unks(self, words):
-        return tuple((w if w in self else self._unk) for w in words)
+        return tuple((w if (w, ) in self else self._unk) for w in words)
 
     def __init__(self, path=None, encoding=None, unk=None):
         self._counts = OrderedDict()
-        self._ngrams = OrderedDict(
-        )  # Use self._ngrams[len(h)][h][w] for saving the entry of (h,w)
-        self._vocabulary = set()
+        self._words = []
+        self._word_to_id = dict()
+        # entries read so far, as lists of (word-ids, log-prob, log-backoff,
+        # position in the file), indexed by order
+        self._pending = defaultdict(list)
+        self._num_entries = 0
+        # Per-order arrays (indexed by order) of the n-grams; see the class
+        # docstring.  '_kept' is False for n-grams that were pruned away
+        # and for the histories that are contexts only, and
+        # '_context_position' is the position in the file where n-gram was
+        # first used as a context (with a backoff or as a history), which
+        # is the order in which the contexts are written.
+        self._word = dict()
+        self._hist = dict()
+        self._log_prob = dict()
+        self._log_prob_is_int = dict()
+        self._log_bo = dict()
+        self._log_bo_is_int = dict()
+        self._position = dict()
+        self._kept = dict()
+        self._context_position = dict()
+        self._sorted_keys = dict()
+        self._key_order = dict()
         if unk is None:
             self._unk = self.UNK
 
@@ -153,38 +176,111 @@ class Arpa:
             self.loadf(path, encoding)
 
     def __contains__(self, ngram):
-        h = ngram[:-1]  # h is a tuple
-        w = ngram[-1]  # w is a string/word
-        return h in self._ngrams[len(h)] and w in self._ngrams[len(h)][h]
+        ids = np.array([self._word_ids(ngram)], dtype=np.int64)
+        index = self._find(ids)[0]
+        return index >= 0 and bool(self._kept[len(ngram)][index])
 
     def contains_word(self, word):
         self._check_word(word)
-        return word in self._vocabulary
+        return word in self._word_to_id
 
     def add_count(self, order, count):
         self._counts[order] = count
-        self._ngrams[order - 1] = defaultdict(Context)
 
     def update_counts(self):
         for order in range(1, self.order() + 1):
-            count = sum(
-                [len(wlist) for _, wlist in self._ngrams[order - 1].items()])
+            count = int(np.count_nonzero(self._kept[order])) \
+                if order in self._kept else 0
             if count > 0:
                 self._counts[order] = count
 
     def add_entry(self, ngram, p, bo=None, order=None):
         # Note: ngram is a tuple of strings, e.g. ("w1", "w2", "w3")
-        h = ngram[:-1]  # h is a tuple
-        w = ngram[-1]  # w is a string/word
-
         # Note that p and bo here are in fact in the log domain (self.base = 10)
-        h_context = self._ngrams[len(h)][h]
-        h_context[w] = p
-        if bo is not None:
-            self._ngrams[len(ngram)][ngram].log_bo = bo
-
-        for word in ngram:
-            self._vocabulary.add(word)
+        if len(ngram) not in self._counts:
+            raise KeyError(len(ngram) - 1)
+        if bo is not None and len(ngram) + 1 not in self._counts:
+            raise KeyError(len(ngram))
+        word_to_id = self._word_to_id
+        ids = list(map(word_to_id.get, ngram))
+        if None in ids:
+            for i, word in enumerate(ngram):
+                if word not in word_to_id:
+                    word_to_id[word] = len(self._words)
+                    self._words.append(word)
+                ids[i] = word_to_id[word]
+        self._pending[len(ngram)].append((ids, p, bo, self._num_entries))
+        self._num_entries += 1
+
+    def finalize(self):
+        # Builds the arrays from the entries added by add_entry().
+        for order in range(1, self.order() + 1):
+            pending = self._pending.pop(order, [])
+            ngrams, log_probs, log_bos, positions = \
+                zip(*pending) if pending else ([], [], [], [])
+            ids = np.array(ngrams, dtype=np.int64).reshape(len(ngrams), order)
+            self._add_ngrams(
+                order, ids,
+                np.array(log_probs, dtype=np.float64),
+                np.array([isinstance(x, int) for x in log_probs], dtype=bool),
+                np.array([np.nan if x is None else x for x in log_bos],
+                         dtype=np.float64),
+                np.array([isinstance(x, int) for x in log_bos], dtype=bool),
+                np.array(positions, dtype=np.int64),
+                np.ones(len(ngrams), dtype=bool))
+        self._pending.clear()
+
+    def _add_ngrams(self, order, ids, log_probs, log_prob_is_int, log_bos,
+                    log_bo_is_int, positions, kept):
+        # Appends the n-grams whose word-ids are the rows of 'ids' to the
+        # arrays of order 'order'.  Their histories that are not in the model
+        # yet are added as contexts only (see the class docstring), as the
+        # original dict-based version did.
+        num_words = len(self._words)
+        hist = self._find(ids[:, :-1])
+        if np.any(hist < 0):
+            missing = np.unique(ids[hist < 0, :-1], axis=0)
+            num_missing = len(missing)
+            self._add_ngrams(
+                order - 1, missing, np.full(num_missing, np.nan),
+                np.zeros(num_missing, dtype=bool), np.full(num_missing, np.nan),
+                np.zeros(num_missing, dtype=bool),
+                np.full(num_missing, np.iinfo(np.int64).max),
+                np.zeros(num_missing, dtype=bool))
+            hist = self._find(ids[:, :-1])
+
+        def append(arrays, values):
+            if order in arrays:
+                values = np.concatenate((arrays[order], values))
+            arrays[order] = values
+            return values
+
+        words = append(self._word, ids[:, -1])
+        hists = append(self._hist, hist)
+        append(self._log_prob, log_probs)
+        append(self._log_prob_is_int, log_prob_is_int)
+        log_bos = append(self._log_bo, log_bos)
+        append(self._log_bo_is_int, log_bo_is_int)
+        positions = append(self._position, positions)
+        append(self._kept, kept)
+
+        keys = hists * num_words + words
+        key_order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[key_order]
+        if np.any(sorted_keys[1:] == sorted_keys[:-1]):
+            raise ValueError(
+                "Duplicate {0}-grams in the model".format(order))
+        self._sorted_keys[order] = sorted_keys
+        self._key_order[order] = key_order
+
+        context_position = np.where(np.isnan(log_bos),
+                                    np.iinfo(np.int64).max, positions)
+        if order + 1 in self._hist:
+            np.minimum.at(context_position, self._hist[order + 1],
+                          self._position[order + 1])
+        self._context_position[order] = context_position
+        if order > 1:
+            np.minimum.at(self._context_position[order - 1], hists, positions)
 
     def counts(self):
         return sorted(self._counts.items())
@@ -194,51 +290,164 @@ class Arpa:
 
     def vocabulary(self, sort=True):
         if sort:
-            return sorted(self._vocabulary)
+            return sorted(self._words)
         else:
-            return self._vocabulary
-
-    def _entries(self, order):
-        return (self._entry(h, w)
-                for h, wlist in self._ngrams[order - 1].items() for w in wlist)
-
-    def _entry(self, h, w):
-        # return the entry for the ngram (h, w)
-        ngram = h + (w, )
-        log_p = self._ngrams[len(h)][h][w]
-        log_bo = self._log_bo(ngram)
-        if log_bo is not None:
-            return round(log_p, self.FLOAT_NDIGITS), ngram, round(
-                log_bo, self.FLOAT_NDIGITS)
-        else:
-            return round(log_p, self.FLOAT_NDIGITS), ngram
+            return set(self._words)
+
+    def _word_ids(self, words):
+        return [self._word_to_id.get(w, -1) for w in words]
+
+    def _find_children(self, order, hists, words, kept_only=True):
+        # Returns the indexes of the n-grams of order 'order' (that were not
+        # pruned, if 'kept_only') with history index 'hists' and last word-id
+        # 'words', or -1 where there is none.  'hists' may be -1.
+        result = np.full(len(words), -1, dtype=np.int64)
+        sorted_keys = self._sorted_keys.get(order)
+        if sorted_keys is None or len(sorted_keys) == 0:
+            return result
+        valid = (hists >= 0) & (words >= 0)
+        keys = hists[valid] * len(self._words) + words[valid]
+        pos = np.minimum(np.searchsorted(sorted_keys, keys),
+                         len(sorted_keys) - 1)
+        index = np.where(sorted_keys[pos] == keys,
+                         self._key_order[order][pos], -1)
+        if kept_only:
+            index[index >= 0] = np.where(self._kept[order][index[index >= 0]],
+                                         index[index >= 0], -1)
+        result[valid] = index
+        return result
 
-    def _log_bo(self, ngram):
-        if len(ngram) in self._ngrams and ngram in self._ngrams[len(ngram)]:
-            return self._ngrams[len(ngram)][ngram].log_bo
-        else:
-            return None
+    def _find(self, ids):
+        # Returns the indexes of the contexts whose word-ids are the rows of
+        # the matrix 'ids', or -1 where there is none; the n-gram of no words
+        # (the root context) has index 0.  Like the contexts of the original
+        # dict-based version, these need not be n-grams that were kept.
+        index = np.zeros(ids.shape[0], dtype=np.int64)
+        for c in range(ids.shape[1]):
+            index = self._find_children(c + 1, index, ids[:, c],
+                                        kept_only=False)
+        return index
+
+    def _ngram_ids(self, order, index):
+        # Returns the word-ids of the n-grams 'index' of order 'order', as a
+        # matrix.
+        ids = np.empty((len(index), order), dtype=np.int64)
+        for k in range(order, 0, -1):
+            ids[:, k - 1] = self._word[k][index]
+            index = self._hist[k][index]
+        return ids
+
+    def _ngram_strings(self, order, index):
+        words = self._words
+        return [
+            ' '.join([words[w] for w in row])
+            for row in self._ngram_ids(order, index).tolist()
+        ]
+
+    def _log_p_raw_of_ids(self, ids):
+        # log_p_raw() of the n-grams that are the rows of 'ids'.  Like
+        # log_p_raw(), the backoff weights are added to the log-prob found
+        # from the innermost one outwards.
+        num_ngrams, order = ids.shape
+        log_p = np.empty(num_ngrams, dtype=np.float64)
+        found_at = np.full(num_ngrams, -1, dtype=np.int64)
+        log_bos = []
+        for m in range(order):
+            hist = self._find(ids[:, m:order - 1])
+            index = self._find_children(order - m, hist, ids[:, order - 1])
+            new = (found_at < 0) & (index >= 0)
+            log_p[new] = self._log_prob[order - m][index[new]]
+            found_at[new] = m
+            if m < order - 1:
+                log_bo = np.zeros(num_ngrams, dtype=np.float64)
+                log_bo[hist >= 0] = self._log_bo[order - m - 1][hist[hist >= 0]]
+                log_bos.append(np.nan_to_num(log_bo, nan=0.0))
+        if np.any(found_at < 0):
+            raise KeyError
+        for m in range(order - 2, -1, -1):
+            backoff = found_at > m
+            log_p[backoff] = log_bos[m][backoff] + log_p[backoff]
+        return log_p
+
+    def _log_p_raw_of_suffixes(self, order, index):
+        # Returns log_p_raw(ngram[1:]) for the n-grams 'index' of order
+        # 'order' (which must be at least 2).
+        log_p = np.empty(len(index), dtype=np.float64)
+        for start in range(0, len(index), self.CHUNK_SIZE):
+            end = start + self.CHUNK_SIZE
+            log_p[start:end] = self._log_p_raw_of_ids(
+                self._ngram_ids(order, index[start:end])[:, 1:])
+        return log_p
+
+    def _log_joint_probs(self, order, index):
+        # log_joint_prob() of the contexts 'index' of order 'order'.  Those
+        # which, or a prefix of which, are contexts only are done by
+        # log_joint_prob().
+        orig_order, orig_index = order, index
+        log_joint_p = self._log_prob[order][index]
+        sos_id = self._word_to_id.get(self.SOS, -1)
+        while order > 1:
+            index = self._hist[order][index]
+            order -= 1
+            log_p = self._log_prob[order][index]
+            if order == 1:
+                # If we're computing the marginal probability of the unigram
+                # <s> context we have to look up </s> instead since the former
+                # has prob = 0.
+                is_sos = self._word[1][index] == sos_id
+                if np.any(is_sos):
+                    log_p[is_sos] = self.log_p_raw((self.EOS, ))
+            log_joint_p = log_joint_p + log_p
+        not_ngram = np.flatnonzero(np.isnan(log_joint_p))
+        if len(not_ngram) > 0:
+            log_joint_p[not_ngram] = [
+                self.log_joint_prob(tuple(ngram.split(' ')))
+                for ngram in self._ngram_strings(orig_order,
+                                                 orig_index[not_ngram])]
+        return log_joint_p
 
-    def _log_p(self, ngram):
-        h = ngram[:-1]  # h is a tuple
-        w = ngram[-1]  # w is a string/word
-        if h in self._ngrams[len(h)] and w in self._ngrams[len(h)][h]:
-            return self._ngrams[len(h)][h][w]
-        else:
-            return None
+    def _entries(self, order):
+        if order not in self._kept:
+            return
+        # the n-grams are written by context, in the order in which the
+        # contexts were created, and then in the order they were read.
+        index = np.flatnonzero(self._kept[order])
+        if order > 1:
+            context_position = self._context_position[order - 1][
+                self._hist[order][index]]
+            index = index[np.lexsort(
+                (self._position[order][index], context_position))]
+        for start in range(0, len(index), self.CHUNK_SIZE):
+            chunk = index[start:start + self.CHUNK_SIZE]
+            ngrams = self._ngram_strings(order, chunk)
+            log_probs = self._log_prob[order][chunk].tolist()
+            log_prob_is_int = self._log_prob_is_int[order][chunk].tolist()
+            log_bos = self._log_bo[order][chunk].tolist()
+            log_bo_is_int = self._log_bo_is_int[order][chunk].tolist()
+            for ngram, log_p, p_is_int, log_bo, bo_is_int in zip(
+                    ngrams, log_probs, log_prob_is_int, log_bos,
+                    log_bo_is_int):
+                log_p = int(log_p) if p_is_int else round(
+                    log_p, self.FLOAT_NDIGITS)
+                if math.isnan(log_bo):
+                    yield log_p, ngram
+                else:
+                    log_bo = int(log_bo) if bo_is_int else round(
+                        log_bo, self.FLOAT_NDIGITS)
+                    yield log_p, ngram, log_bo
+
+    def histories(self, order):
+        # Returns the distinct histories (as tuples of words) of the
+        # n-grams of order 'order' in the model.
+        if order == 1:
+            return [()]
+        hist = np.unique(self._hist[order][self._kept[order]])
+        return [tuple(ngram.split(' '))
+                for ngram in self._ngram_strings(order - 1, hist)]
 
     def log_p_raw(self, ngram):
-        log_p = self._log_p(ngram)
-        if log_p is not None:
-            return log_p
-        else:
-            if len(ngram) == 1:
-                raise KeyError
-            else:
-                log_bo = self._log_bo(ngram[:-1])
-                if log_bo is None:
-                    log_bo = 0
-                return log_bo + self.log_p_raw(ngram[1:])
+        ids = np.array([self._word_ids(ngram)], dtype=np.int64)
+        return float(self._log_p_raw_of_ids(ids)[0])
 
     def log_joint_prob(self, sequence):
         # Compute the joint prob of the sequence based on the chain rule
@@ -261,11 +470,6 @@ class Arpa:
 
         return log_joint_p
 
-    def set_new_context(self, h):
-        old_context = self._ngrams[len(h)][h]
-        self._ngrams[len(h)][h] = Context()
-        return old_context
-
     def log_p(self, ngram):
         words = self._check_input(ngram)
         if self._unk:
@@ -302,7 +506,7 @@ class Arpa:
             fp.write('\\{}-grams:\n'.format(order))
             for e in self._entries(order):
                 prob = e[0]
-                ngram = ' '.join(e[1])
+                ngram = e[1]
                 if len(e) == 2:
                     fp.write('{}\t{}\n'.format(prob, ngram))
                 elif len(e) == 3:
@@ -375,6 +579,7 @@ class ArpaParser:
             self._state = self.State.ENTRY
             self._tmp_order = int(match.group(1))
         elif line == '\\end\\':
+            self._tmp_model.finalize()
             self._result.append(self._tmp_model)
             self._state = self.State.DATA
             self._tmp_model = None
@@ -446,131 +651,163 @@ class ArpaParser:
             return f.getvalue()
 
 
-def add_log_p(prev_log_sum, log_p, base):
-    return math.log(base**log_p + base**prev_log_sum, base)
-
-
-def compute_numerator_denominator(lm, h):
-    log_sum_seen_h = -math.inf
-    log_sum_seen_h_lower = -math.inf
-    base = lm.base
-    for w, log_p in lm._ngrams[len(h)][h].items():
-        log_sum_seen_h = add_log_p(log_sum_seen_h, log_p, base)
+_pow_base = float(Arpa.base).__pow__
+_log_of_base = math.log(Arpa.base)
+
+
+def base_pow(x):
+    # Returns Arpa.base ** x for each element of the array x.  This (like
+    # log_base()) is done with python's floats rather than numpy's
+    # vectorized functions, which may differ in the last bit, so that the
+    # pruning decisions and the backoff weights are exactly the same.
+    return np.fromiter(map(_pow_base, x.tolist()), dtype=np.float64,
+                       count=len(x))
+
+
+def log_base(x):
+    # Returns math.log(y, Arpa.base) for each element y of the array x.
+    return np.fromiter(map(math.log, x.tolist()), dtype=np.float64,
+                       count=len(x)) / _log_of_base
+
+
+def sum_probs(probs, sizes):
+    # 'probs' holds the probabilities of the entries of several contexts, one
+    # context after the other, and 'sizes' the number of entries of each
+    # context.  Returns the sum of the probabilities of each context,
+    # computed like SRILM does in the log domain, i.e. by adding the
+    # entries one by one as log(p + base ** log_sum); this is done for all the
+    # contexts at once.
+    num_contexts = len(sizes)
+    by_size = np.argsort(-sizes, kind='stable')
+    sorted_sizes = sizes[by_size]
+    sorted_starts = (np.cumsum(sizes) - sizes)[by_size]
+    max_size = int(sorted_sizes[0]) if num_contexts > 0 else 0
+    # num_active[j] is the number of contexts with more than j entries.
+    num_active = np.searchsorted(-sorted_sizes, -np.arange(max_size))
+    log_sum = np.full(num_contexts, -math.inf)
+    for j in range(max_size):
+        n = num_active[j]
+        log_sum[:n] = log_base(probs[sorted_starts[:n] + j] +
+                               base_pow(log_sum[:n]))
+    total = np.empty(num_contexts, dtype=np.float64)
+    total[by_size] = base_pow(log_sum)
+    return total
+
+
+def compute_numerator_denominator(probs, probs_lower, sizes):
+    # Returns the numerators and denominators of the backoff weights of
+    # several contexts h: one minus the total probability of the words w
+    # seen in h, and one minus the total lower-order probability P(w|h') of
+    # those words.  See sum_probs() for 'sizes'.
+    numerator = 1.0 - sum_probs(probs, sizes)
+    denominator = 1.0 - sum_probs(probs_lower, sizes)
+    return numerator, denominator
 
-        ngram = h + (w, )
-        log_p_lower = lm.log_p_raw(ngram[1:])
-        log_sum_seen_h_lower = add_log_p(log_sum_seen_h_lower, log_p_lower,
-                                         base)
 
-    numerator = 1.0 - base**log_sum_seen_h
-    denominator = 1.0 - base**log_sum_seen_h_lower
-    return numerator, denominator
+def entries_by_context(lm, order, index):
+    # Returns the n-grams 'index' of order 'order' sorted by context, in the
+    # order they were read within each context, together with the contexts
+    # (the indexes of the histories) and the number of n-grams of each.
+    hist = lm._hist[order][index]
+    index = index[np.lexsort((lm._position[order][index], hist))]
+    contexts, sizes = np.unique(lm._hist[order][index], return_counts=True)
+    return index, contexts, sizes
 
 
 def prune(lm, threshold, minorder):
     # Reference:
     # https://github.com/BitSpeech/SRILM/blob/d571a4424fb0cf08b29fbfccfddd092ea969eae3/lm/src/NgramLM.cc#L2330
-
-    for i in range(lm.order(), max(minorder - 1, 1),
+    #
+    # The n-grams of each order are pruned all at once.  The decisions for
+    # the n-grams of order i only depend on the model's n-grams of order
+    # less than i, which have not been pruned yet, and on which n-grams of
+    # order i are still needed as the history of (i+1)-grams.
+
+    lowest_context_order = max(minorder - 1, 1)
+    for i in range(lm.order(), lowest_context_order,
                    -1):  # i is the order of the ngram (h, w)
         logging.info("processing %d-grams ..." % i)
-        count_pruned_ngrams = 0
-
-        h_dict = lm._ngrams[i - 1]
-        for h in list(h_dict.keys()):
-            # old backoff weight, BOW(h)
-            log_bow = lm._log_bo(h)
-            if log_bow is None:
-                log_bow = 0
-
-            # Compute numerator and denominator of the backoff weight,
-            # so that we can quickly compute the BOW adjustment due to
-            # leaving out one prob.
-            numerator, denominator = compute_numerator_denominator(lm, h)
-
-            # assert abs(math.log(numerator, lm.base) - math.log(denominator, lm.base) - h_dict[h].log_bo) < 1e-5
-
-            # Compute the marginal probability of the context, P(h)
-            h_log_p = lm.log_joint_prob(h)
-
-            all_pruned = True
-            pruned_w_set = set()
-
-            for w, log_p in h_dict[h].items():
-                ngram = h + (w, )
-
-                # lower-order estimate for ngramProb, P(w|h')
-                backoff_prob = lm.log_p_raw(ngram[1:])
-
-                # Compute BOW after removing ngram, BOW'(h)
-                new_log_bow = math.log(numerator + lm.base ** log_p, lm.base) - \
-                              math.log(denominator + lm.base ** backoff_prob, lm.base)
-
-                # Compute change in entropy due to removal of ngram
-                delta_prob = backoff_prob + new_log_bow - log_p
-                delta_entropy = - (lm.base ** h_log_p) * \
-                                ((lm.base ** log_p) * delta_prob +
-                                 numerator * (new_log_bow - log_bow))
-
-                # compute relative change in model (training set) perplexity
-                perp_change = lm.base**delta_entropy - 1.0
-
-                pruned = threshold > 0 and perp_change < threshold
-
-                # Make sure we don't prune ngrams whose backoff nodes are needed
-                if pruned and \
-                        len(ngram) in lm._ngrams and \
-                        len(lm._ngrams[len(ngram)][ngram]) > 0:
-                    pruned = False
-
-                logging.debug("CONTEXT " + str(h) + " WORD " + w +
-                              " CONTEXTPROB %f " % h_log_p +
-                              " OLDPROB %f " % log_p + " NEWPROB %f " %
-                              (backoff_prob + new_log_bow) +
-                              " DELTA-H %f " % delta_entropy +
-                              " DELTA-LOGP %f " % delta_prob +
-                              " PPL-CHANGE %f " % perp_change + " PRUNED " +
-                              str(pruned))
-
-                if pruned:
-                    pruned_w_set.add(w)
-                    count_pruned_ngrams += 1
-                else:
-                    all_pruned = False
-
-            # If we removed all ngrams for this context we can
-            # remove the context itself, but only if the present
-            # context is not a prefix to a longer one.
-            if all_pruned and len(pruned_w_set) == len(h_dict[h]):
-                del h_dict[
-                    h]  # this context h is no longer needed, as its ngram prob is stored at its own context h'
-            elif len(pruned_w_set) > 0:
-                # The pruning for this context h is actually done here
-                old_context = lm.set_new_context(h)
-
-                for w, p_w in old_context.items():
-                    if w not in pruned_w_set:
-                        lm.add_entry(
-                            h + (w, ),
-                            p_w)  # the entry hw is stored at the context h
-
-                # We need to recompute the back-off weight, but
-                # this can only be done after completing the pruning
-                # of the lower-order ngrams.
-                # Reference:
-                # https://github.com/BitSpeech/SRILM/blob/d571a4424fb0cf08b29fbfccfddd092ea969eae3/flm/src/FNgramLM.cc#L2124
-
-        logging.info("pruned %d %d-grams" % (count_pruned_ngrams, i))
-
-    # recompute backoff weights
-    for i in range(max(minorder - 1, 1) + 1,
+
+        index, contexts, sizes = entries_by_context(
+            lm, i, np.flatnonzero(lm._kept[i]))
+
+        # old backoff weight, BOW(h)
+        log_bow = np.nan_to_num(lm._log_bo[i - 1][contexts], nan=0.0)
+
+        log_p = lm._log_prob[i][index]
+        probs = base_pow(log_p)
+        # lower-order estimate for ngramProb, P(w|h')
+        backoff_prob = lm._log_p_raw_of_suffixes(i, index)
+        backoff_probs = base_pow(backoff_prob)
+
+        # Compute numerator and denominator of the backoff weight,
+        # so that we can quickly compute the BOW adjustment due to
+        # leaving out one prob.
+        numerator, denominator = compute_numerator_denominator(
+            probs, backoff_probs, sizes)
+
+        # Compute the marginal probability of the context, P(h)
+        h_log_p = lm._log_joint_probs(i - 1, contexts)
+
+        # the values of the context of each n-gram
+        context_of = np.repeat(np.arange(len(contexts)), sizes)
+        h_log_p = h_log_p[context_of]
+        log_bow = log_bow[context_of]
+        numerator = numerator[context_of]
+        denominator = denominator[context_of]
+
+        # Compute BOW after removing ngram, BOW'(h)
+        new_log_bow = log_base(numerator + probs) - \
+                      log_base(denominator + backoff_probs)
+
+        # Compute change in entropy due to removal of ngram
+        delta_prob = backoff_prob + new_log_bow - log_p
+        delta_entropy = - base_pow(h_log_p) * \
+                        (probs * delta_prob +
+                         numerator * (new_log_bow - log_bow))
+
+        # compute relative change in model (training set) perplexity
+        perp_change = base_pow(delta_entropy) - 1.0
+
+        pruned = (threshold > 0) & (perp_change < threshold)
+
+        # Make sure we don't prune ngrams whose backoff nodes are needed
+        if i < lm.order():
+            has_children = np.bincount(lm._hist[i + 1][lm._kept[i + 1]],
+                                       minlength=len(lm._word[i])) > 0
+            pruned &= ~has_children[index]
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            histories = lm._ngram_strings(i - 1, contexts)
+            words = lm._word[i][index].tolist()
+            for j, c in enumerate(context_of.tolist()):
+                logging.debug("CONTEXT " + str(tuple(histories[c].split(' ')))
+                              + " WORD " + lm._words[words[j]] +
+                              " CONTEXTPROB %f " % h_log_p[j] +
+                              " OLDPROB %f " % log_p[j] + " NEWPROB %f " %
+                              (backoff_prob[j] + new_log_bow[j]) +
+                              " DELTA-H %f " % delta_entropy[j] +
+                              " DELTA-LOGP %f " % delta_prob[j] +
+                              " PPL-CHANGE %f " % perp_change[j] +
+                              " PRUNED " + str(bool(pruned[j])))
+
+        lm._kept[i][index[pruned]] = False
+        logging.info("pruned %d %d-grams" % (np.count_nonzero(pruned), i))
+
+    # recompute backoff weights.  Contexts all of whose n-grams were pruned
+    # no longer have one.
+    for i in range(lowest_context_order + 1,
                    lm.order() +
                    1):  # be careful of this order: from low- to high-order
-        for h in lm._ngrams[i - 1]:
-            numerator, denominator = compute_numerator_denominator(lm, h)
-            new_log_bow = math.log(numerator, lm.base) - math.log(
-                denominator, lm.base)
-            lm._ngrams[len(h)][h].log_bo = new_log_bow
+        index, contexts, sizes = entries_by_context(
+            lm, i, np.flatnonzero(lm._kept[i]))
+        numerator, denominator = compute_numerator_denominator(
+            base_pow(lm._log_prob[i][index]),
+            base_pow(lm._log_p_raw_of_suffixes(i, index)), sizes)
+        log_bo = np.full(len(lm._word[i - 1]), np.nan)
+        log_bo[contexts] = log_base(numerator) - log_base(denominator)
+        lm._log_bo[i - 1] = log_bo
+        lm._log_bo_is_int[i - 1] = np.zeros(len(log_bo), dtype=bool)
 
     # update counts
     lm.update_counts()
@@ -592,8 +829,7 @@ def validate_lm(lm):
     # sanity check if the conditional probability sums to one under each context h
     for i in range(lm.order(), 0, -1):  # i is the order of the ngram (h, w)
         logging.info("validating %d-grams ..." % i)
-        h_dict = lm._ngrams[i - 1]
-        for h in h_dict.keys():
+        for h in lm.histories(i):
             check_h_is_valid(lm, h)
 
 
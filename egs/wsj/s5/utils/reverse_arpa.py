@@ -1,10 +1,15 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 # Copyright 2012 Mirko Hannemann BUT, mirko.hannemann@gmail.com
 
 from __future__ import print_function
 import sys
 import codecs # for UTF-8/unicode
+import heapq
+import tempfile
+
+sys.path.insert(0, 'steps')
+import libs.arpa as arpa_lib
 
 if len(sys.argv) != 2:
     print('usage: reverse_arpa arpa.in')
@@ -62,6 +67,49 @@ while (text and text[:5] == "ngram"):
   #print text,
   text=file.readline()
 
+class SortedNgramSpool(object):
+  """Holds the n-grams of one order, for when there are too many to keep in a
+  dict.  They are stored in temporary files, each containing up to
+  'chunk_size' of them in sorted order; items() merges them."""
+  def __init__(self, chunk_size):
+    self.chunk_size = chunk_size
+    self.chunk = {}
+    self.files = []
+
+  def __setitem__(self, ngram, prob):
+    self.chunk[ngram] = prob
+    if len(self.chunk) >= self.chunk_size:
+      self.flush()
+
+  def flush(self):
+    f = tempfile.TemporaryFile(mode="w+", encoding="utf-8", newline="\n")
+    f.writelines(["{0}\t{1!r}\t{2!r}\n".format(ngram, self.chunk[ngram][0], self.chunk[ngram][1])
+                  for ngram in sorted(self.chunk.keys())])
+    f.seek(0)
+    self.files.append(f)
+    self.chunk = {}
+
+  def items(self):
+    """Yields the pairs (ngram, (prob, back)) sorted on the n-gram; where an
+    n-gram was added more than once, the last one wins, as in a dict."""
+    def read_file(index, f):
+      for line in f:
+        a = line.split("\t")
+        yield (a[0], index, float(a[1]), float(a[2]))
+    self.flush()
+    last = None
+    for entry in heapq.merge(*[read_file(i, f) for i, f in enumerate(self.files)]):
+      if last is not None and entry[0] != last[0]:
+        yield (last[0], (last[2], last[3]))
+      last = entry
+    if last is not None:
+      yield (last[0], (last[2], last[3]))
+    for f in self.files:
+      f.close()
+
+# The number of n-grams of the highest order per temporary file.
+ngrams_per_temp_file = 1000000
+
 # read all n-grams order by order
 sentprob = 0.0 # sentence begin unigram
 ngrams=[]
@@ -72,7 +120,11 @@ for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
     print("invalid ARPA file:{}".format(text))
     sys.exit()
   #print text,cngrams[n-1]
-  this_ngrams={} # stores all read ngrams
+  if n < len(cngrams):
+    this_ngrams={} # stores all read ngrams
+  else:
+    # the highest order, normally the largest one, is kept on disk
+    this_ngrams=SortedNgramSpool(ngrams_per_temp_file)
   for ng in range(cngrams[n-1]):
     while (text and len(text.split())<2):
       text=file.readline()
@@ -133,16 +185,21 @@ file.close()
 #p(ABC)+b(ABC)-p(BC)+p(AB)-p(B)+p(A) CBA 0
 #p(ABCD)+b(ABCD)-p(BCD)+p(ABC)-p(BC)+p(AB)-p(B)+p(A) DCBA 0
 
-# compute new reversed ARPA model
-print("\\data\\")
-for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
-  print("ngram {0} = {1}".format(n, len(ngrams[n-1].keys())))
+# compute new reversed ARPA model.  The \data\ header is written last (the
+# rest is kept in a temporary file until then), because we only know the
+# number of n-grams of the highest order after merging them.
+writer = arpa_lib.SpooledArpaWriter(sys.stdout)
+num_ngrams = []
 offset = 0.0
 for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
-  print("\\{}-grams:".format(n))
-  keys = sorted(ngrams[n-1].keys())
-  for ngram in keys:
-    prob = ngrams[n-1][ngram]
+  lines = ["\\{}-grams:\n".format(n)]
+  if n != len(cngrams):
+    items = ((ngram, ngrams[n-1][ngram]) for ngram in sorted(ngrams[n-1].keys()))
+  else:
+    items = ngrams[n-1].items()
+  num_ngrams.append(0)
+  for ngram, prob in items:
+    num_ngrams[-1] += 1
     # reverse word order
     words = ngram.split()
     rstr = " ".join(reversed(words))
@@ -179,10 +236,16 @@ for n in range(1,len(cngrams)+1): # unigrams, bigrams, trigrams
         elif n == 2:
           revprob = revprob + offset # add <s> weight to bigrams starting with <s>
       if (prob[1] != inf): # only backoff weights from not newly created ngrams
-        print(revprob,rev_ngram.encode("utf-8"),back)
+        lines.append("{0} {1} {2}\n".format(revprob,rev_ngram,back))
       else:
-        print(revprob,rev_ngram.encode("utf-8"),"-100000.0")
+        lines.append("{0} {1} {2}\n".format(revprob,rev_ngram,"-100000.0"))
     else: # highest order - no backoff weights
       if (n==2) and (rev_ngram[:3] == "<s>"): revprob = revprob + offset
-      print(revprob,rev_ngram.encode("utf-8"))
-print("\\end\\")
+      lines.append("{0} {1}\n".format(revprob,rev_ngram))
+    if len(lines) >= 100000:
+      writer.write("".join(lines))
+      lines = []
+  writer.write("".join(lines))
+writer.write("\\end\\\n")
+writer.close(["\\data\\\n"] +
+             ["ngram {0} = {1}\n".format(n, num_ngrams[n-1]) for n in range(1,len(cngrams)+1)])
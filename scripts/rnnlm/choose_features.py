@@ -12,6 +12,8 @@ sys.stdout = open(1, 'w', encoding='utf-8', closefd=False)
 
 import re
 
+import vocab_lib
+
 
 parser = argparse.ArgumentParser(description="This script chooses the sparse feature representation of words. "
                                              "To be more specific, it chooses the set of features-- you compute "
@@ -77,66 +79,16 @@ if args.min_ngram_order < 1:
 if args.max_ngram_order < args.min_ngram_order:
     sys.exit(sys.argv[0] + ": --max-ngram-order must be larger than or equal to --min-ngram-order.")
 
-SPECIAL_SYMBOLS = ["<eps>", "<s>", "<brk>"]
-
-
-# read the vocabulay file
-# Returns a pair (vocab, wordlist)
-# where 'vocab' is a dict mapping the string-valued word to a integer id.
-#  and 'wordlist' is a list indexed by integer id, that returns the string-valued word.
-def read_vocab(vocab_file):
-    vocab = {}
-    with open(vocab_file, 'r', encoding="utf-8") as f:
-        for line in f:
-            fields = line.split()
-            assert len(fields) == 2
-            if fields[0] in vocab:
-                sys.exit(sys.argv[0] + ": duplicated word({0}) in vocab: {1}"
-                                       .format(fields[0], vocab_file))
-            vocab[fields[0]] = int(fields[1])
-
-    # check there is no duplication and no gap among word ids
-    sorted_ids = sorted(vocab.values())
-    for idx, id in enumerate(sorted_ids):
-        assert idx == id
-
-    vocab_size = 1 + max(vocab.values())
-    wordlist = [ None] * vocab_size
-    for word, index in vocab.items():
-        assert wordlist[index] is None
-        wordlist[index] = word
-
-    if wordlist[0] != '<eps>' and wordlist[0] != '<EPS>':
-        sys.exit(sys.argv[0] + ": expected word numbered zero to be epsilon.")
-    return (vocab, wordlist)
-
-
-# read the unigram probs; returns a list indexed by integer
-# id of the word, which evaluates to the unigram prob of the word.
-def read_unigram_probs(unigram_probs_file):
-    unigram_probs = []
-    with open(unigram_probs_file, 'r', encoding="utf-8") as f:
-        for line in f:
-            fields = line.split()
-            assert len(fields) == 2
-            idx = int(fields[0])
-            if idx >= len(unigram_probs):
-                unigram_probs.extend([None] * (idx - len(unigram_probs) + 1))
-            unigram_probs[idx] = float(fields[1])
-
-    for prob in unigram_probs:
-        assert prob is not None
-
-    return unigram_probs
-
 def get_feature_scale(rms):
     if rms > args.max_feature_rms:
         return '%.2g' % (args.max_feature_rms / rms)
     else:
         return "1.0"
 
-(vocab, wordlist) = read_vocab(args.vocab_file)
-unigram_probs = read_unigram_probs(args.unigram_probs)
+(vocab, wordlist) = vocab_lib.read_vocab(args.vocab_file)
+if wordlist[0] != '<eps>' and wordlist[0] != '<EPS>':
+    sys.exit(sys.argv[0] + ": expected word numbered zero to be epsilon.")
+unigram_probs = vocab_lib.read_unigram_probs(args.unigram_probs).tolist()
 assert len(unigram_probs) == len(wordlist)
 
 # num_features is a counter used to keep track of how many features
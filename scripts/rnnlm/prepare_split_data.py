@@ -6,6 +6,8 @@
 
 import os
 import argparse
+import multiprocessing
+import shutil
 import sys
 
 import re
@@ -32,6 +34,12 @@ parser.add_argument("--data-weights-file", type=str, default='', required=True,
                     "like 'foo 1 0.5' and 'bar 2 1.5'.  These don't have to sum to one.")
 parser.add_argument("--num-splits", type=int, required=True,
                     help="The number of pieces to split up the data into.")
+parser.add_argument("--num-jobs", type=int, default=0,
+                    help="The number of data sources processed in parallel; "
+                    "if <= 0, one process is used per data source.")
+parser.add_argument("--block-size", type=int, default=16 * 1024 * 1024,
+                    help="The approximate number of bytes read from a data "
+                    "source at a time.")
 parser.add_argument("text_dir",
                     help="Directory in which to look for source data, as validated by validate_text_dir.py")
 parser.add_argument("split_dir",
@@ -39,9 +47,6 @@ parser.add_argument("split_dir",
                     "if it does not exist.")
 
 
-args = parser.parse_args()
-
-
 
 # get the name with txt and counts file path for all data sources except dev
 # return a dict with key is the name of data_source, value is txt_file_path.
@@ -88,133 +93,217 @@ def read_data_weights(weights_file, data_sources):
 
 
 
-# This function opens the file with filename 'source_filename',
-# reads from it line by line, and writes the lines round-robin
-# to the filehandles in the array 'output_filehandles',
-# each prepended by the weights in 'weight'.
-def distribute_to_outputs(source_filename, weight, output_filehandles):
-    weight_str = str(weight) + ' '
-    num_outputs = len(output_filehandles)
-    n = 0
+# read the vocabulary file (as utils/sym2int.pl would) and return a dict from
+# word to integer id, both as bytes, so that lines can be converted without
+# decoding them.  If unk_word is not empty, it is also returned as an id.
+def read_vocab(vocab_file, unk_word):
+    vocab = {}
+    with open(vocab_file, 'rb') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) != 2:
+                sys.exit(sys.argv[0] + ": bad line in vocabulary file {0}: {1}".format(
+                    vocab_file, line.decode('utf-8', 'replace').rstrip("\n")))
+            vocab[fields[0]] = str(int(fields[1])).encode()
+    unk_id = None
+    if unk_word is not None and unk_word != '':
+        unk_word = unk_word.encode('utf-8')
+        if re.match(b'^[0-9]+$', unk_word):
+            unk_id = unk_word
+        elif unk_word in vocab:
+            unk_id = vocab[unk_word]
+        else:
+            sys.exit(sys.argv[0] + ": OOV symbol {0} not defined in {1}".format(
+                unk_word.decode('utf-8'), vocab_file))
+    return vocab, unk_id
+
+
+# This function reads the file 'filename' in blocks of roughly 'block_size'
+# bytes and yields its lines, as bytes.  Like text-mode reading, '\r\n' and
+# '\r' are treated as line endings.
+def read_lines(filename, block_size):
     try:
-        f = open(source_filename, 'r', encoding="utf-8")
+        f = open(filename, 'rb')
     except Exception as e:
-        sys.exit(sys.argv[0] + ": failed to open file {0} for reading: {1} ".format(
-            source_filename, str(e)))
-    for line in f:
-        output_filehandle = output_filehandles[n % num_outputs]
-        # the line 'line' will already have a terminating newline, so we
-        # suppress the extra newline by specifying end=''.
+        raise Exception("failed to open file {0} for reading: {1}".format(
+            filename, str(e)))
+    with f:
+        while True:
+            lines = f.readlines(block_size)
+            if not lines:
+                break
+            for line in lines:
+                if b'\r' in line:
+                    for l in line.replace(b'\r\n', b'\n').replace(b'\r', b'\n').splitlines():
+                        yield l
+                else:
+                    yield line
+
+
+# Worker state: the vocabulary is set up once per process by init_worker().
+worker_vocab = None
+worker_unk_id = None
+
+
+def init_worker(vocab, unk_id):
+    global worker_vocab, worker_unk_id
+    worker_vocab = vocab
+    worker_unk_id = unk_id
+
+
+# Converts the whitespace-separated words in 'line' to a list of integer ids.
+def words_to_ids(line, oov_counts):
+    ids = []
+    for word in line.split():
+        i = worker_vocab.get(word)
+        if i is None:
+            if worker_unk_id is None:
+                raise Exception("undefined symbol {0}".format(
+                    word.decode('utf-8', 'replace')))
+            oov_counts[0] += 1
+            i = worker_unk_id
+        ids.append(i)
+    return ids
+
+
+# This function reads the source file 'source_filename' once, converts each
+# line to integer form prepended by 'weight', and writes the lines
+# round-robin to the files '<split_dir>/<n>.<name>.tmp' for n = 1 ..
+# num_splits.  This is the contribution of the first copy of the source; the
+# other copies are rotations of it and are assembled from the same files by
+# assemble_split().  Returns the number of OOV words seen.
+def distribute_to_outputs(name, source_filename, weight, split_dir,
+                          num_splits, block_size):
+    weight_bytes = str(weight).encode()
+    filenames = [ "{0}/{1}.{2}.tmp".format(split_dir, n, name)
+                  for n in range(1, num_splits + 1) ]
+    try:
+        outputs = [ open(fname, 'wb', buffering=1024 * 1024)
+                    for fname in filenames ]
+    except Exception as e:
+        raise Exception("failed to open file: " + str(e) +
+                        ".. if this is a max-open-filehandles limitation, you may "
+                        "need to use fewer splits of the data (or change your OS "
+                        "ulimits)")
+    oov_counts = [0]
+    n = 0
+    for line in read_lines(source_filename, block_size):
+        ids = words_to_ids(line, oov_counts)
         try:
-            print(weight_str + line, end='', file=output_filehandle)
-        except:
-            sys.exit(sys.argv[0] + ": failed to write to temporary file (disk full?)")
+            outputs[n % num_splits].write(b' '.join([weight_bytes] + ids) + b'\n')
+        except Exception as e:
+            raise Exception("failed to write to temporary file (disk full?): " + str(e))
         n += 1
-        print
-    f.close()
-
-
-
-
-
-data_sources = get_all_data_sources_except_dev(args.text_dir)
-data_weights = read_data_weights(args.data_weights_file, data_sources)
+    for f in outputs:
+        try:
+            f.close()
+        except Exception as e:
+            raise Exception("error closing temporary file (disk full?): " + str(e))
+    return oov_counts[0]
 
-if not os.path.exists(args.split_dir + "/info"):
-    os.makedirs(args.split_dir +  "/info")
 
-# set up the 'num_splits' file, which contains an integer.
-with open("{0}/info/num_splits".format(args.split_dir), 'w', encoding="utf-8") as f:
-    print(args.num_splits, file=f)
+# Converts the dev data to integer form, with weight 1.
+def convert_dev(source_filename, output_filename, block_size):
+    oov_counts = [0]
+    with open(output_filename, 'wb', buffering=1024 * 1024) as f:
+        for line in read_lines(source_filename, block_size):
+            f.write(b'1 ' + b' '.join(words_to_ids(line, oov_counts)) + b'\n')
+    return oov_counts[0]
 
-# e.g. set temp_files = [ 'foo/1.tmp', 'foo/2.tmp', ..., 'foo/5.tmp' ]
-# we write the text data to here, later we convert to integer
-# while writing to the *.txt files.
-temp_files = [ "{0}/{1}.tmp".format(args.split_dir, n) for n in range(1, args.num_splits + 1) ]
 
-# create filehandles for writing to each of these '.tmp' output files.
-temp_filehandles = []
-for fname in temp_files:
+def run_job(job):
     try:
-        temp_filehandles.append(open(fname, 'w', encoding="utf-8"))
+        if job[0] == 'dev':
+            return convert_dev(*job[1:])
+        else:
+            return distribute_to_outputs(*job[1:])
     except Exception as e:
-        sys.exit(sys.argv[0] + ": failed to open file: " + str(e) +
-                 ".. if this is a max-open-filehandles limitation, you may "
-                 "need to rewrite parts of this script, but a workaround "
-                 "is to use fewer splits of the data (or change your OS "
-                 "ulimits)")
-
-
-print(sys.argv[0] + ": distributing data to temporary files")
-
-# this loop appends text data (prepended by data-weights), from each of
-# the source .txt files, to the filehandles in 'temp_filehandles'.
-for name in data_sources.keys():
-    source_file = data_sources[name]
-    multiplicity = data_weights[name][0]
-    weight = data_weights[name][1]
-    assert multiplicity >= 0
-
-    for n in range(multiplicity):
-        # 'offset' will be zero for the first copy of any data, and
-        # from there it will increase up to some value less than
-        # args.num_splits.  The point of this offset, which you can
-        # think of as a rotation modulo args.num_splits, is so that
-        # when we write the same data multiple times, we don't end
-        # up writing the same lines to the same file.
-        offset = (n * args.num_splits) // multiplicity
-        assert offset < args.num_splits
-        rotated_filehandles = temp_filehandles[offset:] + temp_filehandles[:offset]
-
-        # The following line is the core of what we're doing; see the
-        # documentation for this function for more details.
-        distribute_to_outputs(source_file, weight, rotated_filehandles)
-
-
-for f in temp_filehandles:
-    try:
-        f.close()
-    except:
-        sys.exit(sys.argv[0] + ": error closing temporary file (disk full?)");
-
-
-print(sys.argv[0] + ": converting from text to integer form.")
-
-if args.unk_word != None and args.unk_word != '':
-    unk_opt = "--map-oov '{0}'".format(args.unk_word)
-else:
-    unk_opt = ""
-
-# Convert from text to integer form using the vocabulary file,
-# moving data from *.tmp to *.txt.
-for n in range(1, args.num_splits + 1):
-    command = "utils/sym2int.pl {unk_opt} -f 2- {vocab_file} <{input_file} >{output_file}".format(
-        vocab_file=args.vocab_file,
-        unk_opt=unk_opt,
-        input_file="{0}/{1}.tmp".format(args.split_dir, n),
-        output_file="{0}/{1}.txt".format(args.split_dir, n))
-    ret = os.system(command)
-    if ret != 0:
-        sys.exit(sys.argv[0] + ": command '{0}' returned with status {1}".format(
-            command, ret))
-    os.remove("{0}/{1}.tmp".format(args.split_dir, n))
-
-
-print(sys.argv[0] + ": converting dev data from text to integer form.")
-
-
-command = "utils/sym2int.pl {unk_opt} {vocab_file} <{input_file} | {awk_command} >{output_file}".format(
-    vocab_file=args.vocab_file,
-    unk_opt=unk_opt,
-    awk_command="awk '{print 1.0, $0;}'",  # this is passed as a variable
-                                           # because it has {}'s awhich would
-                                           # otherwise be interpreted.
-    input_file="{0}/dev.txt".format(args.text_dir),
-    output_file="{0}/dev.txt".format(args.split_dir))
-ret = os.system(command)
-if ret != 0:
-    sys.exit(sys.argv[0] + ": command '{0}' returned with status {1}".format(
-            command, ret))
-
-
-print(sys.argv[0] + ": created split data in {0}".format(args.split_dir))
+        return e
+
+
+# Writes '<split_dir>/<n>.txt'.  For each data source (in the order of
+# 'names') and each of its copies, the lines that the copy with rotation
+# 'offset' sends to split n are exactly the lines the first copy sends to
+# split (n - offset) mod num_splits, so they are copied from that file.
+def assemble_split(n, names, data_weights, split_dir, num_splits):
+    with open("{0}/{1}.txt".format(split_dir, n), 'wb') as output:
+        for name in names:
+            multiplicity = data_weights[name][0]
+            for copy in range(multiplicity):
+                # 'offset' will be zero for the first copy of any data, and
+                # from there it will increase up to some value less than
+                # num_splits.  The point of this offset, which you can think
+                # of as a rotation modulo num_splits, is so that when we
+                # write the same data multiple times, we don't end up
+                # writing the same lines to the same file.
+                offset = (copy * num_splits) // multiplicity
+                assert offset < num_splits
+                source_split = (n - 1 - offset) % num_splits + 1
+                with open("{0}/{1}.{2}.tmp".format(split_dir, source_split, name),
+                          'rb') as f:
+                    shutil.copyfileobj(f, output, 1024 * 1024)
+
+
+def main():
+    args = parser.parse_args()
+
+    data_sources = get_all_data_sources_except_dev(args.text_dir)
+    data_weights = read_data_weights(args.data_weights_file, data_sources)
+    vocab, unk_id = read_vocab(args.vocab_file, args.unk_word)
+
+    if not os.path.exists(args.split_dir + "/info"):
+        os.makedirs(args.split_dir +  "/info")
+
+    # set up the 'num_splits' file, which contains an integer.
+    with open("{0}/info/num_splits".format(args.split_dir), 'w', encoding="utf-8") as f:
+        print(args.num_splits, file=f)
+
+    names = []
+    jobs = []
+    for name in data_sources.keys():
+        assert data_weights[name][0] >= 0
+        if data_weights[name][0] > 0:
+            names.append(name)
+            jobs.append(('source', name, data_sources[name], data_weights[name][1],
+                         args.split_dir, args.num_splits, args.block_size))
+    jobs.append(('dev', "{0}/dev.txt".format(args.text_dir),
+                 "{0}/dev.txt".format(args.split_dir), args.block_size))
+
+    print(sys.argv[0] + ": converting data to integer form and distributing it "
+          "to temporary files")
+
+    num_jobs = args.num_jobs if args.num_jobs > 0 else len(jobs)
+    num_jobs = min(num_jobs, len(jobs))
+    if num_jobs > 1:
+        pool = multiprocessing.Pool(num_jobs, initializer=init_worker,
+                                    initargs=(vocab, unk_id))
+        results = pool.map(run_job, jobs, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        init_worker(vocab, unk_id)
+        results = [ run_job(job) for job in jobs ]
+
+    num_oovs = 0
+    for job, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            sys.exit(sys.argv[0] + ": error processing {0}: {1}".format(
+                job[2] if job[0] == 'source' else job[1], str(result)))
+        num_oovs += result
+    if num_oovs > 0:
+        print(sys.argv[0] + ": replaced {0} instances of OOVs with {1}".format(
+            num_oovs, args.unk_word), file=sys.stderr)
+
+    print(sys.argv[0] + ": assembling split data.")
+
+    for n in range(1, args.num_splits + 1):
+        assemble_split(n, names, data_weights, args.split_dir, args.num_splits)
+    for name in names:
+        for n in range(1, args.num_splits + 1):
+            os.remove("{0}/{1}.{2}.tmp".format(args.split_dir, n, name))
+
+    print(sys.argv[0] + ": created split data in {0}".format(args.split_dir))
+
+
+if __name__ == '__main__':
+    main()
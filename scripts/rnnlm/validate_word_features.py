@@ -9,6 +9,8 @@ import sys
 
 import re
 
+import vocab_lib
+
 
 parser = argparse.ArgumentParser(description="Validates word features file, produced by rnnlm/get_word_features.py.",
                                  epilog="E.g. " + sys.argv[0] + " --features-file=exp/rnnlm/features.txt "
@@ -21,36 +23,15 @@ parser.add_argument("word_features_file", help="File containing word features")
 
 args = parser.parse_args()
 
-# we only need to know the feat_id for 'special', 'unigram' and 'length'
-special_feat_ids = []
-constant_feat_id = -1
-constant_feat_value = None
-unigram_feat_id = -1
-length_feat_id = -1
-max_feat_id = -1
-with open(args.features_file, 'r', encoding="utf-8") as f:
-    for line in f:
-        fields = line.split()
-        assert(len(fields) in [3, 4, 5])
-
-        feat_id = int(fields[0])
-
-        # every feature should contain a scale
-        scale = float(fields[-1])
-        assert scale > 0.0 and scale <= 1.0
-
-        if fields[1] == "special":
-            special_feat_ids.append(feat_id)
-        elif fields[1] == "constant":
-            constant_feat_id = feat_id
-            constant_feat_value = scale
-        elif fields[1] == "unigram":
-            unigram_feat_id = feat_id
-        elif fields[1] == "length":
-            length_feat_id = feat_id
-
-        if feat_id > max_feat_id:
-            max_feat_id = feat_id
+# we only need to know the feat_id for 'special' and 'constant' features
+# (read_features() also checks that every feature has a scale in (0, 1]).
+feats = vocab_lib.read_features(args.features_file, check_scales=True)
+special_feat_ids = set(feat_id for (feat_id, _) in feats['special'].values())
+if feats['constant'] is not None:
+    (constant_feat_id, constant_feat_value) = feats['constant']
+else:
+    (constant_feat_id, constant_feat_value) = (-1, None)
+max_feat_id = feats['max_feat_id']
 
 with open(args.word_features_file, 'r', encoding="utf-8") as f:
     for line in f:
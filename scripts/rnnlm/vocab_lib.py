@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+# License: Apache 2.0.
+
+# This module contains the vocabulary, counts and word-feature code shared by
+# rnnlm/get_unigram_probs.py, rnnlm/choose_features.py,
+# rnnlm/get_word_features.py and rnnlm/validate_word_features.py.  Counts,
+# probabilities and features are held in NumPy arrays indexed by word id, so
+# that they can be computed for large vocabularies without per-word Python
+# loops.
+
+import sys
+
+import numpy as np
+
+
+SPECIAL_SYMBOLS = ["<eps>", "<s>", "<brk>"]
+
+
+# read the whole of a text file
+# return a list of its lines, without the newlines.
+def read_lines(filename):
+    with open(filename, 'r', encoding="utf-8") as f:
+        lines = f.read().split("\n")
+    if len(lines) > 0 and lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+# read the vocab
+# return a pair (vocab, wordlist), where 'vocab' is a dict mapping the word to
+# an integer id, and 'wordlist' is a list indexed by integer id, that returns
+# the word.
+def read_vocab(vocab_file):
+    lines = read_lines(vocab_file)
+    fields = [line.split() for line in lines]
+    for line, this_fields in zip(lines, fields):
+        assert len(this_fields) == 2, line
+
+    vocab = {}
+    for word, idx in fields:
+        if word in vocab:
+            sys.exit(sys.argv[0] + ": duplicated word({0}) in vocab: {1}"
+                                   .format(word, vocab_file))
+        vocab[word] = int(idx)
+
+    # check there is no duplication and no gap among word ids
+    ids = np.fromiter(vocab.values(), dtype=np.int64, count=len(vocab))
+    ids.sort()
+    assert np.array_equal(ids, np.arange(len(ids)))
+
+    wordlist = [None] * len(vocab)
+    for word, idx in vocab.items():
+        wordlist[idx] = word
+    return (vocab, wordlist)
+
+
+# read the unigram probs
+# return an array of unigram probs, indexed by word id
+def read_unigram_probs(unigram_probs_file):
+    lines = read_lines(unigram_probs_file)
+    tokens = " ".join(lines).split()
+    assert len(tokens) == 2 * len(lines), \
+        "bad unigram-probs file {0}".format(unigram_probs_file)
+    ids = np.array(tokens[0::2], dtype=np.int64)
+    probs = np.array(tokens[1::2], dtype=np.float64)
+
+    num_words = ids.max() + 1 if len(ids) > 0 else 0
+    unigram_probs = np.zeros(num_words, dtype=np.float64)
+    present = np.zeros(num_words, dtype=bool)
+    unigram_probs[ids] = probs
+    present[ids] = True
+    assert present.all(), "missing word ids in {0}".format(unigram_probs_file)
+    return unigram_probs
+
+
+# read a counts file, with lines of the form '<word> <count>'
+# return a pair (words, counts) where 'words' is an array of strings and
+# 'counts' an array of integer counts, in the order of the file.
+def read_counts(counts_file):
+    lines = read_lines(counts_file)
+    tokens = " ".join(lines).split()
+    if len(tokens) != 2 * len(lines):
+        for line in lines:
+            fields = line.split()
+            if len(fields) != 2:
+                print("Warning, should be 2 cols:", fields, line, file=sys.stderr)
+                assert len(fields) == 2
+    words = np.array(tokens[0::2], dtype=str)
+    counts = np.array(tokens[1::2], dtype=np.int64)
+    return (words, counts)
+
+
+# Map the array of strings 'words' to word ids; words that are not in the
+# vocabulary get the id -1.  'sorted_vocab' is a pair (sorted_words,
+# sorted_ids) as returned by sort_vocab().
+def lookup_words(words, sorted_vocab):
+    (sorted_words, sorted_ids) = sorted_vocab
+    if len(sorted_words) == 0:
+        return np.full(len(words), -1, dtype=np.int64)
+    pos = np.searchsorted(sorted_words, words)
+    pos = np.minimum(pos, len(sorted_words) - 1)
+    found = sorted_words[pos] == words
+    return np.where(found, sorted_ids[pos], -1)
+
+
+# return the vocab as a pair of arrays (sorted_words, sorted_ids), for use by
+# lookup_words().
+def sort_vocab(vocab):
+    words = np.array(list(vocab.keys()), dtype=str)
+    ids = np.fromiter(vocab.values(), dtype=np.int64, count=len(vocab))
+    order = np.argsort(words, kind='stable')
+    return (words[order], ids[order])
+
+
+# Get total (weighted) count for words from all data_sources.
+# 'data_sources' is a dict from the name of a data source to a tuple
+# (txt_file_path, counts_file_path), and 'data_weights' a dict from the name
+# to a tuple (repeated_times_per_epoch, weight).  Words that are not in the
+# vocab are mapped to 'unk_word' if it is not empty.
+# return an array of counts indexed by word id.
+def get_counts(data_sources, data_weights, vocab, unk_word=''):
+    sorted_vocab = sort_vocab(vocab)
+    all_ids = []
+    all_counts = []
+    for name, (_, counts_file) in data_sources.items():
+        weight = data_weights[name][0] * data_weights[name][1]
+        if weight == 0.0:
+            continue
+
+        (words, counts) = read_counts(counts_file)
+        ids = lookup_words(words, sorted_vocab)
+        oov = np.flatnonzero(ids < 0)
+        if len(oov) > 0:
+            if unk_word == '':
+                sys.exit(sys.argv[0] + ": error: an OOV word {0} is present in the "
+                         "counts file {1} but you have not specified an unknown word to "
+                         "map it to (--unk-word option).".format(words[oov[0]], counts_file))
+            ids[oov] = vocab[unk_word]
+        all_ids.append(ids)
+        all_counts.append(weight * counts)
+
+    # np.bincount adds up the weights in the order they appear, so the result
+    # is the same as accumulating the counts line by line.
+    if len(all_ids) == 0:
+        return np.zeros(len(vocab), dtype=np.float64)
+    return np.bincount(np.concatenate(all_ids),
+                       weights=np.concatenate(all_counts),
+                       minlength=len(vocab)).astype(np.float64)
+
+
+# Smooth counts and get unigram probs for words
+# return an array of probs indexed by word id.
+def get_unigram_probs(vocab, counts, smooth_constant):
+    counts = np.array(counts, dtype=np.float64)
+    is_regular = np.ones(len(counts), dtype=bool)
+    is_regular[[vocab[x] for x in SPECIAL_SYMBOLS]] = False
+    vocab_size = len(vocab) - len(SPECIAL_SYMBOLS)
+    num_words_with_non_zero_counts = int(np.count_nonzero(counts[is_regular] > 0))
+
+    if num_words_with_non_zero_counts < vocab_size and smooth_constant == 0.0:
+        sys.exit(sys.argv[0] + ": --smooth-unigram-counts should not be zero, "
+                               "since there are words with zero-counts")
+
+    smooth_count = smooth_constant * num_words_with_non_zero_counts / vocab_size
+    counts[is_regular] += smooth_count
+    # np.cumsum sums sequentially (unlike np.sum, which sums pairwise), which
+    # keeps the total identical to a running sum over the word ids.
+    regular_counts = counts[is_regular]
+    total_counts = np.cumsum(regular_counts)[-1] if len(regular_counts) > 0 else 0.0
+
+    return counts / total_counts
+
+
+# read the features
+# return a dict with following items:
+
+#   feats['constant'] is None if there is no constant feature used, else
+#                     a 2-tuple (feat_id, value), e.g. (1, 0.01)
+#   feats['special'] is a dict whose key is special words and value is a tuple (feat_id, scale)
+#   feats['unigram'] is a tuple with (feat_id, entropy, scale)
+#   feats['length']  is a tuple with (feat_id, scale)
+#
+#   feats['match']
+#   feats['initial']
+#   feats['final']
+#   feats['word']    is a dict with key is ngram, value is a tuple (feat_id, scale)
+#   feats['min_ngram_order'] is a int represents min-ngram-order
+#   feats['max_ngram_order'] is a int represents max-ngram-order
+#   feats['max_feat_id'] is the largest feat_id in the file
+#
+# If 'check_scales' is true, the scale of every feature (the last field) is
+# checked to be in (0, 1].
+def read_features(features_file, check_scales=False):
+    feats = {}
+    feats['constant'] = None
+    feats['special'] = {}
+    feats['match'] = {}
+    feats['initial'] = {}
+    feats['final'] = {}
+    feats['word'] = {}
+    feats['min_ngram_order'] = 10000
+    feats['max_ngram_order'] = -1
+    feats['max_feat_id'] = -1
+
+    with open(features_file, 'r', encoding="utf-8") as f:
+        for line in f:
+            fields = line.split()
+            assert(len(fields) in [3, 4, 5])
+
+            feat_id = int(fields[0])
+            feat_type = fields[1]
+            scale = float(fields[-1])
+            if check_scales:
+                assert scale > 0.0 and scale <= 1.0
+            if feat_id > feats['max_feat_id']:
+                feats['max_feat_id'] = feat_id
+            if feat_type == 'constant':
+                value = float(fields[2])
+                feats['constant'] = (feat_id, value)
+            elif feat_type == 'special':
+                feats['special'][fields[2]] = (feat_id, scale)
+            elif feat_type == 'unigram':
+                feats['unigram'] = (feat_id, float(fields[2]), scale)
+            elif feat_type == 'length':
+                feats['length'] = (feat_id, scale)
+            elif feat_type in ['word', 'match', 'initial', 'final']:
+                ngram = fields[2]
+                feats[feat_type][ngram] = (feat_id, scale)
+                if feat_type == 'word':
+                    continue
+                elif feat_type in ['initial', 'final']:
+                    order = len(ngram) + 1
+                else:
+                    order = len(ngram)
+                if order > feats['max_ngram_order']:
+                    feats['max_ngram_order'] = order
+                if order < feats['min_ngram_order']:
+                    feats['min_ngram_order'] = order
+            else:
+                sys.exit(sys.argv[0] + ": error feature type: {0}".format(feat_type))
+
+    return feats
+
+
+# Compute the sparse word-feature matrix for the words in 'wordlist' (indexed
+# by word id; word 0, epsilon, gets no features).  'unigram_probs' is an array
+# indexed by word id, or None if there is no unigram feature.
+# return a tuple (row_ptr, feat_ids, values) in compressed-sparse-row form:
+# the features of word i are feat_ids[row_ptr[i]:row_ptr[i+1]], in increasing
+# order, with values values[row_ptr[i]:row_ptr[i+1]].
+def get_word_features(wordlist, feats, unigram_probs=None):
+    num_words = len(wordlist)
+    words = list(wordlist)
+    word_ids = np.arange(num_words)
+    # words with the 'special' feature only get that and the constant
+    # feature; word 0 gets nothing.
+    is_special = np.array([w in feats['special'] for w in words], dtype=bool)
+    is_regular = ~is_special
+    is_regular[0] = False
+    is_special[0] = False
+    regular_ids = word_ids[is_regular]
+
+    rows = []
+    cols = []
+    vals = []
+
+    def add(these_rows, feat_id, these_vals):
+        rows.append(these_rows)
+        cols.append(np.full(len(these_rows), feat_id, dtype=np.int64))
+        vals.append(np.broadcast_to(np.asarray(these_vals, dtype=np.float64),
+                                    (len(these_rows),)))
+
+    if feats['constant'] is not None:
+        (feat_id, value) = feats['constant']
+        add(word_ids[1:], feat_id, value)
+
+    special_ids = word_ids[is_special]
+    for word_id in special_ids:
+        (feat_id, scale) = feats['special'][words[word_id]]
+        add(np.array([word_id]), feat_id, 1 * scale)
+
+    if 'unigram' in feats and len(regular_ids) > 0:
+        if unigram_probs is None:
+            sys.exit(sys.argv[0] + ": if unigram feature is present, you must specify the "
+                     "--unigram-probs option.")
+        (feat_id, offset, scale) = feats['unigram']
+        probs = np.asarray(unigram_probs, dtype=np.float64)[regular_ids]
+        if not (probs > 0.0).all():
+            sys.exit(sys.argv[0] + ": unigram probs must be positive for words "
+                     "with the unigram feature.")
+        add(regular_ids, feat_id, offset + np.log(probs) * scale)
+
+    if 'length' in feats:
+        (feat_id, scale) = feats['length']
+        lengths = np.array([len(words[i]) for i in regular_ids], dtype=np.float64)
+        add(regular_ids, feat_id, lengths * scale)
+
+    word_feats = feats['word']
+    word_rows = [i for i in regular_ids if words[i] in word_feats]
+    if len(word_rows) > 0:
+        rows.append(np.array(word_rows, dtype=np.int64))
+        cols.append(np.array([word_feats[words[i]][0] for i in word_rows], dtype=np.int64))
+        vals.append(np.array([1 * word_feats[words[i]][1] for i in word_rows],
+                             dtype=np.float64))
+
+    # character n-gram features.  For each word length we precompute the
+    # (start, end, table) triples that the loop over positions and orders
+    # visits, so that the inner loop is just a slice and a dict lookup.
+    min_order = feats['min_ngram_order']
+    max_order = feats['max_ngram_order']
+    spans_for_length = {}
+
+    def get_spans(length):
+        spans = []
+        for pos in range(length + 1):  # +1 for EOW
+            for order in range(min_order, max_order + 1):
+                start = pos - order + 1
+                end = pos + 1
+                if start < -1:
+                    continue
+                if start < 0 and end > length:
+                    # 'word' feature, which we already match before
+                    continue
+                elif start < 0:
+                    table = feats['initial']
+                    start = 0
+                elif end > length:
+                    table = feats['final']
+                    end = length
+                else:
+                    table = feats['match']
+                if start >= end:
+                    continue
+                spans.append((start, end, table))
+        return spans
+
+    ngram_rows = []
+    ngram_cols = []
+    ngram_vals = []
+    for i in regular_ids:
+        word = words[i]
+        length = len(word)
+        spans = spans_for_length.get(length)
+        if spans is None:
+            spans = get_spans(length)
+            spans_for_length[length] = spans
+        for (start, end, table) in spans:
+            feat = table.get(word[start:end])
+            if feat is not None:
+                ngram_rows.append(i)
+                ngram_cols.append(feat[0])
+                ngram_vals.append(feat[1])
+    if len(ngram_rows) > 0:
+        rows.append(np.array(ngram_rows, dtype=np.int64))
+        cols.append(np.array(ngram_cols, dtype=np.int64))
+        vals.append(np.array(ngram_vals, dtype=np.float64))
+
+    if len(rows) == 0:
+        return (np.zeros(num_words + 1, dtype=np.int64),
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    vals = np.concatenate(vals)
+
+    # Sort by (row, feat_id), keeping the original order among duplicates,
+    # and add up the duplicates (n-grams that match several times in a word).
+    # np.add.at adds in order, as the per-word accumulation did.
+    order = np.lexsort((cols, rows))
+    rows = rows[order]
+    cols = cols[order]
+    vals = vals[order]
+    is_first = np.ones(len(rows), dtype=bool)
+    is_first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    group = np.cumsum(is_first) - 1
+    values = np.zeros(int(is_first.sum()), dtype=np.float64)
+    np.add.at(values, group, vals)
+    rows = rows[is_first]
+    feat_ids = cols[is_first]
+
+    row_ptr = np.zeros(num_words + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_words), out=row_ptr[1:])
+    return (row_ptr, feat_ids, values)
+
+
+# Write the word features in the format
+# <word-id>\t<feat-id> <value> <feat-id> <value> ...
+def write_word_features(row_ptr, feat_ids, values, f):
+    feat_ids = feat_ids.tolist()
+    values = values.tolist()
+    row_ptr = row_ptr.tolist()
+    lines = []
+    for idx in range(len(row_ptr) - 1):
+        begin, end = row_ptr[idx], row_ptr[idx + 1]
+        lines.append("{0}\t{1}\n".format(
+            idx, " ".join(["%s %.3g" % (feat_ids[i], values[i])
+                           for i in range(begin, end)])))
+    f.write("".join(lines))